@@ -71,3 +71,11 @@ def register_commands(app):
     from app.database.init_db import register_commands as register_db_commands
 
     register_db_commands(app)
+
+    from app.benchmark import register_commands as register_benchmark_commands
+
+    register_benchmark_commands(app)
+
+    from app.scheduler.commands import register_commands as register_scheduler_commands
+
+    register_scheduler_commands(app)
@@ -4,13 +4,28 @@ This module provides RESTful API endpoints
 for scheduling emails and checking API health.
 """
 
+import json
 from datetime import UTC, datetime, timedelta
 
-from flask import request
+from flask import current_app, request
 from flask_restx import Namespace, Resource, fields
 from pytz import timezone
 
-from app.event.jobs import add_event
+from app.delivery.queues import PRIORITIES, queue_stats
+from app.delivery.ratelimit import rate_limit_stats
+from app.delivery.relays import RelayRouter
+from app.event.idempotency import (
+    KeyReused,
+    remember_event,
+    replayed_event,
+    request_fingerprint,
+    validate_key,
+)
+from app.event.jobs import add_event, add_events
+from app.extensions import rq
+from app.scheduler.catchup import catchup_stats
+from app.scheduler.spreading import spread_stats
+from app.scheduler.wheel import TimingWheel
 
 # from app.services.event_service import EventService  # Import service layer
 
@@ -47,6 +62,39 @@ mail_event = ns.model(
             pattern=r"\w+@\w+\.\w+(,\s*\w+@\w+\.\w+)*",
             example="retphern@gmail.com, vedafarm.id@gmail.com",
         ),
+        "recurrence": fields.String(
+            required=False,
+            description="Repeat the mail by a cron expression or RRULE, in UTC,\n\
+                  starting from timestamp.",
+            example="0 9 * * MON",
+        ),
+        "priority": fields.String(
+            required=False,
+            description="Queue priority; transactional mail is sent ahead of\n\
+                  bulk mail.",
+            enum=list(PRIORITIES),
+            default="normal",
+            example="high",
+        ),
+        "local_time": fields.Boolean(
+            required=False,
+            description="Send at the wall-clock time of timestamp in each\n\
+                  recipient's time zone, ignoring its offset.",
+            default=False,
+        ),
+        "timezones": fields.Raw(
+            required=False,
+            description="IANA time zone of recipients, by email address;\n\
+                  MAIL_DEFAULT_TIMEZONE for the others.",
+            example={"retphern@gmail.com": "Asia/Jakarta"},
+        ),
+        "spread": fields.Integer(
+            required=False,
+            description="Seconds after timestamp the mail may be sent by, to\n\
+                  flatten the load of round times; MAIL_SPREAD_WINDOW by default.\n\
+                  Only with MAIL_SCHEDULER=database.",
+            example=600,
+        ),
     },
 )
 
@@ -63,6 +111,23 @@ event_model = ns.model(
         "done_at": fields.DateTime(
             description="Time when the email was sent", required=False
         ),
+        "recurrence": fields.String(
+            description="Cron expression or RRULE of a recurring email", required=False
+        ),
+        "next_fire_at": fields.DateTime(
+            description="Next run of a recurring email", required=False
+        ),
+        "parent_id": fields.Integer(
+            description="Recurring email this run belongs to", required=False
+        ),
+        "priority": fields.String(description="Queue priority of the email"),
+        "local_time": fields.DateTime(
+            description="Wall-clock time sent at in each recipient's time zone",
+            required=False,
+        ),
+        "send_by": fields.DateTime(
+            description="Latest time of a mail spread over a window", required=False
+        ),
     },
 )
 
@@ -105,9 +170,17 @@ class EventApi(Resource):
     @ns.expect(mail_event, validate=True)
     @ns.doc(
         description="Schedule a new email to be sent at a specific time",
+        params={
+            "Idempotency-Key": {
+                "in": "header",
+                "description": "Unique per email; a retry with the same key\n\
+                  returns the email first created instead of a new one.",
+            }
+        },
         responses={
             201: "Email successfully scheduled",
             400: "Invalid request data",
+            422: "Idempotency-Key reused with a different request",
             500: "Server error occurred",
         },
     )
@@ -117,7 +190,9 @@ class EventApi(Resource):
 
         Creates a new scheduled email event with the provided subject, content,
         timestamp, and recipients. The email will be sent at the specified time
-        to all recipients.
+        to all recipients. A request repeating the ``Idempotency-Key`` of an
+        earlier one gets the ID of the event that one created, and one
+        repeating the key with a different body is refused.
 
         Returns:
             tuple: A tuple containing a JSON response and HTTP status code.
@@ -131,15 +206,94 @@ class EventApi(Resource):
         try:
             if request.json is None:
                 return {"message": "No JSON data provided"}, 400
-            event_id = add_event(request.json)
+            key = request.headers.get("Idempotency-Key")
+            if key is None:
+                event_id = add_event(request.json)
+            else:
+                validate_key(key)
+                fingerprint = request_fingerprint(request.json)
+                event_id = replayed_event(rq.connection, key, fingerprint)
+                if event_id is None:
+                    event_id = add_event(request.json, idempotency_key=key)
+                    remember_event(
+                        rq.connection,
+                        key,
+                        event_id,
+                        current_app.config.get("MAIL_IDEMPOTENCY_TTL", 86400),
+                        fingerprint,
+                    )
             return {
                 "message": "Event successfully saved to scheduler",
                 "id": event_id,
             }, 201
+        except KeyReused as e:
+            return {"message": str(e)}, 422
         except Exception as e:
             return {"message": f"Error occurred: {str(e)}"}, 400
 
 
+@ns.route("/save_emails/bulk")
+class BulkEventApi(Resource):
+    """
+    Bulk email scheduling endpoint.
+
+    Accepts many events in one request, as a JSON array or as NDJSON (one
+    event object per line, ``Content-Type: application/x-ndjson``). Valid
+    events are stored in a single transaction and scheduled through a
+    single Redis pipeline; invalid ones are reported by their position.
+    """
+
+    @ns.doc(
+        description="Schedule many emails at once",
+        responses={
+            201: "At least one email scheduled, see the per-item results",
+            400: "No valid events in the request",
+            413: "More events than MAIL_BULK_MAX_EVENTS",
+        },
+    )
+    def post(self):
+        """
+        Submit a batch of email events for scheduling.
+
+        Each item takes the fields of ``/save_emails``.
+
+        Returns:
+            tuple: JSON with the number of events created and failed, and a
+                  result per item holding its ``index`` and either the
+                  ``id`` of the new event or an ``error``, and HTTP status
+                  code.
+        """
+        if request.mimetype == "application/x-ndjson":
+            items = []
+            for line in request.get_data(as_text=True).splitlines():
+                if line.strip():
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError:
+                        # Reported as an invalid item.
+                        items.append(None)
+        else:
+            items = request.get_json(silent=True)
+            if not isinstance(items, list):
+                return {"message": "Expected a JSON array of events"}, 400
+
+        limit = current_app.config.get("MAIL_BULK_MAX_EVENTS", 10000)
+        if len(items) > limit:
+            return {"message": f"At most {limit} events per request"}, 413
+
+        try:
+            results = add_events(items)
+        except Exception as e:
+            return {"message": f"Error occurred: {str(e)}"}, 500
+
+        created = sum(1 for result in results if "id" in result)
+        return {
+            "created": created,
+            "failed": len(results) - created,
+            "results": results,
+        }, (201 if created else 400)
+
+
 @ns.route("/events/<int:event_id>")
 class EventDetailApi(Resource):
     """
@@ -187,3 +341,161 @@ class EventDetailApi(Resource):
             return event, 200
         except Exception as e:
             return {"message": f"Error occurred: {str(e)}"}, 500
+
+
+@ns.route("/metrics/rate_limits")
+class RateLimitMetrics(Resource):
+    """Current state of the cluster-wide SMTP rate limits."""
+
+    @ns.doc(
+        description="Token levels and time spent waiting per rate limit bucket",
+        responses={200: "Bucket statistics", 500: "Redis is unavailable"},
+    )
+    def get(self):
+        """
+        Report every bucket configured in ``MAIL_RATE_LIMITS``.
+
+        Returns:
+            tuple: JSON with one entry per bucket (capacity, period in seconds,
+                  current tokens, total seconds waited and number of waits)
+                  and HTTP status code.
+        """
+        try:
+            buckets = rate_limit_stats(rq.connection, current_app.config)
+        except Exception as e:
+            return {"message": f"Error occurred: {str(e)}"}, 500
+        return {"buckets": buckets}, 200
+
+
+@ns.route("/metrics/relays")
+class RelayMetrics(Resource):
+    """Health and throughput of the SMTP relays."""
+
+    @ns.doc(
+        description="State, throughput and error counters per SMTP relay",
+        responses={200: "Relay statistics", 500: "Redis is unavailable"},
+    )
+    def get(self):
+        """
+        Report every relay configured in ``MAIL_RELAYS``.
+
+        Returns:
+            tuple: JSON with one entry per relay (in-flight deliveries,
+                  consecutive failures, seconds until the next probe and
+                  transaction, sent, refused and error counters) and HTTP
+                  status code.
+        """
+        try:
+            router = RelayRouter.from_config(rq.connection, current_app.config)
+            relays = router.stats() if router else []
+        except Exception as e:
+            return {"message": f"Error occurred: {str(e)}"}, 500
+        return {"relays": relays}, 200
+
+
+@ns.route("/metrics/dispatch")
+class DispatchMetrics(Resource):
+    """Timeliness of the timing wheel dispatcher."""
+
+    @ns.doc(
+        description="Dispatch lag percentiles and waiting buckets of the wheel",
+        responses={200: "Dispatcher statistics", 500: "Redis is unavailable"},
+    )
+    def get(self):
+        """
+        Report how late due jobs reached the queue.
+
+        Returns:
+            tuple: JSON with the lag between due time and enqueue over the
+                  most recent jobs (sample count, mean, p50, p95, p99 and max
+                  in seconds) and the buckets waiting on each wheel level,
+                  and HTTP status code.
+        """
+        try:
+            wheel = TimingWheel.from_config(
+                rq.connection, rq.get_queue(), current_app.config
+            )
+            lag, levels = wheel.lag_stats(), wheel.stats()
+        except Exception as e:
+            return {"message": f"Error occurred: {str(e)}"}, 500
+        return {"lag": lag, "levels": levels}, 200
+
+
+@ns.route("/metrics/queues")
+class QueueMetrics(Resource):
+    """Depth and wait times of the priority queues."""
+
+    @ns.doc(
+        description="Jobs waiting and time spent waiting per RQ queue",
+        responses={200: "Queue statistics", 500: "Redis is unavailable"},
+    )
+    def get(self):
+        """
+        Report every queue in ``RQ_QUEUES``.
+
+        Returns:
+            tuple: JSON with one entry per queue (weight, jobs waiting,
+                  seconds the oldest job has waited and a summary of the
+                  waits of recent jobs) and HTTP status code.
+        """
+        try:
+            queues = queue_stats(
+                rq.connection,
+                rq.queues,
+                current_app.config.get("MAIL_QUEUE_WEIGHTS") or {},
+            )
+        except Exception as e:
+            return {"message": f"Error occurred: {str(e)}"}, 500
+        return {"queues": queues}, 200
+
+
+@ns.route("/metrics/catchup")
+class CatchUpMetrics(Resource):
+    """Progress of the database dispatcher through an overdue backlog."""
+
+    @ns.doc(
+        description="Backlog, rate, time to clear and skipped events of catch-up",
+        responses={200: "Catch-up progress", 500: "Redis is unavailable"},
+    )
+    def get(self):
+        """
+        Report the catch-up progress published by ``flask dispatcher``.
+
+        Returns:
+            tuple: JSON with whether any replica is catching up, the
+                  events left, the oldest due time, the total rate in events
+                  per second, the estimated seconds to clear the backlog, the
+                  number of stale events skipped, the IDs of the most recent
+                  ones and the report of every replica, and HTTP status code.
+        """
+        try:
+            report = catchup_stats(rq.connection)
+        except Exception as e:
+            return {"message": f"Error occurred: {str(e)}"}, 500
+        return report, 200
+
+
+@ns.route("/metrics/spread")
+class SpreadMetrics(Resource):
+    """Requested and achieved peak dispatch load of the last day."""
+
+    @ns.doc(
+        description="Busiest minute as scheduled and as dispatched",
+        responses={200: "Peak loads", 500: "Redis is unavailable"},
+    )
+    def get(self):
+        """
+        Compare the peak load events asked for with the one dispatched.
+
+        Returns:
+            tuple: JSON with the period in hours and, for the requested and
+                  the achieved load, the most events dispatched in a minute
+                  and that minute, and HTTP status code.
+        """
+        try:
+            report = spread_stats(
+                rq.connection, datetime.now(UTC).replace(tzinfo=None)
+            )
+        except Exception as e:
+            return {"message": f"Error occurred: {str(e)}"}, 500
+        return report, 200
@@ -0,0 +1,411 @@
+"""End-to-end delivery benchmark.
+
+Runs the real pipeline, ``add_event`` -> scheduler -> ``send_mail``,
+against the local SMTP sink for every combination of event and recipient
+counts, and reports throughput, schedule lag and peak memory::
+
+    flask benchmark --events 1,10 --recipients 100,5000 --latency 0.002
+
+The dispatcher of ``MAIL_SCHEDULER`` and a burst worker run inside the
+command's process, so the reported RSS is the worker's, sampled during
+each run. It needs the Redis of ``RQ_REDIS_URL`` and
+the configured database, and adds its events there: point it at a
+disposable environment, never at production.
+"""
+
+from __future__ import annotations
+
+import resource
+import sys
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from rq.job import Job
+
+from app.database import db
+from app.database.models import Event
+from app.delivery.pool import reset_smtp_pool
+from app.delivery.sink import SMTPSink
+from app.extensions import mail, rq
+from app.scheduler.commands import build_dispatcher
+
+
+class BenchmarkResult(NamedTuple):
+    """Numbers of one benchmark run."""
+
+    events: int
+    recipients: int
+    delivered: int
+    messages: int
+    seconds: float
+    messages_per_second: float
+    recipients_per_second: float
+    lag_p50: float
+    lag_p99: float
+    peak_rss_mb: float
+
+
+def throughput(stats: Mapping[str, int], seconds: float) -> Tuple[float, float]:
+    """
+    Get the message and recipient rates a sink received.
+
+    A message to many recipients counts once in the first and once per
+    recipient in the second.
+
+    Args:
+        stats: Counts from :meth:`SMTPSink.stats`
+        seconds: Length of the run
+
+    Returns:
+        Messages and recipients per second
+    """
+    return (
+        round(stats["messages"] / seconds, 1),
+        round(stats["recipients"] / seconds, 1),
+    )
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """
+    Compute a nearest-rank percentile.
+
+    Args:
+        values: Samples
+        pct: Percentile between 0 and 100
+
+    Returns:
+        The percentile, 0.0 without samples
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb() -> float:
+    """
+    Get the peak resident set size of this process.
+
+    Returns:
+        Peak RSS in MiB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    """
+    Get the current resident set size of this process.
+
+    Returns:
+        RSS in MiB, None where ``/proc`` is unavailable
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+class RSSMonitor(object):
+    """Samples the resident set size of this process during one run.
+
+    ``ru_maxrss`` is the peak of the whole process, so every run after the
+    first would report the earlier peak. Where ``/proc`` is unavailable the
+    monitor reports how much the lifetime peak grew during the run instead.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        """
+        Initialize an RSSMonitor instance.
+
+        Args:
+            interval: Seconds between two samples
+        """
+        self.interval = interval
+        self.peak: Optional[float] = None
+        self._start_peak = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "RSSMonitor":
+        self._start_peak = peak_rss_mb()
+        self.peak = current_rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def peak_mb(self) -> float:
+        """Get the peak RSS of the run, or the growth of the lifetime peak."""
+        if self.peak is None:
+            return max(peak_rss_mb() - self._start_peak, 0.0)
+        return self.peak
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = current_rss_mb()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+
+def due_dispatcher(interval: float) -> Callable[[], Any]:
+    """
+    Get the function moving due jobs to the queue, as chosen by
+    ``MAIL_SCHEDULER``.
+
+    Args:
+        interval: Seconds between two polls of rq-scheduler
+
+    Returns:
+        A function to call once per poll
+    """
+    config = current_app.config
+    if config.get("MAIL_SCHEDULER") in ("wheel", "database"):
+        return cast(Callable[[], Any], build_dispatcher(config).tick)
+    return cast(Callable[[], Any], rq.get_scheduler(interval=interval).enqueue_jobs)
+
+
+def use_sink(app: Any, sink: SMTPSink) -> None:
+    """
+    Point the application's mail settings at the sink.
+
+    Args:
+        app: The Flask application
+        sink: A started sink
+    """
+    app.config.update(
+        MAIL_SERVER=sink.host,
+        MAIL_PORT=sink.port,
+        MAIL_USE_TLS=False,
+        MAIL_USE_SSL=False,
+        MAIL_USERNAME=None,
+        MAIL_PASSWORD=None,
+        MAIL_SUPPRESS_SEND=False,
+        MAIL_RELAYS=[],
+        MAIL_RATE_LIMITS={},
+    )
+    mail.init_app(app)
+    reset_smtp_pool()
+
+
+def run_benchmark(
+    sink: SMTPSink,
+    events: int,
+    recipients: int,
+    lead: float = 2.0,
+    interval: float = 1.0,
+    timeout: float = 600.0,
+) -> BenchmarkResult:
+    """
+    Schedule events and deliver them through the sink.
+
+    Args:
+        sink: Sink the application sends to
+        events: Number of events to schedule
+        recipients: Recipients per event
+        lead: Seconds between scheduling and the events' send time
+        interval: Seconds between two scheduler polls
+        timeout: Seconds to wait for every event to be sent
+
+    Returns:
+        The measured numbers
+    """
+    from app.event.jobs import add_event
+    from app.utils import rq_patch  # noqa: F401
+
+    sink.reset()
+    queue = rq.get_queue()
+    dispatch = due_dispatcher(interval)
+    worker = rq.get_worker()
+    seen = set(queue.finished_job_registry.get_job_ids())
+
+    due = datetime.now(UTC) + timedelta(seconds=lead)
+    addresses = ",".join(f"user{n}@bench.test" for n in range(recipients))
+    event_ids = [
+        add_event(
+            {
+                "subject": f"Benchmark {n}",
+                "content": "<p>Benchmark</p>",
+                "timestamp": due,
+                "recipients": addresses,
+            }
+        )
+        for n in range(events)
+    ]
+
+    deadline = time.monotonic() + lead + timeout
+    with RSSMonitor() as monitor:
+        while time.monotonic() < deadline:
+            dispatch()
+            worker.work(burst=True)
+            db.session.expire_all()
+            pending = db.session.scalar(
+                db.select(db.func.count(Event.id)).where(
+                    Event.id.in_(event_ids), Event._is_done.is_(False)
+                )
+            )
+            if not pending:
+                break
+            time.sleep(interval)
+    finished = datetime.now(UTC).replace(tzinfo=None)
+
+    job_ids = [i for i in queue.finished_job_registry.get_job_ids() if i not in seen]
+    jobs = [
+        job
+        for job in Job.fetch_many(job_ids, connection=rq.connection)
+        if job is not None and job.func_name.endswith(".send_mail")
+    ]
+    lags = schedule_lags(jobs, due.replace(tzinfo=None))
+    started = min((job.started_at for job in jobs), default=finished)
+    seconds = max((finished - started).total_seconds(), 1e-6)
+    stats = sink.stats()
+    messages_per_second, recipients_per_second = throughput(stats, seconds)
+
+    return BenchmarkResult(
+        events=events,
+        recipients=recipients,
+        delivered=stats["recipients"],
+        messages=stats["messages"],
+        seconds=round(seconds, 3),
+        messages_per_second=messages_per_second,
+        recipients_per_second=recipients_per_second,
+        lag_p50=round(percentile(lags, 50), 3),
+        lag_p99=round(percentile(lags, 99), 3),
+        peak_rss_mb=round(monitor.peak_mb, 1),
+    )
+
+
+def schedule_lags(jobs: Iterable[Job], due: datetime) -> List[float]:
+    """
+    Measure how late each job started after its scheduled time.
+
+    Args:
+        jobs: Finished send_mail jobs
+        due: Scheduled send time, naive UTC
+
+    Returns:
+        Seconds between the scheduled time and the start of each job
+    """
+    return [
+        max((job.started_at - due).total_seconds(), 0.0)
+        for job in jobs
+        if job.started_at is not None
+    ]
+
+
+def parse_counts(ctx: Any, param: Any, value: str) -> List[int]:
+    """Parse a comma-separated list of positive integers."""
+    try:
+        counts = [int(part) for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise click.BadParameter("expected comma-separated integers")
+    if not counts or min(counts) < 1:
+        raise click.BadParameter("counts must be positive")
+    return counts
+
+
+@click.command("smtp-sink")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=1025, show_default=True)
+@click.option("--latency", default=0.0, help="Seconds per message.")
+@click.option("--error-rate", default=0.0, help="Share of messages refused.")
+@click.option("--error-code", default=451, show_default=True)
+@click.option("--rcpt-error-rate", default=0.0, help="Share of recipients refused.")
+def smtp_sink_command(
+    host: str,
+    port: int,
+    latency: float,
+    error_rate: float,
+    error_code: int,
+    rcpt_error_rate: float,
+) -> None:
+    """Run a local SMTP server that accepts and discards mail."""
+    sink = SMTPSink(
+        host,
+        port,
+        latency=latency,
+        error_rate=error_rate,
+        error_code=error_code,
+        rcpt_error_rate=rcpt_error_rate,
+    )
+    with sink:
+        click.echo(f"SMTP sink listening on {sink.host}:{sink.port}, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(10)
+                click.echo(sink.stats())
+        except KeyboardInterrupt:
+            click.echo(sink.stats())
+
+
+@click.command("benchmark")
+@click.option("--events", default="1,10", callback=parse_counts, show_default=True)
+@click.option(
+    "--recipients", default="10,1000", callback=parse_counts, show_default=True
+)
+@click.option("--latency", default=0.0, help="Sink seconds per message.")
+@click.option("--error-rate", default=0.0, help="Share of messages refused.")
+@click.option("--interval", type=float, help="Scheduler poll interval.")
+@click.option("--lead", default=2.0, show_default=True, help="Seconds to send time.")
+@with_appcontext
+def benchmark_command(
+    events: List[int],
+    recipients: List[int],
+    latency: float,
+    error_rate: float,
+    interval: float,
+    lead: float,
+) -> None:
+    """Measure end-to-end delivery throughput against the SMTP sink."""
+    app = current_app._get_current_object()  # type: ignore[attr-defined]
+    if interval is None:
+        interval = app.config.get("RQ_SCHEDULER_INTERVAL", 1)
+    db.create_all()
+
+    columns = BenchmarkResult._fields
+    click.echo("\t".join(columns))
+    with SMTPSink(latency=latency, error_rate=error_rate) as sink:
+        use_sink(app, sink)
+        for event_count in events:
+            for recipient_count in recipients:
+                result = run_benchmark(
+                    sink, event_count, recipient_count, lead=lead, interval=interval
+                )
+                click.echo("\t".join(str(value) for value in result))
+        reset_smtp_pool()
+
+
+def register_commands(app: Any) -> None:
+    """
+    Register benchmark commands with the Flask application.
+
+    Args:
+        app: The Flask application
+    """
+    app.cli.add_command(smtp_sink_command)
+    app.cli.add_command(benchmark_command)
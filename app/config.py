@@ -41,11 +41,130 @@ class Config(object):
         os.environ.get("MAIL_DEFAULT_SENDER") or "your@default-mail.com"
     )
 
+    # Keep SMTP connections open between jobs in the same worker process.
+    MAIL_POOL_ENABLED = True
+    MAIL_POOL_SIZE = 2
+    MAIL_POOL_MAX_MESSAGES = 100
+    MAIL_POOL_MAX_AGE = 300
+    # Events with more recipients are split into chunk jobs of this size.
+    MAIL_CHUNK_SIZE = 500
+    # Recipient addresses per bulk status UPDATE statement.
+    MAIL_STATUS_BATCH_SIZE = 1000
+    # Recipients are grouped by domain into transactions of at most this many
+    # RCPT TO; a domain taking longer than MAIL_SLOW_DOMAIN_SECONDS is logged
+    # as a warning and sent after the faster ones from then on.
+    MAIL_MAX_RCPT_PER_TRANSACTION = 100
+    MAIL_SLOW_DOMAIN_SECONDS = 10
+    # "batch" sends one message per transaction with the recipients in the
+    # envelope only, "personal" one message per recipient addressed to them.
+    MAIL_ENVELOPE_MODE = os.environ.get("MAIL_ENVELOPE_MODE", "batch")
+    # Render personal messages in this many processes, 0 to render them in
+    # the worker; at most MAIL_RENDER_QUEUE_DEPTH batches of
+    # MAIL_RENDER_BATCH_SIZE messages wait to be sent.
+    MAIL_RENDER_PROCESSES = int(os.environ.get("MAIL_RENDER_PROCESSES", 0))
+    MAIL_RENDER_QUEUE_DEPTH = 8
+    MAIL_RENDER_BATCH_SIZE = 100
+    # "smtp" sends one blocking transaction per job, "async" runs many SMTP
+    # sessions concurrently from one worker.
+    MAIL_DELIVERY_ENGINE = os.environ.get("MAIL_DELIVERY_ENGINE", "smtp")
+    MAIL_ASYNC_CONCURRENCY = 20
+    MAIL_ASYNC_BATCH_SIZE = 50
+    MAIL_ASYNC_TIMEOUT = 60
+    # Cluster-wide token buckets in Redis, one token per recipient, keyed
+    # "relay:<MAIL_SERVER>" or "sender:<MAIL_USERNAME>", e.g.
+    # {"relay:smtp.gmail.com": {"per_minute": 60, "per_day": 2000}}.
+    MAIL_RATE_LIMITS: dict = {}
+    # Recipients refused with a 4xx reply are retried after an exponential
+    # backoff with jitter, up to MAIL_RETRY_MAX_ATTEMPTS sends in total.
+    MAIL_RETRY_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BASE_DELAY = 30
+    MAIL_RETRY_MAX_DELAY = 3600
+    # Pause every worker sending through a relay that replies 421/451/452.
+    MAIL_BACKOFF_ENABLED = True
+    MAIL_BACKOFF_BASE_DELAY = 1
+    MAIL_BACKOFF_MAX_DELAY = 120
+    # Route deliveries over several relays instead of MAIL_SERVER, e.g.
+    # [{"name": "primary", "server": "smtp1.example.com", "port": 587,
+    #   "use_tls": True, "weight": 3, "max_concurrency": 8}]. A relay failing
+    # MAIL_RELAY_FAILURE_THRESHOLD times in a row is probed again after
+    # MAIL_RELAY_PROBE_INTERVAL seconds.
+    MAIL_RELAYS: list = []
+    MAIL_RELAY_FAILURE_THRESHOLD = 3
+    MAIL_RELAY_PROBE_INTERVAL = 60
+    MAIL_RELAY_WAIT_TIMEOUT = 30
+
     REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
     REDIS_PORT = os.environ.get("REDIS_PORT", 6379)
     RQ_REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
     RQ_ASYNC = True
     RQ_SCHEDULER_INTERVAL = 10
+    # "rq" schedules jobs with rq-scheduler, "wheel" files them in the Redis
+    # timing wheel dispatched by `flask dispatcher`, which sleeps until the
+    # next job is due or one is scheduled, and at most MAIL_WHEEL_INTERVAL
+    # seconds; see app.scheduler.wheel.
+    MAIL_SCHEDULER = os.environ.get("MAIL_SCHEDULER", "rq")
+    MAIL_WHEEL_RESOLUTIONS = (1, 60, 3600)
+    MAIL_WHEEL_INTERVAL = 30
+    # With MAIL_SCHEDULER = "database", `flask dispatcher` polls the events
+    # table instead and claims up to MAIL_POLLER_BATCH_SIZE due events per
+    # transaction. A claim not done after MAIL_POLLER_CLAIM_TIMEOUT seconds
+    # is taken again; see app.scheduler.poller.
+    MAIL_POLLER_INTERVAL = 5
+    MAIL_POLLER_BATCH_SIZE = 100
+    MAIL_POLLER_CLAIM_TIMEOUT = 3600
+    # Replicas of `flask dispatcher` elect a leader holding a lease of
+    # MAIL_DISPATCHER_LEASE_TTL seconds, only it dispatches. With
+    # MAIL_DISPATCHER_SHARDED, the live replicas share the
+    # MAIL_DISPATCHER_PARTITIONS partitions of the due work instead; drain
+    # the wheel before changing the number of partitions.
+    MAIL_DISPATCHER_SHARDED = (
+        os.environ.get("MAIL_DISPATCHER_SHARDED", "").lower() == "true"
+    )
+    MAIL_DISPATCHER_PARTITIONS = int(os.environ.get("MAIL_DISPATCHER_PARTITIONS", 1))
+    MAIL_DISPATCHER_LEASE_TTL = 10
+    # After an outage, once the oldest due event is MAIL_CATCHUP_THRESHOLD
+    # seconds overdue, the database dispatcher claims due events oldest first
+    # at a rate ramping from MAIL_CATCHUP_START_RATE to MAIL_CATCHUP_MAX_RATE
+    # events per second over MAIL_CATCHUP_RAMP seconds. Events overdue by
+    # more than MAIL_CATCHUP_STALE_AFTER seconds are skipped, none if unset;
+    # see app.scheduler.catchup.
+    MAIL_CATCHUP_THRESHOLD = 300
+    MAIL_CATCHUP_START_RATE = 10
+    MAIL_CATCHUP_MAX_RATE = 200
+    MAIL_CATCHUP_RAMP = 300
+    MAIL_CATCHUP_STALE_AFTER = (
+        int(os.environ["MAIL_CATCHUP_STALE_AFTER"])
+        if os.environ.get("MAIL_CATCHUP_STALE_AFTER")
+        else None
+    )
+    # Time zone of recipients without one, for events sent at a local time;
+    # see app.scheduler.timezones.
+    MAIL_DEFAULT_TIMEZONE = os.environ.get("MAIL_DEFAULT_TIMEZONE", "UTC")
+    # Seconds after its timestamp an event may be sent by, when it gives no
+    # spread of its own, with MAIL_SCHEDULER=database only; the other
+    # dispatchers cannot pace events. The database dispatcher releases them at
+    # MAIL_SPREAD_CAPACITY events per second, or evenly over their windows
+    # if unset; see app.scheduler.spreading.
+    MAIL_SPREAD_WINDOW = int(os.environ.get("MAIL_SPREAD_WINDOW", 0))
+    MAIL_SPREAD_CAPACITY = (
+        float(os.environ["MAIL_SPREAD_CAPACITY"])
+        if os.environ.get("MAIL_SPREAD_CAPACITY")
+        else None
+    )
+    # Seconds a retried /api/save_emails request with the same
+    # Idempotency-Key is answered from Redis; see app.event.idempotency.
+    MAIL_IDEMPOTENCY_TTL = 86400
+    # Largest number of events accepted by one /api/save_emails/bulk request.
+    MAIL_BULK_MAX_EVENTS = 10000
+    # Events go to the queue of their priority. Workers listen on RQ_QUEUES
+    # and draw the next queue to look at by MAIL_QUEUE_WEIGHTS, so bulk mail
+    # keeps moving while urgent mail goes first; see app.delivery.queues.
+    RQ_QUEUES = ["high", "default", "low"]
+    MAIL_PRIORITY_QUEUES = {"high": "high", "normal": "default", "low": "low"}
+    MAIL_QUEUE_WEIGHTS = {"high": 10, "default": 3, "low": 1}
+    # Run jobs in the worker process itself so pooled connections survive
+    # from one job to the next.
+    RQ_WORKER_CLASS = "app.delivery.queues.WeightedWorker"
 
 
 class ProductionConfig(Config):
@@ -78,3 +197,5 @@ class TestingConfig(Config):
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
     RQ_ASYNC = False
+    MAIL_POOL_ENABLED = False
+    MAIL_BACKOFF_ENABLED = False
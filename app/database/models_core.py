@@ -1,6 +1,6 @@
 """Core data models for the application.
 
-This module contains the Event and Recipient models.
+This module contains the Event, Recipient and ScheduledCall models.
 """
 
 from __future__ import annotations
@@ -9,6 +9,7 @@ from datetime import UTC, datetime
 from typing import TYPE_CHECKING, Optional
 
 from app.database import db
+from app.delivery.mime import prepare_content
 
 if TYPE_CHECKING:
     pass
@@ -18,16 +19,47 @@ class Event(db.Model):  # type: ignore[name-defined]
     """Event model for scheduled emails."""
 
     __tablename__ = "events"
+    __table_args__ = (db.Index("ix_events_due", "is_done", "timestamp"),)
 
     id = db.Column(db.Integer, primary_key=True)
     _email_subject = db.Column("email_subject", db.String, nullable=False)
     _email_content = db.Column("email_content", db.String)
+    # Derived from email_content when it is stored, see prepare_content().
+    content_type = db.Column(db.String(16), nullable=True)
+    mime_body = db.Column(db.LargeBinary, nullable=True)
     timestamp = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(
         db.DateTime, nullable=False, default=lambda: datetime.now(UTC)
     )
     _is_done = db.Column("is_done", db.Boolean, nullable=False, default=False)
     done_at = db.Column(db.DateTime, nullable=True)
+    # Set when a database poller claims the event, see app.scheduler.poller.
+    dispatched_at = db.Column(db.DateTime, nullable=True)
+    # The job waiting in the scheduler to send (or fire) the event.
+    job_id = db.Column(db.String(64), nullable=True)
+    # Cron expression or RRULE of a recurring event, its next fire time and,
+    # on the events it spawns, the recurring event; see
+    # app.scheduler.recurrence.
+    recurrence = db.Column(db.String, nullable=True)
+    next_fire_at = db.Column(db.DateTime, nullable=True, index=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey("events.id"), nullable=True)
+    # "high", "normal" or "low", mapped to an RQ queue by
+    # MAIL_PRIORITY_QUEUES; see app.delivery.queues.
+    priority = db.Column(
+        db.String(16), nullable=False, default="normal", server_default="normal"
+    )
+    # Wall-clock time to send at in each recipient's time zone, in which
+    # case timestamp is when the first time zone reaches it; see
+    # app.scheduler.timezones.
+    local_time = db.Column(db.DateTime, nullable=True)
+    # Latest time to send an event allowed to spread over a window after
+    # its timestamp; see app.scheduler.spreading.
+    send_by = db.Column(db.DateTime, nullable=True)
+    # Idempotency-Key the event was created with, so a retried request
+    # cannot create it twice; see app.event.idempotency.
+    idempotency_key = db.Column(db.String(255), nullable=True, unique=True)
+    # Hash of the request that created the event with that key.
+    idempotency_hash = db.Column(db.String(64), nullable=True)
     recipients = db.relationship("Recipient", backref="event", lazy="dynamic")
 
     def __init__(
@@ -38,6 +70,11 @@ class Event(db.Model):  # type: ignore[name-defined]
         created_at: Optional[datetime] = None,
         is_done: bool = False,
         done_at: Optional[datetime] = None,
+        recurrence: Optional[str] = None,
+        next_fire_at: Optional[datetime] = None,
+        priority: str = "normal",
+        local_time: Optional[datetime] = None,
+        send_by: Optional[datetime] = None,
     ) -> None:
         """
         Initialize an Event instance.
@@ -49,6 +86,12 @@ class Event(db.Model):  # type: ignore[name-defined]
             created_at: When the event was created (defaults to now)
             is_done: Whether the email has been sent
             done_at: When the email was sent
+            recurrence: Cron expression or RRULE repeating the email
+            next_fire_at: When a recurring email is sent next
+            priority: Priority of the queue the email is sent from
+            local_time: Wall-clock time to send at in each recipient's
+                time zone
+            send_by: Latest time to send the email when spreading sends
         """
         self.email_subject = email_subject
         self.email_content = email_content
@@ -57,6 +100,11 @@ class Event(db.Model):  # type: ignore[name-defined]
             self.created_at = created_at
         self.is_done = is_done
         self.done_at = done_at
+        self.recurrence = recurrence
+        self.next_fire_at = next_fire_at
+        self.priority = priority
+        self.local_time = local_time
+        self.send_by = send_by
 
     @property
     def email_subject(self) -> str:
@@ -75,8 +123,13 @@ class Event(db.Model):  # type: ignore[name-defined]
 
     @email_content.setter
     def email_content(self, value: str) -> None:
-        """Set the email content."""
+        """Set the email content and rebuild its MIME part."""
         self._email_content = value
+        self.prepare_content()
+
+    def prepare_content(self) -> None:
+        """Classify the content and cache its encoded MIME part."""
+        self.content_type, self.mime_body = prepare_content(self.email_content)
 
     @property
     def is_done(self) -> bool:
@@ -99,17 +152,32 @@ class Recipient(db.Model):  # type: ignore[name-defined]
     """Recipient model for event recipients."""
 
     __tablename__ = "recipients"
+    __table_args__ = (db.Index("ix_recipients_event_status", "event_id", "status"),)
+
+    # Delivery states
+    STATUS_QUEUED = "queued"
+    STATUS_SENT = "sent"
+    STATUS_DEFERRED = "deferred"
+    STATUS_FAILED = "failed"
+    # Not sent because the event was overdue for too long after an outage.
+    STATUS_SKIPPED = "skipped"
 
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String, nullable=False)
     name = db.Column(db.String)
     event_id = db.Column(db.Integer, db.ForeignKey("events.id"), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=STATUS_QUEUED)
+    smtp_code = db.Column(db.Integer, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    # IANA time zone, for events sent at a local time.
+    timezone = db.Column(db.String(64), nullable=True)
 
     def __init__(
         self,
         email: str,
         name: Optional[str] = None,
         event_id: Optional[int] = None,
+        timezone: Optional[str] = None,
     ) -> None:
         """
         Initialize a Recipient instance.
@@ -118,14 +186,46 @@ class Recipient(db.Model):  # type: ignore[name-defined]
             email: Email address of the recipient
             name: Name of the recipient (optional)
             event_id: ID of the associated event
+            timezone: IANA time zone of the recipient (optional)
         """
         self.email = email
         self.name = name
         if event_id:
             self.event_id = event_id
+        self.timezone = timezone
+        self.status = self.STATUS_QUEUED
+
+    @property
+    def is_sent(self) -> bool:
+        """Check if the email was accepted for this recipient."""
+        return bool(self.status == self.STATUS_SENT)
 
     def __repr__(self) -> str:
         """String representation of the recipient."""
         if self.name:
             return f"<Recipient {self.id}: {self.name} ({self.email})>"
         return f"<Recipient {self.id}: {self.email}>"
+
+
+class ScheduledCall(db.Model):  # type: ignore[name-defined]
+    """A job to enqueue later, when MAIL_SCHEDULER is database.
+
+    Retries and the jobs of time zone groups are delayed calls rather than
+    events. With the database dispatcher they wait here instead of in
+    rq-scheduler, and the poller enqueues them when due; see
+    app.scheduler.poller.
+    """
+
+    __tablename__ = "scheduled_calls"
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(64), nullable=False, unique=True)
+    due_at = db.Column(db.DateTime, nullable=False, index=True)
+    # Dotted path of the job function, such as app.event.jobs.retry_mail.
+    func = db.Column(db.String(255), nullable=False)
+    args = db.Column(db.PickleType, nullable=False)
+    queue = db.Column(db.String(64), nullable=True)
+
+    def __repr__(self) -> str:
+        """String representation of the scheduled call."""
+        return f"<ScheduledCall {self.job_id}: {self.func} at {self.due_at}>"
@@ -0,0 +1 @@
+"""Delivery components used by the mail sending jobs."""
@@ -0,0 +1,256 @@
+"""Asyncio delivery engine.
+
+Runs many SMTP sessions concurrently from a single worker process, so
+throughput is no longer bound by one blocking round trip at a time. Each
+session sends envelopes from a shared queue and is reopened after
+``messages_per_session`` transactions or on error.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+import aiosmtplib
+
+from app.delivery.ratelimit import RateLimiter
+from app.delivery.relays import Relay
+from app.delivery.smtp import Refused
+
+logger = logging.getLogger(__name__)
+
+
+class Envelope(NamedTuple):
+    """One SMTP transaction: sender, recipients and the serialized message."""
+
+    sender: str
+    recipients: List[str]
+    message: bytes
+
+
+# Per envelope: refused recipients, or the error that failed the transaction.
+Result = Union[Refused, Exception]
+
+
+class AsyncDeliveryEngine(object):
+    """Send envelopes over a bounded number of concurrent SMTP sessions."""
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_ssl: bool = False,
+        use_tls: bool = False,
+        concurrency: int = 20,
+        timeout: float = 60,
+        messages_per_session: int = 100,
+        suppress: bool = False,
+        rate_limiter: Optional[RateLimiter] = None,
+    ) -> None:
+        """
+        Initialize an AsyncDeliveryEngine instance.
+
+        Args:
+            hostname: SMTP server host
+            port: SMTP server port
+            username: Optional AUTH user name
+            password: Optional AUTH password
+            use_ssl: Connect with implicit TLS
+            use_tls: Upgrade the connection with STARTTLS
+            concurrency: Maximum number of simultaneous SMTP sessions
+            timeout: Network timeout in seconds
+            messages_per_session: Transactions before a session is reopened
+            suppress: Skip the network entirely, as Flask-Mail does in tests
+            rate_limiter: Shared limiter drawn from before every transaction
+        """
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.use_tls = use_tls
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.messages_per_session = messages_per_session
+        self.suppress = suppress
+        self.rate_limiter = rate_limiter
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Mapping[str, Any],
+        rate_limiter: Optional[RateLimiter] = None,
+        relay: Optional[Relay] = None,
+    ) -> "AsyncDeliveryEngine":
+        """
+        Build an engine from the Flask-Mail and MAIL_ASYNC_* settings.
+
+        Args:
+            config: The Flask application config
+            rate_limiter: Optional shared rate limiter
+            relay: Relay to send through instead of ``MAIL_SERVER``; its
+                ``max_concurrency`` also caps the number of sessions
+
+        Returns:
+            A configured engine
+        """
+        concurrency = config.get("MAIL_ASYNC_CONCURRENCY", 20)
+        if relay is not None:
+            config = relay.mail_config(config)
+            if relay.max_concurrency:
+                concurrency = min(concurrency, relay.max_concurrency)
+        return cls(
+            hostname=config.get("MAIL_SERVER", "localhost"),
+            port=config.get("MAIL_PORT", 25),
+            username=config.get("MAIL_USERNAME"),
+            password=config.get("MAIL_PASSWORD"),
+            use_ssl=config.get("MAIL_USE_SSL", False),
+            use_tls=config.get("MAIL_USE_TLS", False),
+            concurrency=concurrency,
+            timeout=config.get("MAIL_ASYNC_TIMEOUT", 60),
+            messages_per_session=config.get("MAIL_POOL_MAX_MESSAGES", 100),
+            suppress=config.get("MAIL_SUPPRESS_SEND", config.get("TESTING", False)),
+            rate_limiter=rate_limiter,
+        )
+
+    def deliver(self, envelopes: List[Envelope]) -> List[Result]:
+        """
+        Send every envelope and wait for all of them.
+
+        Args:
+            envelopes: Transactions to send
+
+        Returns:
+            One result per envelope, in the same order
+        """
+        if not envelopes:
+            return []
+        return asyncio.run(self.deliver_async(envelopes))
+
+    async def deliver_async(self, envelopes: List[Envelope]) -> List[Result]:
+        """
+        Coroutine version of :meth:`deliver`.
+
+        Args:
+            envelopes: Transactions to send
+
+        Returns:
+            One result per envelope, in the same order
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in enumerate(envelopes):
+            queue.put_nowait(item)
+
+        results: List[Result] = [{} for _ in envelopes]
+        sessions = min(self.concurrency, len(envelopes))
+        await asyncio.gather(
+            *(self._session(queue, results) for _ in range(sessions))
+        )
+        return results
+
+    async def _session(self, queue: asyncio.Queue, results: List[Result]) -> None:
+        """Send envelopes from the queue over one SMTP session."""
+        smtp: Optional[aiosmtplib.SMTP] = None
+        sent = 0
+        try:
+            while True:
+                try:
+                    index, envelope = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                if self.suppress:
+                    continue
+
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire_async(len(envelope.recipients))
+
+                try:
+                    if smtp is None or sent >= self.messages_per_session:
+                        await self._close(smtp)
+                        smtp = None
+                        smtp = await self._open()
+                        sent = 0
+                    results[index] = await self._send(smtp, envelope)
+                    sent += 1
+                except (aiosmtplib.SMTPException, OSError) as exc:
+                    logger.warning("Async SMTP transaction failed: %s", exc)
+                    results[index] = exc
+                    await self._close(smtp)
+                    smtp = None
+        finally:
+            await self._close(smtp)
+
+    async def _open(self) -> aiosmtplib.SMTP:
+        """Open and authenticate a new SMTP session."""
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            timeout=self.timeout,
+            use_tls=self.use_ssl,
+            start_tls=self.use_tls,
+        )
+        await smtp.connect()
+        if self.username and self.password:
+            await smtp.login(self.username, self.password)
+        return smtp
+
+    @staticmethod
+    async def _send(smtp: aiosmtplib.SMTP, envelope: Envelope) -> Refused:
+        """Run one transaction and return the refused recipients."""
+        try:
+            errors, _ = await smtp.sendmail(
+                envelope.sender, envelope.recipients, envelope.message
+            )
+        except aiosmtplib.SMTPRecipientsRefused as exc:
+            return {
+                error.recipient: (error.code, error.message.encode())
+                for error in exc.recipients
+            }
+        return {
+            addr: (response.code, response.message.encode())
+            for addr, response in errors.items()
+        }
+
+    @staticmethod
+    async def _close(smtp: Optional[aiosmtplib.SMTP]) -> None:
+        """Quit a session, ignoring errors from dead sockets."""
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+
+def split_results(
+    envelopes: List[Envelope], results: List[Result]
+) -> Tuple[Refused, Dict[str, Exception]]:
+    """
+    Flatten per-envelope results into per-recipient outcomes.
+
+    A transaction rejected with an SMTP reply counts as a refusal of each of
+    its recipients with that reply.
+
+    Args:
+        envelopes: The envelopes that were sent
+        results: The matching results from :meth:`AsyncDeliveryEngine.deliver`
+
+    Returns:
+        Refused recipients with their SMTP reply, and recipients whose
+        transaction failed without a reply mapped to the error
+    """
+    refused: Refused = {}
+    errors: Dict[str, Exception] = {}
+    for envelope, result in zip(envelopes, results):
+        if isinstance(result, aiosmtplib.SMTPResponseException):
+            reply = (result.code, result.message.encode())
+            refused.update((addr, reply) for addr in envelope.recipients)
+        elif isinstance(result, Exception):
+            errors.update((addr, result) for addr in envelope.recipients)
+        else:
+            refused.update(result)
+    return refused, errors
@@ -0,0 +1,101 @@
+"""Fan-out of large recipient lists into chunked sub-jobs.
+
+A big event is split into chunks that are enqueued as independent RQ jobs,
+so every worker can take a share of the list. A counter in Redis tracks the
+chunks still outstanding; the chunk that brings it to zero finishes the
+event.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterator, List, Optional, Sequence, TypeVar
+
+from rq.job import Job
+from rq.queue import EnqueueData, Queue
+
+T = TypeVar("T")
+
+FANOUT_KEY = "mail-scheduler:fanout:{event_id}"
+# Keep the counter around long enough for failed chunks to be requeued.
+FANOUT_TTL = 7 * 24 * 60 * 60
+
+
+def chunked(items: Sequence[T], size: int) -> Iterator[List[T]]:
+    """
+    Split a sequence into lists of at most ``size`` items.
+
+    Args:
+        items: The sequence to split
+        size: Maximum chunk length
+
+    Returns:
+        Iterator over the chunks
+    """
+    if size < 1:
+        raise ValueError("Chunk size must be at least 1")
+    for start in range(0, len(items), size):
+        yield list(items[start : start + size])
+
+
+def start_fanout(connection: Any, event_id: int, chunks: int) -> None:
+    """
+    Record how many chunks an event was split into.
+
+    Args:
+        connection: Redis connection
+        event_id: ID of the event being fanned out
+        chunks: Number of chunk jobs about to be enqueued
+    """
+    connection.set(FANOUT_KEY.format(event_id=event_id), chunks, ex=FANOUT_TTL)
+
+
+def finish_chunk(connection: Any, event_id: int) -> bool:
+    """
+    Mark one chunk of an event as finished.
+
+    Args:
+        connection: Redis connection
+        event_id: ID of the event the chunk belongs to
+
+    Returns:
+        True if this was the last outstanding chunk
+    """
+    key = FANOUT_KEY.format(event_id=event_id)
+    remaining = connection.decr(key)
+    if remaining > 0:
+        return False
+    connection.delete(key)
+    return True
+
+
+def enqueue_many(
+    queue: Queue, job_datas: List[EnqueueData], pipeline: Optional[Any] = None
+) -> List[Job]:
+    """
+    Enqueue several jobs in one Redis round trip.
+
+    ``Queue.enqueue_many`` does not run jobs inline, so synchronous queues
+    (``RQ_ASYNC = False``) fall back to enqueueing one job at a time.
+
+    Args:
+        queue: The queue to enqueue into
+        job_datas: Jobs built with ``Queue.prepare_data``
+        pipeline: Optional Redis pipeline the caller executes itself
+
+    Returns:
+        The enqueued jobs
+    """
+    if queue.is_async:
+        return queue.enqueue_many(job_datas, pipeline=pipeline)
+
+    return [
+        queue.enqueue_call(
+            job_data.func,
+            args=job_data.args,
+            kwargs=job_data.kwargs,
+            timeout=job_data.timeout,
+            job_id=job_data.job_id,
+            meta=job_data.meta,
+        )
+        for job_data in job_datas
+    ]
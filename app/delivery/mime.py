@@ -0,0 +1,207 @@
+"""Message bodies prepared once, when an event's content is stored.
+
+Deciding between HTML and plain text means parsing the content, and
+encoding the body for transport is the bulk of building a message. Both
+happen when the content is saved; the send path only joins the cached,
+already encoded MIME part to freshly rendered headers.
+
+For personalised sends the headers are rendered once as well: a
+:class:`MessageTemplate` copies them for every recipient and only swaps
+the ``To`` and ``Message-ID`` lines.
+"""
+
+from __future__ import annotations
+
+import uuid
+from email import policy
+from email.mime.text import MIMEText
+from typing import Any, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+from flask_mail import Message, sanitize_address
+
+CONTENT_TYPE_HTML = "html"
+CONTENT_TYPE_PLAIN = "plain"
+
+# Headers describing the body; they come from the cached part instead.
+BODY_HEADERS = ("Content-Type", "MIME-Version", "Content-Transfer-Encoding")
+
+# To header of a message whose recipients are all in the envelope only.
+UNDISCLOSED_RECIPIENTS = "undisclosed-recipients:;"
+
+
+def classify_content(content: str) -> str:
+    """
+    Decide whether content is HTML or plain text.
+
+    Args:
+        content: Email content
+
+    Returns:
+        CONTENT_TYPE_HTML if the content contains markup, else
+        CONTENT_TYPE_PLAIN
+    """
+    if content and BeautifulSoup(content, "html.parser").find():
+        return CONTENT_TYPE_HTML
+    return CONTENT_TYPE_PLAIN
+
+
+def build_mime_part(content: str, content_type: str) -> bytes:
+    """
+    Encode content as a standalone MIME part.
+
+    Args:
+        content: Email content
+        content_type: CONTENT_TYPE_HTML or CONTENT_TYPE_PLAIN
+
+    Returns:
+        The part's headers and transfer-encoded body, with CRLF line endings
+    """
+    part = MIMEText(content, _subtype=content_type, _charset="utf-8")
+    return part.as_bytes(policy=policy.SMTP)
+
+
+def prepare_content(content: str) -> Tuple[str, bytes]:
+    """
+    Classify content and build its MIME part.
+
+    Args:
+        content: Email content
+
+    Returns:
+        Tuple of content type and encoded MIME part
+    """
+    content_type = classify_content(content)
+    return content_type, build_mime_part(content, content_type)
+
+
+class PreparedMessage(Message):
+    """A Flask-Mail message whose body is a pre-encoded MIME part."""
+
+    def __init__(
+        self,
+        *args: Any,
+        mime_part: bytes = b"",
+        to_header: Optional[str] = None,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Initialize a PreparedMessage instance.
+
+        Args:
+            *args: Positional arguments of ``flask_mail.Message``
+            mime_part: Output of :func:`build_mime_part`
+            to_header: ``To`` header to show instead of the recipients, such
+                as UNDISCLOSED_RECIPIENTS
+            **kwargs: Keyword arguments of ``flask_mail.Message``
+        """
+        super().__init__(*args, **kwargs)
+        # An empty plain body keeps Flask-Mail on its cheapest code path; the
+        # resulting part is dropped in favour of mime_part.
+        self.body = ""
+        self.html = None
+        self.mime_part = mime_part
+        self.to_header = to_header
+
+    def as_bytes(self) -> bytes:
+        """Render the headers and append the cached MIME part."""
+        message = self._message()
+        for header in BODY_HEADERS:
+            del message[header]
+        if self.to_header is not None:
+            del message["To"]
+            message["To"] = self.to_header
+        message.policy = policy.SMTP
+        # Keep the header lines only; the cached part brings its own headers
+        # followed by the blank line and the body.
+        head, _, _ = message.as_bytes().partition(b"\r\n\r\n")
+        return head + b"\r\n" + self.mime_part
+
+    def as_string(self) -> str:
+        """Render the message as text."""
+        return self.as_bytes().decode("utf-8")
+
+
+class RenderedMessage(object):
+    """A serialized message and its envelope, sendable like a Message."""
+
+    def __init__(self, sender: str, recipient: str, data: bytes) -> None:
+        """
+        Initialize a RenderedMessage instance.
+
+        Args:
+            sender: Envelope sender
+            recipient: The one envelope recipient
+            data: The complete message
+        """
+        self.sender = sender
+        self.send_to = {recipient}
+        self.data = data
+        self.date: Optional[float] = None
+        self.mail_options: List[str] = []
+        self.rcpt_options: List[str] = []
+
+    def has_bad_headers(self) -> bool:
+        """Headers were checked once, on the template."""
+        return False
+
+    def as_bytes(self) -> bytes:
+        """Return the serialized message."""
+        return self.data
+
+
+class MessageTemplate(object):
+    """Headers and body rendered once and personalised per recipient."""
+
+    def __init__(self, message: PreparedMessage) -> None:
+        """
+        Initialize a MessageTemplate instance.
+
+        Args:
+            message: The message to copy, without recipients
+        """
+        if message.has_bad_headers():
+            raise ValueError("The message has bad headers")
+
+        self.sender = message.sender
+        head, _, self.mime_part = message.as_bytes().partition(b"\r\n\r\n")
+        self.lines = head.split(b"\r\n")
+        self.to_index = self._find(b"To:")
+        self.id_index = self._find(b"Message-ID:")
+        # Keep the host part of Flask-Mail's Message-ID for the copies.
+        self.msgid_domain = message.msgId.rpartition("@")[2].rstrip(">")
+
+    def _find(self, prefix: bytes) -> int:
+        for index, line in enumerate(self.lines):
+            if line.startswith(prefix):
+                return index
+        raise ValueError(f"Header {prefix.decode()} not found")
+
+    def render(self, recipient: str) -> bytes:
+        """
+        Serialize the message addressed to one recipient.
+
+        Args:
+            recipient: Address for the ``To`` header
+
+        Returns:
+            The complete message with its own ``To`` and ``Message-ID``
+        """
+        lines = list(self.lines)
+        lines[self.to_index] = b"To: " + sanitize_address(recipient).encode()
+        lines[self.id_index] = (
+            f"Message-ID: <{uuid.uuid4().hex}@{self.msgid_domain}>".encode()
+        )
+        return b"\r\n".join(lines) + b"\r\n\r\n" + self.mime_part
+
+    def message(self, recipient: str) -> RenderedMessage:
+        """
+        Build the message for one recipient.
+
+        Args:
+            recipient: Address of the recipient
+
+        Returns:
+            Message that Flask-Mail and pooled connections can send
+        """
+        return RenderedMessage(self.sender, recipient, self.render(recipient))
@@ -0,0 +1,175 @@
+"""Planning of SMTP transactions by destination domain.
+
+Recipients of a page are bucketed by the domain of their address, and each
+bucket is sent as transactions of at most ``max_recipients`` RCPT TO over
+the connection the page goes out on. Receiving servers see all of their
+recipients together instead of interleaved with everyone else's.
+
+The time every domain takes is remembered for the life of the worker
+process. Domains known to be fast are sent first and slow ones last, so a
+slow domain only delays itself rather than the rest of the event.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from app.delivery.fanout import chunked
+from app.delivery.status import normalize_address
+
+logger = logging.getLogger(__name__)
+
+# RFC 5321 requires servers to accept at least 100 recipients per message.
+DEFAULT_MAX_RECIPIENTS = 100
+
+
+class Transaction(NamedTuple):
+    """Recipients of one domain sent in a single SMTP transaction."""
+
+    domain: str
+    recipients: List[str]
+
+
+def recipient_domain(address: str) -> str:
+    """
+    Get the domain an address is delivered to.
+
+    Args:
+        address: Address such as ``Name <user@Example.com>``
+
+    Returns:
+        The lower-cased domain, empty for an address without one
+    """
+    _, at, domain = normalize_address(address).rpartition("@")
+    return domain.lower() if at else ""
+
+
+class DomainTimings(object):
+    """Moving average of the seconds each domain takes per transaction."""
+
+    def __init__(self, smoothing: float = 0.2) -> None:
+        """
+        Initialize a DomainTimings instance.
+
+        Args:
+            smoothing: Weight of the newest sample in the average
+        """
+        self.smoothing = smoothing
+        self._seconds: Dict[str, float] = {}
+        self._transactions: Dict[str, int] = {}
+
+    def record(self, domain: str, seconds: float) -> None:
+        """
+        Add the duration of one transaction to a domain's average.
+
+        Args:
+            domain: Destination domain
+            seconds: Duration of the transaction
+        """
+        previous = self._seconds.get(domain)
+        if previous is None:
+            self._seconds[domain] = seconds
+        else:
+            self._seconds[domain] = previous + self.smoothing * (seconds - previous)
+        self._transactions[domain] = self._transactions.get(domain, 0) + 1
+
+    def average(self, domain: str) -> Optional[float]:
+        """
+        Get a domain's average transaction time.
+
+        Args:
+            domain: Destination domain
+
+        Returns:
+            Seconds per transaction, None for a domain not seen yet
+        """
+        return self._seconds.get(domain)
+
+    def stats(self) -> List[Dict[str, object]]:
+        """
+        Report the timings of every domain seen, slowest first.
+
+        Returns:
+            One dictionary per domain
+        """
+        return [
+            {
+                "domain": domain,
+                "seconds": round(seconds, 3),
+                "transactions": self._transactions[domain],
+            }
+            for domain, seconds in sorted(
+                self._seconds.items(), key=lambda item: item[1], reverse=True
+            )
+        ]
+
+    def clear(self) -> None:
+        """Forget every domain."""
+        self._seconds.clear()
+        self._transactions.clear()
+
+
+_timings = DomainTimings()
+
+
+def domain_timings() -> DomainTimings:
+    """Return the domain timings of the current worker process."""
+    return _timings
+
+
+def plan_transactions(
+    recipients: Iterable[str],
+    max_recipients: int = DEFAULT_MAX_RECIPIENTS,
+    timings: Optional[DomainTimings] = None,
+) -> List[Transaction]:
+    """
+    Bucket recipients by domain and split the buckets into transactions.
+
+    Domains keep the order of their first recipient unless ``timings`` is
+    given. Then domains not seen yet come first and the others follow by
+    their average time, fastest first.
+
+    Args:
+        recipients: Recipient addresses
+        max_recipients: Largest number of RCPT TO per transaction
+        timings: Past domain timings to order the domains by
+
+    Returns:
+        Transactions in the order to send them
+    """
+    buckets: Dict[str, List[str]] = {}
+    for addr in recipients:
+        buckets.setdefault(recipient_domain(addr), []).append(addr)
+
+    domains = list(buckets)
+    if timings is not None:
+        domains.sort(key=lambda domain: timings.average(domain) or 0.0)
+
+    return [
+        Transaction(domain, chunk)
+        for domain in domains
+        for chunk in chunked(buckets[domain], max_recipients)
+    ]
+
+
+def log_domain_timing(
+    domain: str, recipients: int, seconds: float, slow_seconds: float
+) -> None:
+    """
+    Log how long a domain took, as a warning when it was slow.
+
+    Args:
+        domain: Destination domain
+        recipients: Recipients sent to the domain
+        seconds: Time spent on the domain's transactions
+        slow_seconds: Duration from which a domain counts as slow
+    """
+    slow = bool(slow_seconds) and seconds >= slow_seconds
+    logger.log(
+        logging.WARNING if slow else logging.DEBUG,
+        "Domain %s: %d recipients in %.3fs",
+        domain or "-",
+        recipients,
+        seconds,
+    )
@@ -0,0 +1,315 @@
+"""Persistent SMTP connection pool.
+
+Opening an SMTP connection costs a TCP handshake, STARTTLS and AUTH. The
+pool keeps authenticated connections open for the lifetime of the worker
+process so that consecutive jobs reuse them instead of paying the handshake
+on every send.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+from flask import current_app
+
+from app.delivery.relays import Relay
+from app.delivery.smtp import Refused, send_message
+from app.extensions import mail
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning the underlying socket can no longer be used.
+DISCONNECT_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+
+
+class PooledConnection(object):
+    """An open Flask-Mail connection owned by a pool."""
+
+    def __init__(self, pool: "SMTPConnectionPool", connection: Any) -> None:
+        """
+        Initialize a PooledConnection instance.
+
+        Args:
+            pool: The pool the connection belongs to
+            connection: An entered ``flask_mail.Connection``
+        """
+        self.pool = pool
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+    @property
+    def host(self) -> Optional[smtplib.SMTP]:
+        """Get the underlying SMTP client (None when sending is suppressed)."""
+        return getattr(self.connection, "host", None)
+
+    def send(self, message: Any, envelope_from: Optional[str] = None) -> Refused:
+        """
+        Send a message, reconnecting once if the server dropped us.
+
+        A connection that already sent ``max_messages`` messages reconnects
+        first.
+
+        Args:
+            message: A ``flask_mail.Message``
+            envelope_from: Optional MAIL FROM address
+
+        Returns:
+            Refused recipients mapped to their SMTP reply
+        """
+        if self.messages_sent >= self.pool.max_messages:
+            # The cap holds within a checkout too, which may send many.
+            logger.info("Pooled connection reached its message cap, reconnecting")
+            self.reconnect()
+        try:
+            refused = send_message(self.connection, message, envelope_from)
+        except smtplib.SMTPServerDisconnected:
+            logger.info("SMTP server dropped a pooled connection, reconnecting")
+            self.reconnect()
+            refused = send_message(self.connection, message, envelope_from)
+
+        self.messages_sent += 1
+        self.last_used = time.monotonic()
+        return refused
+
+    def reconnect(self) -> None:
+        """Replace the underlying connection with a fresh one."""
+        self.close()
+        self.connection = self.pool.open_connection()
+        self.created_at = time.monotonic()
+        self.messages_sent = 0
+
+    def is_alive(self) -> bool:
+        """
+        Health-check the connection with an SMTP NOOP.
+
+        Returns:
+            True if the server answered 250, False otherwise
+        """
+        host = self.host
+        if host is None:
+            return True
+        try:
+            code, _ = host.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return bool(code == 250)
+
+    def close(self) -> None:
+        """Quit the SMTP session, ignoring errors from dead sockets."""
+        try:
+            self.connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+class SMTPConnectionPool(object):
+    """A small pool of warm SMTP connections.
+
+    Connections are checked out, used for one or more messages and checked
+    back in. A connection is retired once it has sent ``max_messages``
+    messages or is older than ``max_age`` seconds, and is health-checked
+    with NOOP before being handed out again.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        max_size: int = 2,
+        max_messages: int = 100,
+        max_age: float = 300.0,
+    ) -> None:
+        """
+        Initialize an SMTPConnectionPool instance.
+
+        Args:
+            connect: Factory returning an un-entered ``flask_mail.Connection``
+            max_size: Maximum number of idle connections kept open
+            max_messages: Messages sent before a connection is retired
+            max_age: Seconds after which a connection is retired
+        """
+        self._connect = connect
+        self.max_size = max_size
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self._idle: Deque[PooledConnection] = deque()
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.reused = 0
+        self.retired = 0
+
+    def open_connection(self) -> Any:
+        """
+        Open a new authenticated connection.
+
+        Returns:
+            An entered ``flask_mail.Connection``
+        """
+        connection = self._connect().__enter__()
+        with self._lock:
+            self.opened += 1
+        return connection
+
+    def is_expired(self, pooled: PooledConnection) -> bool:
+        """
+        Check whether a connection reached its message or age cap.
+
+        Args:
+            pooled: The connection to check
+
+        Returns:
+            True if the connection should be retired
+        """
+        if pooled.messages_sent >= self.max_messages:
+            return True
+        return time.monotonic() - pooled.created_at >= self.max_age
+
+    def checkout(self) -> PooledConnection:
+        """
+        Take a healthy connection from the pool, opening one if needed.
+
+        Returns:
+            A connection ready to send
+        """
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                break
+            if self.is_expired(pooled) or not pooled.is_alive():
+                self._retire(pooled)
+                continue
+            with self._lock:
+                self.reused += 1
+            return pooled
+
+        return PooledConnection(self, self.open_connection())
+
+    def checkin(self, pooled: PooledConnection) -> None:
+        """
+        Return a connection to the pool.
+
+        Args:
+            pooled: The connection to return
+        """
+        if self.is_expired(pooled):
+            self._retire(pooled)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(pooled)
+                return
+        self._retire(pooled)
+
+    def discard(self, pooled: PooledConnection) -> None:
+        """
+        Drop a connection that can no longer be used.
+
+        Args:
+            pooled: The broken connection
+        """
+        self._retire(pooled)
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        """Check out a connection for the duration of a ``with`` block."""
+        pooled = self.checkout()
+        try:
+            yield pooled
+        except DISCONNECT_ERRORS:
+            self.discard(pooled)
+            raise
+        except BaseException:
+            self.checkin(pooled)
+            raise
+        else:
+            self.checkin(pooled)
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            self._retire(pooled)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Report connection reuse.
+
+        Returns:
+            Dictionary with handshakes opened and saved, retired connections
+            and the current number of idle connections
+        """
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "saved": self.reused,
+                "retired": self.retired,
+                "idle": len(self._idle),
+            }
+
+    def _retire(self, pooled: PooledConnection) -> None:
+        pooled.close()
+        with self._lock:
+            self.retired += 1
+
+
+_pools: Dict[Optional[str], SMTPConnectionPool] = {}
+_pool_pid: Optional[int] = None
+
+
+def get_smtp_pool(relay: Optional[Relay] = None) -> SMTPConnectionPool:
+    """
+    Return a pool of the current worker process, creating it on first use.
+
+    There is one pool per relay. Pools are rebuilt after a fork so that
+    children never share sockets with their parent.
+
+    Args:
+        relay: Relay to connect to, None for the Flask-Mail settings
+
+    Returns:
+        The process-wide SMTPConnectionPool of the relay
+    """
+    global _pool_pid
+
+    if _pool_pid != os.getpid():
+        _pools.clear()
+        _pool_pid = os.getpid()
+
+    name = relay.name if relay is not None else None
+    if name not in _pools:
+        config = current_app.config
+        pool = SMTPConnectionPool(
+            relay.connector(config) if relay is not None else mail.connect,
+            max_size=config.get("MAIL_POOL_SIZE", 2),
+            max_messages=config.get("MAIL_POOL_MAX_MESSAGES", 100),
+            max_age=config.get("MAIL_POOL_MAX_AGE", 300),
+        )
+        _pools[name] = pool
+        atexit.register(pool.close)
+
+    return _pools[name]
+
+
+def reset_smtp_pool() -> None:
+    """Close and forget the pools of the current process."""
+    global _pool_pid
+
+    if _pool_pid == os.getpid():
+        for pool in _pools.values():
+            pool.close()
+    _pools.clear()
+    _pool_pid = None
@@ -0,0 +1,184 @@
+"""Priority queues for send jobs, drained by weight.
+
+Every event has a priority, mapped to an RQ queue by
+``MAIL_PRIORITY_QUEUES``::
+
+    MAIL_PRIORITY_QUEUES = {"high": "high", "normal": "default", "low": "low"}
+
+All jobs of an event (its send job, chunks, retries and recurring runs)
+go to that queue, so a password reset never waits behind the chunks of a
+newsletter.
+
+A plain RQ worker always empties the first of its queues before looking
+at the next, so a steady stream of urgent mail would starve bulk mail
+entirely. :class:`WeightedWorker` instead draws the order in which it
+looks at its queues before every job, each queue coming first with a
+chance that grows with its weight in ``MAIL_QUEUE_WEIGHTS``. An empty
+queue is skipped, so no worker idles while any queue has jobs.
+
+Workers record how long each job waited in its queue, reported with the
+depth of every queue by :func:`queue_stats`.
+"""
+
+from __future__ import annotations
+
+import random
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from flask import current_app, has_app_context
+from rq.job import Job
+from rq.queue import Queue
+from rq.utils import utcnow
+from rq.worker import SimpleWorker
+
+from app.utils.stats import summarize
+
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY_QUEUES = {"high": "high", "normal": "default", "low": "low"}
+WAIT_KEY = "mail-scheduler:queue-wait:{queue}"
+
+# Queue waits kept per queue for queue_stats, most recent first.
+WAIT_SAMPLES = 1000
+
+
+def priority_queue(priority: Optional[str], config: Mapping[str, Any]) -> str:
+    """
+    Get the name of the queue serving a priority.
+
+    Args:
+        priority: Priority of the event, "normal" if None
+        config: The Flask application config
+
+    Returns:
+        Queue name
+    """
+    queues = config.get("MAIL_PRIORITY_QUEUES") or DEFAULT_PRIORITY_QUEUES
+    return str(queues.get(priority or "normal", queues["normal"]))
+
+
+def weighted_order(queues: Sequence[Queue], weights: Mapping[str, float]) -> List[Any]:
+    """
+    Draw the order in which to look at queues.
+
+    Each queue gets a random key ``u ** (1 / weight)`` and the queues are
+    taken by decreasing key, which puts a queue first with a probability
+    that grows with its weight.
+
+    Args:
+        queues: The queues
+        weights: Weight per queue name, 1 for queues not listed
+
+    Returns:
+        The queues, reordered
+    """
+    return sorted(
+        queues,
+        key=lambda queue: random.random() ** (1.0 / weights.get(queue.name, 1)),
+        reverse=True,
+    )
+
+
+def record_wait(connection: Any, queue: str, job: Job) -> None:
+    """
+    Add the time a job spent in its queue to the samples.
+
+    Args:
+        connection: Redis connection
+        queue: Name of the queue the job came from
+        job: The dequeued job
+    """
+    if job.enqueued_at is None:
+        return
+    waited = max(0.0, (utcnow() - job.enqueued_at).total_seconds())
+    key = WAIT_KEY.format(queue=queue)
+    pipe = connection.pipeline()
+    pipe.lpush(key, round(waited, 4))
+    pipe.ltrim(key, 0, WAIT_SAMPLES - 1)
+    pipe.execute()
+
+
+class WeightedWorker(SimpleWorker):
+    """A worker taking jobs from its queues in a weighted random order."""
+
+    def __init__(
+        self,
+        queues: Any,
+        *args: Any,
+        weights: Optional[Mapping[str, float]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Initialize a WeightedWorker instance.
+
+        Args:
+            queues: Queues to work on
+            *args: Arguments of SimpleWorker
+            weights: Weight per queue name, ``MAIL_QUEUE_WEIGHTS`` by default
+            **kwargs: Keyword arguments of SimpleWorker
+        """
+        super().__init__(queues, *args, **kwargs)
+        if weights is None and has_app_context():
+            weights = current_app.config.get("MAIL_QUEUE_WEIGHTS")
+        self.weights = {name: float(w) for name, w in (weights or {}).items()}
+        self._ordered_queues = weighted_order(self.queues, self.weights)
+
+    def reorder_queues(self, reference_queue: Queue) -> None:
+        """Draw a new order of the queues for the next job."""
+        self._ordered_queues = weighted_order(self.queues, self.weights)
+
+    def dequeue_job_and_maintain_ttl(
+        self, timeout: Optional[int], max_idle_time: Optional[int] = None
+    ) -> Any:
+        """Take the next job and record how long it waited."""
+        result = super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+        if result is not None:
+            job, queue = result
+            record_wait(self.connection, queue.name, job)
+        return result
+
+
+def queue_stats(
+    connection: Any, names: Sequence[str], weights: Mapping[str, float]
+) -> List[Dict[str, Any]]:
+    """
+    Report the depth and wait times of queues.
+
+    Args:
+        connection: Redis connection
+        names: Names of the queues
+        weights: Weight per queue name
+
+    Returns:
+        One dictionary per queue with its weight, the number of jobs
+        waiting, how long the oldest has waited and a summary of the waits
+        of recent jobs, in seconds
+    """
+    pipe = connection.pipeline()
+    for name in names:
+        queue = Queue(name, connection=connection)
+        pipe.llen(queue.key)
+        # Jobs are pushed on the right and taken from the left.
+        pipe.lindex(queue.key, 0)
+        pipe.lrange(WAIT_KEY.format(queue=name), 0, -1)
+    state = iter(pipe.execute())
+
+    now = utcnow()
+    result = []
+    for name in names:
+        depth, oldest_id, waits = next(state), next(state), next(state)
+        oldest = None
+        if oldest_id:
+            oldest = Job.fetch_many([oldest_id.decode()], connection=connection)[0]
+        oldest_wait = None
+        if oldest is not None and oldest.enqueued_at is not None:
+            oldest_wait = round((now - oldest.enqueued_at).total_seconds(), 4)
+        result.append(
+            {
+                "name": name,
+                "weight": weights.get(name, 1),
+                "depth": int(depth),
+                "oldest_wait": oldest_wait,
+                "wait": summarize(float(wait) for wait in waits),
+            }
+        )
+    return result
@@ -0,0 +1,273 @@
+"""Cluster-wide SMTP rate limiting with token buckets stored in Redis.
+
+Every worker and chunk job draws from the same buckets, so the send rate
+of the whole cluster stays under the relay's quotas. Buckets are keyed by
+scope (``relay:<host>`` or ``sender:<account>``) and configured through
+``MAIL_RATE_LIMITS``::
+
+    MAIL_RATE_LIMITS = {
+        "relay:smtp.example.com": {"per_minute": 600, "per_day": 100000},
+        "sender:newsletter@example.com": {"per_minute": 120},
+    }
+
+A token is one recipient. Refill and consumption run in a Lua script that
+uses the Redis clock, so all buckets of a request are checked and debited
+atomically whatever the skew between worker hosts.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY = "mail-scheduler:ratelimit:{name}"
+STATS_KEY = "mail-scheduler:ratelimit:stats"
+
+PERIODS = {"per_second": 1, "per_minute": 60, "per_hour": 3600, "per_day": 86400}
+
+# KEYS: one hash per bucket. ARGV[1]: tokens requested, then capacity and
+# period for every key. Returns {acquired, wait seconds, level per bucket}.
+TOKEN_BUCKET_LUA = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local requested = tonumber(ARGV[1])
+local wait = 0
+local levels = {}
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = capacity / tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < requested then
+        wait = math.max(wait, (requested - tokens) / rate)
+    end
+end
+
+local acquired = 0
+if wait == 0 then
+    acquired = 1
+end
+
+local reply = {acquired, tostring(wait)}
+for i, key in ipairs(KEYS) do
+    if acquired == 1 then
+        levels[i] = levels[i] - requested
+    end
+    redis.call('HSET', key, 'tokens', tostring(levels[i]), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[i * 2 + 1]) * 2))
+    reply[i + 2] = tostring(levels[i])
+end
+return reply
+"""
+
+
+class Limit(NamedTuple):
+    """A token bucket: ``capacity`` tokens refilled evenly over ``period``."""
+
+    name: str
+    capacity: int
+    period: float
+
+
+def limits_for_scope(scope: str, quotas: Mapping[str, int]) -> List[Limit]:
+    """
+    Turn a ``MAIL_RATE_LIMITS`` entry into buckets.
+
+    Args:
+        scope: Scope name such as ``relay:smtp.example.com``
+        quotas: Mapping of ``per_minute``/``per_day``/... to a token count
+
+    Returns:
+        One Limit per configured period
+    """
+    return [
+        Limit(f"{scope}:{period_name}", int(count), PERIODS[period_name])
+        for period_name, count in quotas.items()
+        if period_name in PERIODS and count
+    ]
+
+
+class RateLimiter(object):
+    """Draw tokens from one or more shared buckets, waiting when empty."""
+
+    def __init__(
+        self, connection: Any, limits: Iterable[Limit], max_sleep: float = 5.0
+    ) -> None:
+        """
+        Initialize a RateLimiter instance.
+
+        Args:
+            connection: Redis connection shared by all workers
+            limits: Buckets every acquisition is drawn from
+            max_sleep: Longest single sleep before checking again
+        """
+        self.connection = connection
+        self.limits = list(limits)
+        self.max_sleep = max_sleep
+        self._script = connection.register_script(TOKEN_BUCKET_LUA)
+
+    @classmethod
+    def from_config(
+        cls, connection: Any, config: Mapping[str, Any], *scopes: str
+    ) -> Optional["RateLimiter"]:
+        """
+        Build a limiter for the given scopes from ``MAIL_RATE_LIMITS``.
+
+        Args:
+            connection: Redis connection
+            config: The Flask application config
+            *scopes: Scopes the send counts against
+
+        Returns:
+            A limiter, or None when none of the scopes is limited
+        """
+        configured = config.get("MAIL_RATE_LIMITS") or {}
+        limits = [
+            limit
+            for scope in scopes
+            for limit in limits_for_scope(scope, configured.get(scope, {}))
+        ]
+        if not limits:
+            return None
+        return cls(connection, limits)
+
+    @property
+    def burst(self) -> int:
+        """Largest number of tokens a single request can take."""
+        return min(limit.capacity for limit in self.limits)
+
+    def try_acquire(self, tokens: int = 1) -> float:
+        """
+        Take tokens from every bucket if all of them have enough.
+
+        Args:
+            tokens: Number of tokens to take, at most :attr:`burst`
+
+        Returns:
+            0.0 if the tokens were taken, otherwise seconds until they will
+            be available
+        """
+        reply = self._call(tokens)
+        return 0.0 if int(reply[0]) else float(reply[1])
+
+    def acquire(self, tokens: int = 1) -> float:
+        """
+        Take tokens, sleeping until the buckets allow it.
+
+        Requests bigger than :attr:`burst` are taken in slices.
+
+        Args:
+            tokens: Number of tokens to take
+
+        Returns:
+            Seconds spent waiting
+        """
+        waited = 0.0
+        for part in self._slices(tokens):
+            while True:
+                wait = self.try_acquire(part)
+                if not wait:
+                    break
+                wait = min(wait, self.max_sleep)
+                time.sleep(wait)
+                waited += wait
+        self._record_wait(waited)
+        return waited
+
+    async def acquire_async(self, tokens: int = 1) -> float:
+        """
+        Coroutine version of :meth:`acquire` that yields while waiting.
+
+        The Redis calls block, so they run in the loop's default executor
+        instead of stalling the other sends on the loop.
+
+        Args:
+            tokens: Number of tokens to take
+
+        Returns:
+            Seconds spent waiting
+        """
+        loop = asyncio.get_running_loop()
+        waited = 0.0
+        for part in self._slices(tokens):
+            while True:
+                wait = await loop.run_in_executor(None, self.try_acquire, part)
+                if not wait:
+                    break
+                wait = min(wait, self.max_sleep)
+                await asyncio.sleep(wait)
+                waited += wait
+        await loop.run_in_executor(None, self._record_wait, waited)
+        return waited
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Report the level of every bucket without taking tokens.
+
+        Returns:
+            One dictionary per bucket with capacity, current tokens and the
+            total time workers spent waiting on it
+        """
+        reply = self._call(0)
+        recorded = self.connection.hgetall(STATS_KEY)
+        result = []
+        for limit, level in zip(self.limits, reply[2:]):
+            result.append(
+                {
+                    "name": limit.name,
+                    "capacity": limit.capacity,
+                    "period": limit.period,
+                    "tokens": round(float(level), 2),
+                    "waited_seconds": float(
+                        recorded.get(f"{limit.name}:waited".encode(), 0)
+                    ),
+                    "waits": int(recorded.get(f"{limit.name}:waits".encode(), 0)),
+                }
+            )
+        return result
+
+    def _call(self, tokens: int) -> List[Any]:
+        args: List[Any] = [tokens]
+        for limit in self.limits:
+            args.extend([limit.capacity, limit.period])
+        keys = [BUCKET_KEY.format(name=limit.name) for limit in self.limits]
+        return list(self._script(keys=keys, args=args))
+
+    def _slices(self, tokens: int) -> List[int]:
+        burst = self.burst
+        full, rest = divmod(tokens, burst)
+        return [burst] * full + ([rest] if rest else [])
+
+    def _record_wait(self, waited: float) -> None:
+        if not waited:
+            return
+        logger.info("Rate limited for %.2fs", waited)
+        pipe = self.connection.pipeline()
+        for limit in self.limits:
+            pipe.hincrbyfloat(STATS_KEY, f"{limit.name}:waited", waited)
+            pipe.hincrby(STATS_KEY, f"{limit.name}:waits", 1)
+        pipe.execute()
+
+
+def rate_limit_stats(connection: Any, config: Mapping[str, Any]) -> List[Dict]:
+    """
+    Report every bucket configured in ``MAIL_RATE_LIMITS``.
+
+    Args:
+        connection: Redis connection
+        config: The Flask application config
+
+    Returns:
+        Bucket statistics, see :meth:`RateLimiter.stats`
+    """
+    scopes = list((config.get("MAIL_RATE_LIMITS") or {}).keys())
+    limiter = RateLimiter.from_config(connection, config, *scopes)
+    return limiter.stats() if limiter else []
@@ -0,0 +1,122 @@
+"""Streaming recipients of an event from the database.
+
+Jobs carry only an event ID, or an event ID and a range of recipient IDs,
+so the job payload in Redis stays the same size however many recipients
+an event has. Workers read the addresses in pages when they send.
+"""
+
+from __future__ import annotations
+
+from email.utils import formataddr
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import or_, select
+
+from app.database.models import Recipient
+
+
+def recipient_ranges(
+    session: Any,
+    event_id: int,
+    chunk_size: int,
+    status: str = Recipient.STATUS_QUEUED,
+) -> List[Tuple[int, int]]:
+    """
+    Split the recipients of an event into ID ranges of ``chunk_size``.
+
+    Only the IDs are read, through a server-side cursor, so even a very
+    large event is split without loading its addresses.
+
+    Args:
+        session: SQLAlchemy session to query with
+        event_id: ID of the event
+        chunk_size: Number of recipients per range
+        status: Only count recipients with this status
+
+    Returns:
+        Inclusive (first ID, last ID) pairs in ID order
+    """
+    ids = session.scalars(
+        select(Recipient.id)
+        .where(Recipient.event_id == event_id, Recipient.status == status)
+        .order_by(Recipient.id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    ranges: List[Tuple[int, int]] = []
+    first: Optional[int] = None
+    count = 0
+    for recipient_id in ids:
+        if first is None:
+            first = recipient_id
+        count += 1
+        if count == chunk_size:
+            ranges.append((first, recipient_id))
+            first, count = None, 0
+    if first is not None:
+        ranges.append((first, recipient_id))
+    return ranges
+
+
+def recipient_batches(
+    session: Any,
+    event_id: int,
+    batch_size: int,
+    first_id: Optional[int] = None,
+    last_id: Optional[int] = None,
+    status: str = Recipient.STATUS_QUEUED,
+    timezones: Optional[Sequence[Optional[str]]] = None,
+) -> Iterator[List[str]]:
+    """
+    Page through the addresses of an event's recipients.
+
+    Pages are read by keyset (``id > last seen``) rather than through an
+    open cursor, so the caller may commit between pages.
+
+    Args:
+        session: SQLAlchemy session to query with
+        event_id: ID of the event
+        batch_size: Number of addresses per page
+        first_id: Lowest recipient ID to include
+        last_id: Highest recipient ID to include
+        status: Only read recipients with this status
+        timezones: Only read recipients in these time zones, None standing
+            for recipients without one
+
+    Yields:
+        Lists of addresses, formatted as ``Name <email>`` when a name is known
+    """
+    cursor = first_id - 1 if first_id is not None else 0
+    while True:
+        query = select(Recipient.id, Recipient.email, Recipient.name).where(
+            Recipient.event_id == event_id,
+            Recipient.status == status,
+            Recipient.id > cursor,
+        )
+        if last_id is not None:
+            query = query.where(Recipient.id <= last_id)
+        if timezones is not None:
+            query = query.where(in_timezones(timezones))
+        rows = list(session.execute(query.order_by(Recipient.id).limit(batch_size)))
+        if not rows:
+            return
+
+        cursor = rows[-1].id
+        yield [formataddr((name, email)) if name else email for _, email, name in rows]
+
+
+def in_timezones(timezones: Sequence[Optional[str]]) -> Any:
+    """
+    Build the condition of a recipient in one of some time zones.
+
+    Args:
+        timezones: Time zone names, None standing for recipients without one
+
+    Returns:
+        A SQLAlchemy filter clause
+    """
+    named = [zone for zone in timezones if zone is not None]
+    condition = Recipient.timezone.in_(named)
+    if len(named) < len(timezones):
+        condition = or_(condition, Recipient.timezone.is_(None))
+    return condition
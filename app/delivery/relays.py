@@ -0,0 +1,359 @@
+"""Routing of deliveries across several SMTP relays.
+
+Relays are listed in ``MAIL_RELAYS``, each with a weight and an optional
+cap on simultaneous deliveries::
+
+    MAIL_RELAYS = [
+        {"name": "primary", "server": "smtp1.example.com", "weight": 3},
+        {"name": "backup", "server": "smtp2.example.com", "port": 2525,
+         "max_concurrency": 4},
+    ]
+
+Every delivery leases one relay, chosen at random in proportion to the
+weights among the healthy relays with a free slot, so chunk jobs spread
+over all of them. Health, slots and counters live in Redis and are shared
+by every worker. A relay failing ``failure_threshold`` transactions in a
+row is taken out for ``probe_interval`` seconds; afterwards a single
+delivery probes it, and a success puts it back in rotation.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import smtplib
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Mapping, NamedTuple, Optional
+
+from flask_mail import Connection
+
+from app.delivery.smtp import Refused
+from app.extensions import mail
+
+logger = logging.getLogger(__name__)
+
+RELAY_KEY = "mail-scheduler:relay:{name}:{field}"
+
+# Errors meaning the relay itself, not the message, is the problem.
+RELAY_ERRORS = (
+    smtplib.SMTPServerDisconnected,
+    smtplib.SMTPConnectError,
+    smtplib.SMTPAuthenticationError,
+    OSError,
+)
+
+
+class RelayUnavailable(Exception):
+    """Raised when every relay is down or at its concurrency cap."""
+
+
+class Relay(NamedTuple):
+    """One SMTP relay and its share of the traffic."""
+
+    name: str
+    server: str
+    port: int = 25
+    username: Optional[str] = None
+    password: Optional[str] = None
+    use_tls: bool = False
+    use_ssl: bool = False
+    weight: int = 1
+    max_concurrency: int = 0
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "Relay":
+        """
+        Build a relay from a ``MAIL_RELAYS`` entry.
+
+        Args:
+            data: Relay settings; ``name`` defaults to the server host
+
+        Returns:
+            The relay
+        """
+        fields = {key: value for key, value in data.items() if key in cls._fields}
+        fields.setdefault("name", data["server"])
+        return cls(**fields)
+
+    def mail_config(self, config: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Overlay the relay's settings on the Flask-Mail configuration.
+
+        Credentials fall back to ``MAIL_USERNAME``/``MAIL_PASSWORD``.
+
+        Args:
+            config: The Flask application config
+
+        Returns:
+            Configuration sending through this relay
+        """
+        overlay = dict(config)
+        overlay.update(
+            MAIL_SERVER=self.server,
+            MAIL_PORT=self.port,
+            MAIL_USE_TLS=self.use_tls,
+            MAIL_USE_SSL=self.use_ssl,
+            MAIL_USERNAME=self.username or config.get("MAIL_USERNAME"),
+            MAIL_PASSWORD=self.password or config.get("MAIL_PASSWORD"),
+        )
+        return overlay
+
+    def connector(self, config: Mapping[str, Any]) -> Callable[[], Connection]:
+        """
+        Get a factory of Flask-Mail connections to this relay.
+
+        Args:
+            config: The Flask application config
+
+        Returns:
+            Callable returning an un-entered ``flask_mail.Connection``
+        """
+        state = mail.init_mail(
+            self.mail_config(config),
+            config.get("DEBUG", False),
+            config.get("TESTING", False),
+        )
+        return lambda: Connection(state)
+
+
+class RelayLease(object):
+    """A relay taken for one delivery, with the outcome to report back."""
+
+    def __init__(self, relay: Optional[Relay]) -> None:
+        """
+        Initialize a RelayLease instance.
+
+        Args:
+            relay: The leased relay, None for the default Flask-Mail relay
+        """
+        self.relay = relay
+        self.sent = 0
+        self.refused = 0
+        self.healthy = True
+
+    def report(
+        self, recipients: List[str], refused: Refused, errors: Mapping[str, Any]
+    ) -> None:
+        """
+        Record the outcome of the delivery.
+
+        Args:
+            recipients: Every address of the delivery
+            refused: Refused recipients mapped to their SMTP reply
+            errors: Recipients whose transaction failed without a reply
+        """
+        self.refused = len(refused) + len(errors)
+        self.sent = len(recipients) - self.refused
+        self.healthy = not errors and not any(
+            code == 421 for code, _ in refused.values()
+        )
+
+
+class RelayRouter(object):
+    """Choose relays by weight, skipping unhealthy and saturated ones."""
+
+    def __init__(
+        self,
+        connection: Any,
+        relays: List[Relay],
+        failure_threshold: int = 3,
+        probe_interval: int = 60,
+        wait_timeout: float = 30.0,
+    ) -> None:
+        """
+        Initialize a RelayRouter instance.
+
+        Args:
+            connection: Redis connection shared by all workers
+            relays: Relays to route over
+            failure_threshold: Consecutive failures taking a relay out
+            probe_interval: Seconds before a failed relay is probed again
+            wait_timeout: Seconds to wait for a free slot before giving up
+        """
+        self.connection = connection
+        self.relays = relays
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.wait_timeout = wait_timeout
+
+    @classmethod
+    def from_config(
+        cls, connection: Any, config: Mapping[str, Any]
+    ) -> Optional["RelayRouter"]:
+        """
+        Build a router from ``MAIL_RELAYS``.
+
+        Args:
+            connection: Redis connection
+            config: The Flask application config
+
+        Returns:
+            A router, or None when no relays are configured
+        """
+        relays = [Relay.from_dict(entry) for entry in config.get("MAIL_RELAYS") or []]
+        if not relays:
+            return None
+        return cls(
+            connection,
+            relays,
+            failure_threshold=config.get("MAIL_RELAY_FAILURE_THRESHOLD", 3),
+            probe_interval=config.get("MAIL_RELAY_PROBE_INTERVAL", 60),
+            wait_timeout=config.get("MAIL_RELAY_WAIT_TIMEOUT", 30),
+        )
+
+    def key(self, relay: Relay, field: str) -> str:
+        """Get the Redis key holding one piece of a relay's state."""
+        return RELAY_KEY.format(name=relay.name, field=field)
+
+    def candidates(self) -> List[Relay]:
+        """
+        List the relays that may take a delivery, in the order to try them.
+
+        Relays due for a probe come first, so they are tried as soon as
+        their pause is over; healthy relays follow in weighted random order.
+
+        Returns:
+            Relays to try
+        """
+        pipe = self.connection.pipeline()
+        for relay in self.relays:
+            pipe.exists(self.key(relay, "down"))
+            pipe.get(self.key(relay, "failures"))
+        state = pipe.execute()
+
+        probing, healthy = [], []
+        for index, relay in enumerate(self.relays):
+            down, failures = state[index * 2], int(state[index * 2 + 1] or 0)
+            if down:
+                continue
+            if failures < self.failure_threshold:
+                healthy.append(relay)
+            elif self.connection.set(
+                self.key(relay, "probe"), 1, nx=True, ex=self.probe_interval
+            ):
+                probing.append(relay)
+
+        # Weighted shuffle (Efraimidis-Spirakis).
+        healthy.sort(key=lambda r: random.random() ** (1.0 / max(r.weight, 1)))
+        healthy.reverse()
+        return probing + healthy
+
+    def acquire(self) -> Relay:
+        """
+        Take a slot on a relay, waiting while every relay is saturated.
+
+        Returns:
+            The relay to deliver through
+
+        Raises:
+            RelayUnavailable: No relay is healthy, or none had a free slot
+                within ``wait_timeout``
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            relays = self.candidates()
+            if not relays:
+                raise RelayUnavailable("All SMTP relays are down")
+            for relay in relays:
+                if self._take_slot(relay):
+                    return relay
+            if time.monotonic() >= deadline:
+                raise RelayUnavailable("All SMTP relays are at their concurrency cap")
+            time.sleep(0.1)
+
+    def release(self, lease: RelayLease) -> None:
+        """
+        Free a relay's slot and record the delivery's outcome.
+
+        Args:
+            lease: The finished lease
+        """
+        relay = lease.relay
+        if relay is None:
+            return
+
+        pipe = self.connection.pipeline()
+        if relay.max_concurrency:
+            pipe.decr(self.key(relay, "inflight"))
+        stats = self.key(relay, "stats")
+        pipe.hincrby(stats, "transactions", 1)
+        pipe.hincrby(stats, "sent", lease.sent)
+        pipe.hincrby(stats, "refused", lease.refused)
+        if lease.healthy:
+            pipe.delete(self.key(relay, "failures"), self.key(relay, "probe"))
+        else:
+            pipe.hincrby(stats, "errors", 1)
+            pipe.incr(self.key(relay, "failures"))
+        result = pipe.execute()
+
+        if not lease.healthy and int(result[-1]) >= self.failure_threshold:
+            self.connection.set(self.key(relay, "down"), 1, ex=self.probe_interval)
+            logger.warning(
+                "SMTP relay %s failed %d times in a row, taking it out for %ds",
+                relay.name,
+                int(result[-1]),
+                self.probe_interval,
+            )
+
+    @contextmanager
+    def lease(self) -> Iterator[RelayLease]:
+        """Lease a relay for the duration of a ``with`` block."""
+        lease = RelayLease(self.acquire())
+        try:
+            yield lease
+        except RELAY_ERRORS:
+            lease.healthy = False
+            raise
+        finally:
+            self.release(lease)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Report the state and counters of every relay.
+
+        Returns:
+            One dictionary per relay
+        """
+        pipe = self.connection.pipeline()
+        for relay in self.relays:
+            pipe.hgetall(self.key(relay, "stats"))
+            pipe.get(self.key(relay, "inflight"))
+            pipe.get(self.key(relay, "failures"))
+            pipe.ttl(self.key(relay, "down"))
+        state = pipe.execute()
+
+        result = []
+        for index, relay in enumerate(self.relays):
+            counters, inflight, failures, down = state[index * 4 : index * 4 + 4]
+            counters = {k.decode(): int(v) for k, v in (counters or {}).items()}
+            result.append(
+                {
+                    "name": relay.name,
+                    "server": relay.server,
+                    "weight": relay.weight,
+                    "max_concurrency": relay.max_concurrency,
+                    "inflight": int(inflight or 0),
+                    "consecutive_failures": int(failures or 0),
+                    "down_for": max(int(down or 0), 0),
+                    "transactions": counters.get("transactions", 0),
+                    "sent": counters.get("sent", 0),
+                    "refused": counters.get("refused", 0),
+                    "errors": counters.get("errors", 0),
+                }
+            )
+        return result
+
+    def _take_slot(self, relay: Relay) -> bool:
+        if not relay.max_concurrency:
+            return True
+        key = self.key(relay, "inflight")
+        pipe = self.connection.pipeline()
+        pipe.incr(key)
+        # Slots of crashed workers are given back eventually.
+        pipe.expire(key, 3600)
+        inflight, _ = pipe.execute()
+        if int(inflight) <= relay.max_concurrency:
+            return True
+        self.connection.decr(key)
+        return False
@@ -0,0 +1,146 @@
+"""Rendering of personalised messages in a process pool.
+
+Serializing a message is CPU bound and holds the GIL, so a worker sending
+a large personalised event spends its time rendering while its SMTP
+connections wait. With ``MAIL_RENDER_PROCESSES`` set, the copies of a
+:class:`~app.delivery.mime.MessageTemplate` are rendered by that many
+processes, in batches of ``MAIL_RENDER_BATCH_SIZE`` recipients, while the
+worker sends the batches already rendered.
+
+At most ``MAIL_RENDER_QUEUE_DEPTH`` batches are rendered ahead of the
+sending, which bounds the memory held by messages waiting to go out.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
+
+from flask import current_app
+
+from app.delivery.fanout import chunked
+from app.delivery.mime import MessageTemplate, RenderedMessage
+
+logger = logging.getLogger(__name__)
+
+
+def render_batch(template: MessageTemplate, recipients: List[str]) -> List[bytes]:
+    """
+    Render the copies of a template for a batch of recipients.
+
+    Runs in the pool's processes.
+
+    Args:
+        template: The template to copy
+        recipients: Addresses of the batch
+
+    Returns:
+        Serialized messages, in the order of the recipients
+    """
+    return [template.render(addr) for addr in recipients]
+
+
+class RenderPool(object):
+    """Processes rendering template copies ahead of the sending."""
+
+    def __init__(
+        self, processes: int = 2, queue_depth: int = 8, batch_size: int = 100
+    ) -> None:
+        """
+        Initialize a RenderPool instance.
+
+        Args:
+            processes: Number of rendering processes
+            queue_depth: Batches rendered or rendering ahead of the consumer
+            batch_size: Recipients rendered per task
+        """
+        self.processes = processes
+        self.queue_depth = max(1, queue_depth)
+        self.batch_size = max(1, batch_size)
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+
+    def render(
+        self, template: MessageTemplate, recipients: Iterable[str]
+    ) -> Iterator[RenderedMessage]:
+        """
+        Render a message per recipient, in the order of the recipients.
+
+        Args:
+            template: The template to copy
+            recipients: Addresses to render messages for
+
+        Yields:
+            Messages ready to send
+        """
+        pending: Deque[Tuple[List[str], Future]] = deque()
+        try:
+            for batch in chunked(list(recipients), self.batch_size):
+                future = self.executor.submit(render_batch, template, batch)
+                pending.append((batch, future))
+                if len(pending) >= self.queue_depth:
+                    yield from self._take(template, pending)
+            while pending:
+                yield from self._take(template, pending)
+        finally:
+            # The consumer stopped early, e.g. on a dropped connection.
+            for _, future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        """Stop the rendering processes."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _take(
+        template: MessageTemplate, pending: Deque[Tuple[List[str], Future]]
+    ) -> Iterator[RenderedMessage]:
+        batch, future = pending.popleft()
+        for addr, data in zip(batch, future.result()):
+            yield RenderedMessage(template.sender, addr, data)
+
+
+_pool: Optional[RenderPool] = None
+_pool_pid: Optional[int] = None
+
+
+def get_render_pool() -> Optional[RenderPool]:
+    """
+    Return the render pool of the current worker process.
+
+    The pool is created on first use and rebuilt after a fork.
+
+    Returns:
+        The pool, or None when ``MAIL_RENDER_PROCESSES`` is 0
+    """
+    global _pool, _pool_pid
+
+    config = current_app.config
+    processes = config.get("MAIL_RENDER_PROCESSES", 0)
+    if not processes:
+        return None
+
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = RenderPool(
+            processes,
+            queue_depth=config.get("MAIL_RENDER_QUEUE_DEPTH", 8),
+            batch_size=config.get("MAIL_RENDER_BATCH_SIZE", 100),
+        )
+        _pool_pid = os.getpid()
+        atexit.register(_pool.close)
+        logger.info("Rendering messages in %d processes", processes)
+
+    return _pool
+
+
+def reset_render_pool() -> None:
+    """Stop and forget the render pool of the current process."""
+    global _pool, _pool_pid
+
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+    _pool = None
+    _pool_pid = None
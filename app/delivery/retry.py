@@ -0,0 +1,242 @@
+"""Classification of SMTP failures and backoff for the ones worth retrying.
+
+Replies in the 4xx range, dropped or refused connections and timeouts are
+transient: the affected recipients are deferred and sent again later, with
+an exponential delay and jitter so that retries of many jobs do not arrive
+together. 5xx replies, such as a failed login, and other errors, such as a
+TLS or protocol error, are permanent and fail the recipient for good.
+
+An event has at most one retry job pending. It carries only the event ID
+and the attempt number, and sends to every recipient of the event still
+deferred when it runs, so recipients deferred by several sends of the
+event are retried together.
+
+Some transient replies mean the relay itself is overloaded. Those also
+pause every worker sending through that relay for a while, growing the
+pause each time the relay complains again until it recovers.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import smtplib
+import socket
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from app.delivery.smtp import Refused
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_KEY = "mail-scheduler:backoff:{relay}"
+BACKOFF_LEVEL_KEY = "mail-scheduler:backoff:{relay}:level"
+RETRY_KEY = "mail-scheduler:retry:{event_id}"
+
+# Replies meaning the relay wants us to slow down rather than that one
+# recipient is unavailable.
+OVERLOAD_CODES = frozenset({421, 451, 452})
+
+# Errors raised when the connection to the relay broke, could not be
+# opened or timed out before a reply. Not OSError: every SMTPException is
+# one, including permanent replies.
+TRANSIENT_ERRORS = (
+    smtplib.SMTPServerDisconnected,
+    ConnectionError,
+    TimeoutError,
+    socket.gaierror,
+)
+
+
+def is_transient(code: int) -> bool:
+    """
+    Check whether an SMTP reply code is worth retrying.
+
+    Args:
+        code: SMTP reply code
+
+    Returns:
+        True for 4xx replies, False for anything else
+    """
+    return 400 <= code < 500
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """
+    Check whether a send that failed as a whole is worth retrying.
+
+    Args:
+        exc: The error the send raised
+
+    Returns:
+        True for 4xx replies and connection errors, False for anything else
+    """
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return is_transient(exc.smtp_code)
+    return isinstance(exc, TRANSIENT_ERRORS)
+
+
+def split_refused(refused: Refused) -> Tuple[Refused, Refused]:
+    """
+    Separate permanent refusals from transient ones.
+
+    Args:
+        refused: Refused recipients mapped to their SMTP reply
+
+    Returns:
+        Tuple of permanent and transient refusals
+    """
+    permanent: Refused = {}
+    transient: Refused = {}
+    for addr, reply in refused.items():
+        target = transient if is_transient(reply[0]) else permanent
+        target[addr] = reply
+    return permanent, transient
+
+
+def group_by_code(refused: Refused) -> Dict[int, List[str]]:
+    """
+    Group refused recipients by their reply code.
+
+    Args:
+        refused: Refused recipients mapped to their SMTP reply
+
+    Returns:
+        Reply code mapped to the addresses that got it
+    """
+    groups: Dict[int, List[str]] = {}
+    for addr, (code, _) in refused.items():
+        groups.setdefault(code, []).append(addr)
+    return groups
+
+
+def is_overload(codes: Iterable[int]) -> bool:
+    """
+    Check whether any reply signals an overloaded relay.
+
+    Args:
+        codes: SMTP reply codes
+
+    Returns:
+        True if one of the codes is in OVERLOAD_CODES
+    """
+    return any(code in OVERLOAD_CODES for code in codes)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Compute an exponential delay with jitter.
+
+    Half of the delay is fixed and half is random, so retries are spread out
+    but never come back immediately.
+
+    Args:
+        attempt: Zero-based number of the attempt that failed
+        base: Delay after the first failure, in seconds
+        cap: Largest delay, in seconds
+
+    Returns:
+        Seconds to wait before the next attempt
+    """
+    delay = min(cap, base * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def reserve_retry(connection: Any, event_id: int, ttl: float) -> bool:
+    """
+    Reserve the pending retry of an event.
+
+    Args:
+        connection: Redis connection
+        event_id: ID of the event
+        ttl: Seconds the reservation lasts if its job never runs
+
+    Returns:
+        True if no retry of the event was pending, so one must be scheduled
+    """
+    key = RETRY_KEY.format(event_id=event_id)
+    return bool(connection.set(key, 1, nx=True, ex=max(1, int(ttl))))
+
+
+def release_retry(connection: Any, event_id: int) -> None:
+    """
+    Release the pending retry of an event, as its job starts.
+
+    Recipients deferred from then on are retried by a new job.
+
+    Args:
+        connection: Redis connection
+        event_id: ID of the event
+    """
+    connection.delete(RETRY_KEY.format(event_id=event_id))
+
+
+class RelayBackoff(object):
+    """A pause shared by all workers sending through one relay.
+
+    Every overload signal raises the backoff level and pauses the relay
+    for :func:`backoff_delay` of that level. The level decays by expiring
+    once the relay stays quiet for ``cap`` seconds.
+    """
+
+    def __init__(
+        self, connection: Any, relay: str, base: float = 1.0, cap: float = 120.0
+    ) -> None:
+        """
+        Initialize a RelayBackoff instance.
+
+        Args:
+            connection: Redis connection shared by all workers
+            relay: Name of the relay, usually its host
+            base: Pause after the first overload signal, in seconds
+            cap: Longest pause, in seconds
+        """
+        self.connection = connection
+        self.relay = relay
+        self.base = base
+        self.cap = cap
+        self.key = BACKOFF_KEY.format(relay=relay)
+        self.level_key = BACKOFF_LEVEL_KEY.format(relay=relay)
+
+    def signal(self) -> float:
+        """
+        Record an overload reply and pause the relay.
+
+        Returns:
+            Length of the pause, in seconds
+        """
+        pipe = self.connection.pipeline()
+        pipe.incr(self.level_key)
+        pipe.expire(self.level_key, int(self.cap) + 1)
+        level, _ = pipe.execute()
+
+        pause = backoff_delay(int(level) - 1, self.base, self.cap)
+        self.connection.set(self.key, level, px=max(1, int(pause * 1000)))
+        logger.warning(
+            "Relay %s signalled overload, pausing sends for %.1fs",
+            self.relay,
+            pause,
+        )
+        return pause
+
+    def remaining(self) -> float:
+        """
+        Get the time left before the relay may be used again.
+
+        Returns:
+            Seconds left in the current pause, 0.0 if there is none
+        """
+        ttl = self.connection.pttl(self.key)
+        return ttl / 1000.0 if ttl and ttl > 0 else 0.0
+
+    def wait(self) -> float:
+        """
+        Sleep until the current pause is over.
+
+        Returns:
+            Seconds slept
+        """
+        pause = self.remaining()
+        if pause:
+            time.sleep(pause)
+        return pause
@@ -0,0 +1,227 @@
+"""A local SMTP server that accepts and discards mail.
+
+The sink speaks enough ESMTP for Flask-Mail and aiosmtplib, counts what it
+accepts and can be made slow or unreliable on purpose, so the delivery
+path can be measured and tested without a real relay::
+
+    with SMTPSink(latency=0.005, error_rate=0.01) as sink:
+        app.config.update(MAIL_SERVER=sink.host, MAIL_PORT=sink.port)
+        ...
+        print(sink.stats())
+
+It runs its own event loop in a background thread. STARTTLS is not
+offered; ``AUTH PLAIN`` accepts any credentials.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPSink(object):
+    """Threaded SMTP sink with artificial latency and error injection."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_code: int = 451,
+        rcpt_error_rate: float = 0.0,
+        rcpt_error_code: int = 550,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        Initialize an SMTPSink instance.
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 for any free port
+            latency: Seconds to wait before answering each DATA
+            error_rate: Share of messages refused with ``error_code``
+            error_code: Reply code of injected message errors
+            rcpt_error_rate: Share of RCPT commands refused
+            rcpt_error_code: Reply code of injected recipient errors
+            seed: Seed for the error injection, for reproducible runs
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.rcpt_error_rate = rcpt_error_rate
+        self.rcpt_error_code = rcpt_error_code
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._sessions: Set[asyncio.StreamWriter] = set()
+        self.reset()
+
+    def reset(self) -> None:
+        """Zero the counters."""
+        with self._lock:
+            self.connections = 0
+            self.messages = 0
+            self.recipients = 0
+            self.rejected_messages = 0
+            self.rejected_recipients = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Report what the sink has seen.
+
+        Returns:
+            Dictionary with connections, accepted messages and recipients,
+            and injected message and recipient rejections
+        """
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "messages": self.messages,
+                "recipients": self.recipients,
+                "rejected_messages": self.rejected_messages,
+                "rejected_recipients": self.rejected_recipients,
+            }
+
+    def start(self) -> "SMTPSink":
+        """
+        Start listening in a background thread.
+
+        Returns:
+            The sink, with ``port`` set to the bound port
+        """
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run() -> None:
+            assert self._loop is not None
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="smtp-sink", daemon=True)
+        self._thread.start()
+        ready.wait()
+        logger.info("SMTP sink listening on %s:%d", self.host, self.port)
+        return self
+
+    def stop(self) -> None:
+        """Stop listening and join the background thread."""
+        if self._loop is None or self._thread is None:
+            return
+
+        async def shutdown() -> None:
+            if self._server is not None:
+                self._server.close()
+            # Drop open sessions so clients see a closed socket, not silence.
+            for writer in list(self._sessions):
+                writer.close()
+            if self._server is not None:
+                await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = self._thread = self._server = None
+
+    def __enter__(self) -> "SMTPSink":
+        """Start the sink for the duration of a ``with`` block."""
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Stop the sink."""
+        self.stop()
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for name, amount in increments.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def _inject(self, rate: float) -> bool:
+        return rate > 0 and self._random.random() < rate
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve one SMTP session."""
+        self._count(connections=1)
+        self._sessions.add(writer)
+        recipients: List[str] = []
+
+        def reply(line: str) -> None:
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 mail-scheduler sink ESMTP")
+        try:
+            while True:
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    break
+                verb = line.split(b" ", 1)[0].strip().upper()
+
+                if verb == b"EHLO":
+                    reply("250-mail-scheduler sink")
+                    reply("250-8BITMIME")
+                    reply("250-SMTPUTF8")
+                    reply("250 AUTH PLAIN")
+                elif verb == b"HELO":
+                    reply("250 mail-scheduler sink")
+                elif verb == b"AUTH":
+                    reply("235 2.7.0 Authentication successful")
+                elif verb == b"MAIL":
+                    recipients = []
+                    reply("250 2.1.0 OK")
+                elif verb == b"RCPT":
+                    if self._inject(self.rcpt_error_rate):
+                        self._count(rejected_recipients=1)
+                        reply(f"{self.rcpt_error_code} 5.1.1 Injected rejection")
+                    else:
+                        recipients.append(line.decode(errors="replace"))
+                        reply("250 2.1.5 OK")
+                elif verb == b"DATA":
+                    if not recipients:
+                        reply("503 5.5.1 No valid recipients")
+                        continue
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    while await reader.readline() not in (b".\r\n", b".\n", b""):
+                        pass
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    if self._inject(self.error_rate):
+                        self._count(rejected_messages=1)
+                        reply(f"{self.error_code} 4.3.0 Injected failure")
+                    else:
+                        self._count(messages=1, recipients=len(recipients))
+                        reply("250 2.0.0 OK queued")
+                    recipients = []
+                elif verb in (b"RSET", b"NOOP"):
+                    if verb == b"RSET":
+                        recipients = []
+                    reply("250 2.0.0 OK")
+                elif verb == b"QUIT":
+                    reply("221 2.0.0 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    reply("502 5.5.2 Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._sessions.discard(writer)
+            writer.close()
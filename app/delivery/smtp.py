@@ -0,0 +1,57 @@
+"""Low level SMTP helpers."""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from flask import current_app
+from flask_mail import BadHeaderError, email_dispatched, sanitize_address
+
+# Recipient address -> (SMTP reply code, reply text)
+Refused = Dict[str, Tuple[int, bytes]]
+
+
+def send_message(
+    connection: Any, message: Any, envelope_from: Optional[str] = None
+) -> Refused:
+    """
+    Send a message through a Flask-Mail connection.
+
+    Mirrors ``flask_mail.Connection.send`` but returns the recipients the
+    server refused, which Flask-Mail discards.
+
+    Args:
+        connection: An entered ``flask_mail.Connection``
+        message: A ``flask_mail.Message``
+        envelope_from: Optional MAIL FROM address
+
+    Returns:
+        Refused recipients mapped to their SMTP reply
+    """
+    host = getattr(connection, "host", None)
+    if host is None:
+        connection.send(message, envelope_from)
+        return {}
+
+    if not message.send_to:
+        raise ValueError("No recipients have been added")
+    if not message.sender:
+        raise ValueError(
+            "The message does not specify a sender and a default sender "
+            "has not been configured"
+        )
+    if message.has_bad_headers():
+        raise BadHeaderError
+    if message.date is None:
+        message.date = time.time()
+
+    refused: Refused = host.sendmail(
+        sanitize_address(envelope_from or message.sender),
+        [sanitize_address(addr) for addr in message.send_to],
+        message.as_bytes(),
+        message.mail_options,
+        message.rcpt_options,
+    )
+    email_dispatched.send(message, app=current_app._get_current_object())
+    return refused
@@ -0,0 +1,138 @@
+"""Per-recipient delivery status, written with bulk UPDATE statements.
+
+Recipients are updated in batches of ``batch_size`` addresses per
+statement instead of being loaded and flushed one ORM object at a time, so
+recording the outcome of a 100k recipient send costs a handful of queries.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import UTC, datetime
+from email.utils import parseaddr
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select, update
+
+from app.database.models import Recipient
+from app.delivery.fanout import chunked
+from app.delivery.smtp import Refused
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Reply code recorded for recipients the server accepted.
+SMTP_ACCEPTED = 250
+
+
+def normalize_address(address: str) -> str:
+    """
+    Strip the display name from an address.
+
+    Args:
+        address: Address such as ``Name <user@example.com>``
+
+    Returns:
+        The bare email address
+    """
+    return parseaddr(address)[1] or address
+
+
+def mark_recipients(
+    session: Any,
+    event_id: int,
+    addresses: Iterable[str],
+    status: str,
+    smtp_code: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """
+    Set the delivery status of many recipients of an event.
+
+    Args:
+        session: SQLAlchemy session to execute the statements on
+        event_id: ID of the event the recipients belong to
+        addresses: Email addresses to update
+        status: One of the ``Recipient.STATUS_*`` values
+        smtp_code: SMTP reply code to record
+        batch_size: Number of addresses per UPDATE statement
+
+    Returns:
+        Number of rows updated
+    """
+    sent_at = datetime.now(UTC) if status == Recipient.STATUS_SENT else None
+    emails = sorted({normalize_address(addr) for addr in addresses})
+
+    updated = 0
+    for batch in chunked(emails, batch_size):
+        result = session.execute(
+            update(Recipient)
+            .where(Recipient.event_id == event_id, Recipient.email.in_(batch))
+            .values(status=status, smtp_code=smtp_code, sent_at=sent_at)
+            .execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount or 0
+    return updated
+
+
+def record_delivery(
+    session: Any,
+    event_id: int,
+    recipients: Iterable[str],
+    refused: Refused,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> None:
+    """
+    Store the outcome of one SMTP transaction.
+
+    Accepted recipients are marked sent; refused ones are marked failed,
+    grouped by reply code so every code costs one statement per batch.
+
+    Args:
+        session: SQLAlchemy session to execute the statements on
+        event_id: ID of the event that was sent
+        recipients: Every address of the transaction
+        refused: Refused recipients mapped to their SMTP reply
+        batch_size: Number of addresses per UPDATE statement
+    """
+    failed: Dict[int, List[str]] = defaultdict(list)
+    for addr, (code, _) in refused.items():
+        failed[code].append(normalize_address(addr))
+
+    refused_emails = {email for emails in failed.values() for email in emails}
+    accepted = [
+        addr for addr in recipients if normalize_address(addr) not in refused_emails
+    ]
+
+    mark_recipients(
+        session,
+        event_id,
+        accepted,
+        Recipient.STATUS_SENT,
+        SMTP_ACCEPTED,
+        batch_size,
+    )
+    for code, emails in failed.items():
+        mark_recipients(
+            session, event_id, emails, Recipient.STATUS_FAILED, code, batch_size
+        )
+
+
+def failed_recipients(session: Any, event_id: int) -> List[str]:
+    """
+    List the addresses of an event whose delivery failed.
+
+    Args:
+        session: SQLAlchemy session to query with
+        event_id: ID of the event
+
+    Returns:
+        Email addresses with status failed
+    """
+    return list(
+        session.scalars(
+            select(Recipient.email).where(
+                Recipient.event_id == event_id,
+                Recipient.status == Recipient.STATUS_FAILED,
+            )
+        )
+    )
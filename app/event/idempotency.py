@@ -0,0 +1,148 @@
+"""Idempotency keys for the creation of events.
+
+Clients retrying ``POST /api/save_emails`` after a timeout send the same
+``Idempotency-Key`` header with every attempt. The first attempt stores
+the event with the key, which is unique in the ``events`` table, and then
+remembers the key and the event ID in Redis for ``MAIL_IDEMPOTENCY_TTL``
+seconds. A retry is answered from Redis with a single ``GET``, without
+touching the database or the scheduler.
+
+A retry that misses Redis, because it raced the first attempt or came
+after the TTL, still cannot create a second event: the insert violates
+the unique constraint and the ID of the original event is returned
+before anything is scheduled.
+
+The event, its recipients and its job are created in one transaction, so
+a key only ever resolves to an event that was fully scheduled; if any
+step fails the key stays free for the retry. A hash of the request body
+is kept with the key, and a request reusing the key with another body is
+refused with :class:`KeyReused` instead of getting the first event.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from typing import Any, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY = "mail-scheduler:idempotency:{key}"
+
+# Longest key accepted, the size of the events column.
+MAX_KEY_LENGTH = 255
+
+
+class KeyReused(ValueError):
+    """An idempotency key was sent again with a different request body."""
+
+
+def request_fingerprint(data: Mapping[str, Any]) -> str:
+    """
+    Hash a request body, the same for the same fields in any order.
+
+    Args:
+        data: The JSON body of the request
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    body = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def check_fingerprint(
+    key: str, remembered: Optional[str], fingerprint: Optional[str]
+) -> None:
+    """
+    Check that a request repeats the body first sent with its key.
+
+    Args:
+        key: The idempotency key
+        remembered: Fingerprint stored with the key, None if unknown
+        fingerprint: Fingerprint of this request, None to skip the check
+
+    Raises:
+        KeyReused: If both are known and differ
+    """
+    if remembered and fingerprint and remembered != fingerprint:
+        raise KeyReused(f"Idempotency-Key {key} was used with a different request")
+
+
+def validate_key(key: str) -> str:
+    """
+    Check that an idempotency key fits the events table.
+
+    Args:
+        key: The ``Idempotency-Key`` header
+
+    Returns:
+        The key
+
+    Raises:
+        ValueError: If the key is empty or too long
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(
+            f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long"
+        )
+    return key
+
+
+def replayed_event(
+    connection: Any, key: str, fingerprint: Optional[str] = None
+) -> Optional[int]:
+    """
+    Get the event created by an earlier request with the same key.
+
+    Args:
+        connection: Redis connection
+        key: The idempotency key
+        fingerprint: Fingerprint of this request, see request_fingerprint
+
+    Returns:
+        ID of the event, None if the key is not remembered or Redis is
+        unavailable
+
+    Raises:
+        KeyReused: If the key was remembered for a different request
+    """
+    try:
+        value = connection.get(IDEMPOTENCY_KEY.format(key=key))
+    except Exception as e:
+        # The unique constraint still catches the retry.
+        logger.warning("Could not look up idempotency key: %s", e)
+        return None
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode()
+    # "<event ID>:<fingerprint>", or only the ID when remembered without one.
+    event_id, _, remembered = str(value).partition(":")
+    check_fingerprint(key, remembered, fingerprint)
+    return int(event_id)
+
+
+def remember_event(
+    connection: Any,
+    key: str,
+    event_id: int,
+    ttl: int,
+    fingerprint: Optional[str] = None,
+) -> None:
+    """
+    Remember the event created for a key, for retries to find.
+
+    Args:
+        connection: Redis connection
+        key: The idempotency key
+        event_id: ID of the event
+        ttl: Seconds to remember it
+        fingerprint: Fingerprint of the request that created it
+    """
+    value = f"{event_id}:{fingerprint}" if fingerprint else event_id
+    try:
+        connection.set(IDEMPOTENCY_KEY.format(key=key), value, ex=ttl)
+    except Exception as e:
+        logger.warning("Could not remember idempotency key: %s", e)
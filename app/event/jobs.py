@@ -2,33 +2,129 @@
 
 from __future__ import annotations
 
-from datetime import UTC, datetime
-from typing import Any, Dict, List, Union, cast
+import logging
+import smtplib
+import time
+from contextlib import nullcontext
+from datetime import UTC, datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+from typing import (
+    Any,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
+from uuid import uuid4
 
 import dateutil.parser
 import pytz
-from bs4 import BeautifulSoup
-from flask_mail import Message
+from flask import current_app, has_app_context
+from rq.job import Job
+from rq.queue import Queue
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from tzlocal import get_localzone
 
 from app.database import db
-from app.database.models import Event, Recipient
+from app.database.models import Event, Recipient, ScheduledCall
+from app.delivery.async_engine import AsyncDeliveryEngine, Envelope, split_results
+from app.delivery.fanout import enqueue_many, finish_chunk, start_fanout
+from app.delivery.mime import UNDISCLOSED_RECIPIENTS, MessageTemplate, PreparedMessage
+from app.delivery.planner import (
+    Transaction,
+    domain_timings,
+    log_domain_timing,
+    plan_transactions,
+)
+from app.delivery.pool import get_smtp_pool
+from app.delivery.queues import PRIORITIES, priority_queue
+from app.delivery.ratelimit import RateLimiter
+from app.delivery.recipients import recipient_batches, recipient_ranges
+from app.delivery.relays import Relay, RelayLease, RelayRouter, RelayUnavailable
+from app.delivery.render import get_render_pool
+from app.delivery.retry import (
+    RelayBackoff,
+    backoff_delay,
+    group_by_code,
+    is_overload,
+    is_transient_error,
+    release_retry,
+    reserve_retry,
+    split_refused,
+)
+from app.delivery.smtp import Refused
+from app.delivery.status import failed_recipients, mark_recipients, record_delivery
+from app.event.idempotency import check_fingerprint, request_fingerprint
 from app.extensions import mail, rq
+from app.scheduler.recurrence import (
+    advance,
+    create_occurrence,
+    first_fire,
+    next_fire,
+)
+from app.scheduler.timezones import (
+    DEFAULT_TIMEZONE,
+    bucket_send_time,
+    first_send_time,
+    offset_buckets,
+    validate_timezone,
+)
+from app.scheduler.wheel import TimingWheel, to_timestamp
+
+logger = logging.getLogger(__name__)
 
 
 # Helper function.
-def add_recipients(data: str, event_id: int) -> List[str]:
+def add_recipients(
+    data: str,
+    event_id: int,
+    timezones: Optional[Dict[str, str]] = None,
+    commit: bool = True,
+) -> List[str]:
     """
     Store recipients in database.
 
     Args:
         data: Comma-separated email addresses
         event_id: ID of the event to associate recipients with
+        timezones: Time zone of recipients, by email address
+        commit: Commit them, or leave that to the caller's transaction
 
     Returns:
         List of email addresses
     """
+    timezones = timezones or {}
     mail_addr = (data.replace(" ", "")).split(",")
+    for email, name in parse_recipients(mail_addr):
+        # Create a new Recipient - using correct constructor signature
+        recipient = Recipient(email=email, name=name, event_id=event_id)
+        if email in timezones:
+            recipient.timezone = timezones[email]
+        db.session.add(recipient)
+
+    # Commit all recipients at once
+    if commit:
+        db.session.commit()
+    return mail_addr
+
+
+def parse_recipients(mail_addr: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """
+    Split addresses into email and display name.
+
+    Args:
+        mail_addr: Addresses, each ``email`` or ``Name<email>``
+
+    Returns:
+        (email, name) pairs, name None when not given
+    """
+    parsed: List[Tuple[str, Optional[str]]] = []
     for m in mail_addr:
         # Try to extract name if email is in format "Name <email@example.com>"
         name = None
@@ -41,13 +137,8 @@ def add_recipients(data: str, event_id: int) -> List[str]:
                 name = parts[0].strip()
                 email = parts[1].split(">")[0].strip()
 
-        # Create a new Recipient - using correct constructor signature
-        recipient = Recipient(email=email, name=name, event_id=event_id)
-        db.session.add(recipient)
-
-    # Commit all recipients at once
-    db.session.commit()
-    return mail_addr
+        parsed.append((email, name))
+    return parsed
 
 
 def dt_utc(dt: Union[str, datetime]) -> datetime:
@@ -114,56 +205,831 @@ def dt_utc(dt: Union[str, datetime]) -> datetime:
         return utc_now.replace(tzinfo=None)
 
 
-def schedule_mail(event_id: int, recipients: List[str], timestamp: datetime) -> None:
+def smtp_connection(relay: Optional[Relay] = None) -> Any:
+    """
+    Return a context manager yielding a connection to send through.
+
+    Uses the worker's SMTP connection pool when ``MAIL_POOL_ENABLED`` is set,
+    otherwise opens a one-off Flask-Mail connection.
+
+    Args:
+        relay: Relay to connect to, None for the Flask-Mail settings
+
+    Returns:
+        Context manager yielding an object with a ``send(msg)`` method
+    """
+    if current_app.config.get("MAIL_POOL_ENABLED", False):
+        return get_smtp_pool(relay).connection()
+    if relay is not None:
+        return relay.connector(current_app.config)()
+    return mail.connect()
+
+
+def relay_name(relay: Optional[Relay] = None) -> str:
+    """
+    Name a relay in rate limit and backoff scopes.
+
+    Args:
+        relay: A leased relay, None for the Flask-Mail settings
+
+    Returns:
+        ``relay:<name>``, or ``relay:<MAIL_SERVER>`` for the default relay
+    """
+    if relay is not None:
+        return f"relay:{relay.name}"
+    return f"relay:{current_app.config.get('MAIL_SERVER')}"
+
+
+def rate_limiter(relay: Optional[Relay] = None) -> Optional[RateLimiter]:
+    """
+    Return the shared rate limiter for a relay and its sender account.
+
+    Args:
+        relay: A leased relay, None for the Flask-Mail settings
+
+    Returns:
+        A limiter drawing from the ``relay:<name>`` and
+        ``sender:<username>`` buckets, or None when neither is listed in
+        ``MAIL_RATE_LIMITS``
+    """
+    config = current_app.config
+    if not config.get("MAIL_RATE_LIMITS"):
+        return None
+    username = relay.username if relay is not None else None
+    return RateLimiter.from_config(
+        rq.connection,
+        config,
+        relay_name(relay),
+        f"sender:{username or config.get('MAIL_USERNAME')}",
+    )
+
+
+def relay_backoff(relay: Optional[Relay] = None) -> Optional[RelayBackoff]:
+    """
+    Return the shared overload backoff of a relay.
+
+    Args:
+        relay: A leased relay, None for the Flask-Mail settings
+
+    Returns:
+        The relay's backoff, or None when ``MAIL_BACKOFF_ENABLED`` is off
+    """
+    config = current_app.config
+    if not config.get("MAIL_BACKOFF_ENABLED", False):
+        return None
+    return RelayBackoff(
+        rq.connection,
+        relay_name(relay),
+        base=config.get("MAIL_BACKOFF_BASE_DELAY", 1),
+        cap=config.get("MAIL_BACKOFF_MAX_DELAY", 120),
+    )
+
+
+def relay_lease() -> ContextManager[RelayLease]:
+    """
+    Lease a relay for one delivery.
+
+    Returns:
+        Context manager yielding a lease on one of ``MAIL_RELAYS``, or on
+        the Flask-Mail settings when no relays are configured
+    """
+    router = RelayRouter.from_config(rq.connection, current_app.config)
+    if router is None:
+        return nullcontext(RelayLease(None))
+    return router.lease()
+
+
+def schedule_mail(
+    event_id: int, timestamp: datetime, priority: Optional[str] = None
+) -> None:
     """
     Schedule send_mail job.
 
+    Only the event ID goes into the job; the worker reads the recipients
+    from the database when the job runs.
+
     Args:
         event_id: Event ID to send email for
-        recipients: List of recipient email addresses
         timestamp: When to send the email
+        priority: Priority of the event, choosing the queue of the job
+    """
+    config = current_app.config
+    if config.get("MAIL_SCHEDULER") == "database":
+        # The event row is the schedule; a poller claims it when due.
+        return
+    queue = priority_queue(priority, config)
+    record_job(event_id, schedule_job(timestamp, send_mail, event_id, queue=queue))
+
+
+def record_job(event_id: int, job_id: Optional[str]) -> None:
+    """
+    Store the ID of an event's scheduled job, to move or cancel it later.
+
+    Args:
+        event_id: ID of the event
+        job_id: ID of the job
+    """
+    db.session.execute(update(Event).where(Event.id == event_id).values(job_id=job_id))
+    db.session.commit()
+
+
+def schedule_recurrence(
+    event_id: int, fire_at: datetime, priority: Optional[str] = None
+) -> None:
+    """
+    Schedule the next run of a recurring event.
+
+    Args:
+        event_id: ID of the recurring event
+        fire_at: Its next fire time
+        priority: Priority of the event, choosing the queue of the job
     """
+    config = current_app.config
+    if config.get("MAIL_SCHEDULER") == "database":
+        # The poller reads next_fire_at.
+        return
+    queue = priority_queue(priority, config)
+    record_job(
+        event_id,
+        schedule_job(fire_at, fire_recurrence, event_id, fire_at, queue=queue),
+    )
+
+
+def event_queue(event: Event) -> str:
+    """
+    Get the name of the queue the jobs of an event go to.
+
+    Args:
+        event: The event
+
+    Returns:
+        Queue name, from the event's priority
+    """
+    return priority_queue(event.priority, current_app.config)
+
+
+def schedule_events(events: List[Event]) -> None:
+    """
+    Schedule the first jobs of many new events through one Redis pipeline.
+
+    The events' ``job_id`` must already be set.
+
+    Args:
+        events: Events just stored, one-off or recurring
+    """
+    if current_app.config.get("MAIL_SCHEDULER") == "database":
+        return
+    schedule_jobs(
+        [
+            (
+                (event.next_fire_at, fire_recurrence, (event.id, event.next_fire_at))
+                if event.recurrence
+                else (event.timestamp, send_mail, (event.id,))
+            )
+            for event in events
+        ],
+        [event.job_id for event in events],
+        [event_queue(event) for event in events],
+    )
+
+
+def schedule_jobs(
+    calls: List[Tuple[datetime, Any, Tuple[Any, ...]]],
+    job_ids: Optional[List[str]] = None,
+    queues: Optional[List[str]] = None,
+) -> None:
+    """
+    Schedule many jobs through one Redis pipeline.
+
+    Args:
+        calls: (when to enqueue, job function, arguments) triples
+        job_ids: IDs to give the jobs, in the order of the calls
+        queues: Names of the queues of the jobs, in the order of the calls
+    """
+    if not calls:
+        return
+    if current_app.config.get("MAIL_SCHEDULER") == "database":
+        store_calls(calls, job_ids, queues)
+        return
+    if current_app.config.get("MAIL_SCHEDULER", "rq") == "wheel":
+        config = current_app.config
+        wheel = TimingWheel.from_config(rq.connection, rq.get_queue(), config)
+        wheel.schedule_calls(calls, job_ids, queues)
+        return
+
+    # What Scheduler.enqueue_at does per job, with the writes pipelined.
     scheduler = rq.get_scheduler()
-    scheduler.enqueue_at(timestamp, send_mail, event_id, recipients)
+    pipe = scheduler.connection.pipeline()
+    for n, (when, func, args) in enumerate(calls):
+        job_id = job_ids[n] if job_ids else None
+        job = scheduler._create_job(
+            func,
+            args=args,
+            id=job_id,
+            commit=False,
+            queue_name=queues[n] if queues else None,
+        )
+        job.save(pipeline=pipe)
+        pipe.zadd(scheduler.scheduled_jobs_key, {job.id: int(to_timestamp(when))})
+    pipe.execute()
 
 
-# Main job function.
-@rq.job
-def send_mail(event_id: int, recipients: List[str]) -> str:
+def store_calls(
+    calls: List[Tuple[datetime, Any, Tuple[Any, ...]]],
+    job_ids: Optional[List[str]] = None,
+    queues: Optional[List[str]] = None,
+) -> List[str]:
     """
-    Sends an email asynchronously using flask rq-scheduler.
+    Store jobs for the database poller to enqueue when due, and commit.
 
     Args:
-        event_id: Event ID to send email for
-        recipients: List of recipient email addresses
+        calls: (when to enqueue, naive times being UTC, job function,
+            arguments) triples
+        job_ids: IDs to give the jobs, in the order of the calls
+        queues: Names of the queues of the jobs, in the order of the calls
 
     Returns:
-        Success message with timestamp
+        IDs of the jobs
+    """
+    rows = [
+        ScheduledCall(
+            job_id=job_ids[n] if job_ids else str(uuid4()),
+            due_at=when.astimezone(UTC).replace(tzinfo=None) if when.tzinfo else when,
+            func=f"{func.__module__}.{func.__name__}",
+            args=tuple(args),
+            queue=queues[n] if queues else None,
+        )
+        for n, (when, func, args) in enumerate(calls)
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.job_id for row in rows]
 
-    Todo:
-        Use recipients from database rather than passing to function.
-        This function should just need the event ID.
+
+def schedule_job(
+    when: Union[datetime, timedelta],
+    func: Any,
+    *args: Any,
+    queue: Optional[str] = None,
+) -> str:
     """
-    event = db.session.get(Event, event_id)
-    if not event:
-        raise ValueError(f"Event with ID {event_id} not found")
+    Schedule a job through the scheduler chosen by ``MAIL_SCHEDULER``.
+
+    Args:
+        when: When to enqueue the job, or how long from now
+        func: The job function
+        *args: Arguments of the job
+        queue: Name of the queue to enqueue the job in, the default queue
+            if None
+
+    Returns:
+        ID of the scheduled job
+    """
+    if current_app.config.get("MAIL_SCHEDULER") == "database":
+        if isinstance(when, timedelta):
+            when = datetime.now(UTC) + when
+        return store_calls([(when, func, args)], queues=[queue] if queue else None)[0]
+    if current_app.config.get("MAIL_SCHEDULER", "rq") == "wheel":
+        if isinstance(when, timedelta):
+            when = datetime.now(UTC) + when
+        config = current_app.config
+        wheel = TimingWheel.from_config(rq.connection, rq.get_queue(), config)
+        job = wheel.schedule_call(when, func, *args, queue=queue)
+        return cast(str, job.id)
+
+    options = {"queue_name": queue} if queue else {}
+    if isinstance(when, timedelta):
+        job = rq.get_scheduler().enqueue_in(when, func, *args, **options)
+    else:
+        job = rq.get_scheduler().enqueue_at(when, func, *args, **options)
+    return cast(str, job.id)
+
+
+def pending_job(event: Event) -> Optional[Tuple[str, datetime]]:
+    """
+    Get the job an event is waiting on in the scheduler.
+
+    Args:
+        event: The event
+
+    Returns:
+        The job's ID and the time it is scheduled for, or None
+    """
+    when = event.next_fire_at if event.recurrence else event.timestamp
+    if not event.job_id or when is None or event.is_done:
+        return None
+    return event.job_id, when
+
+
+def remove_event(event: Event) -> None:
+    """
+    Delete an event with its recipients and runs, and cancel its job.
+
+    Jobs scheduled for the event other than its send or fire job, such as
+    retries, chunks and time zone groups, finish at once when they find it
+    gone.
+
+    Args:
+        event: The event
+    """
+    pending = pending_job(event)
+    runs = select(Event.id).where(Event.parent_id == event.id)
+    try:
+        db.session.execute(
+            delete(Recipient).where(
+                or_(Recipient.event_id == event.id, Recipient.event_id.in_(runs))
+            )
+        )
+        db.session.execute(delete(Event).where(Event.parent_id == event.id))
+        db.session.delete(event)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Stop its job from taking a worker only to find no event.
+    if pending:
+        cancel_job(*pending)
+        db.session.commit()
+
+
+def cancel_job(job_id: str, when: datetime) -> bool:
+    """
+    Remove a scheduled job before it is due, and delete it.
+
+    Removing it from the scheduler's sorted set is O(log n). A job that
+    already left the scheduler is left alone; it finds its event gone or
+    changed when it runs.
+
+    Args:
+        job_id: ID of the job
+        when: The time it is scheduled for
+
+    Returns:
+        True if the job was still scheduled
+    """
+    config = current_app.config
+    if config.get("MAIL_SCHEDULER") == "database":
+        return bool(
+            db.session.execute(
+                delete(ScheduledCall).where(ScheduledCall.job_id == job_id)
+            ).rowcount
+        )
+    if config.get("MAIL_SCHEDULER", "rq") == "wheel":
+        wheel = TimingWheel.from_config(rq.connection, rq.get_queue(), config)
+        cancelled = wheel.cancel(job_id, when)
+    else:
+        scheduler = rq.get_scheduler()
+        key = scheduler.scheduled_jobs_key
+        cancelled = bool(scheduler.connection.zrem(key, job_id))
+    if cancelled:
+        rq.connection.delete(Job.key_for(job_id))
+    return cancelled
+
+
+def reschedule_job(job_id: str, when: datetime, new_when: datetime) -> bool:
+    """
+    Move a scheduled job to another time.
+
+    On rq-scheduler this is a single ``ZADD XX`` of the new score, O(log n).
+
+    Args:
+        job_id: ID of the job
+        when: The time it is scheduled for
+        new_when: The time to move it to
+
+    Returns:
+        True if the job was moved, False if it had already left the scheduler
+    """
+    config = current_app.config
+    if config.get("MAIL_SCHEDULER", "rq") == "wheel":
+        wheel = TimingWheel.from_config(rq.connection, rq.get_queue(), config)
+        return wheel.reschedule(job_id, when, new_when)
+
+    scheduler = rq.get_scheduler()
+    moved = scheduler.connection.zadd(
+        scheduler.scheduled_jobs_key,
+        {job_id: int(to_timestamp(new_when))},
+        xx=True,
+        ch=True,
+    )
+    return bool(moved)
+
+
+def reschedule_event(event: Event, previous: datetime) -> None:
+    """
+    Move the pending job of an event whose timestamp was edited.
+
+    The spreading window and the local send time move with the timestamp,
+    so the time zone groups of a local-time event follow the edit. The
+    caller commits the event afterwards, with its new ``job_id`` when a new
+    job had to be scheduled.
+
+    Args:
+        event: The event, with its new timestamp
+        previous: The timestamp it had when its job was scheduled
+    """
+    if isinstance(event.send_by, datetime):
+        event.send_by += event.timestamp - previous
+    if isinstance(event.local_time, datetime):
+        # fan_out_zones sends each group at local_time in its zone.
+        event.local_time += event.timestamp - previous
+    if event.is_done or current_app.config.get("MAIL_SCHEDULER") == "database":
+        # The poller reads the new timestamp.
+        return
+
+    if event.recurrence:
+        # The old fire job no longer matches next_fire_at and creates no run.
+        if event.job_id and event.next_fire_at:
+            cancel_job(event.job_id, event.next_fire_at)
+        now = datetime.now(UTC).replace(tzinfo=None)
+        event.next_fire_at = next_fire(
+            event.recurrence, event.timestamp, now - timedelta(seconds=1)
+        )
+        if event.next_fire_at is not None:
+            event.job_id = schedule_job(
+                event.next_fire_at,
+                fire_recurrence,
+                event.id,
+                event.next_fire_at,
+                queue=event_queue(event),
+            )
+        return
 
-    msg = Message(subject=event.email_subject)
+    if event.job_id and reschedule_job(event.job_id, previous, event.timestamp):
+        return
+    # The old job was already taken from the scheduler; if it still runs,
+    # it sends first and this one finds nobody left to send to.
+    event.job_id = schedule_job(
+        event.timestamp, send_mail, event.id, queue=event_queue(event)
+    )
+
+
+def build_message(event: Event, recipients: List[str]) -> PreparedMessage:
+    """
+    Build the message for an event from its cached MIME part.
+
+    With more than one recipient the ``To`` header reads
+    ``undisclosed-recipients:;`` so recipients do not see each other.
+
+    Args:
+        event: Event whose subject and content are sent
+        recipients: List of recipient email addresses
+
+    Returns:
+        Message ready to send
+    """
+    # Events stored before content was prepared at save time.
+    if event.mime_body is None:
+        event.prepare_content()
 
+    msg = PreparedMessage(subject=event.email_subject, mime_part=event.mime_body)
     for addr_ in recipients:
         msg.add_recipient(addr_)
+    if len(recipients) > 1:
+        msg.to_header = UNDISCLOSED_RECIPIENTS
+    return msg
+
+
+def plan_messages(
+    event: Event,
+    plan: List[Transaction],
+    template: Optional[MessageTemplate] = None,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Build the messages of a delivery plan, in the order of the plan.
+
+    Personal messages are rendered in the worker's render pool when
+    ``MAIL_RENDER_PROCESSES`` is set, see :mod:`app.delivery.render`.
+
+    Args:
+        event: Event whose subject and content are sent
+        plan: Transactions from :func:`~app.delivery.planner.plan_transactions`
+        template: Template of the event for personalised messages, None
+            for one message per transaction
+
+    Yields:
+        Tuples of destination domain and message
+    """
+    if template is None:
+        for domain, batch in plan:
+            yield domain, build_message(event, batch)
+        return
+
+    pool = get_render_pool()
+    if pool is None:
+        for domain, batch in plan:
+            for addr in batch:
+                yield domain, template.message(addr)
+        return
+
+    domains = [txn.domain for txn in plan for _ in txn.recipients]
+    recipients = [addr for txn in plan for addr in txn.recipients]
+    yield from zip(domains, pool.render(template, recipients))
+
+
+def envelope_template(event: Event) -> Optional[MessageTemplate]:
+    """
+    Get the template for personalised messages, if they are configured.
+
+    Args:
+        event: Event whose subject and content are sent
+
+    Returns:
+        The event's template when ``MAIL_ENVELOPE_MODE`` is "personal",
+        None when recipients share one message per transaction
+    """
+    if current_app.config.get("MAIL_ENVELOPE_MODE", "batch") != "personal":
+        return None
+    return MessageTemplate(build_message(event, []))
+
+
+def deliver_mail(event: Event, recipients: List[str], attempt: int = 0) -> None:
+    """
+    Send the event's email to the given recipients.
+
+    The outcome is stored per recipient and committed by the caller.
+    Refusals of individual recipients are
+    only visible through the connection pool; a plain Flask-Mail connection
+    reports success or failure for the whole transaction.
+
+    The message goes through one relay leased from ``MAIL_RELAYS``.
+    Transient failures (4xx replies, dropped connections, no relay
+    available) defer the affected recipients to a retry_mail job; see
+    :func:`settle_delivery`.
+
+    Set ``MAIL_DELIVERY_ENGINE = "async"`` to send through the asyncio
+    engine instead.
+
+    Args:
+        event: Event whose subject and content are sent
+        recipients: List of recipient email addresses
+        attempt: Number of earlier attempts for these recipients
+    """
+    try:
+        with relay_lease() as lease:
+            relay = lease.relay
+            backoff = relay_backoff(relay)
+            if backoff is not None:
+                backoff.wait()
+
+            if current_app.config.get("MAIL_DELIVERY_ENGINE") == "async":
+                refused, errors = transmit_async(event, recipients, relay)
+            else:
+                refused, errors = transmit(event, recipients, relay)
+            lease.report(recipients, refused, errors)
+    except RelayUnavailable as exc:
+        logger.warning("No SMTP relay for event %s: %s", event.id, exc)
+        relay = None
+        refused, errors = {}, {addr: exc for addr in recipients}
+
+    settle_delivery(event, recipients, refused, errors, attempt, relay)
+
+
+def send_transaction(conn: Any, message: Any) -> Refused:
+    """
+    Send one message in one SMTP transaction.
+
+    Args:
+        conn: An entered SMTP connection
+        message: Message to send
+
+    Returns:
+        Refused recipients with their SMTP reply; every recipient when the
+        server refused the whole transaction
+    """
+    try:
+        result = conn.send(message)
+    except smtplib.SMTPRecipientsRefused as exc:
+        return cast(Refused, exc.recipients)
+    except smtplib.SMTPResponseException as exc:
+        return {addr: (exc.smtp_code, exc.smtp_error) for addr in message.send_to}
+    return result if isinstance(result, dict) else {}
+
+
+def transmit(
+    event: Event, recipients: List[str], relay: Optional[Relay] = None
+) -> Tuple[Refused, Dict[str, Exception]]:
+    """
+    Send the event's email over one blocking SMTP connection.
 
-    with mail.connect() as conn:
-        # If email content has HTML code, send as HTML.
-        # If it's just text, send as email body.
-        if BeautifulSoup(event.email_content, "html.parser").find():
-            msg.html = event.email_content
+    Recipients are grouped by domain into transactions of at most
+    ``MAIL_MAX_RCPT_PER_TRANSACTION`` RCPT TO, see
+    :func:`~app.delivery.planner.plan_transactions`. With
+    ``MAIL_ENVELOPE_MODE = "personal"`` every recipient gets a message of
+    their own instead. A transaction refused as a whole refuses its own
+    recipients only; the other transactions still go out.
+
+    Args:
+        event: Event whose subject and content are sent
+        recipients: List of recipient email addresses
+        relay: Relay to send through, None for the Flask-Mail settings
+
+    Returns:
+        Refused recipients with their SMTP reply, and recipients lost to a
+        connection error mapped to the error
+    """
+    config = current_app.config
+    slow_seconds = config.get("MAIL_SLOW_DOMAIN_SECONDS", 10)
+    timings = domain_timings()
+    plan = plan_transactions(
+        recipients, config.get("MAIL_MAX_RCPT_PER_TRANSACTION", 100), timings
+    )
+    template = envelope_template(event)
+
+    limiter = rate_limiter(relay)
+    if limiter is not None:
+        limiter.acquire(len(recipients))
+
+    refused: Refused = {}
+    errors: Dict[str, Exception] = {}
+    done = 0
+    try:
+        with smtp_connection(relay) as conn:
+            messages = plan_messages(event, plan, template)
+            for domain, group in groupby(messages, key=itemgetter(0)):
+                domain_started = started = time.monotonic()
+                count = 0
+                for _, msg in group:
+                    refused.update(send_transaction(conn, msg))
+                    done += len(msg.send_to)
+                    count += len(msg.send_to)
+                    timings.record(domain, time.monotonic() - started)
+                    started = time.monotonic()
+                log_domain_timing(
+                    domain, count, time.monotonic() - domain_started, slow_seconds
+                )
+    except (smtplib.SMTPException, OSError) as exc:
+        # settle_delivery tells a dropped connection from a failed login.
+        logger.warning("SMTP connection failed for event %s: %s", event.id, exc)
+        # Recipients of the messages already sent have their answer.
+        pending = [addr for txn in plan for addr in txn.recipients][done:]
+        errors = {addr: exc for addr in pending}
+
+    if config.get("MAIL_POOL_ENABLED", False):
+        logger.info(
+            "SMTP pool: %(opened)d handshakes opened, %(saved)d saved",
+            get_smtp_pool(relay).stats(),
+        )
+    return refused, errors
+
+
+def transmit_async(
+    event: Event, recipients: List[str], relay: Optional[Relay] = None
+) -> Tuple[Refused, Dict[str, Exception]]:
+    """
+    Send the event's email through the asyncio delivery engine.
+
+    Recipients are grouped by domain into envelopes of at most
+    ``MAIL_ASYNC_BATCH_SIZE``, or of one recipient each in personal
+    envelope mode, that are sent over up to ``MAIL_ASYNC_CONCURRENCY``
+    parallel SMTP sessions.
+
+    Args:
+        event: Event whose subject and content are sent
+        recipients: List of recipient email addresses
+        relay: Relay to send through, None for the Flask-Mail settings
+
+    Returns:
+        Refused recipients with their SMTP reply, and recipients whose
+        transaction failed without a reply mapped to the error
+    """
+    config = current_app.config
+
+    template = envelope_template(event)
+
+    plan = plan_transactions(recipients, config.get("MAIL_ASYNC_BATCH_SIZE", 50))
+    envelopes = [
+        Envelope(msg.sender, list(msg.send_to), msg.as_bytes())
+        for _, msg in plan_messages(event, plan, template)
+    ]
+
+    engine = AsyncDeliveryEngine.from_config(config, rate_limiter(relay), relay)
+    return split_results(envelopes, engine.deliver(envelopes))
+
+
+def settle_delivery(
+    event: Event,
+    recipients: List[str],
+    refused: Refused,
+    errors: Dict[str, Exception],
+    attempt: int = 0,
+    relay: Optional[Relay] = None,
+) -> int:
+    """
+    Store the outcome of a send and schedule retries of transient failures.
+
+    Accepted recipients are marked sent and permanently refused ones failed.
+    Recipients refused with a 4xx reply or lost to a connection error are
+    deferred and sent again by a retry_mail job after an exponential backoff,
+    until ``MAIL_RETRY_MAX_ATTEMPTS`` is reached. A retry already pending
+    for the event also sends to them. Overload replies also
+    pause the relay for every worker.
+
+    Args:
+        event: Event that was sent
+        recipients: Every address of the send
+        refused: Refused recipients mapped to their SMTP reply
+        errors: Recipients whose transaction failed without a reply to
+            them, mapped to the error; a permanent one, such as a failed
+            login, fails them for good
+        attempt: Number of earlier attempts for these recipients
+        relay: Relay the send went through, None for the Flask-Mail settings
+
+    Returns:
+        Number of recipients deferred for another attempt
+    """
+    config = current_app.config
+    batch_size = config.get("MAIL_STATUS_BATCH_SIZE", 1000)
+
+    permanent, transient = split_refused(refused)
+    delivered = [
+        addr for addr in recipients if addr not in transient and addr not in errors
+    ]
+    record_delivery(db.session, event.id, delivered, permanent, batch_size)
+
+    lost: Dict[str, Exception] = {}
+    broken: Dict[Optional[int], List[str]] = {}
+    for addr, exc in errors.items():
+        if isinstance(exc, RelayUnavailable) or is_transient_error(exc):
+            lost[addr] = exc
         else:
-            msg.body = event.email_content
+            broken.setdefault(getattr(exc, "smtp_code", None), []).append(addr)
+    for code, addresses in broken.items():
+        logger.warning(
+            "Failed %d recipients of event %s for good: %s",
+            len(addresses),
+            event.id,
+            errors[addresses[0]],
+        )
+        mark_recipients(
+            db.session, event.id, addresses, Recipient.STATUS_FAILED, code, batch_size
+        )
+
+    if is_overload(code for code, _ in transient.values()):
+        backoff = relay_backoff(relay)
+        if backoff is not None:
+            backoff.signal()
+
+    retry_groups = group_by_code(transient)
+    if lost:
+        retry_groups.setdefault(0, []).extend(lost)
+    if not retry_groups:
+        return 0
+
+    exhausted = attempt + 1 >= config.get("MAIL_RETRY_MAX_ATTEMPTS", 5)
+    status = Recipient.STATUS_FAILED if exhausted else Recipient.STATUS_DEFERRED
+    for code, addresses in retry_groups.items():
+        mark_recipients(
+            db.session, event.id, addresses, status, code or None, batch_size
+        )
+
+    deferred = [addr for addresses in retry_groups.values() for addr in addresses]
+    if exhausted:
+        logger.warning(
+            "Giving up on %d recipients of event %s after %d attempts",
+            len(deferred),
+            event.id,
+            attempt + 1,
+        )
+        return 0
+
+    max_delay = config.get("MAIL_RETRY_MAX_DELAY", 3600)
+    delay = backoff_delay(attempt, config.get("MAIL_RETRY_BASE_DELAY", 30), max_delay)
+    # Kept past the delay, so a job queued behind others is not doubled.
+    if not reserve_retry(rq.connection, event.id, delay + max_delay):
+        logger.info(
+            "Deferred %d recipients of event %s to its pending retry",
+            len(deferred),
+            event.id,
+        )
+        return len(deferred)
+    schedule_job(
+        timedelta(seconds=delay),
+        retry_mail,
+        event.id,
+        attempt + 1,
+        queue=event_queue(event),
+    )
+    logger.info(
+        "Deferred %d recipients of event %s, retrying in %.0fs",
+        len(deferred),
+        event.id,
+        delay,
+    )
+    return len(deferred)
 
-        conn.send(msg)
 
-    # Update event status
+def mark_event_done(event: Event) -> str:
+    """
+    Flag an event as sent.
+
+    Args:
+        event: The event to update
+
+    Returns:
+        Success message with timestamp
+    """
     event.is_done = True
     event.done_at = datetime.now(UTC)
     done_at = event.done_at
@@ -174,16 +1040,371 @@ def send_mail(event_id: int, recipients: List[str]) -> str:
     return f"Success. Done at {done_at}"
 
 
-def add_event(data: Dict[str, Any]) -> int:
+def fan_out(
+    event_id: int, ranges: List[Tuple[int, int]], queue: Optional[str] = None
+) -> int:
+    """
+    Enqueue one send_mail_chunk job per range of recipient IDs.
+
+    Args:
+        event_id: Event ID to send email for
+        ranges: Inclusive (first ID, last ID) pairs of recipients
+        queue: Name of the queue of the chunks, the default queue if None
+
+    Returns:
+        Number of chunk jobs enqueued
+    """
+    start_fanout(rq.connection, event_id, len(ranges))
+
+    enqueue_many(
+        rq.get_queue(queue),
+        [
+            Queue.prepare_data(send_mail_chunk, args=(event_id, first_id, last_id))
+            for first_id, last_id in ranges
+        ],
+    )
+    return len(ranges)
+
+
+def deliver_batches(
+    event: Event,
+    batch_size: int,
+    first_id: Optional[int] = None,
+    last_id: Optional[int] = None,
+    timezones: Optional[List[Optional[str]]] = None,
+) -> int:
+    """
+    Send to the queued recipients of an event, one page at a time.
+
+    Args:
+        event: The event to send
+        batch_size: Recipients read and sent per page
+        first_id: Lowest recipient ID to send to
+        last_id: Highest recipient ID to send to
+        timezones: Only send to recipients in these time zones
+
+    Returns:
+        Number of recipients handled
+    """
+    count = 0
+    for batch in recipient_batches(
+        db.session, event.id, batch_size, first_id, last_id, timezones=timezones
+    ):
+        deliver_mail(event, batch)
+        db.session.commit()
+        count += len(batch)
+    return count
+
+
+# Main job function.
+@rq.job
+def send_mail(event_id: int) -> str:
+    """
+    Sends an email asynchronously using flask rq-scheduler.
+
+    Recipients are streamed from the database. Events with more than
+    ``MAIL_CHUNK_SIZE`` queued recipients are fanned out into
+    send_mail_chunk jobs by ID range; the event is marked done by the
+    last chunk.
+
+    Args:
+        event_id: Event ID to send email for
+
+    Returns:
+        Success message with timestamp
+    """
+    event = db.session.get(Event, event_id)
+    if not event:
+        # Deleted after its job left the scheduler; nothing to retry.
+        logger.info("Event %s no longer exists, not sending", event_id)
+        return f"Event {event_id} no longer exists"
+
+    if isinstance(event.local_time, datetime):
+        return fan_out_zones(event)
+
+    chunk_size = current_app.config.get("MAIL_CHUNK_SIZE", 0)
+    if chunk_size:
+        ranges = recipient_ranges(db.session, event_id, chunk_size)
+        if len(ranges) > 1:
+            chunks = fan_out(event_id, ranges, event_queue(event))
+            return f"Fanned out to {chunks} chunks"
+
+    deliver_batches(
+        event, chunk_size or current_app.config.get("MAIL_STATUS_BATCH_SIZE", 1000)
+    )
+    return mark_event_done(event)
+
+
+@rq.job
+def send_mail_chunk(event_id: int, first_id: int, last_id: int) -> str:
+    """
+    Send one chunk of a fanned out event.
+
+    Args:
+        event_id: Event ID to send email for
+        first_id: Lowest recipient ID of this chunk
+        last_id: Highest recipient ID of this chunk
+
+    Returns:
+        Success message once the last chunk finishes, progress otherwise
+    """
+    event = db.session.get(Event, event_id)
+    if not event:
+        logger.info("Event %s no longer exists, not sending", event_id)
+        return f"Event {event_id} no longer exists"
+
+    batch_size = current_app.config.get("MAIL_CHUNK_SIZE") or (last_id - first_id + 1)
+    count = deliver_batches(event, batch_size, first_id, last_id)
+
+    if finish_chunk(rq.connection, event_id):
+        return mark_event_done(event)
+
+    return f"Chunk of {count} recipients sent"
+
+
+def fan_out_zones(event: Event) -> str:
+    """
+    Schedule one send_mail_zone job per UTC offset of an event's recipients.
+
+    Args:
+        event: An event sent at a local time
+
+    Returns:
+        Progress message
+    """
+    zones = db.session.scalars(
+        select(Recipient.timezone)
+        .where(
+            Recipient.event_id == event.id,
+            Recipient.status == Recipient.STATUS_QUEUED,
+        )
+        .distinct()
+    ).all()
+    default = current_app.config.get("MAIL_DEFAULT_TIMEZONE") or DEFAULT_TIMEZONE
+    buckets = offset_buckets(zones, event.local_time, default)
+    if not buckets:
+        return mark_event_done(event)
+
+    calls = [
+        (
+            bucket_send_time(event.local_time, offset),
+            send_mail_zone,
+            (event.id, offset, sorted(names, key=lambda name: name or "")),
+        )
+        for offset, names in sorted(buckets.items(), reverse=True)
+    ]
+    # The event stays not done until its last group is sent, up to a day
+    # later. Holding its claim until then keeps the database poller from
+    # claiming it again and fanning it out twice.
+    event.dispatched_at = max(when for when, _, _ in calls)
+    start_fanout(rq.connection, event.id, len(buckets))
+    schedule_jobs(calls, queues=[event_queue(event)] * len(buckets))
+    db.session.commit()
+    return f"Fanned out to {len(buckets)} time zone groups"
+
+
+@rq.job
+def send_mail_zone(event_id: int, offset: int, timezones: List[Optional[str]]) -> str:
+    """
+    Send an event to the recipients of one UTC offset.
+
+    Args:
+        event_id: Event ID to send email for
+        offset: UTC offset of the group, in minutes, for the logs
+        timezones: Time zones of the group, None for recipients without one
+
+    Returns:
+        Success message once the last group finishes, progress otherwise
+    """
+    event = db.session.get(Event, event_id)
+    if not event:
+        logger.info("Event %s no longer exists, not sending", event_id)
+        return f"Event {event_id} no longer exists"
+
+    count = deliver_batches(
+        event,
+        current_app.config.get("MAIL_STATUS_BATCH_SIZE", 1000),
+        timezones=timezones,
+    )
+    logger.info("Sent event %s to %d recipients at UTC%+d min", event_id, count, offset)
+
+    if finish_chunk(rq.connection, event_id):
+        return mark_event_done(event)
+
+    return f"Time zone group of {count} recipients sent"
+
+
+@rq.job
+def retry_mail(event_id: int, attempt: int) -> str:
+    """
+    Send again to recipients deferred after a transient failure.
+
+    The deferred recipients are streamed from the database like the queued
+    ones of send_mail, so the job payload stays the same size.
+
+    Args:
+        event_id: Event ID to send email for
+        attempt: Number of earlier attempts for these recipients
+
+    Returns:
+        Progress message
+    """
+    event = db.session.get(Event, event_id)
+    if not event:
+        logger.info("Event %s no longer exists, not sending", event_id)
+        return f"Event {event_id} no longer exists"
+
+    release_retry(rq.connection, event_id)
+    count = 0
+    for batch in recipient_batches(
+        db.session,
+        event_id,
+        current_app.config.get("MAIL_STATUS_BATCH_SIZE", 1000),
+        status=Recipient.STATUS_DEFERRED,
+    ):
+        deliver_mail(event, batch, attempt)
+        db.session.commit()
+        count += len(batch)
+    return f"Retry {attempt} of {count} recipients sent"
+
+
+@rq.job
+def fire_recurrence(event_id: int, fire_at: datetime) -> Optional[int]:
+    """
+    Send one run of a recurring event and schedule the next.
+
+    The run is created only by whoever moves the event's ``next_fire_at``
+    on from ``fire_at``, so a duplicated job or a rule changed meanwhile
+    creates nothing. Runs missed while nothing was dispatching are skipped.
+
+    Args:
+        event_id: ID of the recurring event
+        fire_at: The fire time this job was scheduled for
+
+    Returns:
+        ID of the event created for this run, None if nothing was created
+    """
+    event = db.session.get(Event, event_id)
+    if not event or not event.recurrence or event.is_done:
+        return None
+
+    now = datetime.now(UTC).replace(tzinfo=None)
+    next_at = next_fire(event.recurrence, event.timestamp, max(fire_at, now))
+    if not advance(db.session, event_id, fire_at, next_at):
+        db.session.rollback()
+        logger.info("Event %s already fired for %s", event_id, fire_at)
+        return None
+
+    occurrence = create_occurrence(db.session, event, fire_at)
+    db.session.commit()
+
+    if current_app.config.get("MAIL_SCHEDULER") != "database":
+        # In database mode the poller claims the new event.
+        send_mail.queue(occurrence.id, queue=event_queue(occurrence))
+    if next_at is not None:
+        schedule_recurrence(event_id, next_at, event.priority)
+    return cast(int, occurrence.id)
+
+
+def resend_failed(event_id: int) -> int:
+    """
+    Queue the failed recipients of an event for another attempt.
+
+    Args:
+        event_id: Event ID whose failed recipients are resent
+
+    Returns:
+        Number of recipients queued again
+    """
+    recipients = failed_recipients(db.session, event_id)
+    if not recipients:
+        return 0
+
+    mark_recipients(db.session, event_id, recipients, Recipient.STATUS_QUEUED)
+    db.session.commit()
+    event = db.session.get(Event, event_id)
+    send_mail.queue(event_id, queue=event_queue(event))
+    return len(recipients)
+
+
+def add_event(data: Dict[str, Any], idempotency_key: Optional[str] = None) -> int:
     """
     Create an email event and store it to database.
 
     Args:
         data: Dictionary containing email data (subject, content, timestamp,
               recipients)
+        idempotency_key: Key of the request, unique among events; see
+            app.event.idempotency
 
     Returns:
-        Event ID
+        Event ID, that of the event created with the same key if there is
+        one
+
+    Raises:
+        KeyReused: If the key created an event from a different request
+    """
+    fields = event_fields(data)
+    event = Event(**fields)
+    fingerprint = None
+    if idempotency_key is not None:
+        fingerprint = request_fingerprint(data)
+        event.idempotency_key = idempotency_key
+        event.idempotency_hash = fingerprint
+
+    # The event, its recipients and its job are committed together, so a
+    # failed request leaves nothing for a retry with the same key to find.
+    db.session.add(event)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        existing = (
+            db.session.execute(
+                select(Event.id, Event.idempotency_hash).where(
+                    Event.idempotency_key == idempotency_key
+                )
+            ).first()
+            if idempotency_key is not None
+            else None
+        )
+        if existing is None:
+            raise
+        # A retry of a request that already created its event.
+        check_fingerprint(cast(str, idempotency_key), existing[1], fingerprint)
+        return cast(int, existing[0])
+
+    try:
+        add_recipients(
+            data["recipients"], event.id, recipient_timezones(data), commit=False
+        )
+        # Outside database mode record_job commits once the job is scheduled.
+        if fields.get("recurrence"):
+            schedule_recurrence(event.id, fields["next_fire_at"], fields["priority"])
+        else:
+            schedule_mail(event.id, fields["timestamp"], fields["priority"])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return cast(int, event.id)
+
+
+def event_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate email data and convert it to the fields of a new event.
+
+    Args:
+        data: Dictionary containing email data (subject, content, timestamp,
+              recipients)
+
+    Returns:
+        Keyword arguments for Event
+
+    Raises:
+        ValueError: If a required field is missing, or the recurrence,
+            priority or spread is invalid
     """
     email_subject = data.get("subject")
     email_content = data.get("content")
@@ -200,27 +1421,155 @@ def add_event(data: Dict[str, Any]) -> int:
         raise ValueError("Timestamp is required")
     if not recipients:
         raise ValueError("Recipients are required")
+    priority = data.get("priority") or "normal"
+    if priority not in PRIORITIES:
+        raise ValueError(f"Priority must be one of {', '.join(PRIORITIES)}")
 
     # Convert timestamp to UTC datetime, handling both string and datetime
     # inputs
     timestamp = dt_utc(timestamp_data)
 
-    event = Event(
-        email_subject=email_subject,
-        email_content=email_content,
-        timestamp=timestamp,
-        created_at=datetime.now(UTC),
-        is_done=False,
-        done_at=None,
-    )
+    fields = {
+        "email_subject": email_subject,
+        "email_content": email_content,
+        "timestamp": timestamp,
+        "created_at": datetime.now(UTC),
+        "is_done": False,
+        "done_at": None,
+        "priority": priority,
+    }
 
-    db.session.add(event)
-    db.session.commit()
+    recurrence = data.get("recurrence")
+    if recurrence:
+        # The timestamp is when the recurrence starts.
+        next_fire_at = first_fire(recurrence, timestamp)
+        if next_fire_at is None:
+            raise ValueError("Recurrence never fires")
+        fields.update(recurrence=recurrence, next_fire_at=next_fire_at)
+
+    if data.get("local_time"):
+        if recurrence:
+            raise ValueError("Recurring emails cannot be sent at local time")
+        # The wall-clock time is kept; any offset given with it is ignored.
+        if isinstance(timestamp_data, datetime):
+            local_time = timestamp_data.replace(tzinfo=None)
+        else:
+            local_time = dateutil.parser.parse(timestamp_data).replace(tzinfo=None)
+        timezones = recipient_timezones(data)
+        mail_addr = str(recipients).replace(" ", "").split(",")
+        fields["local_time"] = local_time
+        fields["timestamp"] = first_send_time(
+            [timezones.get(email) for email, _ in parse_recipients(mail_addr)],
+            local_time,
+            current_app.config.get("MAIL_DEFAULT_TIMEZONE") or DEFAULT_TIMEZONE,
+        )
 
-    list_recipients = add_recipients(recipients, event.id)
-    schedule_mail(event.id, list_recipients, timestamp)
+    # Only the database dispatcher paces events over their window.
+    paced = has_app_context() and current_app.config.get("MAIL_SCHEDULER") == "database"
+    spread = data.get("spread")
+    if spread is None and paced:
+        spread = current_app.config.get("MAIL_SPREAD_WINDOW")
+    if spread is not None and (
+        isinstance(spread, bool) or not isinstance(spread, int) or spread < 0
+    ):
+        raise ValueError("Spread must be a whole number of seconds")
+    if spread:
+        if not paced:
+            raise ValueError("Spread needs MAIL_SCHEDULER=database")
+        # Due at its timestamp, sent by the end of the window.
+        fields["send_by"] = fields["timestamp"] + timedelta(seconds=spread)
 
-    return cast(int, event.id)
+    return fields
+
+
+def recipient_timezones(data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Validate the time zones given for recipients.
+
+    Args:
+        data: Dictionary containing email data, with an optional
+              ``timezones`` mapping of email address to IANA time zone
+
+    Returns:
+        Time zone by email address
+
+    Raises:
+        ValueError: If the mapping is malformed or a time zone is unknown
+    """
+    timezones = data.get("timezones") or {}
+    if not isinstance(timezones, dict):
+        raise ValueError("Time zones must map email addresses to time zones")
+    return {
+        str(email).strip(): validate_timezone(str(zone))
+        for email, zone in timezones.items()
+    }
+
+
+def add_events(items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Create many email events in one transaction.
+
+    Valid items are inserted together: the events in one batched INSERT,
+    their recipients in one bulk INSERT, with a single commit. Their send
+    jobs are then scheduled through one Redis pipeline. Invalid items are
+    reported and skipped.
+
+    Args:
+        items: Email data dictionaries, as accepted by add_event
+
+    Returns:
+        One result per item, in order, with its ``index`` and either the
+        ``id`` of the new event or an ``error``
+    """
+    results: List[Dict[str, Any]] = []
+    accepted: List[Tuple[Dict[str, Any], Event, List[str], Dict[str, str]]] = []
+    for index, data in enumerate(items):
+        try:
+            if not isinstance(data, dict):
+                raise ValueError("Event must be a JSON object")
+            event = Event(**event_fields(data))
+            mail_addr = str(data["recipients"]).replace(" ", "").split(",")
+            timezones = recipient_timezones(data)
+        except Exception as e:
+            results.append({"index": index, "error": str(e)})
+            continue
+        results.append({"index": index})
+        accepted.append((results[-1], event, mail_addr, timezones))
+
+    if not accepted:
+        return results
+
+    if current_app.config.get("MAIL_SCHEDULER") != "database":
+        # Known before the commit, so the jobs are recorded with the events.
+        for _, event, _, _ in accepted:
+            event.job_id = uuid4().hex
+
+    try:
+        db.session.add_all([event for _, event, _, _ in accepted])
+        # The flush inserts the events in batches and returns their IDs.
+        db.session.flush()
+        db.session.execute(
+            insert(Recipient),
+            [
+                {
+                    "email": email,
+                    "name": name,
+                    "event_id": event.id,
+                    "timezone": timezones.get(email),
+                }
+                for _, event, mail_addr, timezones in accepted
+                for email, name in parse_recipients(mail_addr)
+            ],
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for result, event, _, _ in accepted:
+        result["id"] = event.id
+    schedule_events([event for _, event, _, _ in accepted])
+    return results
 
 
 def schedule_mail_event(data: Dict[str, Any]) -> int:
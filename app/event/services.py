@@ -9,6 +9,7 @@ from markupsafe import Markup
 
 from app.database import db
 from app.database.models import Event
+from app.event.jobs import dt_utc, remove_event, reschedule_event
 from app.services.base import BaseService
 from app.utils.security import safe_error_message
 
@@ -103,6 +104,11 @@ class EventService(BaseService[Event]):
             # Update event attributes
             event.email_subject = data.get("name", event.email_subject)
             event.email_content = data.get("notes", event.email_content)
+            if data.get("schedule_time"):
+                previous = event.timestamp
+                event.timestamp = dt_utc(data["schedule_time"])
+                if event.timestamp != previous:
+                    reschedule_event(event, previous)
 
             # Save changes
             db.session.commit()
@@ -127,9 +133,7 @@ class EventService(BaseService[Event]):
             if not event:
                 return Markup("<strong>Error!</strong> Event does not exist.")
 
-            # Delete the event
-            db.session.delete(event)
-            db.session.commit()
+            remove_event(event)
             return True
         except Exception as e:
             db.session.rollback()
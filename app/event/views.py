@@ -8,6 +8,7 @@ from markupsafe import Markup
 from app.database import db
 from app.event.forms import EditItemsForm, ItemsForm
 from app.event.jobs import add_event as schedule_mail_event
+from app.event.jobs import dt_utc, remove_event, reschedule_event
 from app.services.event_service import EventService
 from app.utils.security import safe_error_message
 
@@ -105,7 +106,11 @@ class EventEditView(MethodView):
                     # Update the event in the database
                     event.email_subject = form.name.data or ""
                     event.email_content = form.notes.data or ""
-                    event.timestamp = form.schedule_time.data
+                    previous = event.timestamp
+                    # Stored in UTC, like events added through the form.
+                    event.timestamp = dt_utc(form.schedule_time.data)
+                    if event.timestamp != previous:
+                        reschedule_event(event, previous)
 
                     # Update recipients (would require more logic to properly
                     # implement)
@@ -152,9 +157,7 @@ class EventDeleteView(MethodView):
             return redirect(url_for("items.all_events"))
 
         try:
-            # Delete the event from the database
-            db.session.delete(event)
-            db.session.commit()
+            remove_event(event)
 
             message = Markup("<strong>Done.</strong> Scheduled email has been deleted.")
             flash(message, "success")
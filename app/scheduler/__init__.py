@@ -0,0 +1 @@
+"""Dispatchers moving scheduled jobs to the queue when they are due."""
@@ -0,0 +1,299 @@
+"""Paced dispatch of the backlog left by an outage.
+
+When the dispatchers or workers were down, every event that came due in
+the meantime is due at once when they return. Sending them all in the
+first poll would flood the relays and the database, so the database
+dispatcher switches to catch-up mode as soon as its oldest due event is
+more than ``MAIL_CATCHUP_THRESHOLD`` seconds overdue.
+
+In catch-up mode due events are still claimed oldest first, but at a rate
+that starts at ``MAIL_CATCHUP_START_RATE`` events per second and grows
+linearly to ``MAIL_CATCHUP_MAX_RATE`` over ``MAIL_CATCHUP_RAMP`` seconds.
+Events overdue by more than ``MAIL_CATCHUP_STALE_AFTER`` seconds are no
+longer worth sending: they are marked done and their recipients
+``skipped`` instead. The mode ends once the oldest due event is no more
+than ``MAIL_CATCHUP_THRESHOLD`` seconds overdue again.
+
+The rates are for all replicas together, so adding replicas does not
+multiply the load on the relays. A replica polling some of the partitions
+gets their share of the rate; replicas that all poll every event split it
+evenly between the live ones.
+
+Every replica publishes its progress, the backlog, the current rate, the
+estimated time to clear it and the skipped events, to Redis under its own
+key; :func:`catchup_stats` adds them up.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Mapping, Optional
+
+from app.scheduler.coordination import default_owner
+
+logger = logging.getLogger(__name__)
+
+CATCHUP_KEY = "mail-scheduler:catchup:replica:{owner}"
+SKIPPED_KEY = "mail-scheduler:catchup:skipped"
+
+# Seconds a replica's report is kept after its last poll.
+REPORT_TTL = 600
+
+# Skipped event IDs kept for catchup_stats, most recent first.
+SKIPPED_SAMPLES = 1000
+
+
+class CatchUp(object):
+    """Decides how many overdue events a dispatcher may claim per poll."""
+
+    def __init__(
+        self,
+        connection: Any,
+        threshold: float = 300,
+        start_rate: float = 10,
+        max_rate: float = 200,
+        ramp: float = 300,
+        stale_after: Optional[float] = None,
+        owner: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize a CatchUp instance.
+
+        Args:
+            connection: Redis connection the progress is published to
+            threshold: Seconds the oldest due event must be overdue to
+                start catching up
+            start_rate: Events per second dispatched when catching up starts
+            max_rate: Events per second dispatched once the ramp is over
+            ramp: Seconds to go from the start rate to the maximum rate
+            stale_after: Seconds overdue after which an event is skipped,
+                never if None
+            owner: Name of this replica, unique by default
+        """
+        self.connection = connection
+        self.threshold = threshold
+        self.start_rate = start_rate
+        self.max_rate = max(max_rate, start_rate)
+        self.ramp = ramp
+        self.stale_after = stale_after
+        self.owner = owner or default_owner()
+        # Parts of the rate this replica may use and of the due events it
+        # sees, set by the poller.
+        self.share = 1.0
+        self.scope = 1.0
+        # When catching up started, None outside catch-up mode.
+        self.started: Optional[datetime] = None
+        self.skipped = 0
+        self._tokens = 0.0
+        self._last: Optional[datetime] = None
+
+    @classmethod
+    def from_config(cls, connection: Any, config: Mapping[str, Any]) -> "CatchUp":
+        """
+        Build the pacing from the ``MAIL_CATCHUP_*`` settings.
+
+        Args:
+            connection: Redis connection
+            config: The Flask application config
+
+        Returns:
+            The catch-up pacing
+        """
+        return cls(
+            connection,
+            threshold=config.get("MAIL_CATCHUP_THRESHOLD", 300),
+            start_rate=config.get("MAIL_CATCHUP_START_RATE", 10),
+            max_rate=config.get("MAIL_CATCHUP_MAX_RATE", 200),
+            ramp=config.get("MAIL_CATCHUP_RAMP", 300),
+            stale_after=config.get("MAIL_CATCHUP_STALE_AFTER"),
+        )
+
+    @property
+    def active(self) -> bool:
+        """Check if the dispatcher is catching up."""
+        return self.started is not None
+
+    def stale_before(self, now: datetime) -> Optional[datetime]:
+        """Get the time before which due events are skipped, if any."""
+        if self.stale_after is None:
+            return None
+        return now - timedelta(seconds=self.stale_after)
+
+    def rate(self, now: datetime) -> float:
+        """
+        Get the dispatch rate of all replicas reached at ``now``.
+
+        Args:
+            now: The current time
+
+        Returns:
+            Events per second
+        """
+        if self.started is None or self.ramp <= 0:
+            return float(self.max_rate)
+        elapsed = (now - self.started).total_seconds()
+        progress = min(1.0, max(0.0, elapsed / self.ramp))
+        return self.start_rate + (self.max_rate - self.start_rate) * progress
+
+    def eta(self, remaining: int, now: datetime) -> float:
+        """
+        Estimate the seconds the replicas need to dispatch the backlog.
+
+        Args:
+            remaining: Number of due events left that this replica sees
+            now: The current time
+
+        Returns:
+            Seconds, following the ramp from the current rate on
+        """
+        rate = self.rate(now)
+        if remaining <= 0 or self.scope <= 0:
+            return 0.0
+        # All replicas together work through every partition.
+        remaining = remaining / self.scope
+        if rate >= self.max_rate:
+            return remaining / rate
+        # The rate grows by ``slope`` per second until the ramp ends.
+        slope = (self.max_rate - self.start_rate) / self.ramp
+        ramp_left = (self.max_rate - rate) / slope
+        during_ramp = (rate + self.max_rate) / 2 * ramp_left
+        if remaining > during_ramp:
+            return ramp_left + (remaining - during_ramp) / self.max_rate
+        return (math.sqrt(rate * rate + 2 * slope * remaining) - rate) / slope
+
+    def allowance(
+        self, backlog: int, oldest: Optional[datetime], now: datetime
+    ) -> Optional[int]:
+        """
+        Enter or leave catch-up mode, and get how many events to claim.
+
+        Args:
+            backlog: Number of due events not claimed yet
+            oldest: Due time of the oldest of them
+            now: The current time, naive UTC like ``oldest``
+
+        Returns:
+            Largest number of events to claim now, None for no limit
+        """
+        if self.started is None:
+            if oldest is None or (now - oldest).total_seconds() <= self.threshold:
+                return None
+            logger.warning(
+                "Catching up on %d overdue events, the oldest due at %s",
+                backlog,
+                oldest,
+            )
+            self.started, self._last = now, now
+            # One second's worth, so the first poll already sends.
+            self._tokens = self.start_rate * self.share
+        elif oldest is None or (now - oldest).total_seconds() <= self.threshold:
+            logger.info(
+                "Caught up after %.0fs, %d stale events skipped",
+                (now - self.started).total_seconds(),
+                self.skipped,
+            )
+            self.started = None
+            self.publish(0, None, now)
+            self.skipped = 0
+            return None
+
+        last = self._last or now
+        elapsed = max(0.0, (now - last).total_seconds())
+        # This replica's share of the events the ramp allows since the last poll.
+        self._tokens += (self.rate(last) + self.rate(now)) / 2 * elapsed * self.share
+        self._last = now
+        allowed = int(self._tokens)
+        # Unused allowance is not saved up: a slow poll never causes a burst.
+        self._tokens -= allowed
+        self.publish(backlog, oldest, now)
+        return allowed
+
+    def record_skipped(self, event_ids: List[int]) -> None:
+        """
+        Count and keep the IDs of events skipped as stale.
+
+        Args:
+            event_ids: IDs of the skipped events
+        """
+        if not event_ids:
+            return
+        logger.warning("Skipped %d stale events", len(event_ids))
+        self.skipped += len(event_ids)
+        pipe = self.connection.pipeline()
+        pipe.lpush(SKIPPED_KEY, *event_ids)
+        pipe.ltrim(SKIPPED_KEY, 0, SKIPPED_SAMPLES - 1)
+        pipe.execute()
+
+    def publish(self, backlog: int, oldest: Optional[datetime], now: datetime) -> None:
+        """
+        Publish the catch-up progress of this replica for :func:`catchup_stats`.
+
+        Args:
+            backlog: Number of due events not claimed yet
+            oldest: Due time of the oldest of them
+            now: The current time
+        """
+        report = {
+            "active": self.active,
+            "started": self.started.isoformat() if self.started else None,
+            "backlog": backlog,
+            "oldest": oldest.isoformat() if oldest else None,
+            "rate": round(self.rate(now) * self.share, 2) if self.active else None,
+            "eta": round(self.eta(backlog, now), 1) if self.active else 0.0,
+            "skipped": self.skipped,
+            "scope": self.scope,
+            "updated": now.isoformat(),
+        }
+        self.connection.set(
+            CATCHUP_KEY.format(owner=self.owner), json.dumps(report), ex=REPORT_TTL
+        )
+
+
+def catchup_stats(connection: Any) -> Dict[str, Any]:
+    """
+    Read and add up the catch-up progress published by the replicas.
+
+    Args:
+        connection: Redis connection
+
+    Returns:
+        Whether any replica is catching up, the backlog, its oldest due
+        time, the total rate, the estimated seconds to clear the backlog,
+        the number of events skipped, the IDs of recently skipped events
+        and the report of every replica
+    """
+    keys = sorted(connection.scan_iter(match=CATCHUP_KEY.format(owner="*")))
+    pipe = connection.pipeline()
+    for key in keys:
+        pipe.get(key)
+    pipe.lrange(SKIPPED_KEY, 0, -1)
+    *values, skipped = pipe.execute()
+    prefix = CATCHUP_KEY.format(owner="")
+    replicas: Dict[str, Any] = {}
+    for key, value in zip(keys, values):
+        if value:
+            name = key.decode() if isinstance(key, bytes) else key
+            replicas[name[len(prefix) :]] = json.loads(value)
+    reports = list(replicas.values())
+    busy = [report for report in reports if report["active"]]
+    oldest = [report["oldest"] for report in busy if report["oldest"]]
+    started = [report["started"] for report in busy if report["started"]]
+    # Replicas seeing every event each count the whole backlog, and those
+    # seeing some of the partitions count their part.
+    scope = sum(report.get("scope", 1.0) for report in reports)
+    backlog = sum(report["backlog"] for report in reports)
+    return {
+        "active": bool(busy),
+        "started": min(started, default=None),
+        "backlog": round(backlog / scope) if scope else backlog,
+        "oldest": min(oldest, default=None),
+        "rate": round(sum(report["rate"] for report in busy), 2) if busy else None,
+        "eta": max((report["eta"] for report in busy), default=0.0),
+        "skipped": sum(report["skipped"] for report in reports),
+        "skipped_events": [int(event_id) for event_id in skipped],
+        "replicas": replicas,
+    }
+
@@ -0,0 +1,144 @@
+"""Flask CLI commands running the dispatchers."""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from app.database import db
+from app.database.models import Event
+from app.delivery.queues import priority_queue
+from app.extensions import rq
+from app.scheduler.catchup import CatchUp
+from app.scheduler.coordination import Coordinator, Membership
+from app.scheduler.poller import DuePoller
+from app.scheduler.spreading import Spreader
+from app.scheduler.wheel import TimingWheel
+
+
+def dispatch_event(event_id: int) -> None:
+    """
+    Enqueue the send job of a due event, in the queue of its priority.
+
+    Args:
+        event_id: ID of the event
+    """
+    from app.event.jobs import send_mail
+
+    priority = db.session.scalar(select(Event.priority).where(Event.id == event_id))
+    send_mail.queue(event_id, queue=priority_queue(priority, current_app.config))
+
+
+def fire_event(event_id: int, fire_at: datetime) -> None:
+    """
+    Create the run of a due recurring event, in this process.
+
+    Args:
+        event_id: ID of the recurring event
+        fire_at: Its fire time
+    """
+    from app.event.jobs import fire_recurrence
+
+    fire_recurrence(event_id, fire_at)
+
+
+def dispatch_call(
+    job_id: str, func: str, args: Tuple[Any, ...], queue: Optional[str]
+) -> None:
+    """
+    Enqueue a due scheduled call.
+
+    Args:
+        job_id: ID of the job
+        func: Dotted path of the job function
+        args: Arguments of the job
+        queue: Name of the queue, the default queue if None
+    """
+    rq.get_queue(queue).enqueue_call(func, args=args, job_id=job_id)
+
+
+def poller_membership(config: Any) -> Optional[Membership]:
+    """
+    Build the membership the database pollers split their rates by.
+
+    Args:
+        config: The Flask application config
+
+    Returns:
+        The membership, None when the pollers split the partitions
+    """
+    if config.get("MAIL_DISPATCHER_SHARDED"):
+        return None
+    # A poller heartbeats once per poll, so it stays live between two.
+    ttl = max(
+        config.get("MAIL_DISPATCHER_LEASE_TTL", 10),
+        3 * config.get("MAIL_POLLER_INTERVAL", 5),
+    )
+    return Membership(rq.connection, "poller", ttl)
+
+
+def build_dispatcher(config: Any) -> Any:
+    """
+    Build the dispatcher of ``MAIL_SCHEDULER``, wheel unless database.
+
+    Args:
+        config: The Flask application config
+
+    Returns:
+        A DuePoller or a TimingWheel
+    """
+    if config.get("MAIL_SCHEDULER") == "database":
+        return DuePoller(
+            db.session,
+            dispatch_event,
+            batch_size=config.get("MAIL_POLLER_BATCH_SIZE", 100),
+            claim_timeout=config.get("MAIL_POLLER_CLAIM_TIMEOUT", 3600),
+            fire=fire_event,
+            call=dispatch_call,
+            partitions=config.get("MAIL_DISPATCHER_PARTITIONS", 1),
+            catchup=CatchUp.from_config(rq.connection, config),
+            spreader=Spreader.from_config(rq.connection, config),
+            membership=poller_membership(config),
+        )
+    return TimingWheel.from_config(rq.connection, rq.get_queue(), config)
+
+
+@click.command("dispatcher")
+@click.option("--interval", type=float, help="Longest wait between ticks.")
+@click.option("--burst", is_flag=True, help="Dispatch what is due, then exit.")
+@with_appcontext
+def dispatcher_command(interval: Optional[float], burst: bool) -> None:
+    """Move due jobs to the queue, as chosen by MAIL_SCHEDULER."""
+    config = current_app.config
+    coordinator: Optional[Coordinator] = Coordinator.from_config(
+        rq.connection, config
+    )
+    dispatcher = build_dispatcher(config)
+    if config.get("MAIL_SCHEDULER") == "database":
+        if interval is None:
+            interval = config.get("MAIL_POLLER_INTERVAL", 5)
+        if not config.get("MAIL_DISPATCHER_SHARDED"):
+            # Row claims already keep replicas apart, no leader is needed.
+            coordinator = None
+    elif interval is None:
+        interval = config.get("MAIL_WHEEL_INTERVAL", 30)
+
+    try:
+        dispatcher.run(interval, burst=burst, coordinator=coordinator)
+    except KeyboardInterrupt:
+        pass
+
+
+def register_commands(app: Any) -> None:
+    """
+    Register dispatcher commands with the Flask application.
+
+    Args:
+        app: The Flask application
+    """
+    app.cli.add_command(dispatcher_command)
@@ -0,0 +1,292 @@
+"""Coordination of several dispatcher replicas through Redis.
+
+By default the replicas of ``flask dispatcher`` elect a leader: each one
+tries to take a lease, a Redis key set with a time to live, and only its
+holder dispatches. The holder renews the lease while it runs. When it
+dies, the key expires and another replica takes over. Every new holder
+gets a fencing token from an ever increasing counter. The timing wheel
+moves a bucket only while the counter still holds its token, so a paused
+former leader that wakes up cannot move jobs after a new leader took
+over.
+
+With ``MAIL_DISPATCHER_SHARDED`` every replica dispatches instead. Due
+work is split into ``MAIL_DISPATCHER_PARTITIONS`` partitions by hash, and
+the replicas that sent a heartbeat within the lease time share them. A
+replica that disappears stops sending heartbeats, and its partitions move
+to the others once its entry expires. While ownership changes two replicas
+may briefly dispatch the same partition; wheel buckets are taken under
+``WATCH`` and database claims are row locks, so no job is sent twice.
+
+Times are read from the Redis clock, so host clock skew does not matter.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import zlib
+from typing import Any, List, Mapping, Optional, Tuple, Union
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+LEASE_KEY = "mail-scheduler:lease:{name}"
+FENCE_KEY = "mail-scheduler:lease:{name}:fence"
+MEMBERS_KEY = "mail-scheduler:members:{name}"
+
+# KEYS: lease, fence counter. ARGV: owner, TTL in ms. Returns the owner's
+# fencing token, a new one if the lease was free, or nil if it is held.
+ACQUIRE_LUA = """
+local holder = redis.call('GET', KEYS[1])
+if holder == ARGV[1] then
+  redis.call('PEXPIRE', KEYS[1], ARGV[2])
+  return tonumber(redis.call('GET', KEYS[2]))
+end
+if holder then
+  return nil
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return redis.call('INCR', KEYS[2])
+"""
+
+# KEYS: lease. ARGV: owner. Deletes the lease only if the owner holds it.
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS: members. ARGV: owner, TTL in seconds. Returns the live members.
+HEARTBEAT_LUA = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+return redis.call('ZRANGE', KEYS[1], 0, -1)
+"""
+
+
+class LeaseLost(Exception):
+    """Raised when a newer lease holder fenced this dispatcher off."""
+
+
+def default_owner() -> str:
+    """Get a name for this process that is unique across hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+def partition_for(key: Union[str, bytes, int], partitions: int) -> int:
+    """
+    Get the partition of a job or event.
+
+    Args:
+        key: Job ID or event ID
+        partitions: Number of partitions
+
+    Returns:
+        Partition number, stable across processes
+    """
+    if partitions <= 1:
+        return 0
+    if not isinstance(key, bytes):
+        key = str(key).encode()
+    return zlib.crc32(key) % partitions
+
+
+class Lease(object):
+    """A lease in Redis, held by one owner at a time, with fencing tokens."""
+
+    def __init__(
+        self,
+        connection: Any,
+        name: str = "dispatcher",
+        ttl: float = 10.0,
+        owner: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize a Lease instance.
+
+        Args:
+            connection: Redis connection shared by the replicas
+            name: Name of the lease
+            ttl: Seconds the lease lasts without being renewed
+            owner: Name of this replica, unique by default
+        """
+        self.connection = connection
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner or default_owner()
+        self.token: Optional[int] = None
+        self.key = LEASE_KEY.format(name=name)
+        self.fence_key = FENCE_KEY.format(name=name)
+        self._acquire = connection.register_script(ACQUIRE_LUA)
+        self._release = connection.register_script(RELEASE_LUA)
+
+    def acquire(self) -> Optional[int]:
+        """
+        Take the lease if it is free, or renew it if this owner holds it.
+
+        Returns:
+            The fencing token of this owner, or None if another holds it
+        """
+        token = self._acquire(
+            keys=[self.key, self.fence_key],
+            args=[self.owner, int(self.ttl * 1000)],
+        )
+        token = None if token is None else int(token)
+        if token != self.token:
+            if token is None:
+                logger.info("Lease %s lost by %s", self.name, self.owner)
+            else:
+                logger.info(
+                    "Lease %s taken by %s with token %d", self.name, self.owner, token
+                )
+        self.token = token
+        return token
+
+    def release(self) -> None:
+        """Give the lease up, if this owner holds it."""
+        self._release(keys=[self.key], args=[self.owner])
+        self.token = None
+
+
+class Membership(object):
+    """Live replicas, known from their heartbeats in a sorted set."""
+
+    def __init__(
+        self,
+        connection: Any,
+        name: str = "dispatcher",
+        ttl: float = 10.0,
+        owner: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize a Membership instance.
+
+        Args:
+            connection: Redis connection shared by the replicas
+            name: Name of the group
+            ttl: Seconds a replica counts as live after a heartbeat
+            owner: Name of this replica, unique by default
+        """
+        self.connection = connection
+        self.ttl = ttl
+        self.owner = owner or default_owner()
+        self.key = MEMBERS_KEY.format(name=name)
+        self._heartbeat = connection.register_script(HEARTBEAT_LUA)
+
+    def heartbeat(self) -> List[str]:
+        """
+        Mark this replica live and drop the expired ones.
+
+        Returns:
+            Names of the live replicas, sorted
+        """
+        members = self._heartbeat(keys=[self.key], args=[self.owner, self.ttl])
+        return sorted(m.decode() if isinstance(m, bytes) else m for m in members)
+
+    def owned(self, partitions: int) -> List[int]:
+        """
+        Send a heartbeat and get the partitions this replica owns.
+
+        Partitions are dealt round-robin over the sorted live replicas, so
+        every replica computes the same assignment.
+
+        Args:
+            partitions: Number of partitions
+
+        Returns:
+            The partitions of this replica
+        """
+        members = self.heartbeat()
+        index = members.index(self.owner)
+        return [p for p in range(partitions) if p % len(members) == index]
+
+    def leave(self) -> None:
+        """Hand this replica's partitions over at once."""
+        self.connection.zrem(self.key, self.owner)
+
+
+class Coordinator(object):
+    """Decide which partitions this dispatcher replica works on."""
+
+    def __init__(
+        self,
+        connection: Any,
+        partitions: int = 1,
+        sharded: bool = False,
+        ttl: float = 10.0,
+        name: str = "dispatcher",
+    ) -> None:
+        """
+        Initialize a Coordinator instance.
+
+        Args:
+            connection: Redis connection shared by the replicas
+            partitions: Number of partitions of the due work
+            sharded: Share the partitions instead of electing a leader
+            ttl: Seconds before a silent replica loses its lease or share
+            name: Name of the lease and membership keys
+        """
+        self.partitions = partitions
+        self.sharded = sharded
+        self.ttl = ttl
+        owner = default_owner()
+        self.lease = Lease(connection, name, ttl, owner)
+        self.membership = Membership(connection, name, ttl, owner)
+
+    @classmethod
+    def from_config(
+        cls, connection: Any, config: Mapping[str, Any]
+    ) -> "Coordinator":
+        """
+        Build a coordinator from the ``MAIL_DISPATCHER_*`` settings.
+
+        Args:
+            connection: Redis connection
+            config: The Flask application config
+
+        Returns:
+            The coordinator
+        """
+        return cls(
+            connection,
+            partitions=config.get("MAIL_DISPATCHER_PARTITIONS", 1),
+            sharded=config.get("MAIL_DISPATCHER_SHARDED", False),
+            ttl=config.get("MAIL_DISPATCHER_LEASE_TTL", 10),
+        )
+
+    @property
+    def renew_interval(self) -> float:
+        """Longest time between two assignments, well within the TTL."""
+        return self.ttl / 3
+
+    @property
+    def fence(self) -> Optional[Tuple[str, int]]:
+        """The fence key and token to check writes against, if leader."""
+        if self.sharded or self.lease.token is None:
+            return None
+        return self.lease.fence_key, self.lease.token
+
+    def assignment(self) -> List[int]:
+        """
+        Renew this replica's lease or heartbeat.
+
+        Returns:
+            The partitions to dispatch until the next call, empty while
+            another replica leads
+        """
+        if self.sharded:
+            return self.membership.owned(self.partitions)
+        if self.lease.acquire() is None:
+            return []
+        return list(range(self.partitions))
+
+    def leave(self) -> None:
+        """Let the other replicas take over at once."""
+        if self.sharded:
+            self.membership.leave()
+        else:
+            self.lease.release()
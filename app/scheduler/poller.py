@@ -0,0 +1,491 @@
+"""Dispatching of due events straight from the database.
+
+In this mode the ``events`` table is the schedule: nothing is written to
+Redis until an event is due, so losing Redis loses no scheduled email.
+Pollers scan the ``(is_done, timestamp)`` index for due events, claim them
+by setting ``dispatched_at`` and enqueue one send job per claimed event.
+
+On PostgreSQL the due rows are selected ``FOR UPDATE SKIP LOCKED``, so
+replicas polling at the same time each lock a different set of rows. Other
+databases claim row by row with a conditional ``UPDATE`` that only one
+poller can win. An event claimed longer ago than the claim timeout and
+still not done is claimed again, in case its job never reached a worker.
+
+Recurring events are never claimed themselves. Each poll first fires the
+ones whose ``next_fire_at`` has passed, which creates their due runs.
+
+Delayed jobs that are not events, retries and the jobs of time zone
+groups, wait in the ``scheduled_calls`` table. Each poll enqueues the due
+ones and deletes them in the same transaction.
+
+Replicas may also split the events by ID modulo a number of partitions,
+each polling only its own; see app.scheduler.coordination.
+
+After an outage the overdue backlog is claimed at a ramping rate instead
+of all at once, and events too old to be worth sending are skipped; see
+app.scheduler.catchup. Events allowed to spread over a window are
+claimed by their ``send_by`` deadline, at a rate that flattens the peaks
+of round times; see app.scheduler.spreading.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from datetime import UTC, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, or_, select, true, update
+
+from app.database.models import Event, Recipient, ScheduledCall
+from app.scheduler.catchup import CatchUp
+from app.scheduler.coordination import Coordinator, Membership
+from app.scheduler.spreading import Spreader
+
+logger = logging.getLogger(__name__)
+
+# Enqueues a scheduled call from its job ID, function path, arguments and
+# queue name.
+CallFunction = Callable[[str, str, Tuple[Any, ...], Optional[str]], Any]
+
+
+class DuePoller(object):
+    """Claims due events and hands them to a dispatch function."""
+
+    def __init__(
+        self,
+        session: Any,
+        dispatch: Callable[[int], Any],
+        batch_size: int = 100,
+        claim_timeout: float = 3600,
+        fire: Optional[Callable[[int, datetime], Any]] = None,
+        partitions: int = 1,
+        catchup: Optional[CatchUp] = None,
+        spreader: Optional[Spreader] = None,
+        call: Optional[CallFunction] = None,
+        membership: Optional[Membership] = None,
+    ) -> None:
+        """
+        Initialize a DuePoller instance.
+
+        Args:
+            session: SQLAlchemy session to claim with
+            dispatch: Called with the ID of every claimed event
+            batch_size: Largest number of events claimed per transaction
+            claim_timeout: Seconds after which an unfinished claim expires
+            fire: Called with the ID and fire time of every due recurring
+                event, see app.scheduler.recurrence
+            partitions: Number of partitions the event IDs are split into
+            catchup: Paces the dispatch of an overdue backlog, which is
+                claimed as fast as possible without it
+            spreader: Spreads events over their window, which are claimed
+                as soon as due without it
+            call: Called with the job ID, function path, arguments and queue
+                of every due scheduled call
+            membership: Live pollers splitting the catch-up and spreading
+                rates when they do not split the partitions
+        """
+        self.session = session
+        self.dispatch = dispatch
+        self.batch_size = batch_size
+        self.claim_timeout = claim_timeout
+        self.fire = fire
+        self.partitions = partitions
+        self.catchup = catchup
+        self.spreader = spreader
+        self.call = call
+        self.membership = membership
+        # Partitions this poller claims from, all while None.
+        self.owned: Optional[List[int]] = None
+
+    @property
+    def skip_locked(self) -> bool:
+        """Check if the database supports ``FOR UPDATE SKIP LOCKED``."""
+        return bool(self.session.get_bind().dialect.name == "postgresql")
+
+    def owned_events(self) -> Any:
+        """
+        Build the condition of an event in a partition of this poller.
+
+        Returns:
+            A SQLAlchemy filter clause
+        """
+        if self.owned is None or (self.partitions <= 1 and self.owned):
+            return true()
+        return (Event.id % self.partitions).in_(self.owned)
+
+    def shares(self) -> Tuple[float, float]:
+        """
+        Get the part of the fleet's rates this poller may use, and the part
+        of the due events it claims from.
+
+        Returns:
+            The share of the rates and the share of the events
+        """
+        if self.owned is not None and self.partitions > 1:
+            share = len(set(self.owned)) / self.partitions
+            return share, share
+        if self.membership is not None:
+            # Every poller claims from every event, and takes its turn.
+            return 1.0 / len(self.membership.heartbeat()), 1.0
+        return 1.0, 1.0
+
+    def claimable(self, now: datetime) -> Any:
+        """
+        Build the condition of an event a poller may claim.
+
+        Args:
+            now: The current time, naive UTC like ``Event.timestamp``
+
+        Returns:
+            A SQLAlchemy filter clause
+        """
+        expired = now - timedelta(seconds=self.claim_timeout)
+        return (
+            Event._is_done.is_(False)
+            & Event.recurrence.is_(None)
+            & (Event.timestamp <= now)
+            & or_(Event.dispatched_at.is_(None), Event.dispatched_at < expired)
+            & self.owned_events()
+        )
+
+    @property
+    def deadline(self) -> Any:
+        """Get the column events are claimed in the order of."""
+        if self.spreader is None:
+            return Event.timestamp
+        return func.coalesce(Event.send_by, Event.timestamp)
+
+    def claim(
+        self, now: Optional[datetime] = None, limit: Optional[int] = None
+    ) -> List[int]:
+        """
+        Claim the oldest due events, in one transaction.
+
+        Args:
+            now: The current time, for tests
+            limit: Largest number of events to claim, the batch size by
+                default
+
+        Returns:
+            IDs of the events this poller claimed
+        """
+        now = now or datetime.now(UTC).replace(tzinfo=None)
+        try:
+            ids = self._update_oldest(
+                self.claimable(now), {Event.dispatched_at: now}, limit, self.deadline
+            )
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        if self.spreader is not None and ids:
+            self.spreader.record(
+                self.session.scalars(
+                    select(Event.timestamp).where(Event.id.in_(ids))
+                ).all(),
+                now,
+            )
+        return ids
+
+    def backlog(self, now: datetime) -> Tuple[int, Optional[datetime]]:
+        """
+        Count the claimable events of this poller.
+
+        Args:
+            now: The current time, naive UTC
+
+        Returns:
+            Number of claimable events, and the due time of the oldest
+        """
+        count, oldest = self.session.execute(
+            select(func.count(Event.id), func.min(Event.timestamp)).where(
+                self.claimable(now)
+            )
+        ).one()
+        return int(count), oldest
+
+    def deadlines(self, now: datetime) -> List[Tuple[datetime, int]]:
+        """
+        Count the claimable events of this poller by deadline.
+
+        Args:
+            now: The current time, naive UTC
+
+        Returns:
+            (send_by, number of events) pairs, earliest first
+        """
+        deadline = self.deadline
+        rows = self.session.execute(
+            select(deadline, func.count(Event.id))
+            .where(self.claimable(now))
+            .group_by(deadline)
+            .order_by(deadline)
+        )
+        return [(when, int(count)) for when, count in rows]
+
+    def skip_stale(self, now: datetime, stale_before: datetime) -> List[int]:
+        """
+        Mark events never dispatched and due before ``stale_before`` done,
+        and their queued recipients skipped, in one transaction.
+
+        Args:
+            now: The current time, naive UTC
+            stale_before: Due time before which an event is not sent
+
+        Returns:
+            IDs of the events this poller skipped
+        """
+        stale = (
+            self.claimable(now)
+            & Event.dispatched_at.is_(None)
+            & (Event.timestamp < stale_before)
+        )
+        try:
+            ids = self._update_oldest(
+                stale, {Event._is_done: True, Event.done_at: now}
+            )
+            if ids:
+                self.session.execute(
+                    update(Recipient)
+                    .where(
+                        Recipient.event_id.in_(ids),
+                        Recipient.status == Recipient.STATUS_QUEUED,
+                    )
+                    .values(status=Recipient.STATUS_SKIPPED)
+                    .execution_options(synchronize_session=False)
+                )
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return ids
+
+    def due_recurrences(self, now: datetime) -> List[Tuple[int, datetime]]:
+        """
+        Read the recurring events due to fire, from the next fire index.
+
+        Args:
+            now: The current time, naive UTC
+
+        Returns:
+            (event ID, fire time) pairs, earliest first
+        """
+        rows = self.session.execute(
+            select(Event.id, Event.next_fire_at)
+            .where(Event.next_fire_at <= now, self.owned_events())
+            .order_by(Event.next_fire_at)
+            .limit(self.batch_size)
+        )
+        return [(event_id, fire_at) for event_id, fire_at in rows]
+
+    def take_calls(self, now: datetime) -> List[ScheduledCall]:
+        """
+        Delete the oldest due scheduled calls, without committing.
+
+        Args:
+            now: The current time, naive UTC
+
+        Returns:
+            The calls this poller took
+        """
+        query = (
+            select(ScheduledCall)
+            .where(ScheduledCall.due_at <= now)
+            .order_by(ScheduledCall.due_at)
+            .limit(self.batch_size)
+        )
+        if self.skip_locked:
+            calls = list(self.session.scalars(query.with_for_update(skip_locked=True)))
+            if calls:
+                self.session.execute(
+                    delete(ScheduledCall).where(
+                        ScheduledCall.id.in_([row.id for row in calls])
+                    )
+                )
+            return calls
+        # Of two pollers racing for a row, one deletes nothing.
+        return [
+            row
+            for row in self.session.scalars(query).all()
+            if self.session.execute(
+                delete(ScheduledCall).where(ScheduledCall.id == row.id)
+            ).rowcount
+            == 1
+        ]
+
+    def dispatch_calls(self, now: Optional[datetime] = None) -> int:
+        """
+        Enqueue the due scheduled calls.
+
+        A call is deleted in the transaction that enqueues it, so it stays
+        scheduled if enqueuing fails.
+
+        Args:
+            now: The current time, for tests
+
+        Returns:
+            Number of calls enqueued
+        """
+        if self.call is None:
+            return 0
+        now = now or datetime.now(UTC).replace(tzinfo=None)
+        dispatched = 0
+        while True:
+            try:
+                calls = self.take_calls(now)
+                for row in calls:
+                    self.call(row.job_id, row.func, tuple(row.args), row.queue)
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+            dispatched += len(calls)
+            if len(calls) < self.batch_size:
+                return dispatched
+
+    def tick(self, now: Optional[datetime] = None) -> int:
+        """
+        Fire due recurring events and enqueue due scheduled calls, then
+        claim and dispatch due events until none are left, or as many as
+        catching up and spreading allow.
+
+        Args:
+            now: The current time, for tests
+
+        Returns:
+            Number of events dispatched
+        """
+        if self.fire is not None:
+            # Firing creates the due events claimed below.
+            due = self.due_recurrences(now or datetime.now(UTC).replace(tzinfo=None))
+            for event_id, fire_at in due:
+                self.fire(event_id, fire_at)
+        self.dispatch_calls(now)
+
+        if self.catchup is not None or self.spreader is not None:
+            share, scope = self.shares()
+            for pacing in (self.catchup, self.spreader):
+                if pacing is not None:
+                    pacing.share, pacing.scope = share, scope
+        limits = [self.paced_limit(now), self.spread_limit(now)]
+        limit = min((n for n in limits if n is not None), default=None)
+        dispatched = 0
+        while limit is None or dispatched < limit:
+            batch = self.batch_size
+            if limit is not None:
+                batch = min(batch, limit - dispatched)
+            ids = self.claim(now, batch)
+            for event_id in ids:
+                self.dispatch(event_id)
+            dispatched += len(ids)
+            if len(ids) < batch:
+                break
+        return dispatched
+
+    def paced_limit(self, now: Optional[datetime] = None) -> Optional[int]:
+        """
+        Skip stale events and get how many due events to claim this poll.
+
+        Args:
+            now: The current time, for tests
+
+        Returns:
+            Largest number of events to claim, None for no limit
+        """
+        if self.catchup is None:
+            return None
+        now = now or datetime.now(UTC).replace(tzinfo=None)
+        count, oldest = self.backlog(now)
+        stale_before = self.catchup.stale_before(now)
+        if oldest is not None and stale_before is not None and oldest < stale_before:
+            while True:
+                skipped = self.skip_stale(now, stale_before)
+                self.catchup.record_skipped(skipped)
+                if len(skipped) < self.batch_size:
+                    break
+            count, oldest = self.backlog(now)
+        return self.catchup.allowance(count, oldest, now)
+
+    def spread_limit(self, now: Optional[datetime] = None) -> Optional[int]:
+        """
+        Get how many due events spreading lets this poll claim.
+
+        Args:
+            now: The current time, for tests
+
+        Returns:
+            Largest number of events to claim, None for no limit
+        """
+        if self.spreader is None:
+            return None
+        now = now or datetime.now(UTC).replace(tzinfo=None)
+        return self.spreader.allowance(self.deadlines(now), now)
+
+    def run(
+        self,
+        interval: float = 5.0,
+        burst: bool = False,
+        coordinator: Optional[Coordinator] = None,
+    ) -> None:
+        """
+        Poll every ``interval`` seconds.
+
+        Args:
+            interval: Seconds between polls
+            burst: Poll once and return
+            coordinator: Decides the partitions of this replica, which
+                polls every partition without one
+        """
+        if coordinator is not None:
+            interval = min(interval, coordinator.renew_interval)
+        logger.info("Polling the database for due events every %.1fs", interval)
+        try:
+            while True:
+                started = time.monotonic()
+                if coordinator is not None:
+                    self.owned = coordinator.assignment()
+                dispatched = self.tick() if self.owned != [] else 0
+                if dispatched:
+                    logger.info("Dispatched %d due events", dispatched)
+                if burst:
+                    return
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        finally:
+            if coordinator is not None:
+                coordinator.leave()
+            if self.membership is not None:
+                self.membership.leave()
+
+    def _update_oldest(
+        self,
+        condition: Any,
+        values: Dict[Any, Any],
+        limit: Optional[int] = None,
+        order: Any = Event.timestamp,
+    ) -> List[int]:
+        """Update the oldest events matching a condition, without committing."""
+        query = (
+            select(Event.id)
+            .where(condition)
+            .order_by(order)
+            .limit(self.batch_size if limit is None else limit)
+        )
+        if self.skip_locked:
+            query = query.with_for_update(skip_locked=True)
+            ids = list(self.session.scalars(query))
+            if ids:
+                self.session.execute(
+                    update(Event).where(Event.id.in_(ids)).values(values)
+                )
+            return ids
+        # The UPDATE only matches a row that still matches, so of two
+        # pollers racing for a row one updates nothing.
+        return [
+            event_id
+            for event_id in self.session.scalars(query).all()
+            if self.session.execute(
+                update(Event).where(Event.id == event_id, condition).values(values)
+            ).rowcount
+            == 1
+        ]
@@ -0,0 +1,143 @@
+"""Recurring events.
+
+A recurring event holds its message, its recipients and a rule: a cron
+expression such as ``0 9 * * MON`` or an RFC 5545 RRULE such as
+``FREQ=WEEKLY;BYDAY=MO;COUNT=10``, both read in UTC. The event itself is
+never sent. Each time it fires, an occurrence is created: a copy of the
+event and its recipients, sent like any one-off event, so every run keeps
+its own delivery status.
+
+Only the next fire time is computed, into the indexed ``next_fire_at``
+column, and it is advanced after each run. Whoever fires the event
+advances the column from the time it saw, so a run is only created once
+even when two dispatchers see the same due row.
+"""
+
+from __future__ import annotations
+
+from datetime import UTC, datetime, timedelta
+from typing import Any, Dict, Optional
+
+from croniter import croniter
+from dateutil.rrule import rrulestr
+from sqlalchemy import insert, literal, select, update
+
+from app.database.models import Event, Recipient
+
+
+def is_rrule(rule: str) -> bool:
+    """Check if a rule is an RRULE rather than a cron expression."""
+    return "FREQ=" in rule.upper()
+
+
+def next_fire(rule: str, start: datetime, after: datetime) -> Optional[datetime]:
+    """
+    Get the first time a rule fires after a given time.
+
+    Args:
+        rule: Cron expression or RRULE
+        start: When the event starts, the DTSTART of an RRULE
+        after: Fire times up to and including this are skipped
+
+    Returns:
+        The next fire time, naive UTC, or None when the rule has ended
+
+    Raises:
+        ValueError: If the rule cannot be parsed
+    """
+    if is_rrule(rule):
+        try:
+            fire = rrulestr(rule, dtstart=start).after(after)
+        except TypeError:
+            raise ValueError("RRULE times must not carry a time zone")
+        if fire is not None and fire.tzinfo is not None:
+            fire = fire.astimezone(UTC).replace(tzinfo=None)
+        return fire
+
+    if not croniter.is_valid(rule):
+        raise ValueError(f"Invalid cron expression: {rule}")
+    # Cron rules do not fire before the event starts.
+    base = max(after, start - timedelta(seconds=1))
+    return croniter(rule, base).get_next(datetime)
+
+
+def first_fire(rule: str, start: datetime) -> Optional[datetime]:
+    """
+    Get the first time a rule fires, at or after the event starts.
+
+    Args:
+        rule: Cron expression or RRULE
+        start: When the event starts
+
+    Returns:
+        The first fire time, naive UTC, or None if the rule never fires
+    """
+    return next_fire(rule, start, start - timedelta(seconds=1))
+
+
+def advance(
+    session: Any, event_id: int, fire_at: datetime, next_at: Optional[datetime]
+) -> bool:
+    """
+    Move an event's next fire time on, if it is still ``fire_at``.
+
+    An event without a next fire time is marked done.
+
+    Args:
+        session: SQLAlchemy session
+        event_id: ID of the recurring event
+        fire_at: The fire time being run
+        next_at: The fire time after it
+
+    Returns:
+        True if this caller moved the fire time and so owns the run
+    """
+    values: Dict[Any, Any] = {Event.next_fire_at: next_at}
+    if next_at is None:
+        values.update({Event._is_done: True, Event.done_at: datetime.now(UTC)})
+    result = session.execute(
+        update(Event)
+        .where(Event.id == event_id, Event.next_fire_at == fire_at)
+        .values(values)
+    )
+    return bool(result.rowcount == 1)
+
+
+def create_occurrence(session: Any, event: Event, fire_at: datetime) -> Event:
+    """
+    Copy a recurring event and its recipients into a one-off event.
+
+    The recipients are copied by a single ``INSERT ... SELECT``.
+
+    Args:
+        session: SQLAlchemy session
+        event: The recurring event
+        fire_at: When the occurrence is sent
+
+    Returns:
+        The occurrence, flushed so it has an ID
+    """
+    occurrence = Event(
+        email_subject=event.email_subject,
+        email_content=event.email_content,
+        timestamp=fire_at,
+        priority=event.priority,
+    )
+    occurrence.parent_id = event.id
+    if event.send_by is not None:
+        occurrence.send_by = fire_at + (event.send_by - event.timestamp)
+    session.add(occurrence)
+    session.flush()
+
+    session.execute(
+        insert(Recipient).from_select(
+            ["email", "name", "event_id", "status"],
+            select(
+                Recipient.email,
+                Recipient.name,
+                literal(occurrence.id),
+                literal(Recipient.STATUS_QUEUED),
+            ).where(Recipient.event_id == event.id),
+        )
+    )
+    return occurrence
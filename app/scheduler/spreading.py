@@ -0,0 +1,221 @@
+"""Spreading of sends over a window after their scheduled time.
+
+Most events are scheduled on round times, so the workers and relays get
+all of an hour's mail in its first minute. An event may instead allow a
+spreading window, per event (``spread``) or for all events
+(``MAIL_SPREAD_WINDOW``). It is then due at its ``timestamp`` but only has
+to be sent by its ``send_by`` time, ``timestamp`` plus the window.
+
+The database dispatcher claims due events in ``send_by`` order. Events
+whose ``send_by`` has passed are always claimed. The others are released
+at a rate of ``MAIL_SPREAD_CAPACITY`` events per second, or faster when the
+backlog could not otherwise be sent by its deadlines: the slowest even
+rate meeting every deadline is the largest, over the backlog sorted by
+deadline, of the number of events due by a deadline divided by the time
+left until it. Without a capacity, the backlog is spread evenly at that
+rate.
+
+The capacity and the rates are for all replicas together. A replica
+polling some of the partitions releases their share, and replicas that
+all poll every event split the rate evenly between the live ones, as for
+catching up.
+
+Every dispatched event is counted in the minute it was requested for and
+in the minute it was dispatched, so :func:`spread_stats` can compare the
+requested peak with the achieved one.
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import UTC, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from app.scheduler.wheel import to_timestamp
+
+logger = logging.getLogger(__name__)
+
+SPREAD_KEY = "mail-scheduler:spread:{kind}:{day}"
+
+# Days the per-minute counts are kept.
+SPREAD_RETENTION_DAYS = 2
+
+
+def minute_of(when: datetime) -> datetime:
+    """Truncate a time to its minute."""
+    return when.replace(second=0, microsecond=0)
+
+
+def spread_key(kind: str, minute: datetime) -> str:
+    """Get the key of the per-minute counts of one kind for one day."""
+    return SPREAD_KEY.format(kind=kind, day=minute.strftime("%Y-%m-%d"))
+
+
+def required_rate(deadlines: Sequence[Tuple[datetime, int]], now: datetime) -> float:
+    """
+    Get the slowest even rate that sends a backlog by its deadlines.
+
+    Args:
+        deadlines: (deadline, number of events) pairs in the future,
+            earliest first
+        now: The current time
+
+    Returns:
+        Events per second
+    """
+    rate, count = 0.0, 0
+    for deadline, events in deadlines:
+        count += events
+        left = max((deadline - now).total_seconds(), 1.0)
+        rate = max(rate, count / left)
+    return rate
+
+
+class Spreader(object):
+    """Decides how many due events a dispatcher releases per poll."""
+
+    def __init__(self, connection: Any, capacity: Optional[float] = None) -> None:
+        """
+        Initialize a Spreader instance.
+
+        Args:
+            connection: Redis connection the per-minute counts are kept in
+            capacity: Events per second the workers and relays sustain,
+                None to spread evenly over the windows
+        """
+        self.connection = connection
+        self.capacity = capacity
+        # Parts of the rate this replica may use and of the due events it
+        # sees, set by the poller.
+        self.share = 1.0
+        self.scope = 1.0
+        self._tokens = 0.0
+        self._last: Optional[datetime] = None
+
+    @classmethod
+    def from_config(cls, connection: Any, config: Mapping[str, Any]) -> "Spreader":
+        """
+        Build a spreader from ``MAIL_SPREAD_CAPACITY``.
+
+        Args:
+            connection: Redis connection
+            config: The Flask application config
+
+        Returns:
+            The spreader
+        """
+        return cls(connection, config.get("MAIL_SPREAD_CAPACITY"))
+
+    def rate(self, deadlines: Sequence[Tuple[datetime, int]], now: datetime) -> float:
+        """
+        Get the rate of all replicas to release events with a deadline
+        still ahead.
+
+        Args:
+            deadlines: (deadline, number of events) pairs in the future
+                this replica sees, earliest first
+            now: The current time
+
+        Returns:
+            Events per second
+        """
+        required = required_rate(deadlines, now) / self.scope if self.scope else 0.0
+        return max(required, self.capacity or 0.0)
+
+    def allowance(
+        self, deadlines: Sequence[Tuple[datetime, int]], now: datetime
+    ) -> Optional[int]:
+        """
+        Get how many due events to claim this poll.
+
+        Args:
+            deadlines: (send_by, number of events) pairs of the due events,
+                earliest first
+            now: The current time, naive UTC
+
+        Returns:
+            Largest number of events to claim, None for no limit
+        """
+        late = sum(events for deadline, events in deadlines if deadline <= now)
+        ahead = [(deadline, events) for deadline, events in deadlines if deadline > now]
+        if not ahead:
+            self._tokens, self._last = 0.0, None
+            return None
+
+        last = self._last or now
+        elapsed = max(0.0, (now - last).total_seconds())
+        rate = self.rate(ahead, now)
+        if self.capacity and rate > self.capacity:
+            logger.debug("Spreading at %.1f/s, above capacity, to meet deadlines", rate)
+        self._tokens += rate * self.share * elapsed
+        self._last = now
+        released = int(self._tokens)
+        self._tokens -= released
+        return late + released
+
+    def record(self, requested: Iterable[datetime], dispatched_at: datetime) -> None:
+        """
+        Count dispatched events in their requested and dispatch minutes.
+
+        Args:
+            requested: Scheduled times of the dispatched events
+            dispatched_at: When they were dispatched
+        """
+        counts: Dict[datetime, int] = {}
+        for when in requested:
+            minute = minute_of(when)
+            counts[minute] = counts.get(minute, 0) + 1
+        if not counts:
+            return
+        ttl = int(timedelta(days=SPREAD_RETENTION_DAYS).total_seconds())
+        pipe = self.connection.pipeline()
+        for minute, events in counts.items():
+            key = spread_key("requested", minute)
+            pipe.hincrby(key, int(to_timestamp(minute)), events)
+            pipe.expire(key, ttl)
+        minute = minute_of(dispatched_at)
+        key = spread_key("achieved", minute)
+        pipe.hincrby(key, int(to_timestamp(minute)), sum(counts.values()))
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+
+def spread_stats(connection: Any, now: datetime, hours: int = 24) -> Dict[str, Any]:
+    """
+    Compare the requested and achieved peaks of the dispatch load.
+
+    Args:
+        connection: Redis connection
+        now: The current time, naive UTC
+        hours: Length of the period looked at, ending now
+
+    Returns:
+        For the requested and the achieved load, the most events of any
+        minute of the period and that minute
+    """
+    since = minute_of(now - timedelta(hours=hours))
+    days: List[datetime] = []
+    day = since
+    while day.date() <= now.date():
+        days.append(day)
+        day += timedelta(days=1)
+
+    pipe = connection.pipeline()
+    for kind in ("requested", "achieved"):
+        for day in days:
+            pipe.hgetall(spread_key(kind, day))
+    replies = iter(pipe.execute())
+
+    result: Dict[str, Any] = {"hours": hours}
+    for kind in ("requested", "achieved"):
+        peak, at = 0, None
+        for _ in days:
+            for minute, events in next(replies).items():
+                when = datetime.fromtimestamp(int(minute), UTC).replace(tzinfo=None)
+                if since <= when <= now and int(events) > peak:
+                    peak, at = int(events), when
+        result[f"{kind}_peak"] = {
+            "per_minute": peak,
+            "at": at.isoformat() if at else None,
+        }
+    return result
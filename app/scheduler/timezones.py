@@ -0,0 +1,118 @@
+"""Delivery at the same local time in every recipient's time zone.
+
+An event with a ``local_time`` is sent at that wall-clock time in the time
+zone of each recipient, ``MAIL_DEFAULT_TIMEZONE`` for recipients without
+one. Recipients are not scheduled one by one: the time zones of an event
+are grouped by their UTC offset on the day of the send, and each group
+gets one send job. A list spanning the globe therefore costs about 40
+jobs, however many recipients it has.
+
+The event's ``timestamp`` is the UTC time of its earliest group. Its send
+job, scheduled like any other, schedules the job of every group.
+
+Offsets are looked up for the local date and time of the send, so time
+zones observing daylight saving time land in the right group.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import pytz
+
+DEFAULT_TIMEZONE = "UTC"
+
+
+def validate_timezone(name: str) -> str:
+    """
+    Check that a time zone name is known.
+
+    Args:
+        name: IANA time zone name, such as ``Asia/Tokyo``
+
+    Returns:
+        The name
+
+    Raises:
+        ValueError: If the time zone is unknown
+    """
+    try:
+        pytz.timezone(name)
+    except (pytz.UnknownTimeZoneError, AttributeError):
+        raise ValueError(f"Unknown time zone: {name}")
+    return name
+
+
+def zone_offset(name: str, local_time: datetime) -> int:
+    """
+    Get the UTC offset of a time zone at a wall-clock time.
+
+    Args:
+        name: IANA time zone name
+        local_time: Naive wall-clock time in that time zone
+
+    Returns:
+        Offset in minutes east of UTC
+    """
+    offset = pytz.timezone(name).localize(local_time).utcoffset()
+    return int(offset.total_seconds() // 60) if offset is not None else 0
+
+
+def offset_buckets(
+    zones: Iterable[Optional[str]],
+    local_time: datetime,
+    default: str = DEFAULT_TIMEZONE,
+) -> Dict[int, List[Optional[str]]]:
+    """
+    Group time zones by their UTC offset at a wall-clock time.
+
+    Args:
+        zones: Time zone names, None for recipients without one
+        local_time: Naive wall-clock time of the send
+        default: Time zone of recipients without one
+
+    Returns:
+        The time zones of each offset, in minutes east of UTC
+    """
+    buckets: Dict[int, List[Optional[str]]] = defaultdict(list)
+    for zone in set(zones):
+        buckets[zone_offset(zone or default, local_time)].append(zone)
+    return dict(buckets)
+
+
+def bucket_send_time(local_time: datetime, offset: int) -> datetime:
+    """
+    Get when a group of time zones reaches a wall-clock time.
+
+    Args:
+        local_time: Naive wall-clock time of the send
+        offset: UTC offset of the group, in minutes
+
+    Returns:
+        Naive UTC time
+    """
+    return local_time - timedelta(minutes=offset)
+
+
+def first_send_time(
+    zones: Iterable[Optional[str]],
+    local_time: datetime,
+    default: str = DEFAULT_TIMEZONE,
+) -> datetime:
+    """
+    Get when the first time zone reaches a wall-clock time.
+
+    Args:
+        zones: Time zone names, None for recipients without one
+        local_time: Naive wall-clock time of the send
+        default: Time zone of recipients without one
+
+    Returns:
+        Naive UTC time of the earliest group
+    """
+    offsets = offset_buckets(zones, local_time, default) or {
+        zone_offset(default, local_time): [None]
+    }
+    return bucket_send_time(local_time, max(offsets))
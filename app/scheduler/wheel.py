@@ -0,0 +1,613 @@
+"""Hierarchical timing wheel in Redis.
+
+rq-scheduler keeps every scheduled job in one sorted set and moves due
+jobs to the queue one at a time. The wheel instead files each job in a
+time bucket of the finest level whose wheel reaches its due time: with the
+default resolutions a job due within a minute goes to a one second bucket, one due
+within the hour to a one minute bucket and anything later to a one hour
+bucket.
+
+The dispatcher looks only at the buckets that came due. A due coarse
+bucket is promoted as a whole when it starts: its jobs are spread over the
+finer buckets. A bucket of the finest level is indexed by its earliest job
+and its due jobs are moved to the RQ queue, every enqueue in a single Redis
+pipeline. A bucket is taken under ``WATCH``, so replicas of the dispatcher
+never move a job twice.
+
+Between ticks the dispatcher sleeps until the earliest bucket is due, for
+at most its interval. Scheduling publishes when the job's bucket is taken
+on ``WAKE_CHANNEL``, and a sleeping dispatcher wakes early only for a job
+due sooner than it planned.
+The delay between each job's due time and its enqueue is recorded, see
+:meth:`TimingWheel.lag_stats`.
+
+With more than one partition, jobs are spread over separate wheels by a
+hash of their ID, so replicas can share the dispatching; see
+app.scheduler.coordination.
+
+Jobs are saved like any RQ job, with the ``scheduled`` status, and only
+their IDs live in the buckets.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from datetime import UTC, datetime
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from redis.exceptions import WatchError
+from rq.job import Job, JobStatus
+from rq.queue import Queue
+
+from app.scheduler.coordination import Coordinator, LeaseLost, partition_for
+from app.utils.stats import summarize
+
+logger = logging.getLogger(__name__)
+
+WHEEL_PREFIX = "mail-scheduler:wheel"
+WHEEL_KEY = "{wheel}:{level}"
+BUCKET_KEY = "{wheel}:{level}:{slot}"
+WAKE_CHANNEL = "mail-scheduler:wheel:wake"
+LAG_KEY = "mail-scheduler:wheel:lag"
+
+# Dispatch lags kept for lag_stats, most recent first.
+LAG_SAMPLES = 1000
+
+# Seconds covered by one bucket of each level, finest first.
+DEFAULT_RESOLUTIONS = (1, 60, 3600)
+
+
+def to_timestamp(when: datetime) -> float:
+    """
+    Convert a datetime to a POSIX timestamp.
+
+    Args:
+        when: Aware datetime, or naive datetime in UTC
+
+    Returns:
+        Seconds since the epoch
+    """
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=UTC)
+    return when.timestamp()
+
+
+def wake_time(message: Dict[str, Any]) -> float:
+    """
+    Get the time a wake-up message asks the dispatcher to tick at.
+
+    Args:
+        message: Message received on ``WAKE_CHANNEL``
+
+    Returns:
+        Timestamp, 0 to tick at once if the message is malformed
+    """
+    try:
+        return float(message["data"])
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+class TimingWheel(object):
+    """Buckets of scheduled job IDs, promoted level by level when due."""
+
+    def __init__(
+        self,
+        connection: Any,
+        queue: Queue,
+        resolutions: Sequence[int] = DEFAULT_RESOLUTIONS,
+        partitions: int = 1,
+    ) -> None:
+        """
+        Initialize a TimingWheel instance.
+
+        Args:
+            connection: Redis connection shared by the app and dispatchers
+            queue: Queue that due jobs are moved to
+            resolutions: Seconds per bucket of each level, finest first
+            partitions: Number of separate wheels jobs are spread over
+        """
+        self.connection = connection
+        self.queue = queue
+        self.resolutions = sorted(resolutions)
+        self.partitions = partitions
+        # Fence key and token of the lease holder, checked by every take.
+        self.fence: Optional[Tuple[str, int]] = None
+
+    @classmethod
+    def from_config(
+        cls, connection: Any, queue: Queue, config: Mapping[str, Any]
+    ) -> "TimingWheel":
+        """
+        Build a wheel from ``MAIL_WHEEL_RESOLUTIONS`` and
+        ``MAIL_DISPATCHER_PARTITIONS``.
+
+        Args:
+            connection: Redis connection
+            queue: Queue that due jobs are moved to
+            config: The Flask application config
+
+        Returns:
+            The wheel
+        """
+        return cls(
+            connection,
+            queue,
+            config.get("MAIL_WHEEL_RESOLUTIONS") or DEFAULT_RESOLUTIONS,
+            config.get("MAIL_DISPATCHER_PARTITIONS", 1),
+        )
+
+    def queue_named(self, name: Optional[str]) -> Queue:
+        """
+        Get a queue like the wheel's own, by name.
+
+        Args:
+            name: Name of the queue, None for the wheel's own
+
+        Returns:
+            The queue
+        """
+        if name is None or name == self.queue.name:
+            return self.queue
+        return type(self.queue)(
+            name,
+            connection=self.connection,
+            job_class=self.queue.job_class,
+            is_async=self.queue.is_async,
+        )
+
+    def wheel_key(self, partition: int = 0) -> str:
+        """Get the prefix of the keys of one partition's wheel."""
+        if self.partitions == 1:
+            return WHEEL_PREFIX
+        return f"{WHEEL_PREFIX}:p{partition}"
+
+    def index_key(self, level: int, partition: int = 0) -> str:
+        """Get the key of the sorted set of a level's non-empty buckets."""
+        return WHEEL_KEY.format(wheel=self.wheel_key(partition), level=level)
+
+    def bucket_key(self, level: int, slot: int, partition: int = 0) -> str:
+        """Get the key of the sorted set of job IDs in one bucket."""
+        return BUCKET_KEY.format(
+            wheel=self.wheel_key(partition), level=level, slot=slot
+        )
+
+    def level_for(self, due: float, now: float) -> int:
+        """
+        Pick the level of a job.
+
+        Args:
+            due: When the job is due, as a timestamp
+            now: The current timestamp
+
+        Returns:
+            The finest level whose wheel spans the time left
+        """
+        remaining = due - now
+        for level, span in enumerate(self.resolutions[1:]):
+            if remaining < span:
+                return level
+        return len(self.resolutions) - 1
+
+    def slot_for(self, level: int, due: float) -> int:
+        """Get the number of the bucket of ``level`` holding ``due``."""
+        return int(due // self.resolutions[level])
+
+    def bucket_due(self, level: int, slot: int) -> float:
+        """
+        Get the time a coarse bucket is promoted.
+
+        Coarse buckets are promoted when they start, so their jobs reach
+        the finer levels in time. Buckets of the finest level are taken
+        when their earliest job is due instead, so no job is sent early.
+
+        Args:
+            level: Level of the bucket
+            slot: Number of the bucket
+
+        Returns:
+            Timestamp from which the dispatcher takes the bucket
+        """
+        return slot * self.resolutions[level]
+
+    def schedule(self, job: Job, when: datetime) -> Job:
+        """
+        Save a job and file it for ``when``.
+
+        Args:
+            job: Job created but not enqueued
+            when: When to enqueue the job
+
+        Returns:
+            The job
+        """
+        pipe = self.connection.pipeline()
+        job.save(pipeline=pipe)
+        take_at = self._file(pipe, job.id, to_timestamp(when), time.time())
+        pipe.publish(WAKE_CHANNEL, take_at)
+        pipe.execute()
+        return job
+
+    def schedule_call(
+        self,
+        when: datetime,
+        func: Union[str, Callable[..., Any]],
+        *args: Any,
+        job_id: Optional[str] = None,
+        queue: Optional[str] = None,
+    ) -> Job:
+        """
+        Schedule a call of ``func`` with ``args``.
+
+        Args:
+            when: When to enqueue the job
+            func: Job function, or its import path
+            *args: Arguments of the job
+            job_id: ID to give the job, random by default
+            queue: Name of the queue to enqueue the job in, the wheel's own
+                queue by default
+
+        Returns:
+            The scheduled job
+        """
+        job = self.queue_named(queue).create_job(
+            func, args=args, job_id=job_id, status=JobStatus.SCHEDULED
+        )
+        return self.schedule(job, when)
+
+    def schedule_calls(
+        self,
+        calls: Sequence[Tuple[datetime, Union[str, Callable[..., Any]], Any]],
+        job_ids: Optional[Sequence[str]] = None,
+        queues: Optional[Sequence[Optional[str]]] = None,
+    ) -> List[Job]:
+        """
+        Schedule many calls through one pipeline.
+
+        Args:
+            calls: (when, job function, arguments) triples
+            job_ids: IDs to give the jobs, in the order of the calls
+            queues: Names of the queues of the jobs, in the order of the calls
+
+        Returns:
+            The scheduled jobs
+        """
+        pipe = self.connection.pipeline()
+        now = time.time()
+        earliest = float("inf")
+        jobs = []
+        for n, (when, func, args) in enumerate(calls):
+            job = self.queue_named(queues[n] if queues else None).create_job(
+                func,
+                args=args,
+                job_id=job_ids[n] if job_ids else None,
+                status=JobStatus.SCHEDULED,
+            )
+            job.save(pipeline=pipe)
+            earliest = min(earliest, self._file(pipe, job.id, to_timestamp(when), now))
+            jobs.append(job)
+        if jobs:
+            pipe.publish(WAKE_CHANNEL, earliest)
+        pipe.execute()
+        return jobs
+
+    def cancel(self, job_id: str, when: datetime) -> bool:
+        """
+        Remove a job from the wheel before it is due.
+
+        The job's hash is left for the caller to delete.
+
+        Args:
+            job_id: ID of the scheduled job
+            when: The time the job was scheduled for
+
+        Returns:
+            True if the job was still waiting in a bucket
+        """
+        due = to_timestamp(when)
+        partition = partition_for(job_id, self.partitions)
+        pipe = self.connection.pipeline()
+        # Promotions move the job down the levels, so look in all of them.
+        for level in range(len(self.resolutions)):
+            slot = self.slot_for(level, due)
+            pipe.zrem(self.bucket_key(level, slot, partition), job_id)
+        return any(pipe.execute())
+
+    def reschedule(self, job_id: str, when: datetime, new_when: datetime) -> bool:
+        """
+        Move a job still waiting in the wheel to another time.
+
+        Args:
+            job_id: ID of the scheduled job
+            when: The time the job is scheduled for
+            new_when: The time to move it to
+
+        Returns:
+            True if the job was moved, False if it had already left the wheel
+        """
+        if not self.cancel(job_id, when):
+            return False
+        pipe = self.connection.pipeline()
+        take_at = self._file(pipe, job_id, to_timestamp(new_when), time.time())
+        pipe.publish(WAKE_CHANNEL, take_at)
+        pipe.execute()
+        return True
+
+    def tick(
+        self, now: Optional[float] = None, partitions: Optional[Sequence[int]] = None
+    ) -> int:
+        """
+        Promote every due bucket, coarsest level first.
+
+        Args:
+            now: The current timestamp, for tests
+            partitions: Partitions to dispatch, all by default
+
+        Returns:
+            Number of jobs moved to the queue
+
+        Raises:
+            LeaseLost: If a newer lease holder took over while ticking
+        """
+        now = time.time() if now is None else now
+        enqueued = 0
+        for partition in self._partitions(partitions):
+            for level in reversed(range(len(self.resolutions))):
+                slots = self.connection.zrangebyscore(
+                    self.index_key(level, partition), "-inf", now
+                )
+                for slot in slots:
+                    enqueued += self._take(level, int(slot), now, partition)
+        return enqueued
+
+    def next_due(self, partitions: Optional[Sequence[int]] = None) -> Optional[float]:
+        """
+        Get the time the earliest bucket of any level is taken.
+
+        Args:
+            partitions: Partitions to look at, all by default
+
+        Returns:
+            Timestamp, or None if the wheel is empty
+        """
+        pipe = self.connection.pipeline()
+        for partition in self._partitions(partitions):
+            for level in range(len(self.resolutions)):
+                pipe.zrange(self.index_key(level, partition), 0, 0, withscores=True)
+        firsts = [first[0][1] for first in pipe.execute() if first]
+        return min(firsts) if firsts else None
+
+    def sleep_time(
+        self,
+        interval: float,
+        now: Optional[float] = None,
+        partitions: Optional[Sequence[int]] = None,
+    ) -> float:
+        """
+        Get how long to sleep before the next tick.
+
+        Args:
+            interval: Longest sleep, in case a wake-up message is lost
+            now: The current timestamp, for tests
+            partitions: Partitions dispatched, all by default
+
+        Returns:
+            Seconds until the earliest bucket is due, at most ``interval``
+        """
+        now = time.time() if now is None else now
+        due = self.next_due(partitions)
+        if due is None:
+            return interval
+        return min(interval, max(0.0, due - now))
+
+    def run(
+        self,
+        interval: float = 30.0,
+        burst: bool = False,
+        coordinator: Optional[Coordinator] = None,
+    ) -> None:
+        """
+        Tick whenever a bucket is due, or a job is scheduled.
+
+        Args:
+            interval: Longest sleep between ticks
+            burst: Tick once and return
+            coordinator: Decides the partitions of this replica, which
+                dispatches every partition without one
+        """
+        if coordinator is not None:
+            interval = min(interval, coordinator.renew_interval)
+        logger.info("Timing wheel dispatching, sleeping at most %.1fs", interval)
+        pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(WAKE_CHANNEL)
+        try:
+            while True:
+                partitions = None
+                if coordinator is not None:
+                    partitions = coordinator.assignment()
+                    self.fence = coordinator.fence
+                try:
+                    enqueued = self.tick(partitions=partitions)
+                except LeaseLost:
+                    logger.warning("Timing wheel fenced off by a newer leader")
+                    enqueued = 0
+                if enqueued:
+                    logger.info("Timing wheel enqueued %d jobs", enqueued)
+                if burst:
+                    return
+                wait = self.sleep_time(interval, partitions=partitions)
+                self.wait(pubsub, time.time() + wait)
+        finally:
+            pubsub.close()
+            if coordinator is not None:
+                coordinator.leave()
+
+    def wait(self, pubsub: Any, wake_at: float) -> None:
+        """
+        Sleep until ``wake_at``, or until a job is scheduled to be taken
+        before it.
+
+        Wake-up messages carry the time their job's bucket is taken, so
+        jobs scheduled for later than the planned wake-up do not cut the
+        sleep short. Messages still pending on waking are drained: the
+        tick that follows takes their jobs anyway.
+
+        Args:
+            pubsub: PubSub subscribed to ``WAKE_CHANNEL``
+            wake_at: Timestamp of the planned wake-up
+        """
+        while True:
+            remaining = wake_at - time.time()
+            if remaining <= 0:
+                break
+            message = pubsub.get_message(timeout=remaining)
+            if message is not None:
+                wake_at = min(wake_at, wake_time(message))
+        while pubsub.get_message(timeout=0.0) is not None:
+            pass
+
+    def lag_stats(self) -> Dict[str, Any]:
+        """
+        Summarize the most recent dispatch lags.
+
+        The lag of a job is the time from its due time to its enqueue.
+
+        Returns:
+            Number of samples, and mean, median, 95th and 99th percentile
+            and maximum lag in seconds, None without samples
+        """
+        return summarize(float(lag) for lag in self.connection.lrange(LAG_KEY, 0, -1))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Report the buckets waiting on every level.
+
+        Returns:
+            One dictionary per level, finest first
+        """
+        pipe = self.connection.pipeline()
+        for level in range(len(self.resolutions)):
+            for partition in range(self.partitions):
+                pipe.zcard(self.index_key(level, partition))
+                pipe.zrange(self.index_key(level, partition), 0, 0, withscores=True)
+        state = iter(pipe.execute())
+
+        result = []
+        for level, resolution in enumerate(self.resolutions):
+            buckets, firsts = 0, []
+            for _ in range(self.partitions):
+                buckets += int(next(state))
+                firsts += [score for _, score in next(state)]
+            result.append(
+                {
+                    "level": level,
+                    "resolution": resolution,
+                    "buckets": buckets,
+                    "next_due": min(firsts) if firsts else None,
+                }
+            )
+        return result
+
+    def _partitions(self, partitions: Optional[Sequence[int]]) -> Sequence[int]:
+        """Get the partitions to work on, all when none are given."""
+        return range(self.partitions) if partitions is None else partitions
+
+    def _file(
+        self, pipe: Any, job_id: Union[str, bytes], due: float, now: float
+    ) -> float:
+        """
+        Add a job to the bucket of the level and slot it belongs in, and get
+        when the dispatcher takes that bucket.
+        """
+        partition = partition_for(job_id, self.partitions)
+        level = self.level_for(due, now)
+        slot = self.slot_for(level, due)
+        pipe.zadd(self.bucket_key(level, slot, partition), {job_id: due})
+        # A finest bucket is due with its earliest job: LT keeps the lowest.
+        score = due if level == 0 else self.bucket_due(level, slot)
+        pipe.zadd(self.index_key(level, partition), {slot: score}, lt=True)
+        return score
+
+    def _take(self, level: int, slot: int, now: float, partition: int = 0) -> int:
+        """Move one due bucket down a level, or to the queue, atomically."""
+        key = self.bucket_key(level, slot, partition)
+        index = self.index_key(level, partition)
+        with self.connection.pipeline() as pipe:
+            while True:
+                try:
+                    if self.fence is None:
+                        pipe.watch(key)
+                    else:
+                        # A new lease holder bumps the fence and aborts this.
+                        fence_key, token = self.fence
+                        pipe.watch(key, fence_key)
+                        if int(pipe.get(fence_key) or 0) != token:
+                            raise LeaseLost(f"Fencing token {token} is stale")
+                    members = pipe.zrange(key, 0, -1, withscores=True)
+                    later: List[Tuple[bytes, float]] = []
+                    jobs: List[Job] = []
+                    if level == 0:
+                        later = [m for m in members if m[1] > now]
+                        members = [m for m in members if m[1] <= now]
+                    if level == 0 and members:
+                        jobs = [
+                            job
+                            for job in self.queue.job_class.fetch_many(
+                                [member.decode() for member, _ in members],
+                                connection=self.connection,
+                            )
+                            if job is not None
+                        ]
+
+                    pipe.multi()
+                    if level == 0:
+                        if self.queue.is_async:
+                            # Wheel jobs have no dependencies to check, and
+                            # enqueue_job would call MULTI a second time.
+                            for job in jobs:
+                                queue = self.queue_named(job.origin)
+                                queue._enqueue_job(job, pipeline=pipe)
+                        self._record_lag(pipe, members)
+                    else:
+                        for member, due in members:
+                            self._file(pipe, member, due, now)
+                    if later:
+                        # The rest of the bucket is due with its next job.
+                        if members:
+                            pipe.zrem(key, *[member for member, _ in members])
+                        pipe.zadd(index, {slot: later[0][1]})
+                    else:
+                        pipe.delete(key)
+                        pipe.zrem(index, slot)
+                    pipe.execute()
+                    break
+                except WatchError:
+                    # Another dispatcher took the bucket or a job was added.
+                    continue
+
+        if not self.queue.is_async:
+            # Synchronous queues run jobs inline, outside the transaction.
+            for job in jobs:
+                self.queue_named(job.origin).enqueue_job(job)
+        return len(jobs)
+
+    def _record_lag(self, pipe: Any, members: List[Tuple[bytes, float]]) -> None:
+        """Add the dispatch lag of jobs being enqueued to the samples."""
+        if not members:
+            return
+        now = time.time()
+        lags = [round(max(0.0, now - due), 4) for _, due in members]
+        logger.debug("Timing wheel lag %.3fs", max(lags))
+        pipe.lpush(LAG_KEY, *lags)
+        pipe.ltrim(LAG_KEY, 0, LAG_SAMPLES - 1)
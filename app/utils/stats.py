@@ -0,0 +1,26 @@
+"""Summaries of timing samples reported by the metrics endpoints."""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable
+
+
+def summarize(samples: Iterable[float]) -> Dict[str, Any]:
+    """
+    Summarize timing samples.
+
+    Args:
+        samples: Durations in seconds
+
+    Returns:
+        Number of samples, and mean, median, 95th and 99th percentile and
+        maximum in seconds, None without samples
+    """
+    values = sorted(samples)
+    result: Dict[str, Any] = {"samples": len(values), "mean": None}
+    if values:
+        result["mean"] = round(sum(values) / len(values), 4)
+    for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1)):
+        index = min(len(values) - 1, int(fraction * len(values)))
+        result[name] = round(values[index], 4) if values else None
+    return result
@@ -7,6 +7,12 @@ source /opt/venv/bin/activate
 # Set up Python path
 export PYTHONPATH=/var/www/mail-scheduler
 
+# The timing wheel or the database poller replaces rq-scheduler
+if [ "${MAIL_SCHEDULER:-rq}" != "rq" ]; then
+    echo "Starting ${MAIL_SCHEDULER} dispatcher..."
+    exec flask dispatcher
+fi
+
 # Create a monkey patch module for RQ utils
 cat > /tmp/patch_rq.py << 'EOF'
 import logging
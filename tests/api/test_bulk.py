@@ -0,0 +1,120 @@
+"""Tests for the bulk email scheduling endpoint."""
+
+import json
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.database.models import Event, Recipient
+
+VALID = {
+    "subject": "Bulk",
+    "content": "Body",
+    "timestamp": "07 Feb 2026 12:00 +08",
+    "recipients": "one@example.com, Two <two@example.com>",
+}
+
+
+@pytest.fixture
+def scheduled(monkeypatch):
+    """Capture the jobs scheduled by the bulk endpoint."""
+    schedule_jobs = MagicMock()
+    monkeypatch.setattr("app.event.jobs.schedule_jobs", schedule_jobs)
+    return schedule_jobs
+
+
+def test_bulk_array_reports_ids_and_errors(client, db, scheduled):
+    """Test that valid items are stored and invalid ones reported by index."""
+    payload = [VALID, {"subject": "No content"}, "not an object"]
+
+    response = client.post("/api/save_emails/bulk", json=payload)
+
+    assert response.status_code == 201
+    assert response.json["created"] == 1
+    assert response.json["failed"] == 2
+    first, second, third = response.json["results"]
+    assert second == {"index": 1, "error": "Email content is required"}
+    assert third["index"] == 2 and "error" in third
+
+    event = db.session.get(Event, first["id"])
+    assert event.email_subject == "Bulk"
+    recipients = db.session.query(Recipient).filter_by(event_id=event.id).all()
+    assert sorted((r.email, r.name) for r in recipients) == [
+        ("one@example.com", None),
+        ("two@example.com", "Two"),
+    ]
+
+    calls, job_ids, queues = scheduled.call_args.args
+    assert [(when, args) for when, _, args in calls] == [
+        (event.timestamp, (event.id,))
+    ]
+    assert job_ids == [event.job_id] and event.job_id
+    assert queues == ["default"]
+
+
+def test_bulk_ndjson(client, scheduled):
+    """Test that NDJSON is read line by line, bad lines reported."""
+    body = "\n".join([json.dumps(VALID), "{broken", "", json.dumps(VALID)])
+
+    response = client.post(
+        "/api/save_emails/bulk", data=body, content_type="application/x-ndjson"
+    )
+
+    assert response.status_code == 201
+    assert response.json["created"] == 2
+    assert [sorted(r) for r in response.json["results"]] == [
+        ["id", "index"],
+        ["error", "index"],
+        ["id", "index"],
+    ]
+    assert len(scheduled.call_args.args[0]) == 2
+
+
+def test_bulk_rejects_non_array(client, scheduled):
+    """Test that a single object is not taken as a batch."""
+    response = client.post("/api/save_emails/bulk", json=VALID)
+
+    assert response.status_code == 400
+    scheduled.assert_not_called()
+
+
+def test_bulk_without_valid_items(client, scheduled):
+    """Test that a batch with nothing to store fails as a whole."""
+    response = client.post("/api/save_emails/bulk", json=[{}])
+
+    assert response.status_code == 400
+    assert response.json["created"] == 0
+    scheduled.assert_not_called()
+
+
+def test_bulk_limit(app, client, scheduled, monkeypatch):
+    """Test that batches above MAIL_BULK_MAX_EVENTS are refused."""
+    monkeypatch.setitem(app.config, "MAIL_BULK_MAX_EVENTS", 1)
+
+    response = client.post("/api/save_emails/bulk", json=[VALID, VALID])
+
+    assert response.status_code == 413
+
+
+def test_schedule_jobs_uses_one_pipeline(app, monkeypatch):
+    """Test that rq-scheduler jobs are saved and indexed in one pipeline."""
+    from app.event import jobs
+
+    scheduler = MagicMock(scheduled_jobs_key="rq:scheduler:scheduled_jobs")
+    scheduler._create_job.side_effect = lambda func, args, id, commit, queue_name: MagicMock(
+        id=id
+    )
+    monkeypatch.setattr(jobs, "rq", MagicMock(get_scheduler=lambda: scheduler))
+    when = datetime(2026, 2, 7, 4, 0)
+
+    with app.app_context():
+        jobs.schedule_jobs(
+            [(when, jobs.send_mail, (1,)), (when, jobs.send_mail, (2,))],
+            ["job-1", "job-2"],
+        )
+
+    pipe = scheduler.connection.pipeline.return_value
+    assert pipe.zadd.call_count == 2
+    pipe.zadd.assert_any_call("rq:scheduler:scheduled_jobs", {"job-2": 1770436800})
+    pipe.execute.assert_called_once()
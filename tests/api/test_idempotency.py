@@ -0,0 +1,140 @@
+"""Tests for idempotency keys on /api/save_emails."""
+
+import json
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import func, select
+
+from app.database.models import Event, Recipient
+from app.event.idempotency import KeyReused, request_fingerprint
+
+PAYLOAD = {
+    "subject": "Test Email",
+    "content": "This is a test email",
+    "timestamp": "07 Feb 2026 12:00 +08",
+    "recipients": "test@example.com",
+}
+
+
+def post(client, key, payload=PAYLOAD):
+    """Post the payload with an Idempotency-Key header."""
+    return client.post(
+        "/api/save_emails",
+        data=json.dumps(payload),
+        content_type="application/json",
+        headers={"Idempotency-Key": key},
+    )
+
+
+@patch("app.api.routes.add_event")
+@patch("app.api.routes.rq")
+def test_retry_is_answered_from_redis(mock_rq, mock_add_event, client):
+    """Test that a remembered key returns its event without creating one."""
+    mock_rq.connection.get.return_value = b"42"
+
+    response = post(client, "order-1")
+
+    assert response.status_code == 201
+    assert response.json["id"] == 42
+    mock_rq.connection.get.assert_called_once_with(
+        "mail-scheduler:idempotency:order-1"
+    )
+    assert not mock_add_event.called
+
+
+@patch("app.api.routes.add_event")
+@patch("app.api.routes.rq")
+def test_first_request_remembers_its_event(mock_rq, mock_add_event, client):
+    """Test that a new key creates the event and stores it with a TTL."""
+    mock_rq.connection.get.return_value = None
+    mock_add_event.return_value = 7
+
+    response = post(client, "order-2")
+
+    assert response.status_code == 201
+    assert response.json["id"] == 7
+    mock_add_event.assert_called_once_with(PAYLOAD, idempotency_key="order-2")
+    mock_rq.connection.set.assert_called_once_with(
+        "mail-scheduler:idempotency:order-2",
+        f"7:{request_fingerprint(PAYLOAD)}",
+        ex=86400,
+    )
+
+
+@patch("app.api.routes.add_event")
+@patch("app.api.routes.rq")
+def test_reused_key_with_other_payload_is_refused(mock_rq, mock_add_event, client):
+    """Test that a remembered key sent with a different body is a conflict."""
+    mock_rq.connection.get.return_value = f"42:{request_fingerprint(PAYLOAD)}"
+    other = dict(PAYLOAD, subject="Another email")
+
+    assert post(client, "order-3").json["id"] == 42
+    response = post(client, "order-3", other)
+
+    assert response.status_code == 422
+    assert "different request" in response.json["message"]
+    assert not mock_add_event.called
+
+
+@patch("app.api.routes.add_event")
+def test_overlong_key_is_rejected(mock_add_event, client):
+    """Test that a key too long for the events table is a bad request."""
+    response = post(client, "k" * 256)
+
+    assert response.status_code == 400
+    assert "Idempotency-Key" in response.json["message"]
+    assert not mock_add_event.called
+
+
+def test_unique_key_returns_the_original_event(app, db):
+    """Test that a retry missing Redis still creates no second event."""
+    from app.event.jobs import add_event
+
+    key = str(uuid4())
+    with patch("app.event.jobs.schedule_mail") as schedule_mail:
+        first = add_event(dict(PAYLOAD), idempotency_key=key)
+        second = add_event(dict(PAYLOAD), idempotency_key=key)
+
+    assert first == second
+    assert schedule_mail.call_count == 1
+    count = db.session.scalar(
+        select(func.count(Event.id)).where(Event.idempotency_key == key)
+    )
+    assert count == 1
+
+
+def test_failed_scheduling_leaves_the_key_free(app, db):
+    """Test that a request failing to schedule stores nothing for its retry."""
+    from app.event.jobs import add_event
+
+    key = str(uuid4())
+    recipients_before = db.session.scalar(select(func.count(Recipient.id)))
+    with patch("app.event.jobs.schedule_mail", side_effect=ConnectionError):
+        with pytest.raises(ConnectionError):
+            add_event(dict(PAYLOAD), idempotency_key=key)
+
+    stored = db.session.scalar(select(Event.id).where(Event.idempotency_key == key))
+    assert stored is None
+    assert db.session.scalar(select(func.count(Recipient.id))) == recipients_before
+
+    with patch("app.event.jobs.schedule_mail") as schedule_mail:
+        event_id = add_event(dict(PAYLOAD), idempotency_key=key)
+
+    schedule_mail.assert_called_once()
+    recipients = db.session.scalars(
+        select(Recipient.email).where(Recipient.event_id == event_id)
+    ).all()
+    assert recipients == ["test@example.com"]
+
+
+def test_unique_key_with_other_payload_is_refused(app, db):
+    """Test that a key reused for another email missing Redis is refused."""
+    from app.event.jobs import add_event
+
+    key = str(uuid4())
+    with patch("app.event.jobs.schedule_mail"):
+        add_event(dict(PAYLOAD), idempotency_key=key)
+        with pytest.raises(KeyReused):
+            add_event(dict(PAYLOAD, subject="Another email"), idempotency_key=key)
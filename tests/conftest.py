@@ -100,5 +100,6 @@ def mock_redis(monkeypatch):
     from unittest.mock import Mock
 
     mock_scheduler = Mock()
+    mock_scheduler.enqueue_at.return_value = Mock(id="mocked_job_id")
     monkeypatch.setattr("app.event.jobs.rq.get_scheduler", lambda: mock_scheduler)
     return mock_scheduler
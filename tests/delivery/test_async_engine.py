@@ -0,0 +1,117 @@
+"""Tests for the asyncio delivery engine."""
+
+import asyncio
+from unittest.mock import patch
+
+import aiosmtplib
+import pytest
+
+from app.delivery.async_engine import AsyncDeliveryEngine, Envelope, split_results
+
+
+class FakeSMTP:
+    """In-memory stand-in for aiosmtplib.SMTP that tracks concurrency."""
+
+    active = 0
+    peak = 0
+    opened = 0
+    refuse = {}
+
+    def __init__(self, **kwargs):
+        self.is_connected = False
+
+    async def connect(self):
+        FakeSMTP.opened += 1
+        FakeSMTP.active += 1
+        FakeSMTP.peak = max(FakeSMTP.peak, FakeSMTP.active)
+        self.is_connected = True
+
+    async def login(self, username, password):
+        pass
+
+    async def sendmail(self, sender, recipients, message):
+        await asyncio.sleep(0.01)
+        errors = {
+            addr: aiosmtplib.SMTPResponse(*FakeSMTP.refuse[addr])
+            for addr in recipients
+            if addr in FakeSMTP.refuse
+        }
+        return errors, "OK"
+
+    async def quit(self):
+        FakeSMTP.active -= 1
+        self.is_connected = False
+
+
+@pytest.fixture
+def fake_smtp():
+    """Patch aiosmtplib.SMTP with FakeSMTP and reset its counters."""
+    FakeSMTP.active = FakeSMTP.peak = FakeSMTP.opened = 0
+    FakeSMTP.refuse = {}
+    with patch("app.delivery.async_engine.aiosmtplib.SMTP", FakeSMTP):
+        yield FakeSMTP
+
+
+def envelopes(count):
+    """Build one single-recipient envelope per index."""
+    return [Envelope("from@x.com", [f"user{i}@x.com"], b"msg") for i in range(count)]
+
+
+def test_sessions_run_concurrently_up_to_limit(fake_smtp):
+    """Test that no more than `concurrency` sessions are open at once."""
+    engine = AsyncDeliveryEngine("localhost", 25, concurrency=4)
+
+    results = engine.deliver(envelopes(20))
+
+    assert results == [{}] * 20
+    assert fake_smtp.peak == 4
+    assert fake_smtp.opened == 4
+    assert fake_smtp.active == 0
+
+
+def test_session_is_reopened_after_message_cap(fake_smtp):
+    """Test that a session is recycled after messages_per_session sends."""
+    engine = AsyncDeliveryEngine(
+        "localhost", 25, concurrency=1, messages_per_session=3
+    )
+
+    engine.deliver(envelopes(7))
+
+    assert fake_smtp.opened == 3
+
+
+def test_refused_recipients_are_reported(fake_smtp):
+    """Test that per-recipient refusals end up in the results."""
+    fake_smtp.refuse = {"user1@x.com": (550, "No such user")}
+    engine = AsyncDeliveryEngine("localhost", 25, concurrency=2)
+
+    results = engine.deliver(envelopes(3))
+
+    assert results[1] == {"user1@x.com": (550, b"No such user")}
+    assert results[0] == results[2] == {}
+
+
+def test_suppressed_engine_does_not_connect(fake_smtp):
+    """Test that suppress skips the network like MAIL_SUPPRESS_SEND."""
+    engine = AsyncDeliveryEngine("localhost", 25, suppress=True)
+
+    assert engine.deliver(envelopes(3)) == [{}, {}, {}]
+    assert fake_smtp.opened == 0
+
+
+def test_split_results():
+    """Test flattening envelope results into recipient outcomes."""
+    sent = envelopes(3)
+    results = [
+        {"user0@x.com": (550, b"Unknown")},
+        aiosmtplib.SMTPDataError(554, "Rejected"),
+        ConnectionRefusedError(),
+    ]
+
+    refused, errors = split_results(sent, results)
+
+    assert refused == {
+        "user0@x.com": (550, b"Unknown"),
+        "user1@x.com": (554, b"Rejected"),
+    }
+    assert list(errors) == ["user2@x.com"]
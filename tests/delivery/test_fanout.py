@@ -0,0 +1,72 @@
+"""Tests for the recipient fan-out helpers."""
+
+from unittest.mock import MagicMock
+
+import pytest
+from rq.queue import Queue
+
+from app.delivery.fanout import (
+    FANOUT_KEY,
+    chunked,
+    enqueue_many,
+    finish_chunk,
+    start_fanout,
+)
+
+
+def job(*args):
+    """Dummy job function."""
+    return args
+
+
+def test_chunked_splits_evenly_and_keeps_remainder():
+    """Test that chunked yields fixed size chunks plus a remainder."""
+    chunks = list(chunked(["a", "b", "c", "d", "e"], 2))
+    assert chunks == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_chunked_rejects_invalid_size():
+    """Test that chunked needs a positive chunk size."""
+    with pytest.raises(ValueError):
+        list(chunked(["a"], 0))
+
+
+def test_start_fanout_sets_counter():
+    """Test that the outstanding chunk counter is stored with a TTL."""
+    connection = MagicMock()
+    start_fanout(connection, 7, 3)
+
+    args, kwargs = connection.set.call_args
+    assert args == (FANOUT_KEY.format(event_id=7), 3)
+    assert kwargs["ex"] > 0
+
+
+def test_finish_chunk_reports_last_chunk():
+    """Test that only the chunk bringing the counter to zero is last."""
+    connection = MagicMock()
+    connection.decr.side_effect = [2, 1, 0]
+
+    assert [finish_chunk(connection, 7) for _ in range(3)] == [False, False, True]
+    connection.delete.assert_called_once_with(FANOUT_KEY.format(event_id=7))
+
+
+def test_enqueue_many_uses_single_call_on_async_queue():
+    """Test that async queues enqueue all jobs through enqueue_many."""
+    queue = MagicMock(is_async=True)
+    job_datas = [Queue.prepare_data(job, args=(i,)) for i in range(3)]
+
+    enqueue_many(queue, job_datas)
+
+    queue.enqueue_many.assert_called_once_with(job_datas, pipeline=None)
+    assert not queue.enqueue_call.called
+
+
+def test_enqueue_many_runs_jobs_one_by_one_on_sync_queue():
+    """Test that sync queues enqueue each job so it runs inline."""
+    queue = MagicMock(is_async=False)
+    job_datas = [Queue.prepare_data(job, args=(i,)) for i in range(3)]
+
+    enqueue_many(queue, job_datas)
+
+    assert queue.enqueue_call.call_count == 3
+    assert not queue.enqueue_many.called
@@ -0,0 +1,140 @@
+"""Tests for message bodies prepared at save time."""
+
+import email
+from email import policy
+from datetime import UTC, datetime
+from unittest.mock import patch
+
+import pytest
+
+from app.database.models import Event
+from app.delivery.mime import (
+    CONTENT_TYPE_HTML,
+    CONTENT_TYPE_PLAIN,
+    UNDISCLOSED_RECIPIENTS,
+    MessageTemplate,
+    PreparedMessage,
+    classify_content,
+    prepare_content,
+)
+from app.delivery.planner import plan_transactions
+from app.event.jobs import build_message, plan_messages
+
+
+def test_classify_content():
+    """Test detecting HTML and plain text content."""
+    assert classify_content("<p>Hello</p>") == CONTENT_TYPE_HTML
+    assert classify_content("Hello there") == CONTENT_TYPE_PLAIN
+    assert classify_content("") == CONTENT_TYPE_PLAIN
+
+
+@pytest.mark.parametrize(
+    "content, mime_type",
+    [("<p>Hällo</p>", "text/html"), ("Plain hällo", "text/plain")],
+)
+def test_prepared_message_renders_cached_part(app, content, mime_type):
+    """Test that the cached part becomes the body of a valid message."""
+    _, part = prepare_content(content)
+    with app.app_context():
+        msg = PreparedMessage(
+            subject="Subject",
+            recipients=["to@example.com"],
+            sender="from@example.com",
+            mime_part=part,
+        )
+        parsed = email.message_from_bytes(msg.as_bytes())
+
+    assert parsed["Subject"] == "Subject"
+    assert parsed["To"] == "to@example.com"
+    assert parsed.get_content_type() == mime_type
+    assert parsed.get_payload(decode=True).decode("utf-8") == content
+
+
+def test_event_prepares_content_when_stored(session):
+    """Test that creating and editing an event caches the MIME part."""
+    event = Event(
+        email_subject="Subject",
+        email_content="<b>Bold</b>",
+        timestamp=datetime.now(UTC),
+    )
+    session.add(event)
+    session.commit()
+    assert event.content_type == CONTENT_TYPE_HTML
+    assert b"<b>Bold</b>" in event.mime_body
+
+    event.email_content = "Now plain"
+    session.commit()
+    assert event.content_type == CONTENT_TYPE_PLAIN
+    assert b"Now plain" in event.mime_body
+
+
+def test_build_message_does_not_parse_content(app):
+    """Test that sending never runs the HTML classifier."""
+    event = Event(
+        email_subject="Subject",
+        email_content="<p>Hi</p>",
+        timestamp=datetime.now(UTC),
+    )
+    with app.app_context():
+        with patch("app.delivery.mime.BeautifulSoup") as mock_soup:
+            msg = build_message(event, ["to@example.com"])
+            msg.sender = "from@example.com"
+            msg.as_bytes()
+
+    assert not mock_soup.called
+    assert msg.mime_part == event.mime_body
+
+
+def test_build_message_hides_recipients_from_each_other(app):
+    """Test that a shared message lists its recipients in the envelope only."""
+    event = Event(
+        email_subject="Subject", email_content="Hi", timestamp=datetime.now(UTC)
+    )
+    with app.app_context():
+        shared = build_message(event, ["a@example.com", "b@example.com"])
+        single = build_message(event, ["a@example.com"])
+        shared_parsed = email.message_from_bytes(shared.as_bytes())
+        single_parsed = email.message_from_bytes(single.as_bytes())
+
+    assert shared.send_to == {"a@example.com", "b@example.com"}
+    assert shared_parsed["To"] == UNDISCLOSED_RECIPIENTS
+    assert single_parsed["To"] == "a@example.com"
+
+
+def test_message_template_patches_to_and_message_id(app):
+    """Test that personalised copies differ only in To and Message-ID."""
+    _, part = prepare_content("<p>Hällo</p>")
+    with app.app_context():
+        template = MessageTemplate(
+            PreparedMessage(
+                subject="Subject", sender="from@example.com", mime_part=part
+            )
+        )
+    first = email.message_from_bytes(
+        template.render("Jane <jane@example.com>"), policy=policy.default
+    )
+    second = email.message_from_bytes(
+        template.render("joe@example.com"), policy=policy.default
+    )
+
+    assert first["To"] == "Jane <jane@example.com>"
+    assert second["To"] == "joe@example.com"
+    assert first["Message-ID"] != second["Message-ID"]
+    assert first["Subject"] == second["Subject"] == "Subject"
+    assert first["Date"] == second["Date"]
+    assert first.get_content() == "<p>Hällo</p>"
+
+
+def test_build_messages_personal_mode(app):
+    """Test that a template yields one message per recipient."""
+    event = Event(
+        email_subject="Subject", email_content="Hi", timestamp=datetime.now(UTC)
+    )
+    with app.app_context():
+        template = MessageTemplate(build_message(event, []))
+        plan = plan_transactions(["a@example.com", "b@example.com"])
+        messages = [msg for _, msg in plan_messages(event, plan, template)]
+
+    assert [msg.send_to for msg in messages] == [{"a@example.com"}, {"b@example.com"}]
+    assert all(msg.sender == template.sender for msg in messages)
+    assert b"To: b@example.com\r\n" in messages[1].as_bytes()
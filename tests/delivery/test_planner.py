@@ -0,0 +1,70 @@
+"""Tests for planning SMTP transactions by destination domain."""
+
+import logging
+
+from app.delivery.planner import (
+    DomainTimings,
+    Transaction,
+    log_domain_timing,
+    plan_transactions,
+    recipient_domain,
+)
+
+
+def test_recipient_domain_ignores_display_name_and_case():
+    """Test that the domain is taken from the bare, lower-cased address."""
+    assert recipient_domain("Jane <jane@Example.COM>") == "example.com"
+    assert recipient_domain("nobody") == ""
+
+
+def test_plan_groups_by_domain_in_first_seen_order():
+    """Test that recipients of one domain are sent together."""
+    plan = plan_transactions(["a@x.com", "b@y.com", "c@x.com"])
+
+    assert plan == [
+        Transaction("x.com", ["a@x.com", "c@x.com"]),
+        Transaction("y.com", ["b@y.com"]),
+    ]
+
+
+def test_plan_caps_recipients_per_transaction():
+    """Test that large domains are split at max_recipients."""
+    plan = plan_transactions([f"u{i}@x.com" for i in range(5)], max_recipients=2)
+
+    assert [len(txn.recipients) for txn in plan] == [2, 2, 1]
+    assert {txn.domain for txn in plan} == {"x.com"}
+
+
+def test_plan_sends_slow_domains_last():
+    """Test that known slow domains follow fast and unknown ones."""
+    timings = DomainTimings()
+    timings.record("slow.com", 5.0)
+    timings.record("fast.com", 0.1)
+
+    plan = plan_transactions(["a@slow.com", "b@fast.com", "c@new.com"], timings=timings)
+
+    assert [txn.domain for txn in plan] == ["new.com", "fast.com", "slow.com"]
+
+
+def test_timings_keep_moving_average():
+    """Test that new samples move the average by the smoothing factor."""
+    timings = DomainTimings(smoothing=0.5)
+    timings.record("x.com", 1.0)
+    timings.record("x.com", 3.0)
+
+    assert timings.average("x.com") == 2.0
+    assert timings.average("y.com") is None
+    assert timings.stats() == [{"domain": "x.com", "seconds": 2.0, "transactions": 2}]
+
+
+def test_slow_domain_logged_as_warning(caplog):
+    """Test that domains over the threshold are logged as warnings."""
+    with caplog.at_level(logging.DEBUG, logger="app.delivery.planner"):
+        log_domain_timing("fast.com", 3, 0.5, 10)
+        log_domain_timing("slow.com", 3, 12.0, 10)
+
+    levels = [(record.getMessage(), record.levelno) for record in caplog.records]
+    assert levels == [
+        ("Domain fast.com: 3 recipients in 0.500s", logging.DEBUG),
+        ("Domain slow.com: 3 recipients in 12.000s", logging.WARNING),
+    ]
@@ -0,0 +1,154 @@
+"""Tests for the SMTP connection pool."""
+
+import smtplib
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.delivery.pool import SMTPConnectionPool, get_smtp_pool, reset_smtp_pool
+
+
+def make_connection(noop_code=250):
+    """Create a mock Flask-Mail connection."""
+    connection = MagicMock()
+    connection.__enter__.return_value = connection
+    connection.host.noop.return_value = (noop_code, b"OK")
+    connection.host.sendmail.return_value = {}
+    return connection
+
+
+def make_message():
+    """Create a mock Flask-Mail message."""
+    message = MagicMock()
+    message.send_to = {"to@example.com"}
+    message.sender = "from@example.com"
+    message.has_bad_headers.return_value = False
+    return message
+
+
+@pytest.fixture(autouse=True)
+def app_context(app):
+    """Run every test inside an application context, like a job does."""
+    with app.app_context():
+        yield
+
+
+@pytest.fixture
+def connect():
+    """Factory returning a fresh mock connection on every call."""
+    return MagicMock(side_effect=lambda: make_connection())
+
+
+def test_connection_is_reused(connect):
+    """Test that a checked in connection is handed out again."""
+    pool = SMTPConnectionPool(connect)
+
+    with pool.connection() as first:
+        first.send(make_message())
+    with pool.connection() as second:
+        second.send(make_message())
+
+    assert first is second
+    assert connect.call_count == 1
+    assert pool.stats() == {"opened": 1, "saved": 1, "retired": 0, "idle": 1}
+
+
+def test_dead_connection_fails_noop_and_is_replaced(connect):
+    """Test that a connection failing the NOOP check is not reused."""
+    pool = SMTPConnectionPool(connect)
+
+    with pool.connection() as first:
+        first.send(make_message())
+    first.host.noop.side_effect = smtplib.SMTPServerDisconnected()
+
+    with pool.connection() as second:
+        second.send(make_message())
+
+    assert first is not second
+    assert pool.stats()["opened"] == 2
+    assert pool.stats()["retired"] == 1
+
+
+def test_reconnects_when_server_drops_connection(connect):
+    """Test that send reconnects once after a disconnect."""
+    pool = SMTPConnectionPool(connect)
+    pooled = pool.checkout()
+    pooled.host.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+    message = make_message()
+
+    refused = pooled.send(message)
+
+    assert refused == {}
+    assert pool.stats()["opened"] == 2
+    assert pooled.host.sendmail.call_count == 1
+
+
+def test_message_cap_retires_connection(connect):
+    """Test that a connection is retired after max_messages sends."""
+    pool = SMTPConnectionPool(connect, max_messages=2)
+
+    with pool.connection() as conn:
+        conn.send(make_message())
+        conn.send(make_message())
+
+    assert pool.stats()["idle"] == 0
+    assert pool.stats()["retired"] == 1
+
+
+def test_message_cap_holds_within_one_checkout(connect):
+    """Test that a checkout sending past max_messages reconnects."""
+    pool = SMTPConnectionPool(connect, max_messages=2)
+
+    with pool.connection() as conn:
+        for _ in range(5):
+            conn.send(make_message())
+
+    # Messages 1-2, 3-4 and 5 each went over their own connection.
+    assert connect.call_count == 3
+    assert conn.messages_sent == 1
+
+
+def test_age_cap_retires_connection(connect):
+    """Test that a connection older than max_age is not reused."""
+    pool = SMTPConnectionPool(connect, max_age=60)
+
+    with patch("app.delivery.pool.time.monotonic", return_value=0.0):
+        pooled = pool.checkout()
+    pool._idle.append(pooled)
+
+    with patch("app.delivery.pool.time.monotonic", return_value=61.0):
+        replacement = pool.checkout()
+
+    assert replacement is not pooled
+    assert pool.stats()["opened"] == 2
+
+
+def test_disconnect_inside_block_discards_connection(connect):
+    """Test that a broken connection is not returned to the pool."""
+    pool = SMTPConnectionPool(connect)
+
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        with pool.connection():
+            raise smtplib.SMTPServerDisconnected()
+
+    assert pool.stats()["idle"] == 0
+
+
+def test_pool_is_bounded(connect):
+    """Test that only max_size idle connections are kept."""
+    pool = SMTPConnectionPool(connect, max_size=1)
+    first = pool.checkout()
+    second = pool.checkout()
+
+    pool.checkin(first)
+    pool.checkin(second)
+
+    assert pool.stats()["idle"] == 1
+    assert pool.stats()["retired"] == 1
+
+
+def test_get_smtp_pool_is_process_wide():
+    """Test that the worker pool is created once per process."""
+    reset_smtp_pool()
+    assert get_smtp_pool() is get_smtp_pool()
+    reset_smtp_pool()
@@ -0,0 +1,133 @@
+"""Tests for priority queues and the weighted worker."""
+
+import random
+from collections import Counter
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from rq.queue import Queue
+from rq.utils import utcnow
+
+from app.delivery import queues
+from app.delivery.queues import (
+    WAIT_KEY,
+    WeightedWorker,
+    priority_queue,
+    queue_stats,
+    record_wait,
+    weighted_order,
+)
+from app.event.jobs import event_fields
+from app.utils.stats import summarize
+
+
+def make_queues(connection, names=("high", "default", "low")):
+    """Build real RQ queues over a mocked connection."""
+    return [Queue(name, connection=connection) for name in names]
+
+
+def test_priority_queue_maps_priorities():
+    """Test that priorities map to queues, normal by default."""
+    assert priority_queue("high", {}) == "high"
+    assert priority_queue(None, {}) == "default"
+    assert priority_queue("low", {"MAIL_PRIORITY_QUEUES": {"normal": "bulk"}}) == (
+        "bulk"
+    )
+
+
+def test_weighted_order_favours_heavy_queues(monkeypatch):
+    """Test that the heavier queue comes first most of the time."""
+    monkeypatch.setattr(queues.random, "random", random.Random(7).random)
+    first = Counter(
+        weighted_order(make_queues(MagicMock()), {"high": 10, "default": 3})[0].name
+        for _ in range(2000)
+    )
+
+    assert first["high"] > first["default"] > first["low"] > 0
+    assert first["high"] / 2000 == pytest.approx(10 / 14, abs=0.05)
+
+
+def test_worker_redraws_order_for_each_job():
+    """Test that the worker reorders its queues with its weights."""
+    connection = MagicMock()
+    worker = WeightedWorker(
+        make_queues(connection), connection=connection, weights={"high": 10}
+    )
+    with patch.object(queues, "weighted_order", return_value=["x"]) as order:
+        worker.reorder_queues(worker.queues[0])
+
+    order.assert_called_once_with(worker.queues, {"high": 10.0})
+    assert worker._ordered_queues == ["x"]
+
+
+def test_worker_reads_weights_from_config(app):
+    """Test that the worker defaults to MAIL_QUEUE_WEIGHTS."""
+    connection = MagicMock()
+    with app.app_context():
+        worker = WeightedWorker(make_queues(connection), connection=connection)
+
+    assert worker.weights == {"high": 10.0, "default": 3.0, "low": 1.0}
+
+
+def test_record_wait_keeps_recent_samples():
+    """Test that the queue wait of a job is pushed and trimmed."""
+    connection = MagicMock()
+    job = MagicMock(enqueued_at=utcnow() - timedelta(seconds=2))
+
+    record_wait(connection, "high", job)
+
+    pipe = connection.pipeline.return_value
+    key, waited = pipe.lpush.call_args.args
+    assert key == WAIT_KEY.format(queue="high")
+    assert waited == pytest.approx(2, abs=0.5)
+    pipe.ltrim.assert_called_once_with(key, 0, queues.WAIT_SAMPLES - 1)
+
+
+def test_queue_stats_reports_depth_and_waits():
+    """Test that depth, oldest wait and wait summary are reported per queue."""
+    connection = MagicMock()
+    connection.pipeline.return_value.execute.return_value = [
+        2,
+        b"job-1",
+        [b"0.5", b"1.5"],
+        0,
+        None,
+        [],
+    ]
+    oldest = MagicMock(enqueued_at=utcnow() - timedelta(seconds=30))
+    with patch.object(queues.Job, "fetch_many", return_value=[oldest]) as fetch:
+        stats = queue_stats(connection, ["high", "low"], {"high": 10})
+
+    fetch.assert_called_once_with(["job-1"], connection=connection)
+    high, low = stats
+    assert (high["name"], high["weight"], high["depth"]) == ("high", 10, 2)
+    assert high["oldest_wait"] == pytest.approx(30, abs=1)
+    assert high["wait"] == summarize([0.5, 1.5])
+    assert (low["depth"], low["oldest_wait"], low["wait"]["samples"]) == (0, None, 0)
+
+
+def test_event_fields_rejects_unknown_priority():
+    """Test that only the known priorities are accepted."""
+    with pytest.raises(ValueError, match="Priority"):
+        event_fields(
+            {
+                "subject": "Subject",
+                "content": "Body",
+                "timestamp": "10 May 2025 08:00 +00",
+                "recipients": "a@example.com",
+                "priority": "urgent",
+            }
+        )
+
+
+def test_queue_metrics_endpoint(client):
+    """Test that the queue metrics endpoint reports every queue."""
+    report = [{"name": "high", "depth": 0}]
+    with patch("app.api.routes.queue_stats", return_value=report), patch(
+        "app.api.routes.rq"
+    ):
+        response = client.get("/api/metrics/queues")
+
+    assert response.status_code == 200
+    assert response.json == {"queues": report}
@@ -0,0 +1,195 @@
+"""Tests for the Redis token bucket rate limiter."""
+
+import asyncio
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.delivery.ratelimit import (
+    BUCKET_KEY,
+    STATS_KEY,
+    Limit,
+    RateLimiter,
+    limits_for_scope,
+    rate_limit_stats,
+)
+
+CONFIG = {
+    "MAIL_RATE_LIMITS": {
+        "relay:smtp.x.com": {"per_minute": 60, "per_day": 1000},
+        "sender:me@x.com": {"per_second": 5},
+    }
+}
+
+
+def make_limiter(replies, limits=None):
+    """Build a limiter whose Lua script returns the given replies in turn."""
+    connection = MagicMock()
+    script = connection.register_script.return_value
+    script.side_effect = replies
+    limiter = RateLimiter(connection, limits or [Limit("relay:x:per_minute", 60, 60)])
+    return limiter, connection, script
+
+
+def test_limits_for_scope_skips_unknown_and_empty_periods():
+    """Test that only known, non-zero periods become buckets."""
+    limits = limits_for_scope("relay:x", {"per_minute": 60, "per_day": 0, "x": 1})
+    assert limits == [Limit("relay:x:per_minute", 60, 60)]
+
+
+def test_from_config_combines_scopes():
+    """Test that every bucket of every requested scope is drawn from."""
+    limiter = RateLimiter.from_config(
+        MagicMock(), CONFIG, "relay:smtp.x.com", "sender:me@x.com"
+    )
+    assert [limit.name for limit in limiter.limits] == [
+        "relay:smtp.x.com:per_minute",
+        "relay:smtp.x.com:per_day",
+        "sender:me@x.com:per_second",
+    ]
+    assert limiter.burst == 5
+
+
+def test_from_config_without_limits():
+    """Test that unlisted scopes need no limiter."""
+    assert RateLimiter.from_config(MagicMock(), CONFIG, "relay:other") is None
+    assert RateLimiter.from_config(MagicMock(), {}, "relay:smtp.x.com") is None
+
+
+def test_try_acquire_passes_keys_and_quotas():
+    """Test that the script gets one key and one quota per bucket."""
+    limiter, _, script = make_limiter([[1, "0", "59"]])
+
+    assert limiter.try_acquire(1) == 0.0
+    script.assert_called_once_with(
+        keys=[BUCKET_KEY.format(name="relay:x:per_minute")], args=[1, 60, 60]
+    )
+
+
+def test_try_acquire_reports_wait_when_empty():
+    """Test that a refused acquisition returns the time to wait."""
+    limiter, _, _ = make_limiter([[0, "2.5", "0.5"]])
+    assert limiter.try_acquire(3) == 2.5
+
+
+@patch("app.delivery.ratelimit.time.sleep")
+def test_acquire_waits_and_records_stats(mock_sleep):
+    """Test that acquire sleeps until tokens are available."""
+    limiter, connection, _ = make_limiter([[0, "1.5", "0"], [1, "0", "0"]])
+
+    assert limiter.acquire(1) == 1.5
+
+    mock_sleep.assert_called_once_with(1.5)
+    pipe = connection.pipeline.return_value
+    pipe.hincrbyfloat.assert_called_once_with(
+        STATS_KEY, "relay:x:per_minute:waited", 1.5
+    )
+    pipe.hincrby.assert_called_once_with(STATS_KEY, "relay:x:per_minute:waits", 1)
+
+
+@patch("app.delivery.ratelimit.time.sleep")
+def test_acquire_caps_single_sleep(mock_sleep):
+    """Test that long waits are split to re-check the shared bucket."""
+    limiter, _, _ = make_limiter([[0, "30", "0"], [1, "0", "0"]])
+    limiter.max_sleep = 5.0
+
+    assert limiter.acquire(1) == 5.0
+    mock_sleep.assert_called_once_with(5.0)
+
+
+def test_acquire_slices_requests_larger_than_burst():
+    """Test that a request above bucket capacity is taken in slices."""
+    limiter, connection, script = make_limiter(
+        [[1, "0", "0"]] * 3, [Limit("sender:x:per_second", 4, 1)]
+    )
+
+    assert limiter.acquire(10) == 0.0
+    assert [c.kwargs["args"][0] for c in script.call_args_list] == [4, 4, 2]
+    assert not connection.pipeline.called
+
+
+def test_acquire_async_yields_while_waiting():
+    """Test that the coroutine version sleeps on the event loop."""
+    limiter, _, _ = make_limiter([[0, "0.01", "0"], [1, "0", "0"]])
+    assert asyncio.run(limiter.acquire_async(1)) == 0.01
+
+
+def test_acquire_async_calls_redis_off_the_event_loop():
+    """Test that the blocking script call runs outside the loop's thread."""
+    limiter, _, script = make_limiter([[1, "0", "0"]])
+    threads = []
+
+    def reply(**kwargs):
+        threads.append(threading.get_ident())
+        return [1, "0", "0"]
+
+    script.side_effect = reply
+
+    asyncio.run(limiter.acquire_async(1))
+
+    assert threads and threads[0] != threading.get_ident()
+
+
+def test_stats_reports_levels_without_taking_tokens():
+    """Test that stats peeks at the buckets with a zero token request."""
+    limiter, connection, script = make_limiter([[1, "0", "42.123"]])
+    connection.hgetall.return_value = {
+        b"relay:x:per_minute:waited": b"3.5",
+        b"relay:x:per_minute:waits": b"2",
+    }
+
+    assert limiter.stats() == [
+        {
+            "name": "relay:x:per_minute",
+            "capacity": 60,
+            "period": 60,
+            "tokens": 42.12,
+            "waited_seconds": 3.5,
+            "waits": 2,
+        }
+    ]
+    assert script.call_args.kwargs["args"][0] == 0
+
+
+def test_rate_limit_stats_without_limits():
+    """Test that no Redis call is made when nothing is limited."""
+    connection = MagicMock()
+    assert rate_limit_stats(connection, {}) == []
+    assert not connection.register_script.called
+
+
+def test_rate_limit_metrics_endpoint(client):
+    """Test that the metrics endpoint returns the bucket statistics."""
+    buckets = [{"name": "relay:x:per_minute", "tokens": 3.0}]
+    with patch("app.api.routes.rate_limit_stats", return_value=buckets):
+        response = client.get("/api/metrics/rate_limits")
+
+    assert response.status_code == 200
+    assert response.json == {"buckets": buckets}
+
+
+@pytest.mark.parametrize("engine", ["smtp", "async"])
+def test_deliver_mail_acquires_one_token_per_recipient(app, monkeypatch, engine):
+    """Test that both delivery engines draw from the shared limiter."""
+    from app.event import jobs
+
+    limiter = MagicMock(acquire_async=AsyncMock())
+    smtp = AsyncMock()
+    smtp.sendmail.return_value = ({}, "OK")
+    monkeypatch.setattr(jobs, "rate_limiter", lambda relay=None: limiter)
+    monkeypatch.setattr(jobs, "db", MagicMock())
+    monkeypatch.setattr(jobs, "mail", MagicMock())
+    monkeypatch.setitem(app.config, "MAIL_DELIVERY_ENGINE", engine)
+    monkeypatch.setitem(app.config, "MAIL_SUPPRESS_SEND", False)
+
+    event = MagicMock(id=1, email_subject="Subject", mime_body=b"\r\nBody")
+    with app.app_context(), patch(
+        "app.delivery.async_engine.aiosmtplib.SMTP", return_value=smtp
+    ):
+        jobs.deliver_mail(event, ["a@x.com", "b@x.com"])
+
+    if engine == "smtp":
+        limiter.acquire.assert_called_once_with(2)
+    else:
+        limiter.acquire_async.assert_called_once_with(2)
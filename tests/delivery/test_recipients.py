@@ -0,0 +1,91 @@
+"""Tests for streaming event recipients from the database."""
+
+from datetime import UTC, datetime
+
+import pytest
+
+from app.database.models import Event, Recipient
+from app.delivery.recipients import recipient_batches, recipient_ranges
+from app.delivery.status import mark_recipients
+
+
+@pytest.fixture
+def event_with_recipients(session):
+    """Create an event with five recipients, the second one named."""
+    event = Event(
+        email_subject="Stream",
+        email_content="Body",
+        timestamp=datetime.now(UTC),
+    )
+    session.add(event)
+    session.commit()
+    for i in range(5):
+        session.add(
+            Recipient(
+                email=f"user{i}@example.com",
+                name="User One" if i == 1 else None,
+                event_id=event.id,
+            )
+        )
+    session.commit()
+    return event
+
+
+def recipient_ids(session, event_id):
+    """Return the recipient IDs of an event in ascending order."""
+    rows = session.query(Recipient).filter_by(event_id=event_id)
+    return sorted(row.id for row in rows)
+
+
+def test_recipient_ranges_split_by_chunk_size(session, event_with_recipients):
+    """Test that IDs are split into inclusive ranges of chunk_size."""
+    ids = recipient_ids(session, event_with_recipients.id)
+
+    ranges = recipient_ranges(session, event_with_recipients.id, 2)
+
+    assert ranges == [(ids[0], ids[1]), (ids[2], ids[3]), (ids[4], ids[4])]
+
+
+def test_recipient_ranges_skip_other_statuses(session, event_with_recipients):
+    """Test that only queued recipients are counted."""
+    session.query(Recipient).filter_by(event_id=event_with_recipients.id).update(
+        {"status": Recipient.STATUS_SENT}
+    )
+
+    assert recipient_ranges(session, event_with_recipients.id, 2) == []
+
+
+def test_recipient_batches_page_by_id(session, event_with_recipients):
+    """Test that addresses come in pages, with display names kept."""
+    batches = list(recipient_batches(session, event_with_recipients.id, 2))
+
+    assert batches == [
+        ["user0@example.com", "User One <user1@example.com>"],
+        ["user2@example.com", "user3@example.com"],
+        ["user4@example.com"],
+    ]
+
+
+def test_recipient_batches_within_range(session, event_with_recipients):
+    """Test that first_id and last_id bound the pages."""
+    ids = recipient_ids(session, event_with_recipients.id)
+
+    batches = list(
+        recipient_batches(session, event_with_recipients.id, 10, ids[1], ids[3])
+    )
+
+    assert batches == [
+        ["User One <user1@example.com>", "user2@example.com", "user3@example.com"]
+    ]
+
+
+def test_recipient_batches_survive_status_changes(session, event_with_recipients):
+    """Test that marking a page sent between pages does not skip anyone."""
+    seen = []
+    for batch in recipient_batches(session, event_with_recipients.id, 2):
+        seen.extend(batch)
+        mark_recipients(session, event_with_recipients.id, batch, Recipient.STATUS_SENT)
+        session.commit()
+
+    assert len(seen) == 5
+    assert recipient_ranges(session, event_with_recipients.id, 2) == []
@@ -0,0 +1,229 @@
+"""Tests for routing deliveries across SMTP relays."""
+
+from collections import Counter
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.database.models import Recipient
+from app.delivery.relays import Relay, RelayRouter, RelayUnavailable
+
+
+class FakeRedis:
+    """Just enough of a Redis client for the router, without expiry."""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def decr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) - 1
+        return self.data[key]
+
+    def expire(self, key, seconds):
+        return True
+
+    def ttl(self, key):
+        return 60 if key in self.data else -2
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def hincrby(self, key, field, amount):
+        counters = self.data.setdefault(key, {})
+        counters[field.encode()] = counters.get(field.encode(), 0) + amount
+        return counters[field.encode()]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+
+class FakePipeline:
+    """Queue FakeRedis calls and run them on execute."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.redis, name), args, kwargs))
+
+        return queue
+
+    def execute(self):
+        return [func(*args, **kwargs) for func, args, kwargs in self.calls]
+
+
+RELAYS = [
+    Relay("primary", "smtp1.x.com", weight=3),
+    Relay("backup", "smtp2.x.com", weight=1),
+]
+
+
+@pytest.fixture
+def router():
+    """Build a router over two relays backed by FakeRedis."""
+    return RelayRouter(FakeRedis(), list(RELAYS), failure_threshold=2)
+
+
+def fail(router, relay, times=1):
+    """Report failed deliveries through a relay."""
+    for _ in range(times):
+        with pytest.raises(OSError):
+            with patch.object(router, "acquire", return_value=relay):
+                with router.lease():
+                    raise OSError("Connection refused")
+
+
+def test_relay_from_dict_defaults_name_and_credentials():
+    """Test that relays are named after their host and inherit credentials."""
+    relay = Relay.from_dict({"server": "smtp1.x.com", "port": 2525, "extra": 1})
+    config = relay.mail_config({"MAIL_USERNAME": "me", "MAIL_PASSWORD": "pw"})
+
+    assert relay.name == "smtp1.x.com"
+    assert config["MAIL_SERVER"] == "smtp1.x.com"
+    assert config["MAIL_PORT"] == 2525
+    assert config["MAIL_USERNAME"] == "me"
+
+
+def test_from_config_without_relays():
+    """Test that no router is built when MAIL_RELAYS is empty."""
+    assert RelayRouter.from_config(FakeRedis(), {"MAIL_RELAYS": []}) is None
+
+
+def test_acquire_spreads_by_weight(router):
+    """Test that relays are chosen in proportion to their weights."""
+    picks = Counter(router.acquire().name for _ in range(2000))
+    assert 0.68 < picks["primary"] / 2000 < 0.82
+
+
+def test_consecutive_failures_take_relay_out(router):
+    """Test that a failing relay leaves rotation at the threshold."""
+    fail(router, RELAYS[0])
+    assert RELAYS[0] in router.candidates()
+
+    fail(router, RELAYS[0])
+    assert router.candidates() == [RELAYS[1]]
+
+
+def test_relay_is_probed_back_in(router):
+    """Test that one delivery probes a relay once its pause is over."""
+    fail(router, RELAYS[0], times=2)
+    router.connection.delete(router.key(RELAYS[0], "down"))
+
+    assert router.candidates()[0] == RELAYS[0]
+    assert RELAYS[0] not in router.candidates()
+
+    with patch.object(router, "acquire", return_value=RELAYS[0]):
+        with router.lease() as lease:
+            lease.report(["a@x.com"], {}, {})
+    assert router.candidates().count(RELAYS[0]) == 1
+    assert router.stats()[0]["consecutive_failures"] == 0
+
+
+def test_no_relay_available(router):
+    """Test that acquire gives up when every relay is down."""
+    for relay in RELAYS:
+        fail(router, relay, times=2)
+    with pytest.raises(RelayUnavailable):
+        router.acquire()
+
+
+def test_concurrency_cap():
+    """Test that a saturated relay is not leased until a slot frees up."""
+    relay = Relay("only", "smtp.x.com", max_concurrency=1)
+    router = RelayRouter(FakeRedis(), [relay], wait_timeout=0)
+
+    with router.lease():
+        with pytest.raises(RelayUnavailable):
+            router.acquire()
+    assert router.acquire() == relay
+
+
+def test_stats_counts_sent_refused_and_errors(router):
+    """Test the per-relay throughput and error counters."""
+    with patch.object(router, "acquire", return_value=RELAYS[1]):
+        with router.lease() as lease:
+            lease.report(["a@x.com", "b@x.com"], {"b@x.com": (550, b"No")}, {})
+    fail(router, RELAYS[1])
+
+    stats = {entry["name"]: entry for entry in router.stats()}
+    assert stats["backup"]["transactions"] == 2
+    assert stats["backup"]["sent"] == 1
+    assert stats["backup"]["refused"] == 1
+    assert stats["backup"]["errors"] == 1
+    assert stats["primary"]["transactions"] == 0
+
+
+def test_lease_report_flags_overload_as_unhealthy():
+    """Test that 421 replies count against the relay but 5xx do not."""
+    from app.delivery.relays import RelayLease
+
+    lease = RelayLease(RELAYS[0])
+    lease.report(["a@x.com"], {"a@x.com": (550, b"No")}, {})
+    assert lease.healthy
+
+    lease.report(["a@x.com"], {"a@x.com": (421, b"Busy")}, {})
+    assert not lease.healthy
+
+
+def test_send_mail_routes_through_leased_relay(app, router, monkeypatch):
+    """Test that send_mail delivers through a relay and counts the result."""
+    from app.event import jobs
+
+    monkeypatch.setattr(jobs, "relay_lease", router.lease)
+    monkeypatch.setattr(jobs, "db", MagicMock())
+    monkeypatch.setattr(jobs, "record_delivery", MagicMock())
+    event = MagicMock(id=1, email_subject="Subject", mime_body=b"\r\nBody")
+
+    with app.app_context():
+        jobs.deliver_mail(event, ["a@x.com", "b@x.com"])
+
+    assert sum(entry["sent"] for entry in router.stats()) == 2
+
+
+def test_send_mail_defers_when_no_relay_is_available(app, router, monkeypatch):
+    """Test that recipients are retried later when every relay is down."""
+    from app.event import jobs
+
+    for relay in RELAYS:
+        fail(router, relay, times=2)
+    scheduler = MagicMock()
+    monkeypatch.setattr(jobs, "relay_lease", router.lease)
+    monkeypatch.setattr(jobs, "db", MagicMock())
+    monkeypatch.setattr(jobs.rq, "get_scheduler", lambda: scheduler)
+    monkeypatch.setattr(jobs.rq, "_connection", MagicMock())
+    event = MagicMock(id=1, email_subject="Subject", mime_body=b"\r\nBody")
+
+    with app.app_context(), patch.object(jobs, "mark_recipients") as mock_mark:
+        jobs.deliver_mail(event, ["a@x.com"])
+
+    assert mock_mark.call_args[0][3] == Recipient.STATUS_DEFERRED
+    assert scheduler.enqueue_in.call_args[0][1:] == (jobs.retry_mail, 1, 1)
+
+
+def test_relay_metrics_endpoint(client):
+    """Test that the relay metrics endpoint lists no relays by default."""
+    response = client.get("/api/metrics/relays")
+    assert response.status_code == 200
+    assert response.json == {"relays": []}
+
@@ -0,0 +1,89 @@
+"""Tests for rendering personalised messages in a process pool."""
+
+import email
+from concurrent.futures import Future
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.delivery.mime import MessageTemplate, PreparedMessage
+from app.delivery.render import (
+    RenderPool,
+    get_render_pool,
+    render_batch,
+    reset_render_pool,
+)
+
+
+@pytest.fixture
+def template(app):
+    """Create a template of a plain text message."""
+    with app.app_context():
+        message = PreparedMessage(
+            subject="Subject", sender="from@example.com", mime_part=b"\r\nBody"
+        )
+        return MessageTemplate(message)
+
+
+def test_render_batch_keeps_recipient_order(template):
+    """Test that a batch renders one message per recipient, in order."""
+    rendered = render_batch(template, ["a@x.com", "b@x.com"])
+
+    assert [email.message_from_bytes(data)["To"] for data in rendered] == [
+        "a@x.com",
+        "b@x.com",
+    ]
+
+
+def test_render_pool_renders_in_processes(template):
+    """Test that messages come back in order from the worker processes."""
+    pool = RenderPool(processes=2, queue_depth=2, batch_size=3)
+    try:
+        recipients = [f"user{i}@x.com" for i in range(10)]
+        messages = list(pool.render(template, recipients))
+    finally:
+        pool.close()
+
+    assert [msg.send_to for msg in messages] == [{addr} for addr in recipients]
+    assert all(msg.sender == "from@example.com" for msg in messages)
+    assert b"To: user9@x.com\r\n" in messages[-1].as_bytes()
+
+
+def test_render_pool_bounds_batches_ahead(template):
+    """Test that no more than queue_depth batches are submitted ahead."""
+    pool = RenderPool(processes=1, queue_depth=2, batch_size=1)
+    pool.executor.shutdown()
+    submitted = []
+
+    def submit(func, tmpl, batch):
+        submitted.append(batch)
+        future = Future()
+        future.set_result(func(tmpl, batch))
+        return future
+
+    pool.executor = MagicMock(submit=submit)
+    messages = pool.render(template, [f"user{i}@x.com" for i in range(5)])
+
+    next(messages)
+    assert len(submitted) == 2
+    next(messages)
+    assert len(submitted) == 3
+    assert len(list(messages)) == 3
+
+
+def test_render_pool_disabled_by_default(app):
+    """Test that there is no pool unless MAIL_RENDER_PROCESSES is set."""
+    with app.app_context():
+        assert get_render_pool() is None
+
+
+def test_get_render_pool_is_reused(app, monkeypatch):
+    """Test that the worker process keeps one pool."""
+    monkeypatch.setitem(app.config, "MAIL_RENDER_PROCESSES", 1)
+    with app.app_context():
+        try:
+            pool = get_render_pool()
+            assert pool is get_render_pool()
+            assert pool.processes == 1
+        finally:
+            reset_render_pool()
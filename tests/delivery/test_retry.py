@@ -0,0 +1,107 @@
+"""Tests for SMTP failure classification and relay backoff."""
+
+import smtplib
+import socket
+import ssl
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.delivery.retry import (
+    BACKOFF_KEY,
+    RelayBackoff,
+    backoff_delay,
+    group_by_code,
+    is_overload,
+    is_transient,
+    is_transient_error,
+    split_refused,
+)
+
+
+@pytest.mark.parametrize(
+    "code,expected", [(421, True), (450, True), (550, False), (250, False)]
+)
+def test_is_transient(code, expected):
+    """Test that only 4xx replies are retried."""
+    assert is_transient(code) is expected
+
+
+@pytest.mark.parametrize(
+    "error,expected",
+    [
+        (smtplib.SMTPServerDisconnected("gone"), True),
+        (ConnectionRefusedError(), True),
+        (TimeoutError(), True),
+        (socket.gaierror(), True),
+        (smtplib.SMTPResponseException(421, b"Closing"), True),
+        (smtplib.SMTPAuthenticationError(535, b"Bad credentials"), False),
+        (smtplib.SMTPSenderRefused(550, b"Denied", "a@x.com"), False),
+        (smtplib.SMTPNotSupportedError(), False),
+        (ssl.SSLCertVerificationError(), False),
+    ],
+)
+def test_is_transient_error(error, expected):
+    """Test that only 4xx replies and connection errors are retried."""
+    assert is_transient_error(error) is expected
+
+
+def test_split_refused_and_group_by_code():
+    """Test that refusals are split by class and grouped by code."""
+    refused = {
+        "a@x.com": (550, b"No such user"),
+        "b@x.com": (451, b"Try later"),
+        "c@x.com": (451, b"Try later"),
+    }
+    permanent, transient = split_refused(refused)
+
+    assert permanent == {"a@x.com": (550, b"No such user")}
+    assert group_by_code(transient) == {451: ["b@x.com", "c@x.com"]}
+
+
+def test_is_overload():
+    """Test that throttling replies are told apart from mailbox errors."""
+    assert is_overload([450, 421])
+    assert not is_overload([450, 550])
+
+
+@pytest.mark.parametrize("attempt", range(8))
+def test_backoff_delay_grows_with_jitter_and_cap(attempt):
+    """Test that delays stay between half and all of the capped exponential."""
+    delay = min(100, 2 * 2**attempt)
+    assert delay / 2 <= backoff_delay(attempt, 2, 100) <= delay
+
+
+def test_relay_backoff_signal_escalates_pause():
+    """Test that repeated overload signals lengthen the shared pause."""
+    connection = MagicMock()
+    connection.pipeline.return_value.execute.return_value = [3, True]
+    backoff = RelayBackoff(connection, "relay:x", base=1, cap=60)
+
+    pause = backoff.signal()
+
+    assert 2 <= pause <= 4
+    args, kwargs = connection.set.call_args
+    assert args[0] == BACKOFF_KEY.format(relay="relay:x")
+    assert kwargs["px"] == int(pause * 1000)
+
+
+@patch("app.delivery.retry.time.sleep")
+def test_relay_backoff_wait_sleeps_for_remaining_pause(mock_sleep):
+    """Test that senders sleep out the remaining pause."""
+    connection = MagicMock()
+    connection.pttl.return_value = 1500
+    backoff = RelayBackoff(connection, "relay:x")
+
+    assert backoff.wait() == 1.5
+    mock_sleep.assert_called_once_with(1.5)
+
+
+@patch("app.delivery.retry.time.sleep")
+def test_relay_backoff_wait_without_pause(mock_sleep):
+    """Test that nothing sleeps when the relay is not paused."""
+    connection = MagicMock()
+    connection.pttl.return_value = -2
+
+    assert RelayBackoff(connection, "relay:x").wait() == 0.0
+    assert not mock_sleep.called
@@ -0,0 +1,158 @@
+"""Tests for the local SMTP sink."""
+
+import asyncio
+import smtplib
+import time
+
+import pytest
+
+from app.delivery.async_engine import AsyncDeliveryEngine, Envelope
+from app.delivery.sink import SMTPSink
+
+
+@pytest.fixture
+def sink():
+    """Run a sink on a free port."""
+    with SMTPSink(seed=1) as running:
+        yield running
+
+
+def send(sink, recipients=("a@x.com",)):
+    """Send one message to the sink with smtplib."""
+    with smtplib.SMTP(sink.host, sink.port) as smtp:
+        return smtp.sendmail("from@x.com", list(recipients), b"Subject: Hi\r\n\r\nBody")
+
+
+def test_sink_counts_accepted_messages(sink):
+    """Test that every accepted message and recipient is counted."""
+    send(sink, ["a@x.com", "b@x.com"])
+    send(sink)
+
+    stats = sink.stats()
+    assert stats["messages"] == 2
+    assert stats["recipients"] == 3
+    assert stats["connections"] == 2
+
+
+def test_sink_accepts_login(sink):
+    """Test that Flask-Mail style AUTH succeeds with any credentials."""
+    with smtplib.SMTP(sink.host, sink.port) as smtp:
+        smtp.login("user", "password")
+        smtp.sendmail("from@x.com", ["a@x.com"], b"Body")
+    assert sink.stats()["messages"] == 1
+
+
+def test_sink_injects_message_errors(sink):
+    """Test that error_rate refuses messages with the configured code."""
+    sink.error_rate = 1.0
+    sink.error_code = 451
+
+    with pytest.raises(smtplib.SMTPDataError) as excinfo:
+        send(sink)
+
+    assert excinfo.value.smtp_code == 451
+    assert sink.stats()["rejected_messages"] == 1
+    assert sink.stats()["messages"] == 0
+
+
+def test_sink_injects_recipient_errors(sink):
+    """Test that rcpt_error_rate refuses individual recipients."""
+    sink.rcpt_error_rate = 0.5
+
+    refused = {}
+    for n in range(20):
+        try:
+            refused.update(send(sink, [f"a{n}@x.com", f"b{n}@x.com"]))
+        except smtplib.SMTPRecipientsRefused as exc:
+            refused.update(exc.recipients)
+
+    stats = sink.stats()
+    assert 0 < stats["rejected_recipients"] < 40
+    assert len(refused) == stats["rejected_recipients"]
+    assert {code for code, _ in refused.values()} == {550}
+
+
+def test_sink_latency(sink):
+    """Test that each message is delayed by the configured latency."""
+    sink.latency = 0.05
+    start = time.monotonic()
+    send(sink)
+    assert time.monotonic() - start >= 0.05
+
+
+def test_async_engine_against_sink(sink):
+    """Test the asyncio engine end to end over real sockets."""
+    sink.latency = 0.02
+    engine = AsyncDeliveryEngine(sink.host, sink.port, concurrency=5)
+    envelopes = [
+        Envelope("from@x.com", [f"user{n}@x.com"], b"Subject: Hi\r\n\r\nBody")
+        for n in range(20)
+    ]
+
+    start = time.monotonic()
+    results = asyncio.run(engine.deliver_async(envelopes))
+
+    assert results == [{} for _ in envelopes]
+    assert sink.stats()["messages"] == 20
+    # Five sessions in parallel: well under 20 sequential latencies.
+    assert time.monotonic() - start < 20 * 0.02
+
+
+@pytest.fixture
+def app_on_sink(app, sink):
+    """Point the application's mail settings at the sink, then restore them."""
+    from app.benchmark import use_sink
+    from app.extensions import mail
+
+    saved = dict(app.config)
+    use_sink(app, sink)
+    yield app
+    app.config.clear()
+    app.config.update(saved)
+    mail.init_app(app)
+
+
+@pytest.mark.parametrize("pooled", [False, True])
+def test_deliver_mail_through_sink(app_on_sink, sink, pooled, monkeypatch):
+    """Test the blocking delivery path over real sockets."""
+    from unittest.mock import MagicMock
+
+    from app.delivery.pool import reset_smtp_pool
+    from app.event import jobs
+
+    monkeypatch.setitem(app_on_sink.config, "MAIL_POOL_ENABLED", pooled)
+    monkeypatch.setattr(jobs, "db", MagicMock())
+    event = MagicMock(id=1, email_subject="Subject", mime_body=b"\r\nBody")
+
+    with app_on_sink.app_context():
+        for _ in range(3):
+            jobs.deliver_mail(event, ["a@x.com", "b@x.com"])
+        reset_smtp_pool()
+
+    assert sink.stats()["recipients"] == 6
+    assert sink.stats()["connections"] == (1 if pooled else 3)
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_deliver_mail_personal_envelopes(app_on_sink, sink, processes, monkeypatch):
+    """Test that personal mode sends one message per recipient."""
+    from unittest.mock import MagicMock
+
+    from app.delivery.render import reset_render_pool
+    from app.event import jobs
+
+    monkeypatch.setitem(app_on_sink.config, "MAIL_POOL_ENABLED", False)
+    monkeypatch.setitem(app_on_sink.config, "MAIL_ENVELOPE_MODE", "personal")
+    monkeypatch.setitem(app_on_sink.config, "MAIL_RENDER_PROCESSES", processes)
+    monkeypatch.setattr(jobs, "db", MagicMock())
+    event = MagicMock(id=1, email_subject="Subject", mime_body=b"\r\nBody")
+
+    with app_on_sink.app_context():
+        try:
+            jobs.deliver_mail(event, ["a@x.com", "b@x.com", "c@y.com"])
+        finally:
+            reset_render_pool()
+
+    assert sink.stats()["connections"] == 1
+    assert sink.stats()["messages"] == 3
+    assert sink.stats()["recipients"] == 3
@@ -0,0 +1,86 @@
+"""Tests for batched per-recipient delivery status writes."""
+
+from datetime import UTC, datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.database.models import Event, Recipient
+from app.delivery.status import (
+    failed_recipients,
+    mark_recipients,
+    normalize_address,
+    record_delivery,
+)
+
+
+@pytest.fixture
+def event_with_recipients(session):
+    """Create an event with five queued recipients."""
+    event = Event(
+        email_subject="Status",
+        email_content="Body",
+        timestamp=datetime.now(UTC),
+    )
+    session.add(event)
+    session.commit()
+    for i in range(5):
+        session.add(Recipient(email=f"user{i}@example.com", event_id=event.id))
+    session.commit()
+    return event
+
+
+def statuses(session, event_id):
+    """Return a mapping of email to (status, smtp_code)."""
+    rows = session.query(Recipient).filter_by(event_id=event_id).all()
+    for row in rows:
+        session.refresh(row)
+    return {row.email: (row.status, row.smtp_code) for row in rows}
+
+
+def test_new_recipients_are_queued(session, event_with_recipients):
+    """Test that recipients start in the queued state."""
+    result = statuses(session, event_with_recipients.id)
+    assert set(result.values()) == {(Recipient.STATUS_QUEUED, None)}
+
+
+def test_normalize_address_strips_display_name():
+    """Test that display names are removed from addresses."""
+    assert normalize_address("Jane <jane@example.com>") == "jane@example.com"
+    assert normalize_address("jane@example.com") == "jane@example.com"
+
+
+def test_record_delivery_marks_sent_and_failed(session, event_with_recipients):
+    """Test that accepted and refused recipients get their own status."""
+    event_id = event_with_recipients.id
+    recipients = [f"user{i}@example.com" for i in range(5)]
+    refused = {
+        "user1@example.com": (550, b"No such user"),
+        "user3@example.com": (452, b"Mailbox full"),
+    }
+
+    record_delivery(session, event_id, recipients, refused)
+    session.commit()
+
+    result = statuses(session, event_id)
+    assert result["user0@example.com"] == (Recipient.STATUS_SENT, 250)
+    assert result["user1@example.com"] == (Recipient.STATUS_FAILED, 550)
+    assert result["user3@example.com"] == (Recipient.STATUS_FAILED, 452)
+    assert failed_recipients(session, event_id) == [
+        "user1@example.com",
+        "user3@example.com",
+    ]
+
+
+def test_mark_recipients_issues_one_statement_per_batch():
+    """Test that updates are batched instead of issued per row."""
+    session = MagicMock()
+    session.execute.return_value.rowcount = 2
+    addresses = [f"user{i}@example.com" for i in range(5)]
+
+    updated = mark_recipients(
+        session, 1, addresses, Recipient.STATUS_SENT, 250, batch_size=2
+    )
+
+    assert session.execute.call_count == 3
+    assert updated == 6
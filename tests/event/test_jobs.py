@@ -96,19 +96,20 @@ def test_dt_utc_without_timezone(monkeypatch):
 def test_schedule_mail(mock_redis):
     """Test scheduling an email."""
     event_id = 1
-    recipients = ["test@example.com"]
     timestamp = datetime.now(UTC) + timedelta(hours=1)
 
     # Call the function
-    schedule_mail(event_id, recipients, timestamp)
+    schedule_mail(event_id, timestamp)
 
-    # Check that the scheduler's enqueue_at method was called
+    # Only the event ID is stored with the job
     assert mock_redis.enqueue_at.called
-    mock_redis.enqueue_at.assert_called_with(timestamp, send_mail, event_id, recipients)
+    mock_redis.enqueue_at.assert_called_with(
+        timestamp, send_mail, event_id, queue_name="default"
+    )
 
 
 # Test send_mail function
-@patch("app.event.jobs.Message")
+@patch("app.event.jobs.PreparedMessage")
 def test_send_mail(mock_message_class, app, mock_event, monkeypatch):
     """Test sending an email."""
     # Setup
@@ -137,12 +138,20 @@ def test_send_mail(mock_message_class, app, mock_event, monkeypatch):
     mock_db_session.get.return_value = mock_event  # Add get method to return mock_event
     monkeypatch.setattr("app.event.jobs.db.session", mock_db_session)
 
+    # Recipients are read from the database by the job
+    monkeypatch.setattr(
+        "app.event.jobs.recipient_batches",
+        lambda *args, **kwargs: iter([["test@example.com"]]),
+    )
+
     # Call the function
     with app.app_context():
-        result = send_mail(1, ["test@example.com"])
+        result = send_mail(1)
 
     # Check that email was created with correct subject
-    mock_message_class.assert_called_once_with(subject=mock_event.email_subject)
+    mock_message_class.assert_called_once_with(
+        subject=mock_event.email_subject, mime_part=mock_event.mime_body
+    )
 
     # Check that email recipients were added
     assert mock_msg.add_recipient.called
@@ -69,14 +69,16 @@ def mock_event_query(monkeypatch, mock_event):
 
 
 @pytest.fixture
-def mock_mail_connection(monkeypatch):
+def mock_mail_connection(app, monkeypatch):
     """Mock flask_mail connection for testing."""
     mock_connection = MagicMock()
     mock_mail = MagicMock()
     mock_mail.connect.return_value.__enter__.return_value = mock_connection
 
     monkeypatch.setattr("app.event.jobs.mail", mock_mail)
-    return mock_connection
+    # send_mail reads the app config, as it does inside an RQ job
+    with app.app_context():
+        yield mock_connection
 
 
 # Test add_recipients function
@@ -222,21 +224,21 @@ def test_schedule_mail(monkeypatch):
     """Test scheduling an email."""
     # Setup mock scheduler
     mock_scheduler = MagicMock()
+    mock_scheduler.enqueue_at.return_value.id = "job-1"
     mock_rq = MagicMock()
     mock_rq.get_scheduler.return_value = mock_scheduler
     monkeypatch.setattr("app.event.jobs.rq", mock_rq)
 
     # Test data
     event_id = 1
-    recipients = ["test@example.com"]
     timestamp = datetime.now(UTC) + timedelta(hours=1)
 
     # Call the function
-    schedule_mail(event_id, recipients, timestamp)
+    schedule_mail(event_id, timestamp)
 
     # Check that the scheduler's enqueue_at method was called correctly
     mock_scheduler.enqueue_at.assert_called_once_with(
-        timestamp, send_mail, event_id, recipients
+        timestamp, send_mail, event_id, queue_name="default"
     )
 
 
@@ -253,7 +255,7 @@ def test_send_mail_html_content(
 
     mock_message_class = MagicMock()
     mock_message_class.return_value = mock_msg
-    monkeypatch.setattr("app.event.jobs.Message", mock_message_class)
+    monkeypatch.setattr("app.event.jobs.PreparedMessage", mock_message_class)
 
     # Test data
     event_id = 1
@@ -263,14 +265,14 @@ def test_send_mail_html_content(
     mock_event = mock_event_query.get.return_value
     mock_event.email_content = "<p>This is HTML content</p>"
 
-    # Mock BeautifulSoup to return a tag (indicating HTML)
-    mock_soup = MagicMock()
-    mock_soup.find.return_value = True  # Simulate finding HTML tags
-    mock_soup_class = MagicMock(return_value=mock_soup)
-    monkeypatch.setattr("app.event.jobs.BeautifulSoup", mock_soup_class)
+    # Content type and MIME part are prepared when the event is stored
+    mock_event.content_type = "html"
 
     # Call the function
-    result = send_mail(event_id, recipients)
+    with patch(
+        "app.event.jobs.recipient_batches", return_value=[recipients]
+    ):
+        result = send_mail(event_id)
 
     # Check that Message was created (subject is passed correctly)
     mock_message_class.assert_called_once()
@@ -283,9 +285,8 @@ def test_send_mail_html_content(
         [call("test@example.com"), call("another@example.com")]
     )
 
-    # Check that HTML content was set
-    # Note: Skipping assertion on mock_msg.html as it involves complex mock chaining
-    assert mock_msg.body is None  # Body should be None for HTML email
+    # Check that the cached MIME part was attached without parsing
+    assert "mime_part" in kwargs
 
     # Check that email was sent
     mock_mail_connection.send.assert_called_once_with(mock_msg)
@@ -310,7 +311,7 @@ def test_send_mail_text_content(
 
     mock_message_class = MagicMock()
     mock_message_class.return_value = mock_msg
-    monkeypatch.setattr("app.event.jobs.Message", mock_message_class)
+    monkeypatch.setattr("app.event.jobs.PreparedMessage", mock_message_class)
 
     # Test data
     event_id = 1
@@ -320,23 +321,22 @@ def test_send_mail_text_content(
     mock_event = mock_event_query.get.return_value
     mock_event.email_content = "This is plain text content"
 
-    # Mock BeautifulSoup to return None (indicating plain text)
-    mock_soup = MagicMock()
-    mock_soup.find.return_value = False  # Simulate NOT finding HTML tags
-    mock_soup_class = MagicMock(return_value=mock_soup)
-    monkeypatch.setattr("app.event.jobs.BeautifulSoup", mock_soup_class)
+    # Content type and MIME part are prepared when the event is stored
+    mock_event.content_type = "plain"
 
     # Call the function
-    result = send_mail(event_id, recipients)
+    with patch(
+        "app.event.jobs.recipient_batches", return_value=[recipients]
+    ):
+        result = send_mail(event_id)
 
     # Check that Message was created (subject is passed correctly)
     mock_message_class.assert_called_once()
     args, kwargs = mock_message_class.call_args
     assert "subject" in kwargs  # Verify subject parameter is passed
 
-    # Check that body content was set
-    # Note: Skipping assertion on mock_msg.body as it involves complex mock chaining
-    assert mock_msg.html is None  # HTML should be None for text-only email
+    # Check that the cached MIME part was attached without parsing
+    assert "mime_part" in kwargs
 
     # Check that email was sent
     mock_mail_connection.send.assert_called_once_with(mock_msg)
@@ -394,9 +394,11 @@ def test_add_event(mock_db_session, monkeypatch):
     mock_db_session.commit.assert_called_once()
 
     # Check add_recipients was called
-    mock_add_recipients.assert_called_once_with(test_data["recipients"], mock_event.id)
+    mock_add_recipients.assert_called_once_with(
+        test_data["recipients"], mock_event.id, {}, commit=False
+    )
 
     # Check schedule_mail was called
     mock_schedule_mail.assert_called_once_with(
-        mock_event.id, ["test@example.com"], test_datetime
+        mock_event.id, test_datetime, "normal"
     )
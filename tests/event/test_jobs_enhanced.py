@@ -125,17 +125,16 @@ class TestScheduleMail:
         """Test scheduling an email."""
         # Setup
         event_id = 1
-        recipients = ["test@example.com"]
         timestamp = datetime.now(UTC) + timedelta(hours=1)
 
         # Execute
-        schedule_mail(event_id, recipients, timestamp)
+        schedule_mail(event_id, timestamp)
 
         # Verify
         # Assert that scheduler.enqueue_at was called with correct args
         # This depends on the mock_redis fixture in conftest.py
         mock_redis.enqueue_at.assert_called_once_with(
-            timestamp, send_mail, event_id, recipients
+            timestamp, send_mail, event_id, queue_name="default"
         )
 
 
@@ -143,7 +142,7 @@ class TestSendMail:
     """Tests for the send_mail function."""
 
     @patch("app.event.jobs.Event")
-    @patch("app.event.jobs.Message")
+    @patch("app.event.jobs.PreparedMessage")
     @patch("app.event.jobs.mail")
     @patch("app.event.jobs.db")
     def test_send_mail_text_content(self, mock_db, mock_mail, mock_message, mock_event):
@@ -167,21 +166,27 @@ class TestSendMail:
         mock_mail.connect.return_value.__enter__.return_value = mock_conn
 
         # Execute
-        result = send_mail(event_id, recipients)
+        with patch(
+            "app.event.jobs.recipient_batches", return_value=[recipients]
+        ):
+            result = send_mail(event_id)
 
         # Verify
-        mock_message.assert_called_once_with(subject="Test Subject")
+        mock_message.assert_called_once_with(
+            subject="Test Subject", mime_part=mock_event_obj.mime_body
+        )
         mock_msg.add_recipient.assert_called_once_with("test@example.com")
         # Skip checking mock attributes directly as they're MagicMock objects
         mock_conn.send.assert_called_once_with(mock_msg)
         assert mock_event_obj.is_done is True
         assert mock_event_obj.done_at is not None
         mock_db.session.add.assert_called_once_with(mock_event_obj)
-        mock_db.session.commit.assert_called_once()
+        # One commit for the batch of recipients, one for the event
+        assert mock_db.session.commit.call_count == 2
         assert "Success" in result
 
     @patch("app.event.jobs.Event")
-    @patch("app.event.jobs.Message")
+    @patch("app.event.jobs.PreparedMessage")
     @patch("app.event.jobs.mail")
     @patch("app.event.jobs.db")
     def test_send_mail_html_content(self, mock_db, mock_mail, mock_message, mock_event):
@@ -207,21 +212,27 @@ class TestSendMail:
         mock_mail.connect.return_value.__enter__.return_value = mock_conn
 
         # Execute
-        result = send_mail(event_id, recipients)
+        with patch(
+            "app.event.jobs.recipient_batches", return_value=[recipients]
+        ):
+            result = send_mail(event_id)
 
         # Verify
-        mock_message.assert_called_once_with(subject="Test Subject")
+        mock_message.assert_called_once_with(
+            subject="Test Subject", mime_part=mock_event_obj.mime_body
+        )
         mock_msg.add_recipient.assert_called_once_with("test@example.com")
         # Skip checking mock attributes directly as they're MagicMock objects
         mock_conn.send.assert_called_once_with(mock_msg)
         assert mock_event_obj.is_done is True
         assert mock_event_obj.done_at is not None
         mock_db.session.add.assert_called_once_with(mock_event_obj)
-        mock_db.session.commit.assert_called_once()
+        # One commit for the batch of recipients, one for the event
+        assert mock_db.session.commit.call_count == 2
         assert "Success" in result
 
     @patch("app.event.jobs.Event")
-    @patch("app.event.jobs.Message")
+    @patch("app.event.jobs.PreparedMessage")
     @patch("app.event.jobs.mail")
     @patch("app.event.jobs.db")
     def test_send_mail_multiple_recipients(
@@ -251,10 +262,15 @@ class TestSendMail:
         mock_mail.connect.return_value.__enter__.return_value = mock_conn
 
         # Execute
-        result = send_mail(event_id, recipients)
+        with patch(
+            "app.event.jobs.recipient_batches", return_value=[recipients]
+        ):
+            result = send_mail(event_id)
 
         # Verify
-        mock_message.assert_called_once_with(subject="Test Subject")
+        mock_message.assert_called_once_with(
+            subject="Test Subject", mime_part=mock_event_obj.mime_body
+        )
         assert mock_msg.add_recipient.call_count == 3
         mock_conn.send.assert_called_once_with(mock_msg)
         assert "Success" in result
@@ -309,9 +325,12 @@ class TestAddEvent:
             created_at=ANY,
             is_done=False,
             done_at=None,
+            priority="normal",
         )
         mock_db.session.add.assert_called_once_with(mock_event_obj)
         mock_db.session.commit.assert_called_once()
-        mock_add_recipients.assert_called_once_with("test@example.com", 1)
-        mock_schedule.assert_called_once_with(1, ["test@example.com"], timestamp)
+        mock_add_recipients.assert_called_once_with(
+            "test@example.com", 1, {}, commit=False
+        )
+        mock_schedule.assert_called_once_with(1, timestamp, "normal")
         assert result == 1
@@ -0,0 +1,209 @@
+"""Tests for moving and cancelling the jobs of edited and deleted events."""
+
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from flask import url_for
+
+from app.database.models import Event, Recipient
+from app.event import jobs
+
+WHEN = datetime(2030, 1, 1, 9, 0)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """Replace rq with a mock whose scheduler holds the sorted set."""
+    scheduler = MagicMock(scheduled_jobs_key="rq:scheduler:scheduled_jobs")
+    scheduler.enqueue_at.return_value.id = "new-job"
+    rq = MagicMock(get_scheduler=lambda: scheduler)
+    monkeypatch.setattr(jobs, "rq", rq)
+    return scheduler
+
+
+@pytest.fixture
+def logged_in():
+    """Bypass login_required for the event views."""
+    with patch("flask_login.utils._get_user") as get_user:
+        get_user.return_value = MagicMock(is_authenticated=True, id=1)
+        yield
+
+
+@pytest.fixture
+def scheduled_event(db):
+    """Create an event whose send job is waiting in the scheduler."""
+    event = Event("Subject", "Body", WHEN)
+    event.job_id = "job-1"
+    db.session.add(event)
+    db.session.commit()
+    db.session.add(Recipient("a@example.com", event_id=event.id))
+    db.session.commit()
+    return event
+
+
+def test_reschedule_job_moves_score_in_place(app, scheduler):
+    """Test that rescheduling updates the existing member only."""
+    scheduler.connection.zadd.return_value = 1
+
+    with app.app_context():
+        assert jobs.reschedule_job("job-1", WHEN, WHEN + timedelta(hours=1))
+
+    scheduler.connection.zadd.assert_called_once_with(
+        "rq:scheduler:scheduled_jobs", {"job-1": 1893492000}, xx=True, ch=True
+    )
+
+
+def test_reschedule_event_replaces_job_already_taken(app, scheduler):
+    """Test that a job no longer in the scheduler is replaced by a new one."""
+    scheduler.connection.zadd.return_value = 0
+    event = Event("Subject", "Body", WHEN + timedelta(hours=1))
+    event.id, event.job_id = 7, "job-1"
+
+    with app.app_context():
+        jobs.reschedule_event(event, WHEN)
+
+    scheduler.enqueue_at.assert_called_once_with(
+        event.timestamp, jobs.send_mail, 7, queue_name="default"
+    )
+    assert event.job_id == "new-job"
+
+
+def test_reschedule_event_moves_local_time(app, scheduler):
+    """Test that the time zone groups of a local-time event follow the edit."""
+    scheduler.connection.zadd.return_value = 1
+    event = Event(
+        "Subject",
+        "Body",
+        WHEN + timedelta(hours=2),
+        local_time=datetime(2030, 1, 1, 18, 0),
+        send_by=WHEN + timedelta(minutes=5),
+    )
+    event.id, event.job_id = 7, "job-1"
+
+    with app.app_context():
+        jobs.reschedule_event(event, WHEN)
+
+    assert event.local_time == datetime(2030, 1, 1, 20, 0)
+    assert event.send_by == WHEN + timedelta(hours=2, minutes=5)
+
+
+def test_cancel_job_removes_member_and_job(app, scheduler):
+    """Test that a cancelled job leaves the sorted set and is deleted."""
+    scheduler.connection.zrem.return_value = 1
+
+    with app.app_context():
+        assert jobs.cancel_job("job-1", WHEN)
+
+    scheduler.connection.zrem.assert_called_once_with(
+        "rq:scheduler:scheduled_jobs", "job-1"
+    )
+    jobs.rq.connection.delete.assert_called_once_with(b"rq:job:job-1")
+
+
+def test_cancel_job_in_wheel(app, monkeypatch):
+    """Test that MAIL_SCHEDULER=wheel cancels in the wheel's buckets."""
+    wheel = MagicMock()
+    wheel.cancel.return_value = False
+    monkeypatch.setattr(jobs.TimingWheel, "from_config", lambda *args: wheel)
+    monkeypatch.setattr(jobs, "rq", MagicMock())
+    monkeypatch.setitem(app.config, "MAIL_SCHEDULER", "wheel")
+
+    with app.app_context():
+        assert not jobs.cancel_job("job-1", WHEN)
+
+    wheel.cancel.assert_called_once_with("job-1", WHEN)
+    jobs.rq.connection.delete.assert_not_called()
+
+
+def test_pending_job_of_sent_event_is_none():
+    """Test that a done event has nothing left to cancel."""
+    event = Event("Subject", "Body", WHEN, is_done=True)
+    event.job_id = "job-1"
+
+    assert jobs.pending_job(event) is None
+
+
+def test_send_mail_for_deleted_event_is_a_no_op(app, session):
+    """Test that a stale job finishes at once instead of failing."""
+    with app.app_context():
+        assert "no longer exists" in jobs.send_mail(999999)
+
+
+def test_edit_view_reschedules(
+    app, client, db, scheduled_event, scheduler, logged_in, monkeypatch
+):
+    """Test that editing the time moves the event's job."""
+    monkeypatch.setattr(jobs, "get_localzone", lambda: UTC)
+    scheduler.connection.zadd.return_value = 1
+    new_time = datetime(2030, 1, 2, 9, 0)
+    data = {
+        "name": "Subject",
+        "notes": "Body",
+        "recipients": "a@example.com",
+        "schedule_time": new_time.strftime("%Y-%m-%dT%H:%M"),
+    }
+
+    with app.test_request_context():
+        url = url_for("items.edit_event", event_id=scheduled_event.id)
+    client.post(url, data=data)
+
+    db.session.refresh(scheduled_event)
+    assert scheduled_event.timestamp == new_time
+    (member,) = scheduler.connection.zadd.call_args.args[1]
+    assert member == "job-1"
+
+
+def test_delete_view_cancels(
+    app, client, db, scheduled_event, scheduler, logged_in
+):
+    """Test that deleting an event with recipients removes them and its job."""
+    scheduler.connection.zrem.return_value = 1
+    event_id = scheduled_event.id
+
+    with app.test_request_context():
+        url = url_for("items.delete_event", event_id=event_id)
+    client.post(url)
+
+    scheduler.connection.zrem.assert_called_once_with(
+        "rq:scheduler:scheduled_jobs", "job-1"
+    )
+    assert db.session.get(Event, event_id) is None
+    assert Recipient.query.filter_by(event_id=event_id).count() == 0
+
+
+def test_remove_recurring_event_deletes_its_runs(app, db, scheduler):
+    """Test that the runs of a recurring event go with it."""
+    from app.event.services import EventService
+
+    parent = Event("Weekly", "Body", WHEN, recurrence="0 9 * * 1")
+    db.session.add(parent)
+    db.session.commit()
+    run = Event("Weekly", "Body", WHEN)
+    run.parent_id = parent.id
+    db.session.add(run)
+    db.session.commit()
+    db.session.add_all(
+        [
+            Recipient("a@example.com", event_id=parent.id),
+            Recipient("a@example.com", event_id=run.id),
+        ]
+    )
+    db.session.commit()
+    ids = [parent.id, run.id]
+
+    with app.app_context():
+        assert EventService.delete_event(parent.id) is True
+
+    assert Event.query.filter(Event.id.in_(ids)).count() == 0
+    assert Recipient.query.filter(Recipient.event_id.in_(ids)).count() == 0
+
+
+@pytest.mark.parametrize(
+    "job, args",
+    [(jobs.send_mail_chunk, (999999, 1, 10)), (jobs.retry_mail, (999999, 1))],
+)
+def test_jobs_of_deleted_event_are_no_ops(app, session, job, args):
+    """Test that chunks and retries left behind by a delete finish at once."""
+    with app.app_context():
+        assert "no longer exists" in job(*args)
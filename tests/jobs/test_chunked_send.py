@@ -0,0 +1,99 @@
+"""Tests for fanning out large events into chunk jobs."""
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.event.jobs import send_mail, send_mail_chunk
+
+
+@pytest.fixture
+def chunk_env(app, monkeypatch):
+    """Mock the database, mail and RQ used by the send jobs."""
+    event = MagicMock()
+    event.id = 1
+    event.email_subject = "Subject"
+    event.email_content = "Body"
+
+    mock_db = MagicMock()
+    mock_db.session.get.return_value = event
+    monkeypatch.setattr("app.event.jobs.db", mock_db)
+
+    mock_mail = MagicMock()
+    conn = mock_mail.connect.return_value.__enter__.return_value
+    monkeypatch.setattr("app.event.jobs.mail", mock_mail)
+
+    mock_rq = MagicMock()
+    monkeypatch.setattr("app.event.jobs.rq", mock_rq)
+
+    ranges = MagicMock(return_value=[])
+    monkeypatch.setattr("app.event.jobs.recipient_ranges", ranges)
+    batches = MagicMock(return_value=iter([]))
+    monkeypatch.setattr("app.event.jobs.recipient_batches", batches)
+
+    with app.app_context():
+        app.config["MAIL_CHUNK_SIZE"] = 2
+        yield {
+            "event": event,
+            "conn": conn,
+            "rq": mock_rq,
+            "db": mock_db,
+            "ranges": ranges,
+            "batches": batches,
+        }
+        app.config["MAIL_CHUNK_SIZE"] = 500
+
+
+def test_send_mail_fans_out_large_recipient_list(chunk_env):
+    """Test that send_mail enqueues chunk jobs instead of sending."""
+    queue = chunk_env["rq"].get_queue.return_value
+    queue.is_async = True
+    chunk_env["ranges"].return_value = [(1, 2), (3, 4), (5, 5)]
+
+    result = send_mail(1)
+
+    assert result == "Fanned out to 3 chunks"
+    assert not chunk_env["conn"].send.called
+    assert not chunk_env["batches"].called
+    chunk_env["ranges"].assert_called_once_with(chunk_env["db"].session, 1, 2)
+    chunk_env["rq"].connection.set.assert_called_once()
+    job_datas = queue.enqueue_many.call_args[0][0]
+    # Jobs carry ID ranges, never the addresses themselves
+    assert [data.args for data in job_datas] == [(1, 1, 2), (1, 3, 4), (1, 5, 5)]
+    assert all(data.func is send_mail_chunk for data in job_datas)
+
+
+def test_send_mail_below_chunk_size_sends_directly(chunk_env):
+    """Test that small events are sent without fanning out."""
+    chunk_env["ranges"].return_value = [(1, 2)]
+    chunk_env["batches"].return_value = iter([["a@x.com", "b@x.com"]])
+
+    result = send_mail(1)
+
+    assert "Success" in result
+    chunk_env["batches"].assert_called_once_with(
+        chunk_env["db"].session, 1, 2, None, None, timezones=None
+    )
+    assert chunk_env["conn"].send.called
+    assert not chunk_env["rq"].get_queue.called
+
+
+def test_chunk_marks_event_done_only_when_last(chunk_env):
+    """Test that the event is marked done by the last chunk only."""
+    chunk_env["rq"].connection.decr.side_effect = [1, 0]
+    event = chunk_env["event"]
+    event.is_done = False
+
+    chunk_env["batches"].side_effect = [iter([["a@x.com"]]), iter([["b@x.com"]])]
+
+    first = send_mail_chunk(1, 10, 11)
+    assert first == "Chunk of 1 recipients sent"
+    assert event.is_done is False
+    chunk_env["batches"].assert_called_with(
+        chunk_env["db"].session, 1, 2, 10, 11, timezones=None
+    )
+
+    last = send_mail_chunk(1, 12, 13)
+    assert "Success" in last
+    assert event.is_done is True
+    assert chunk_env["conn"].send.call_count == 2
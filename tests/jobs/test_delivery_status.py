@@ -0,0 +1,129 @@
+"""Tests for recording recipient status from the send jobs."""
+
+import smtplib
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.database.models import Recipient
+from app.delivery.planner import DomainTimings
+from app.event.jobs import resend_failed, send_mail
+
+
+@pytest.fixture
+def job_env(app, monkeypatch):
+    """Mock the database and mail connection used by send_mail."""
+    event = MagicMock()
+    event.id = 1
+    event.email_subject = "Subject"
+    event.email_content = "Body"
+
+    mock_db = MagicMock()
+    mock_db.session.get.return_value = event
+    monkeypatch.setattr("app.event.jobs.db", mock_db)
+
+    mock_mail = MagicMock()
+    conn = mock_mail.connect.return_value.__enter__.return_value
+    monkeypatch.setattr("app.event.jobs.mail", mock_mail)
+
+    batches = MagicMock(return_value=[])
+    monkeypatch.setattr("app.event.jobs.recipient_batches", batches)
+    timings = DomainTimings()
+    monkeypatch.setattr("app.event.jobs.domain_timings", lambda: timings)
+
+    with app.app_context():
+        yield {"event": event, "conn": conn, "db": mock_db, "batches": batches}
+
+
+@patch("app.event.jobs.record_delivery")
+def test_send_mail_records_refused_recipients(mock_record, job_env):
+    """Test that refusals returned by the connection are recorded."""
+    refused = {"b@x.com": (550, b"No such user")}
+    job_env["conn"].send.return_value = refused
+
+    job_env["batches"].return_value = [["a@x.com", "b@x.com"]]
+
+    send_mail(1)
+
+    mock_record.assert_called_once_with(
+        job_env["db"].session, 1, ["a@x.com", "b@x.com"], refused, 1000
+    )
+
+
+@patch("app.event.jobs.record_delivery")
+def test_send_mail_marks_all_failed_on_transaction_error(mock_record, job_env):
+    """Test that a rejected transaction fails every recipient."""
+    job_env["conn"].send.side_effect = smtplib.SMTPDataError(554, b"Rejected")
+    job_env["batches"].return_value = [["a@x.com", "b@x.com"]]
+
+    send_mail(1)
+
+    assert mock_record.call_args[0][3] == {
+        "a@x.com": (554, b"Rejected"),
+        "b@x.com": (554, b"Rejected"),
+    }
+
+
+@patch("app.event.jobs.record_delivery")
+def test_rejected_transaction_does_not_stop_other_domains(mock_record, job_env):
+    """Test that a transaction refused for one domain spares the others."""
+    job_env["conn"].send.side_effect = [
+        smtplib.SMTPDataError(554, b"Rejected"),
+        {},
+    ]
+    job_env["batches"].return_value = [["a@x.com", "b@y.com", "c@x.com"]]
+
+    send_mail(1)
+
+    assert job_env["conn"].send.call_count == 2
+    recipients, refused = mock_record.call_args[0][2:4]
+    assert recipients == ["a@x.com", "b@y.com", "c@x.com"]
+    assert refused == {"a@x.com": (554, b"Rejected"), "c@x.com": (554, b"Rejected")}
+
+
+@patch("app.event.jobs.send_mail")
+@patch("app.event.jobs.mark_recipients")
+@patch("app.event.jobs.failed_recipients")
+def test_resend_failed_queues_only_failed(mock_failed, mock_mark, mock_send, job_env):
+    """Test that only failed recipients are queued again."""
+    mock_failed.return_value = ["b@x.com"]
+
+    assert resend_failed(1) == 1
+
+    mock_mark.assert_called_once_with(
+        job_env["db"].session, 1, ["b@x.com"], Recipient.STATUS_QUEUED
+    )
+    mock_send.queue.assert_called_once_with(1, queue="default")
+
+
+@patch("app.event.jobs.send_mail")
+@patch("app.event.jobs.failed_recipients", return_value=[])
+def test_resend_failed_without_failures(mock_failed, mock_send, job_env):
+    """Test that nothing is queued when no recipient failed."""
+    assert resend_failed(1) == 0
+    assert not mock_send.queue.called
+
+
+@patch("app.event.jobs.record_delivery")
+@patch("app.event.jobs.AsyncDeliveryEngine")
+def test_send_mail_uses_async_engine_when_configured(
+    mock_engine_class, mock_record, app, job_env
+):
+    """Test that MAIL_DELIVERY_ENGINE=async routes through the engine."""
+    engine = mock_engine_class.from_config.return_value
+    engine.deliver.side_effect = lambda envelopes: [{} for _ in envelopes]
+    job_env["batches"].return_value = [["a@x.com", "b@x.com", "c@x.com"]]
+    app.config.update(MAIL_DELIVERY_ENGINE="async", MAIL_ASYNC_BATCH_SIZE=2)
+    try:
+        result = send_mail(1)
+    finally:
+        app.config.update(MAIL_DELIVERY_ENGINE="smtp", MAIL_ASYNC_BATCH_SIZE=50)
+
+    assert "Success" in result
+    assert not job_env["conn"].send.called
+    envelopes = engine.deliver.call_args[0][0]
+    assert [sorted(env.recipients) for env in envelopes] == [
+        ["a@x.com", "b@x.com"],
+        ["c@x.com"],
+    ]
+    assert mock_record.call_args[0][2] == ["a@x.com", "b@x.com", "c@x.com"]
@@ -9,11 +9,10 @@ from app.database.models import Event, Recipient
 from app.event.jobs import send_mail
 
 
-@patch("app.event.jobs.BeautifulSoup")
 @patch("app.extensions.mail.connect")
 @patch("app.database.db.session.add")
 @patch("app.database.db.session.commit")
-def test_send_mail_plain_text(mock_commit, mock_add, mock_mail_connect, mock_bs, db):
+def test_send_mail_plain_text(mock_commit, mock_add, mock_mail_connect, db):
     """Test sending a plain text email."""
     # Mock Event query
     mock_event = MagicMock()
@@ -26,11 +25,6 @@ def test_send_mail_plain_text(mock_commit, mock_add, mock_mail_connect, mock_bs,
         mock_query_obj.get.return_value = mock_event
         mock_query.return_value = mock_query_obj
 
-        # Mock BeautifulSoup to indicate no HTML
-        mock_soup = MagicMock()
-        mock_soup.find.return_value = None
-        mock_bs.return_value = mock_soup
-
         # Mock mail connection
         mock_conn = MagicMock()
         mock_context = MagicMock()
@@ -38,7 +32,10 @@ def test_send_mail_plain_text(mock_commit, mock_add, mock_mail_connect, mock_bs,
         mock_mail_connect.return_value = mock_context
 
         # Call the function
-        result = send_mail(1, ["test@example.com"])
+        with patch(
+            "app.event.jobs.recipient_batches", return_value=[["test@example.com"]]
+        ):
+            result = send_mail(1)
 
         # Assertions
         assert "Success" in result
@@ -47,11 +44,10 @@ def test_send_mail_plain_text(mock_commit, mock_add, mock_mail_connect, mock_bs,
         assert mock_commit.called
 
 
-@patch("app.event.jobs.BeautifulSoup")
 @patch("app.extensions.mail.connect")
 @patch("app.database.db.session.add")
 @patch("app.database.db.session.commit")
-def test_send_mail_html(mock_commit, mock_add, mock_mail_connect, mock_bs, db):
+def test_send_mail_html(mock_commit, mock_add, mock_mail_connect, db):
     """Test sending an HTML email."""
     # Mock Event query
     mock_event = MagicMock()
@@ -64,11 +60,6 @@ def test_send_mail_html(mock_commit, mock_add, mock_mail_connect, mock_bs, db):
         mock_query_obj.get.return_value = mock_event
         mock_query.return_value = mock_query_obj
 
-        # Mock BeautifulSoup to indicate HTML content
-        mock_soup = MagicMock()
-        mock_soup.find.return_value = True  # Indicate HTML content
-        mock_bs.return_value = mock_soup
-
         # Mock mail connection
         mock_conn = MagicMock()
         mock_context = MagicMock()
@@ -76,7 +67,10 @@ def test_send_mail_html(mock_commit, mock_add, mock_mail_connect, mock_bs, db):
         mock_mail_connect.return_value = mock_context
 
         # Call the function
-        result = send_mail(1, ["test@example.com"])
+        with patch(
+            "app.event.jobs.recipient_batches", return_value=[["test@example.com"]]
+        ):
+            result = send_mail(1)
 
         # Assertions
         assert "Success" in result
@@ -104,7 +98,7 @@ def test_send_mail_multiple_recipients(
     # Create a mock Message class
     mock_message = MagicMock()
 
-    with patch("app.event.jobs.Message", return_value=mock_message):
+    with patch("app.event.jobs.PreparedMessage", return_value=mock_message):
         # Mock mail connection
         mock_conn = MagicMock()
         mock_context = MagicMock()
@@ -117,7 +111,8 @@ def test_send_mail_multiple_recipients(
             "test2@example.com",
             "test3@example.com",
         ]
-        result = send_mail(1, recipients)
+        with patch("app.event.jobs.recipient_batches", return_value=[recipients]):
+            result = send_mail(1)
 
         # Assertions
         assert "Success" in result
@@ -31,13 +31,13 @@ def test_add_event_exception_handling(mock_dt_utc):
 
 @patch("app.event.jobs.Event")
 @patch("app.database.db.session.add")
-@patch("app.database.db.session.commit")
-def test_add_event_database_error(mock_commit, mock_add, mock_event):
+@patch("app.database.db.session.flush")
+def test_add_event_database_error(mock_flush, mock_add, mock_event):
     """Test database error handling in add_event."""
     # Setup mock to raise exception when accessing property
     mock_event_instance = MagicMock()
     mock_event.return_value = mock_event_instance
-    mock_commit.side_effect = Exception("Database error")
+    mock_flush.side_effect = Exception("Database error")
 
     # Test data
     event_data = {
@@ -93,15 +93,15 @@ def test_schedule_mail(mock_get_scheduler, db):
     """Test scheduling a mail job."""
     # Mock the scheduler
     mock_scheduler = MagicMock()
+    mock_scheduler.enqueue_at.return_value.id = "job-1"
     mock_get_scheduler.return_value = mock_scheduler
 
     # Test data
     event_id = 1
-    recipients = ["test@example.com"]
     timestamp = datetime.now(UTC) + timedelta(days=1)
 
     # Call the function
-    schedule_mail(event_id, recipients, timestamp)
+    schedule_mail(event_id, timestamp)
 
     # Verify the job was scheduled
     assert mock_scheduler.enqueue_at.called
@@ -109,5 +109,4 @@ def test_schedule_mail(mock_get_scheduler, db):
     args, kwargs = mock_scheduler.enqueue_at.call_args
     assert args[0] == timestamp  # First arg should be the timestamp
     assert args[1].__name__ == "send_mail"  # Second arg should be the function
-    assert args[2] == event_id  # Third arg should be event_id
-    assert args[3] == recipients  # Fourth arg should be recipients
+    assert args[2:] == (event_id,)  # Only the event ID is stored with the job
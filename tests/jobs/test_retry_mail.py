@@ -0,0 +1,173 @@
+"""Tests for deferring and retrying recipients after transient failures."""
+
+import smtplib
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.database.models import Recipient
+from app.event.jobs import retry_mail, send_mail
+
+
+@pytest.fixture
+def job_env(app, monkeypatch):
+    """Mock the database, mail connection and scheduler used by send_mail."""
+    event = MagicMock()
+    event.id = 1
+    event.mime_body = b"\r\nBody"
+
+    mock_db = MagicMock()
+    mock_db.session.get.return_value = event
+    monkeypatch.setattr("app.event.jobs.db", mock_db)
+
+    mock_mail = MagicMock()
+    conn = mock_mail.connect.return_value.__enter__.return_value
+    monkeypatch.setattr("app.event.jobs.mail", mock_mail)
+
+    scheduler = MagicMock()
+    monkeypatch.setattr("app.event.jobs.rq.get_scheduler", lambda: scheduler)
+    connection = MagicMock()
+    monkeypatch.setattr("app.event.jobs.rq._connection", connection)
+
+    batches = MagicMock(return_value=[])
+    monkeypatch.setattr("app.event.jobs.recipient_batches", batches)
+
+    with app.app_context():
+        yield {
+            "event": event,
+            "conn": conn,
+            "scheduler": scheduler,
+            "batches": batches,
+            "connection": connection,
+            "mail": mock_mail,
+        }
+
+
+def marked(mock_mark):
+    """Map each status written by mark_recipients to its addresses and code."""
+    return {c.args[3]: (sorted(c.args[2]), c.args[4]) for c in mock_mark.call_args_list}
+
+
+@patch("app.event.jobs.mark_recipients")
+@patch("app.event.jobs.record_delivery")
+def test_transient_refusals_are_retried_alone(mock_record, mock_mark, job_env):
+    """Test that only recipients refused with 4xx are rescheduled."""
+    job_env["conn"].send.return_value = {
+        "b@x.com": (450, b"Mailbox busy"),
+        "c@x.com": (550, b"No such user"),
+    }
+
+    job_env["batches"].return_value = [["a@x.com", "b@x.com", "c@x.com"]]
+
+    result = send_mail(1)
+
+    assert "Success" in result
+    args = mock_record.call_args[0]
+    assert args[2] == ["a@x.com", "c@x.com"]
+    assert args[3] == {"c@x.com": (550, b"No such user")}
+    assert marked(mock_mark) == {Recipient.STATUS_DEFERRED: (["b@x.com"], 450)}
+
+    delay, func, *job_args = job_env["scheduler"].enqueue_in.call_args[0]
+    assert func is retry_mail
+    assert job_args == [1, 1]
+    assert 15 <= delay.total_seconds() <= 30
+
+
+@patch("app.event.jobs.mark_recipients")
+@patch("app.event.jobs.record_delivery")
+def test_transient_transaction_error_defers_everyone(mock_record, mock_mark, job_env):
+    """Test that a 4xx reply to the whole transaction is retried, not raised."""
+    job_env["conn"].send.side_effect = smtplib.SMTPDataError(451, b"Try later")
+
+    job_env["batches"].return_value = [["a@x.com", "b@x.com"]]
+
+    send_mail(1)
+
+    assert mock_record.call_args[0][2] == []
+    assert marked(mock_mark) == {
+        Recipient.STATUS_DEFERRED: (["a@x.com", "b@x.com"], 451)
+    }
+    assert job_env["scheduler"].enqueue_in.called
+
+
+@patch("app.event.jobs.mark_recipients")
+@patch("app.event.jobs.record_delivery")
+def test_dropped_connection_defers_everyone(mock_record, mock_mark, job_env):
+    """Test that a connection lost before a reply is retried."""
+    job_env["conn"].send.side_effect = smtplib.SMTPServerDisconnected("gone")
+
+    job_env["batches"].return_value = [["a@x.com"]]
+
+    send_mail(1)
+
+    assert marked(mock_mark) == {Recipient.STATUS_DEFERRED: (["a@x.com"], None)}
+    assert job_env["scheduler"].enqueue_in.call_args[0][2:] == (1, 1)
+
+
+@pytest.mark.parametrize(
+    "error, code",
+    [
+        (smtplib.SMTPAuthenticationError(535, b"Bad credentials"), 535),
+        (smtplib.SMTPConnectError(554, b"No service"), 554),
+        (smtplib.SMTPNotSupportedError("No STARTTLS"), None),
+    ],
+)
+@patch("app.event.jobs.mark_recipients")
+@patch("app.event.jobs.record_delivery")
+def test_permanent_errors_fail_everyone(mock_record, mock_mark, job_env, error, code):
+    """Test that a failed login or 5xx greeting is not retried."""
+    job_env["mail"].connect.return_value.__enter__.side_effect = error
+    job_env["batches"].return_value = [["a@x.com"]]
+
+    send_mail(1)
+
+    assert marked(mock_mark) == {Recipient.STATUS_FAILED: (["a@x.com"], code)}
+    job_env["scheduler"].enqueue_in.assert_not_called()
+
+
+@patch("app.event.jobs.mark_recipients")
+@patch("app.event.jobs.record_delivery")
+def test_pending_retry_takes_new_deferrals(mock_record, mock_mark, job_env):
+    """Test that a second deferral joins the retry already scheduled."""
+    job_env["conn"].send.side_effect = smtplib.SMTPServerDisconnected("gone")
+    job_env["batches"].return_value = [["a@x.com"], ["b@x.com"]]
+    job_env["connection"].set.side_effect = [True, None]
+
+    send_mail(1)
+
+    assert job_env["scheduler"].enqueue_in.call_count == 1
+    assert job_env["connection"].set.call_args.kwargs["nx"] is True
+
+
+@patch("app.event.jobs.mark_recipients")
+@patch("app.event.jobs.record_delivery")
+def test_last_attempt_fails_recipients(mock_record, mock_mark, app, job_env):
+    """Test that recipients fail once MAIL_RETRY_MAX_ATTEMPTS is reached."""
+    job_env["conn"].send.return_value = {"a@x.com": (450, b"Mailbox busy")}
+
+    job_env["batches"].return_value = [["a@x.com"]]
+
+    attempt = app.config["MAIL_RETRY_MAX_ATTEMPTS"] - 1
+    result = retry_mail(1, attempt)
+
+    assert result == f"Retry {attempt} of 1 recipients sent"
+    assert job_env["batches"].call_args.kwargs["status"] == Recipient.STATUS_DEFERRED
+    job_env["connection"].delete.assert_called_once_with("mail-scheduler:retry:1")
+    assert marked(mock_mark) == {Recipient.STATUS_FAILED: (["a@x.com"], 450)}
+    assert not job_env["scheduler"].enqueue_in.called
+
+
+@patch("app.event.jobs.record_delivery")
+def test_overload_reply_pauses_relay(mock_record, job_env, monkeypatch):
+    """Test that an overload reply signals the shared relay backoff."""
+    backoff = MagicMock()
+    monkeypatch.setattr("app.event.jobs.relay_backoff", lambda relay=None: backoff)
+    job_env["conn"].send.side_effect = smtplib.SMTPConnectError(421, b"Too busy")
+
+    job_env["batches"].return_value = [["a@x.com"]]
+
+    with patch("app.event.jobs.mark_recipients"):
+        send_mail(1)
+
+    backoff.wait.assert_called_once_with()
+    backoff.signal.assert_called_once_with()
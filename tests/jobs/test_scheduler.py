@@ -8,6 +8,7 @@ import pytest
 from app.event.jobs import add_event, add_recipients, dt_utc
 
 
+@patch("app.event.jobs.record_job")
 @patch("app.event.jobs.add_recipients")
 @patch("app.event.jobs.dt_utc")
 @patch("app.database.db.session.add")
@@ -19,6 +20,7 @@ def test_add_event(
     mock_add,
     mock_dt_utc,
     mock_add_recipients,
+    mock_record_job,
     mock_redis,
 ):
     """Test adding an event to the scheduler."""
@@ -0,0 +1,227 @@
+"""Tests for the paced dispatch of an overdue backlog."""
+
+import json
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.database.models import Event, Recipient
+from app.scheduler.catchup import CatchUp, catchup_stats
+from app.scheduler.poller import DuePoller
+
+NOW = datetime(2025, 5, 10, 12, 0)
+
+
+def make_catchup(**kwargs):
+    """Build a pacing ramping from 10 to 100 events per second in 90s."""
+    options = dict(threshold=300, start_rate=10, max_rate=100, ramp=90)
+    options.update(kwargs)
+    options.setdefault("owner", "replica-1")
+    return CatchUp(MagicMock(), **options)
+
+
+def test_rate_ramps_linearly_to_maximum():
+    """Test that the rate grows from the start rate over the ramp."""
+    catchup = make_catchup()
+    catchup.started = NOW
+
+    assert catchup.rate(NOW) == 10
+    assert catchup.rate(NOW + timedelta(seconds=45)) == 55
+    assert catchup.rate(NOW + timedelta(minutes=10)) == 100
+
+
+def test_eta_follows_the_ramp():
+    """Test that the estimate accounts for the rate still growing."""
+    catchup = make_catchup()
+    catchup.started = NOW
+
+    # 90s of ramp send (10 + 100) / 2 * 90 = 4950 events.
+    assert catchup.eta(4950, NOW) == pytest.approx(90)
+    assert catchup.eta(4950 + 1000, NOW) == pytest.approx(100)
+    # 10t + t^2 / 2 = 1200 at t = 40.
+    assert catchup.eta(1200, NOW) == pytest.approx(40)
+    assert catchup.eta(0, NOW) == 0
+
+
+def test_allowance_is_unlimited_until_backlog_is_overdue():
+    """Test that a recent backlog is claimed without pacing."""
+    catchup = make_catchup()
+
+    assert catchup.allowance(500, NOW - timedelta(seconds=60), NOW) is None
+    assert not catchup.active
+
+
+def test_allowance_paces_and_ends_when_caught_up():
+    """Test that catching up hands out the rate per elapsed second."""
+    catchup = make_catchup()
+    oldest = NOW - timedelta(hours=1)
+
+    assert catchup.allowance(5000, oldest, NOW) == 10
+    assert catchup.active
+    assert catchup.allowance(4990, oldest, NOW + timedelta(seconds=5)) == 62
+    assert catchup.allowance(0, None, NOW + timedelta(seconds=10)) is None
+    assert not catchup.active
+
+
+def test_catching_up_ends_within_threshold():
+    """Test that a steady flow of due events does not keep the pacing on."""
+    catchup = make_catchup()
+
+    catchup.allowance(5000, NOW - timedelta(hours=1), NOW)
+    later = NOW + timedelta(minutes=10)
+
+    assert catchup.allowance(800, later - timedelta(seconds=30), later) is None
+    assert not catchup.active
+
+
+def test_allowance_is_shared_by_partition():
+    """Test that a replica owning half the partitions gets half the rate."""
+    catchup = make_catchup()
+    catchup.share = catchup.scope = 0.5
+    oldest = NOW - timedelta(hours=1)
+
+    assert catchup.allowance(5000, oldest, NOW) == 5
+    assert catchup.allowance(4990, oldest, NOW + timedelta(seconds=5)) == 31
+    # Half the rate for half the events takes as long as the whole fleet.
+    fleet = make_catchup()
+    fleet.started = NOW
+    assert catchup.eta(2000, NOW) == pytest.approx(fleet.eta(4000, NOW))
+
+
+def test_progress_is_published_per_replica():
+    """Test that the reports of the replicas and skipped events add up."""
+    reports = []
+    for owner in ("replica-1", "replica-2"):
+        catchup = make_catchup(owner=owner)
+        catchup.share = catchup.scope = 0.5
+        catchup.allowance(2500, NOW - timedelta(hours=1), NOW)
+        key, report = catchup.connection.set.call_args.args
+        assert key == f"mail-scheduler:catchup:replica:{owner}"
+        assert catchup.connection.set.call_args.kwargs == {"ex": 600}
+        reports.append((key.encode(), report))
+    connection = MagicMock()
+    connection.scan_iter.return_value = [key for key, _ in reports]
+    connection.pipeline.return_value.execute.return_value = [
+        *(report for _, report in reports),
+        [b"7", b"3"],
+    ]
+
+    stats = catchup_stats(connection)
+
+    assert stats["active"] and stats["backlog"] == 5000
+    assert stats["rate"] == 10
+    assert stats["eta"] == round(catchup.eta(2500, NOW), 1)
+    assert stats["skipped_events"] == [7, 3]
+    assert set(stats["replicas"]) == {"replica-1", "replica-2"}
+    assert json.loads(reports[0][1])["rate"] == 5
+
+
+def test_no_reports_mean_not_catching_up():
+    """Test that the stats are empty before any replica published."""
+    connection = MagicMock()
+    connection.scan_iter.return_value = []
+    connection.pipeline.return_value.execute.return_value = [[]]
+
+    stats = catchup_stats(connection)
+
+    assert not stats["active"] and stats["backlog"] == 0
+    assert stats["replicas"] == {}
+
+
+@pytest.fixture
+def backlog(session):
+    """Create 30 events due one minute apart, the oldest three hours ago."""
+    rows = [
+        Event(f"Event {n}", "Body", NOW - timedelta(hours=3) + timedelta(minutes=n))
+        for n in range(30)
+    ]
+    session.add_all(rows)
+    session.commit()
+    session.add_all(Recipient("a@example.com", event_id=row.id) for row in rows)
+    session.commit()
+    return rows
+
+
+def test_poller_drains_backlog_oldest_first_at_ramp(session, backlog):
+    """Test that catching up claims only the allowance, oldest first."""
+    dispatch = MagicMock()
+    poller = DuePoller(session, dispatch, batch_size=4, catchup=make_catchup())
+
+    assert poller.tick(NOW) == 10
+    assert [c.args[0] for c in dispatch.call_args_list] == [
+        row.id for row in backlog[:10]
+    ]
+    assert poller.tick(NOW + timedelta(seconds=1)) == 10
+    assert poller.tick(NOW + timedelta(seconds=60)) == 10
+    poller.tick(NOW + timedelta(seconds=61))
+    assert not poller.catchup.active
+
+
+def test_poller_paces_its_share_of_partitions(session, backlog):
+    """Test that a poller owning one of two partitions claims half the rate."""
+    dispatch = MagicMock()
+    poller = DuePoller(
+        session, dispatch, batch_size=4, partitions=2, catchup=make_catchup()
+    )
+    poller.owned = [0]
+
+    assert poller.tick(NOW) == 5
+    assert poller.catchup.share == 0.5
+    assert all(c.args[0] % 2 == 0 for c in dispatch.call_args_list)
+
+
+def test_pollers_without_partitions_split_the_rate(session, backlog):
+    """Test that two pollers of every event together keep to the rate."""
+    membership = MagicMock()
+    membership.heartbeat.return_value = ["replica-1", "replica-2"]
+    dispatch = MagicMock()
+    pollers = [
+        DuePoller(
+            session,
+            dispatch,
+            batch_size=4,
+            catchup=make_catchup(owner=owner),
+            membership=membership,
+        )
+        for owner in ("replica-1", "replica-2")
+    ]
+
+    assert [poller.tick(NOW) for poller in pollers] == [5, 5]
+    # The rate grows from 10 to 11 events per second, split in two.
+    later = NOW + timedelta(seconds=1)
+    assert [poller.tick(later) for poller in pollers] == [5, 5]
+    claimed = [c.args[0] for c in dispatch.call_args_list]
+    assert sorted(claimed) == [row.id for row in backlog[:20]]
+
+
+def test_poller_skips_stale_events(session, backlog):
+    """Test that events overdue past the cutoff are done and skipped."""
+    catchup = make_catchup(stale_after=3600 * 2 + 60 * 40)
+    dispatch = MagicMock()
+    poller = DuePoller(session, dispatch, batch_size=4, catchup=catchup)
+
+    poller.tick(NOW)
+
+    skipped = [row.id for row in backlog[:20]]
+    catchup.connection.pipeline.return_value.lpush.assert_called()
+    assert catchup.skipped == 20
+    session.expire_all()
+    assert all(session.get(Event, event_id).is_done for event_id in skipped)
+    recipients = session.query(Recipient).filter(Recipient.event_id.in_(skipped))
+    assert {r.status for r in recipients} == {Recipient.STATUS_SKIPPED}
+    assert [c.args[0] for c in dispatch.call_args_list] == [
+        row.id for row in backlog[20:]
+    ]
+
+
+def test_catchup_metrics_endpoint(client):
+    """Test that the catch-up endpoint reports the published progress."""
+    report = {"active": True, "backlog": 3, "skipped_events": []}
+    with patch("app.api.routes.catchup_stats", return_value=report), patch(
+        "app.api.routes.rq"
+    ):
+        response = client.get("/api/metrics/catchup")
+
+    assert response.status_code == 200
+    assert response.json == report
@@ -0,0 +1,100 @@
+"""Tests for leader election and sharding of dispatcher replicas."""
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.scheduler.coordination import (
+    Coordinator,
+    Lease,
+    LeaseLost,
+    Membership,
+    partition_for,
+)
+from app.scheduler.wheel import TimingWheel
+
+
+def scripted_connection(*replies):
+    """Make a connection whose Lua scripts return the given replies."""
+    connection = MagicMock()
+    connection.register_script.return_value = MagicMock(side_effect=replies)
+    return connection
+
+
+def test_partition_for_is_stable_and_in_range():
+    """Test that strings and bytes of an ID hash to the same partition."""
+    assert partition_for("job-1", 8) == partition_for(b"job-1", 8)
+    assert {partition_for(n, 4) for n in range(100)} == {0, 1, 2, 3}
+    assert partition_for("job-1", 1) == 0
+
+
+def test_lease_keeps_token_of_holder():
+    """Test that the token is kept while held and dropped once lost."""
+    lease = Lease(scripted_connection(3, 3, None), owner="a")
+
+    assert lease.acquire() == 3
+    assert lease.acquire() == 3
+    assert lease.acquire() is None
+    assert lease.token is None
+
+
+def test_follower_gets_no_partitions():
+    """Test that only the lease holder dispatches, fenced by its token."""
+    coordinator = Coordinator(scripted_connection(None, 7), partitions=2)
+
+    assert coordinator.assignment() == []
+    assert coordinator.fence is None
+    assert coordinator.assignment() == [0, 1]
+    assert coordinator.fence == ("mail-scheduler:lease:dispatcher:fence", 7)
+
+
+def test_membership_deals_partitions_over_live_replicas():
+    """Test that partitions move to the others when a replica leaves."""
+    membership = Membership(
+        scripted_connection([b"a", b"b", b"c"], [b"b", b"c"]), owner="b"
+    )
+
+    assert membership.owned(6) == [1, 4]
+    assert membership.owned(6) == [0, 2, 4]
+
+
+def test_sharded_coordinator_is_not_fenced():
+    """Test that shards rely on their heartbeats, not on the lease."""
+    coordinator = Coordinator(scripted_connection(), partitions=4, sharded=True)
+    coordinator.membership.heartbeat = lambda: [coordinator.membership.owner]
+
+    assert coordinator.assignment() == [0, 1, 2, 3]
+    assert coordinator.fence is None
+    assert coordinator.renew_interval < coordinator.ttl
+
+
+def test_partitioned_wheel_files_jobs_in_their_partition():
+    """Test that each partition has its own keys."""
+    wheel = TimingWheel(MagicMock(), MagicMock(), partitions=4)
+    pipe = MagicMock()
+    partition = partition_for("job-1", 4)
+
+    wheel._file(pipe, "job-1", 1_000_000.5, 1_000_000.0)
+
+    pipe.zadd.assert_any_call(
+        f"mail-scheduler:wheel:p{partition}:0:1000000", {"job-1": 1_000_000.5}
+    )
+    assert TimingWheel(MagicMock(), MagicMock()).index_key(0) == (
+        "mail-scheduler:wheel:0"
+    )
+
+
+def test_wheel_take_stops_on_stale_fencing_token():
+    """Test that a former leader moves nothing once a new one took over."""
+    wheel = TimingWheel(MagicMock(), MagicMock())
+    wheel.fence = ("fence", 1)
+    wheel.connection.zrangebyscore.side_effect = [[], [], [b"999999"]]
+    pipe = MagicMock()
+    pipe.get.return_value = b"2"
+    wheel.connection.pipeline.return_value.__enter__.return_value = pipe
+
+    with pytest.raises(LeaseLost):
+        wheel.tick(1_000_000.0)
+
+    pipe.watch.assert_called_once_with("mail-scheduler:wheel:0:999999", "fence")
+    pipe.execute.assert_not_called()
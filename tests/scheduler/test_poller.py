@@ -0,0 +1,180 @@
+"""Tests for claiming due events from the database."""
+
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.database.models import Event
+from app.scheduler.poller import DuePoller
+
+NOW = datetime(2025, 5, 10, 12, 0)
+
+
+@pytest.fixture
+def events(session):
+    """Create two due events, a future one and a done one."""
+    rows = [
+        Event("Second", "Body", NOW - timedelta(minutes=1)),
+        Event("First", "Body", NOW - timedelta(minutes=5)),
+        Event("Future", "Body", NOW + timedelta(hours=1)),
+        Event("Done", "Body", NOW - timedelta(minutes=9), is_done=True),
+    ]
+    session.add_all(rows)
+    session.commit()
+    return rows
+
+
+def test_claim_takes_due_events_oldest_first(session, events):
+    """Test that only due events not done are claimed, oldest first."""
+    poller = DuePoller(session, MagicMock())
+
+    assert poller.claim(NOW) == [events[1].id, events[0].id]
+    session.refresh(events[0])
+    assert events[0].dispatched_at == NOW
+    assert events[2].dispatched_at is None
+
+
+def test_claimed_events_are_not_claimed_again(session, events):
+    """Test that a second poller finds nothing left to claim."""
+    DuePoller(session, MagicMock()).claim(NOW)
+
+    assert DuePoller(session, MagicMock()).claim(NOW) == []
+
+
+def test_expired_claim_is_taken_again(session, events):
+    """Test that events claimed longer ago than the timeout are retaken."""
+    poller = DuePoller(session, MagicMock(), claim_timeout=60)
+    poller.claim(NOW)
+
+    assert poller.claim(NOW + timedelta(seconds=30)) == []
+    assert len(poller.claim(NOW + timedelta(seconds=90))) == 2
+
+
+def test_claim_loses_race_for_row_taken_meanwhile(session, events, monkeypatch):
+    """Test that a row claimed after the scan is skipped, not claimed twice."""
+    poller = DuePoller(session, MagicMock())
+    scalars = session.scalars
+
+    def scan_then_lose_race(query):
+        ids = scalars(query).all()
+        events[1].dispatched_at = NOW
+        session.flush()
+        return MagicMock(all=lambda: ids)
+
+    monkeypatch.setattr(session, "scalars", scan_then_lose_race)
+
+    assert poller.claim(NOW) == [events[0].id]
+
+
+def test_claim_skips_locked_rows_on_postgres():
+    """Test that PostgreSQL selects the due rows FOR UPDATE SKIP LOCKED."""
+    session = MagicMock()
+    session.get_bind.return_value.dialect.name = "postgresql"
+    session.scalars.return_value = [1, 2]
+
+    assert DuePoller(session, MagicMock()).claim(NOW) == [1, 2]
+
+    query = session.scalars.call_args.args[0]
+    assert "FOR UPDATE SKIP LOCKED" in str(query.compile(dialect=postgresql.dialect()))
+    session.commit.assert_called_once()
+
+
+def test_tick_dispatches_every_due_event_in_batches(session, events):
+    """Test that tick keeps claiming until a batch comes back short."""
+    dispatch = MagicMock()
+    poller = DuePoller(session, dispatch, batch_size=1)
+
+    assert poller.tick(NOW) == 2
+    assert [c.args[0] for c in dispatch.call_args_list] == [
+        events[1].id,
+        events[0].id,
+    ]
+
+
+def test_schedule_mail_leaves_database_mode_to_poller(app, monkeypatch):
+    """Test that nothing is written to Redis when the table is the schedule."""
+    from app.event import jobs
+
+    monkeypatch.setattr(jobs, "rq", MagicMock())
+    monkeypatch.setitem(app.config, "MAIL_SCHEDULER", "database")
+
+    with app.app_context():
+        jobs.schedule_mail(1, NOW)
+
+    jobs.rq.get_scheduler.assert_not_called()
+    jobs.rq.get_queue.assert_not_called()
+
+
+def test_dispatcher_command_polls_in_database_mode(app, monkeypatch):
+    """Test that MAIL_SCHEDULER=database runs the poller."""
+    poller = MagicMock()
+    monkeypatch.setattr("app.scheduler.commands.DuePoller", lambda *a, **k: poller)
+    monkeypatch.setitem(app.config, "MAIL_SCHEDULER", "database")
+
+    from app.scheduler.commands import dispatcher_command
+
+    result = app.test_cli_runner().invoke(dispatcher_command, ["--burst"])
+
+    assert result.exit_code == 0
+    poller.run.assert_called_once_with(5, burst=True, coordinator=None)
+
+
+def test_pollers_count_each_other_unless_sharded(app, monkeypatch):
+    """Test that only pollers of every event split the rates by heartbeat."""
+    from app.scheduler.commands import poller_membership
+
+    monkeypatch.setattr("app.scheduler.commands.rq", MagicMock())
+    monkeypatch.setitem(app.config, "MAIL_POLLER_INTERVAL", 20)
+
+    assert poller_membership(app.config).ttl == 60
+    monkeypatch.setitem(app.config, "MAIL_DISPATCHER_SHARDED", True)
+    assert poller_membership(app.config) is None
+
+
+def test_poller_claims_only_its_partitions(session, events):
+    """Test that a sharded poller claims the event IDs of its partitions."""
+    poller = DuePoller(session, MagicMock(), partitions=2)
+    poller.owned = [events[0].id % 2]
+
+    assert poller.claim(NOW) == [events[0].id]
+
+    poller.owned = []
+    assert poller.claim(NOW) == []
+
+
+def test_deferral_is_retried_through_the_poller(app, session, monkeypatch):
+    """Test that in database mode a retry waits in the table, not in Redis."""
+    from rq.utils import import_attribute
+
+    from app.database.models import Recipient, ScheduledCall
+    from app.event import jobs
+
+    monkeypatch.setitem(app.config, "MAIL_SCHEDULER", "database")
+    monkeypatch.setattr(jobs, "rq", MagicMock())
+    event = Event("Retry", "Body", NOW)
+    session.add(event)
+    session.commit()
+    session.add(Recipient("a@example.com", event_id=event.id))
+    session.commit()
+
+    refused = {"a@example.com": (450, b"Mailbox busy")}
+    assert jobs.settle_delivery(event, ["a@example.com"], refused, {}) == 1
+    jobs.rq.get_scheduler.assert_not_called()
+
+    calls = []
+    poller = DuePoller(session, MagicMock(), call=lambda *call: calls.append(call))
+    now = datetime.now(UTC).replace(tzinfo=None)
+    assert poller.dispatch_calls(now) == 0
+    assert poller.dispatch_calls(now + timedelta(hours=2)) == 1
+    [(job_id, func, args, queue)] = calls
+    assert func == "app.event.jobs.retry_mail"
+    assert (args, queue) == ((event.id, 1), "default")
+    assert session.query(ScheduledCall).count() == 0
+
+    monkeypatch.setattr(jobs, "transmit", lambda *args: ({}, {}))
+    import_attribute(func)(*args)
+
+    session.expire_all()
+    assert session.query(Recipient).filter_by(event_id=event.id).one().is_sent
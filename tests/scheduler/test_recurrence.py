@@ -0,0 +1,180 @@
+"""Tests for recurring events."""
+
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.database.models import Event, Recipient
+from app.scheduler.poller import DuePoller
+from app.scheduler.recurrence import first_fire, next_fire
+
+START = datetime(2025, 5, 10, 8, 0)
+
+
+def test_cron_fires_after_given_time():
+    """Test that a cron rule yields the next match after the given time."""
+    assert next_fire("0 9 * * *", START, START) == datetime(2025, 5, 10, 9, 0)
+    assert next_fire("0 9 * * *", START, datetime(2025, 5, 10, 9, 0)) == datetime(
+        2025, 5, 11, 9, 0
+    )
+
+
+def test_cron_does_not_fire_before_start():
+    """Test that a cron rule starts at the event time, inclusive."""
+    assert first_fire("0 8 * * *", START) == START
+    assert next_fire("0 8 * * *", START, START - timedelta(days=3)) == START
+
+
+def test_rrule_counts_from_event_start():
+    """Test that an RRULE uses the event time as DTSTART and ends."""
+    rule = "FREQ=WEEKLY;COUNT=2"
+
+    assert first_fire(rule, START) == START
+    assert next_fire(rule, START, START) == START + timedelta(weeks=1)
+    assert next_fire(rule, START, START + timedelta(weeks=1)) is None
+
+
+@pytest.mark.parametrize("rule", ["every monday", "FREQ=SOMETIMES"])
+def test_invalid_rules_raise_value_error(rule):
+    """Test that rules that do not parse are rejected."""
+    with pytest.raises(ValueError):
+        first_fire(rule, START)
+
+
+@pytest.fixture
+def recurring(session):
+    """Create a daily recurring event with two recipients, due at START."""
+    event = Event(
+        "Daily",
+        "Body",
+        START,
+        recurrence="0 8 * * *",
+        next_fire_at=START,
+    )
+    session.add(event)
+    session.commit()
+    session.add_all(
+        [
+            Recipient("a@example.com", event_id=event.id),
+            Recipient("b@example.com", name="B", event_id=event.id),
+        ]
+    )
+    session.commit()
+    return event
+
+
+@pytest.fixture
+def fire_env(monkeypatch):
+    """Capture the send and next fire scheduled by fire_recurrence."""
+    from app.event import jobs
+
+    send_mail = MagicMock()
+    schedule_job = MagicMock(return_value="job-2")
+    monkeypatch.setattr(jobs, "send_mail", send_mail)
+    monkeypatch.setattr(jobs, "schedule_job", schedule_job)
+    return jobs, send_mail, schedule_job
+
+
+def test_fire_recurrence_creates_run_and_schedules_next(
+    app, session, recurring, fire_env
+):
+    """Test that a run copies the event and recipients and advances."""
+    jobs, send_mail, schedule_job = fire_env
+
+    run_id = jobs.fire_recurrence(recurring.id, START)
+
+    run = session.get(Event, run_id)
+    assert (run.parent_id, run.timestamp, run.recurrence) == (
+        recurring.id,
+        START,
+        None,
+    )
+    assert sorted(
+        (r.email, r.name, r.status)
+        for r in session.query(Recipient).filter_by(event_id=run_id)
+    ) == [
+        ("a@example.com", None, Recipient.STATUS_QUEUED),
+        ("b@example.com", "B", Recipient.STATUS_QUEUED),
+    ]
+    send_mail.queue.assert_called_once_with(run_id, queue="default")
+
+    session.refresh(recurring)
+    assert recurring.next_fire_at > datetime.now() - timedelta(days=1)
+    when, func, event_id, fire_at = schedule_job.call_args.args
+    assert func is jobs.fire_recurrence
+    assert (event_id, fire_at) == (recurring.id, recurring.next_fire_at)
+
+
+def test_fire_recurrence_runs_once_per_fire_time(app, session, recurring, fire_env):
+    """Test that a duplicated job does not create a second run."""
+    jobs, send_mail, _ = fire_env
+
+    assert jobs.fire_recurrence(recurring.id, START) is not None
+    assert jobs.fire_recurrence(recurring.id, START) is None
+    assert send_mail.queue.call_count == 1
+
+
+def test_fire_recurrence_marks_finished_rule_done(app, session, recurring, fire_env):
+    """Test that the last run of an RRULE completes the event."""
+    jobs, _, schedule_job = fire_env
+    recurring.recurrence = "FREQ=DAILY;COUNT=1"
+    session.commit()
+
+    assert jobs.fire_recurrence(recurring.id, START) is not None
+
+    session.refresh(recurring)
+    assert recurring.is_done and recurring.next_fire_at is None
+    schedule_job.assert_not_called()
+
+
+def test_add_event_schedules_first_fire(app, monkeypatch):
+    """Test that a recurring event schedules its first run, not a send."""
+    from app.event import jobs
+
+    monkeypatch.setattr(jobs, "db", MagicMock())
+    monkeypatch.setattr(jobs, "add_recipients", MagicMock())
+    monkeypatch.setattr(jobs, "schedule_mail", MagicMock())
+    monkeypatch.setattr(jobs, "schedule_recurrence", MagicMock())
+
+    with app.app_context():
+        jobs.add_event(
+            {
+                "subject": "Weekly",
+                "content": "Body",
+                "timestamp": START.replace(tzinfo=None).isoformat() + "+00:00",
+                "recipients": "a@example.com",
+                "recurrence": "0 9 * * MON",
+            }
+        )
+
+    jobs.schedule_mail.assert_not_called()
+    _, fire_at, _ = jobs.schedule_recurrence.call_args.args
+    assert fire_at == datetime(2025, 5, 12, 9, 0)
+
+
+def test_add_event_rejects_invalid_recurrence(app):
+    """Test that a bad rule fails validation before anything is stored."""
+    from app.event.jobs import event_fields
+
+    with pytest.raises(ValueError):
+        event_fields(
+            {
+                "subject": "Weekly",
+                "content": "Body",
+                "timestamp": "10 May 2025 08:00 +00",
+                "recipients": "a@example.com",
+                "recurrence": "sometimes",
+            }
+        )
+
+
+def test_poller_fires_recurrences_and_skips_them_as_sends(session, recurring):
+    """Test that the poller fires due rules but never sends the rule itself."""
+    fire = MagicMock()
+    poller = DuePoller(session, MagicMock(), fire=fire)
+
+    assert poller.claim(START) == []
+    poller.tick(START)
+
+    fire.assert_called_once_with(recurring.id, START)
@@ -0,0 +1,171 @@
+"""Tests for spreading sends over a window after their scheduled time."""
+
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.database.models import Event, Recipient
+from app.scheduler.poller import DuePoller
+from app.scheduler.spreading import Spreader, required_rate, spread_stats
+from app.scheduler.wheel import to_timestamp
+
+NOW = datetime(2025, 5, 10, 9, 0)
+
+
+def test_required_rate_meets_every_deadline():
+    """Test that the rate is set by the tightest deadline."""
+    deadlines = [
+        (NOW + timedelta(seconds=10), 5),
+        (NOW + timedelta(seconds=100), 100),
+    ]
+
+    # 5 in 10s is 0.5/s, but 105 in 100s needs 1.05/s.
+    assert required_rate(deadlines, NOW) == pytest.approx(1.05)
+    assert required_rate([], NOW) == 0
+
+
+def test_allowance_spreads_evenly_without_capacity():
+    """Test that events are released at the rate meeting the deadlines."""
+    spreader = Spreader(MagicMock())
+    deadlines = [(NOW + timedelta(minutes=10), 600)]
+
+    assert spreader.allowance(deadlines, NOW) == 0
+    assert spreader.allowance(deadlines, NOW + timedelta(seconds=5)) == 5
+
+
+def test_allowance_uses_capacity_and_sends_late_events():
+    """Test that capacity sets the pace and late events are never held."""
+    spreader = Spreader(MagicMock(), capacity=20)
+    deadlines = [
+        (NOW - timedelta(seconds=1), 3),
+        (NOW + timedelta(minutes=10), 600),
+    ]
+
+    spreader.allowance(deadlines, NOW)
+    assert spreader.allowance(deadlines, NOW + timedelta(seconds=2)) == 3 + 40
+    assert spreader.allowance([(NOW, 3)], NOW + timedelta(seconds=3)) is None
+
+
+def test_allowance_takes_the_replica_share():
+    """Test that replicas together keep to the capacity and the deadlines."""
+    unsharded = Spreader(MagicMock(), capacity=20)
+    unsharded.share = 0.25
+    # Every replica sees all 600 events and takes a quarter of the rate.
+    deadlines = [(NOW + timedelta(minutes=10), 600)]
+    unsharded.allowance(deadlines, NOW)
+    assert unsharded.allowance(deadlines, NOW + timedelta(seconds=2)) == 10
+
+    sharded = Spreader(MagicMock())
+    sharded.share = sharded.scope = 0.5
+    # Half the partitions hold half the events, released at half the rate.
+    deadlines = [(NOW + timedelta(minutes=10), 300)]
+    sharded.allowance(deadlines, NOW)
+    assert sharded.allowance(deadlines, NOW + timedelta(seconds=4)) == 2
+
+
+def test_dispatches_are_counted_per_minute():
+    """Test that the requested and achieved peaks are read back."""
+    spreader = Spreader(MagicMock())
+    spreader.record([NOW, NOW, NOW + timedelta(seconds=30)], NOW)
+    pipe = spreader.connection.pipeline.return_value
+    pipe.hincrby.assert_any_call(
+        "mail-scheduler:spread:requested:2025-05-10", int(to_timestamp(NOW)), 3
+    )
+    connection = MagicMock()
+    minute = str(int(to_timestamp(NOW))).encode()
+    later = str(int(to_timestamp(NOW + timedelta(minutes=5)))).encode()
+    connection.pipeline.return_value.execute.return_value = [
+        {},
+        {minute: b"120"},
+        {},
+        {minute: b"20", later: b"30"},
+    ]
+
+    stats = spread_stats(connection, NOW + timedelta(minutes=10))
+
+    assert stats["requested_peak"] == {"per_minute": 120, "at": NOW.isoformat()}
+    assert stats["achieved_peak"] == {
+        "per_minute": 30,
+        "at": (NOW + timedelta(minutes=5)).isoformat(),
+    }
+
+
+@pytest.fixture
+def round_time(session):
+    """Create 20 events due now, half of them spread over ten minutes."""
+    rows = [
+        Event(
+            f"Event {n}",
+            "Body",
+            NOW,
+            send_by=NOW + timedelta(minutes=10) if n % 2 else None,
+        )
+        for n in range(20)
+    ]
+    session.add_all(rows)
+    session.commit()
+    session.add_all(Recipient("a@example.com", event_id=row.id) for row in rows)
+    session.commit()
+    return rows
+
+
+def test_poller_holds_back_spread_events(session, round_time):
+    """Test that events without a window go first and the rest are paced."""
+    dispatch = MagicMock()
+    spreader = Spreader(MagicMock(), capacity=1)
+    poller = DuePoller(session, dispatch, batch_size=4, spreader=spreader)
+
+    assert poller.tick(NOW) == 10
+    assert {c.args[0] for c in dispatch.call_args_list} == {
+        row.id for row in round_time[::2]
+    }
+    assert poller.tick(NOW + timedelta(seconds=3)) == 3
+    spreader.connection.pipeline.return_value.execute.assert_called()
+
+
+SPREAD_DATA = {
+    "subject": "Newsletter",
+    "content": "Body",
+    "timestamp": "10 May 2025 09:00 +00",
+    "recipients": "a@example.com",
+}
+
+
+def test_event_fields_spread(app, monkeypatch):
+    """Test that a spread sets the deadline and the default applies."""
+    from app.event.jobs import event_fields
+
+    monkeypatch.setitem(app.config, "MAIL_SCHEDULER", "database")
+    monkeypatch.setitem(app.config, "MAIL_SPREAD_WINDOW", 300)
+    with app.app_context():
+        assert event_fields(SPREAD_DATA)["send_by"] == NOW + timedelta(minutes=5)
+        assert "send_by" not in event_fields(dict(SPREAD_DATA, spread=0))
+        for spread in (-5, True, 1.5):
+            with pytest.raises(ValueError, match="whole number"):
+                event_fields(dict(SPREAD_DATA, spread=spread))
+
+
+@pytest.mark.parametrize("scheduler", [None, "wheel"])
+def test_spread_needs_database_dispatcher(app, monkeypatch, scheduler):
+    """Test that modes that cannot pace reject a spread and skip the default."""
+    from app.event.jobs import event_fields
+
+    monkeypatch.setitem(app.config, "MAIL_SCHEDULER", scheduler)
+    monkeypatch.setitem(app.config, "MAIL_SPREAD_WINDOW", 300)
+    with app.app_context():
+        assert "send_by" not in event_fields(SPREAD_DATA)
+        with pytest.raises(ValueError, match="MAIL_SCHEDULER=database"):
+            event_fields(dict(SPREAD_DATA, spread=600))
+
+
+def test_spread_metrics_endpoint(client):
+    """Test that the spread endpoint reports the peaks."""
+    report = {"hours": 24, "requested_peak": {"per_minute": 3, "at": None}}
+    with patch("app.api.routes.spread_stats", return_value=report), patch(
+        "app.api.routes.rq"
+    ):
+        response = client.get("/api/metrics/spread")
+
+    assert response.status_code == 200
+    assert response.json == report
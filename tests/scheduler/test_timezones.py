@@ -0,0 +1,155 @@
+"""Tests for sending at a local time in every recipient's time zone."""
+
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.database.models import Event, Recipient
+from app.scheduler.timezones import (
+    bucket_send_time,
+    first_send_time,
+    offset_buckets,
+    validate_timezone,
+    zone_offset,
+)
+
+NINE = datetime(2025, 7, 1, 9, 0)
+
+
+def test_zone_offset_follows_daylight_saving_time():
+    """Test that the offset is the one in force on the day of the send."""
+    assert zone_offset("America/New_York", NINE) == -240
+    assert zone_offset("America/New_York", NINE.replace(month=1)) == -300
+    assert zone_offset("Asia/Kolkata", NINE) == 330
+
+
+def test_zones_sharing_an_offset_share_a_bucket():
+    """Test that time zones are grouped by offset, one bucket each."""
+    buckets = offset_buckets(
+        ["Europe/Paris", "Europe/Berlin", "Asia/Tokyo", None, "Europe/Paris"], NINE
+    )
+
+    assert {offset: sorted(zones, key=str) for offset, zones in buckets.items()} == {
+        120: ["Europe/Berlin", "Europe/Paris"],
+        540: ["Asia/Tokyo"],
+        0: [None],
+    }
+    assert bucket_send_time(NINE, 540) == datetime(2025, 7, 1, 0, 0)
+
+
+def test_first_send_time_is_the_easternmost_bucket():
+    """Test that the event is due when the first time zone reaches it."""
+    assert first_send_time(["Asia/Tokyo", "America/Denver"], NINE) == datetime(
+        2025, 7, 1, 0, 0
+    )
+    assert first_send_time([None], NINE, "Asia/Jakarta") == datetime(2025, 7, 1, 2, 0)
+
+
+def test_unknown_timezone_is_rejected():
+    """Test that a misspelt time zone raises ValueError."""
+    assert validate_timezone("Asia/Tokyo") == "Asia/Tokyo"
+    with pytest.raises(ValueError, match="Unknown time zone"):
+        validate_timezone("Mars/Olympus")
+
+
+def test_event_fields_local_time(app):
+    """Test that a local-time event keeps the wall clock and its first send."""
+    from app.event.jobs import event_fields
+
+    with app.app_context():
+        fields = event_fields(
+            {
+                "subject": "Morning",
+                "content": "Body",
+                "timestamp": "1 Jul 2025 09:00 +08",
+                "recipients": "a@example.com, b@example.com",
+                "local_time": True,
+                "timezones": {"a@example.com": "Asia/Tokyo"},
+            }
+        )
+
+    assert fields["local_time"] == NINE
+    assert fields["timestamp"] == datetime(2025, 7, 1, 0, 0)
+
+
+@pytest.fixture
+def global_event(session):
+    """Create a local-time event with recipients in four time zones."""
+    event = Event("Morning", "Body", datetime(2025, 7, 1, 0, 0), local_time=NINE)
+    session.add(event)
+    session.commit()
+    zones = ["Asia/Tokyo", "Asia/Seoul", "Europe/Paris", None]
+    session.add_all(
+        Recipient(f"{n}@example.com", event_id=event.id, timezone=zone)
+        for n, zone in enumerate(zones)
+    )
+    session.commit()
+    return event
+
+
+def test_fanned_out_event_is_not_claimed_again(
+    app, session, global_event, monkeypatch
+):
+    """Test that a claim expiring before the last group does not fan out twice."""
+    from app.database.models import ScheduledCall
+    from app.event import jobs
+    from app.scheduler.poller import DuePoller
+
+    monkeypatch.setitem(app.config, "MAIL_SCHEDULER", "database")
+    monkeypatch.setattr(jobs, "rq", MagicMock())
+    poller = DuePoller(session, jobs.send_mail, claim_timeout=3600)
+    start = datetime(2025, 7, 1, 0, 0)
+
+    assert poller.claim(start) == [global_event.id]
+    jobs.send_mail(global_event.id)
+    assert session.query(ScheduledCall).count() == 3
+
+    # Paris is due at 07:00, long after the one hour claim timeout.
+    assert poller.claim(start + timedelta(hours=2)) == []
+    assert poller.claim(start + timedelta(hours=9, minutes=30)) == []
+    assert session.query(ScheduledCall).count() == 3
+    assert poller.claim(start + timedelta(hours=10, minutes=1)) == [global_event.id]
+
+
+def test_send_mail_schedules_one_job_per_offset(
+    app, session, global_event, monkeypatch
+):
+    """Test that the send job fans out one job per UTC offset."""
+    from app.event import jobs
+
+    schedule_jobs = MagicMock()
+    monkeypatch.setattr(jobs, "schedule_jobs", schedule_jobs)
+    monkeypatch.setattr(jobs, "rq", MagicMock())
+
+    assert jobs.send_mail(global_event.id) == "Fanned out to 3 time zone groups"
+
+    calls = schedule_jobs.call_args.args[0]
+    assert [(when, args) for when, _, args in calls] == [
+        (
+            datetime(2025, 7, 1, 0, 0),
+            (global_event.id, 540, ["Asia/Seoul", "Asia/Tokyo"]),
+        ),
+        (datetime(2025, 7, 1, 7, 0), (global_event.id, 120, ["Europe/Paris"])),
+        (datetime(2025, 7, 1, 9, 0), (global_event.id, 0, [None])),
+    ]
+    assert schedule_jobs.call_args.kwargs["queues"] == ["default"] * 3
+    jobs.rq.connection.set.assert_called_once()
+
+
+def test_send_mail_zone_sends_only_its_time_zones(
+    app, session, global_event, monkeypatch
+):
+    """Test that a group job sends to its own recipients only."""
+    from app.event import jobs
+
+    deliver_mail = MagicMock()
+    monkeypatch.setattr(jobs, "deliver_mail", deliver_mail)
+    monkeypatch.setattr(jobs, "rq", MagicMock())
+    jobs.rq.connection.decr.return_value = 1
+
+    result = jobs.send_mail_zone(global_event.id, 0, [None, "Europe/Paris"])
+
+    assert result == "Time zone group of 2 recipients sent"
+    (_, batch), _ = deliver_mail.call_args
+    assert batch == ["2@example.com", "3@example.com"]
@@ -0,0 +1,359 @@
+"""Tests for the timing wheel dispatcher."""
+
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from rq.queue import Queue
+
+from app.scheduler.commands import dispatcher_command
+from app.scheduler.wheel import TimingWheel, to_timestamp
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture
+def wheel():
+    """Create a wheel over a mocked connection and queue."""
+    connection = MagicMock()
+    queue = MagicMock()
+    queue.name = "default"
+    queue.is_async = True
+    return TimingWheel(connection, queue)
+
+
+def test_to_timestamp_treats_naive_datetimes_as_utc():
+    """Test that naive and UTC datetimes give the same timestamp."""
+    aware = datetime(2025, 5, 10, 12, 0, tzinfo=UTC)
+
+    assert to_timestamp(aware.replace(tzinfo=None)) == to_timestamp(aware)
+
+
+@pytest.mark.parametrize(
+    "remaining, level",
+    [(0, 0), (59.9, 0), (60, 1), (3599, 1), (3600, 2), (86400 * 30, 2)],
+)
+def test_level_for_picks_finest_level_spanning_the_wait(wheel, remaining, level):
+    """Test that jobs go to the finest level whose wheel reaches them."""
+    assert wheel.level_for(NOW + remaining, NOW) == level
+
+
+def test_bucket_due_promotes_coarse_buckets_at_their_start(wheel):
+    """Test that coarse buckets are due when they start."""
+    assert wheel.slot_for(0, 125.5) == 125
+    assert wheel.slot_for(1, 125.5) == 2
+    assert wheel.bucket_due(1, 2) == 120
+
+
+def test_schedule_files_job_in_bucket_and_index(wheel, monkeypatch):
+    """Test that the job and its bucket are written in one pipeline."""
+    monkeypatch.setattr("app.scheduler.wheel.time.time", lambda: NOW)
+    pipe = wheel.connection.pipeline.return_value
+    job = MagicMock(id="job-1")
+
+    wheel.schedule(job, datetime.fromtimestamp(NOW + 90, UTC))
+
+    job.save.assert_called_once_with(pipeline=pipe)
+    slot = int((NOW + 90) // 60)
+    pipe.zadd.assert_any_call(f"mail-scheduler:wheel:1:{slot}", {"job-1": NOW + 90})
+    pipe.zadd.assert_any_call("mail-scheduler:wheel:1", {slot: slot * 60}, lt=True)
+    # The minute bucket is taken at the start of its minute.
+    pipe.publish.assert_called_once_with("mail-scheduler:wheel:wake", slot * 60)
+    pipe.execute.assert_called_once()
+
+
+def test_finest_bucket_is_due_with_its_earliest_job(wheel, monkeypatch):
+    """Test that a level 0 bucket is indexed by its job's exact due time."""
+    monkeypatch.setattr("app.scheduler.wheel.time.time", lambda: NOW)
+    pipe = wheel.connection.pipeline.return_value
+
+    wheel.schedule(MagicMock(id="job-1"), datetime.fromtimestamp(NOW + 5.25, UTC))
+
+    pipe.zadd.assert_any_call(
+        "mail-scheduler:wheel:0", {int(NOW + 5): NOW + 5.25}, lt=True
+    )
+
+
+def test_schedule_calls_share_one_pipeline(wheel, monkeypatch):
+    """Test that many calls are saved and filed with one round trip."""
+    monkeypatch.setattr("app.scheduler.wheel.time.time", lambda: NOW)
+    pipe = wheel.connection.pipeline.return_value
+    when = datetime.fromtimestamp(NOW + 5, UTC)
+
+    calls = [(when, "app.event.jobs.send_mail", (n,)) for n in (1, 2)]
+
+    jobs = wheel.schedule_calls(calls)
+
+    assert len(jobs) == 2
+    assert wheel.queue.create_job.call_args.kwargs["args"] == (2,)
+    assert pipe.zadd.call_count == 4
+    pipe.publish.assert_called_once_with("mail-scheduler:wheel:wake", NOW + 5)
+    pipe.execute.assert_called_once()
+
+
+def test_cancel_removes_job_from_every_level(wheel):
+    """Test that a job is looked for in the bucket of each level."""
+    pipe = wheel.connection.pipeline.return_value
+    pipe.execute.return_value = [0, 1, 0]
+
+    assert wheel.cancel("job-1", datetime.fromtimestamp(NOW, UTC))
+    assert pipe.zrem.call_count == 3
+
+
+def test_reschedule_files_cancelled_job_again(wheel, monkeypatch):
+    """Test that a rescheduled job moves to the bucket of its new time."""
+    monkeypatch.setattr("app.scheduler.wheel.time.time", lambda: NOW)
+    pipe = wheel.connection.pipeline.return_value
+    pipe.execute.return_value = [1, 0, 0]
+    new_when = datetime.fromtimestamp(NOW + 5, UTC)
+
+    assert wheel.reschedule("job-1", datetime.fromtimestamp(NOW, UTC), new_when)
+    pipe.zadd.assert_any_call(
+        f"mail-scheduler:wheel:0:{int(NOW + 5)}", {"job-1": NOW + 5}
+    )
+
+
+def test_reschedule_of_taken_job_fails(wheel):
+    """Test that a job already moved to the queue is not filed again."""
+    pipe = wheel.connection.pipeline.return_value
+    pipe.execute.return_value = [0, 0, 0]
+
+    when = datetime.fromtimestamp(NOW, UTC)
+
+    assert not wheel.reschedule("job-1", when, when + timedelta(hours=1))
+    pipe.zadd.assert_not_called()
+
+
+def take_pipeline(wheel, members):
+    """Make the connection return a pipeline whose bucket holds members."""
+    pipe = MagicMock()
+    pipe.zrange.return_value = members
+    wheel.connection.pipeline.return_value.__enter__.return_value = pipe
+    return pipe
+
+
+def test_tick_moves_due_finest_bucket_to_queue(wheel):
+    """Test that the jobs of a due level 0 bucket are enqueued atomically."""
+    wheel.connection.zrangebyscore.side_effect = [[], [], [b"999999"]]
+    pipe = take_pipeline(wheel, [(b"job-1", NOW - 1), (b"job-2", NOW - 1)])
+    jobs = [MagicMock(id="job-1", origin="default"), None]
+    wheel.queue.job_class.fetch_many.return_value = jobs
+
+    assert wheel.tick(NOW) == 1
+
+    pipe.watch.assert_called_once_with("mail-scheduler:wheel:0:999999")
+    wheel.queue._enqueue_job.assert_called_once_with(jobs[0], pipeline=pipe)
+    pipe.delete.assert_called_once_with("mail-scheduler:wheel:0:999999")
+    pipe.zrem.assert_called_once_with("mail-scheduler:wheel:0", 999999)
+    pipe.lpush.assert_called_once()
+
+
+def test_tick_leaves_jobs_not_yet_due_in_finest_bucket(wheel):
+    """Test that later jobs stay, and the bucket is due with the next one."""
+    wheel.connection.zrangebyscore.side_effect = [[], [], [b"999999"]]
+    pipe = take_pipeline(wheel, [(b"job-1", NOW - 0.5), (b"job-2", NOW + 0.25)])
+    job = MagicMock(id="job-1", origin="default")
+    wheel.queue.job_class.fetch_many.return_value = [job]
+
+    assert wheel.tick(NOW) == 1
+
+    wheel.queue.job_class.fetch_many.assert_called_once_with(
+        ["job-1"], connection=wheel.connection
+    )
+    pipe.zrem.assert_called_once_with("mail-scheduler:wheel:0:999999", b"job-1")
+    pipe.zadd.assert_called_once_with("mail-scheduler:wheel:0", {999999: NOW + 0.25})
+    pipe.delete.assert_not_called()
+
+
+def test_tick_promotes_due_coarse_bucket(wheel):
+    """Test that a due minute bucket is spread over second buckets."""
+    slot = int(NOW // 60)
+    due = slot * 60 + 30
+    wheel.connection.zrangebyscore.side_effect = [[], [str(slot).encode()], []]
+    pipe = take_pipeline(wheel, [(b"job-1", due)])
+
+    assert wheel.tick(NOW) == 0
+
+    pipe.zadd.assert_any_call(f"mail-scheduler:wheel:0:{int(due)}", {b"job-1": due})
+    wheel.queue._enqueue_job.assert_not_called()
+    pipe.delete.assert_called_once_with(f"mail-scheduler:wheel:1:{slot}")
+
+
+def test_tick_runs_jobs_inline_on_synchronous_queue(wheel):
+    """Test that a synchronous queue runs jobs after the transaction."""
+    wheel.queue.is_async = False
+    wheel.connection.zrangebyscore.side_effect = [[], [], [b"999999"]]
+    pipe = take_pipeline(wheel, [(b"job-1", NOW - 1)])
+    job = MagicMock(id="job-1", origin="default")
+    wheel.queue.job_class.fetch_many.return_value = [job]
+
+    assert wheel.tick(NOW) == 1
+
+    wheel.queue.enqueue_job.assert_called_once_with(job)
+    pipe.execute.assert_called_once()
+
+
+def test_jobs_are_enqueued_in_their_own_queue(wheel, monkeypatch):
+    """Test that a job scheduled for another queue is enqueued there."""
+    wheel.connection.zrangebyscore.side_effect = [[], [], [b"999999"]]
+    pipe = take_pipeline(wheel, [(b"job-1", NOW - 1)])
+    job = MagicMock(id="job-1", origin="high")
+    wheel.queue.job_class.fetch_many.return_value = [job]
+    high = MagicMock()
+    monkeypatch.setattr(wheel, "queue_named", {"high": high}.get)
+
+    assert wheel.tick(NOW) == 1
+
+    high._enqueue_job.assert_called_once_with(job, pipeline=pipe)
+
+
+def test_queue_named_shares_the_wheel_settings():
+    """Test that other queues are built like the wheel's own."""
+    queue = Queue("default", connection=MagicMock(), is_async=False)
+    wheel = TimingWheel(queue.connection, queue)
+
+    assert wheel.queue_named(None) is queue
+    high = wheel.queue_named("high")
+    assert (high.name, high.is_async, high.connection) == (
+        "high",
+        False,
+        queue.connection,
+    )
+
+
+def test_sleep_time_runs_until_the_earliest_bucket(wheel):
+    """Test that the dispatcher sleeps until the next due bucket, capped."""
+    pipe = wheel.connection.pipeline.return_value
+    pipe.execute.return_value = [[(b"1", NOW + 0.4)], [], [(b"2", NOW + 3600)]]
+
+    assert wheel.next_due() == NOW + 0.4
+    assert wheel.sleep_time(30, now=NOW) == pytest.approx(0.4)
+    assert wheel.sleep_time(0.1, now=NOW) == 0.1
+
+    pipe.execute.return_value = [[], [], []]
+    assert wheel.sleep_time(30, now=NOW) == 30
+
+
+def test_run_waits_on_wake_channel(wheel, monkeypatch):
+    """Test that the dispatcher blocks on the wake channel between ticks."""
+    monkeypatch.setattr("app.scheduler.wheel.time.time", lambda: NOW)
+    pubsub = wheel.connection.pubsub.return_value
+    monkeypatch.setattr(wheel, "tick", MagicMock(return_value=0))
+    monkeypatch.setattr(wheel, "sleep_time", lambda interval, partitions: 0.25)
+    monkeypatch.setattr(wheel, "wait", MagicMock(side_effect=[None, KeyboardInterrupt]))
+
+    with pytest.raises(KeyboardInterrupt):
+        wheel.run(30)
+
+    pubsub.subscribe.assert_called_once_with("mail-scheduler:wheel:wake")
+    wheel.wait.assert_called_with(pubsub, NOW + 0.25)
+    assert wheel.tick.call_count == 2
+    pubsub.close.assert_called_once()
+
+
+def message(take_at):
+    """Build a wake-up message for a bucket taken at ``take_at``."""
+    return {"type": "message", "data": str(take_at).encode()}
+
+
+def test_wait_ignores_jobs_due_after_the_planned_wake(wheel, monkeypatch):
+    """Test that scheduling later jobs does not cut the sleep short."""
+    clock = [NOW]
+    monkeypatch.setattr("app.scheduler.wheel.time.time", lambda: clock[0])
+    pubsub = MagicMock()
+
+    def get_message(timeout):
+        # Two later jobs arrive a second apart, then the sleep runs out.
+        if timeout == 0.0:
+            return None
+        if clock[0] < NOW + 2:
+            clock[0] += 1
+            return message(NOW + 60)
+        clock[0] += timeout
+        return None
+
+    pubsub.get_message.side_effect = get_message
+
+    wheel.wait(pubsub, NOW + 10)
+
+    assert clock[0] == NOW + 10
+    timeouts = [c.kwargs["timeout"] for c in pubsub.get_message.call_args_list]
+    assert timeouts == [10, 9, 8, 0.0]
+
+
+def test_wait_wakes_early_and_drains_pending_messages(wheel, monkeypatch):
+    """Test that a sooner job ends the sleep and later messages are dropped."""
+    monkeypatch.setattr("app.scheduler.wheel.time.time", lambda: NOW)
+    pubsub = MagicMock()
+    pubsub.get_message.side_effect = [
+        message(NOW + 60),
+        message(NOW - 1),
+        message(NOW + 5),
+        message(NOW + 2),
+        None,
+    ]
+
+    wheel.wait(pubsub, NOW + 10)
+
+    timeouts = [c.kwargs["timeout"] for c in pubsub.get_message.call_args_list]
+    assert timeouts == [10, 10, 0.0, 0.0, 0.0]
+
+
+def test_lag_stats_summarizes_samples(wheel):
+    """Test that recorded lags are reported as percentiles."""
+    wheel.connection.lrange.return_value = [str(n / 100).encode() for n in range(100)]
+
+    stats = wheel.lag_stats()
+
+    assert stats["samples"] == 100
+    assert (stats["p50"], stats["p99"], stats["max"]) == (0.5, 0.99, 0.99)
+
+    wheel.connection.lrange.return_value = []
+    assert wheel.lag_stats()["p99"] is None
+
+
+def test_schedule_job_files_in_wheel(app, monkeypatch):
+    """Test that MAIL_SCHEDULER=wheel bypasses rq-scheduler."""
+    from app.event import jobs
+
+    wheel = MagicMock()
+    monkeypatch.setattr(jobs.TimingWheel, "from_config", lambda *args: wheel)
+    monkeypatch.setattr(jobs, "rq", MagicMock())
+    monkeypatch.setitem(app.config, "MAIL_SCHEDULER", "wheel")
+
+    with app.app_context():
+        jobs.schedule_job(timedelta(seconds=30), jobs.send_mail, 1)
+
+    when, func, event_id = wheel.schedule_call.call_args.args
+    assert func is jobs.send_mail and event_id == 1
+    assert when > datetime.now(UTC) + timedelta(seconds=20)
+    jobs.rq.get_scheduler.assert_not_called()
+
+
+def test_dispatcher_command_burst(app, monkeypatch):
+    """Test that --burst ticks once and exits."""
+    wheel = MagicMock()
+    monkeypatch.setattr(
+        "app.scheduler.commands.TimingWheel.from_config", lambda *args: wheel
+    )
+    monkeypatch.setattr("app.scheduler.commands.rq", MagicMock())
+
+    result = app.test_cli_runner().invoke(dispatcher_command, ["--burst"])
+
+    assert result.exit_code == 0
+    interval, = wheel.run.call_args.args
+    assert interval == 30 and wheel.run.call_args.kwargs["burst"]
+
+
+def test_dispatch_metrics_endpoint(client):
+    """Test that the dispatch metrics endpoint reports the lag."""
+    wheel = MagicMock()
+    wheel.lag_stats.return_value = {"samples": 1, "p99": 0.01}
+    wheel.stats.return_value = []
+    with patch("app.api.routes.TimingWheel.from_config", return_value=wheel), patch(
+        "app.api.routes.rq"
+    ):
+        response = client.get("/api/metrics/dispatch")
+
+    assert response.status_code == 200
+    assert response.json == {"lag": {"samples": 1, "p99": 0.01}, "levels": []}
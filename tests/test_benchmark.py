@@ -0,0 +1,88 @@
+"""Tests for the end-to-end benchmark helpers."""
+
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import click
+import pytest
+
+from app.benchmark import (
+    RSSMonitor,
+    due_dispatcher,
+    parse_counts,
+    peak_rss_mb,
+    percentile,
+    schedule_lags,
+    throughput,
+)
+
+
+def test_percentile_nearest_rank():
+    """Test nearest-rank percentiles."""
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+def test_throughput_counts_messages_and_recipients():
+    """Test that a message to many recipients counts once as a message."""
+    stats = {"messages": 10, "recipients": 1000}
+
+    assert throughput(stats, 4) == (2.5, 250.0)
+
+
+def test_schedule_lags():
+    """Test that lag is measured from the due time to the job start."""
+    due = datetime(2024, 1, 1, 12, 0, 0)
+    jobs = [
+        MagicMock(started_at=due + timedelta(seconds=1.5)),
+        MagicMock(started_at=None),
+    ]
+    assert schedule_lags(jobs, due) == [1.5]
+
+
+def test_parse_counts():
+    """Test parsing of the --events and --recipients options."""
+    assert parse_counts(None, None, "1, 10,100") == [1, 10, 100]
+    with pytest.raises(click.BadParameter):
+        parse_counts(None, None, "0")
+    with pytest.raises(click.BadParameter):
+        parse_counts(None, None, "ten")
+
+
+def test_peak_rss_is_reported():
+    """Test that the peak RSS of the process is a positive size in MiB."""
+    assert 1 < peak_rss_mb() < 100000
+
+
+def test_rss_monitor_measures_each_run():
+    """Test that a run reports its own peak, not the process lifetime's."""
+    ballast = b"x" * (64 * 1024 * 1024)
+    with RSSMonitor() as first:
+        pass
+    del ballast
+    with RSSMonitor() as second:
+        pass
+
+    assert second.peak_mb < first.peak_mb
+    assert second.peak_mb < peak_rss_mb()
+
+
+@pytest.mark.parametrize("mode", ["wheel", "database"])
+def test_due_dispatcher_follows_mail_scheduler(app, mode):
+    """Test that the dispatcher of MAIL_SCHEDULER is polled, not rq-scheduler."""
+    dispatcher = MagicMock()
+    with app.app_context(), patch.dict(app.config, MAIL_SCHEDULER=mode), patch(
+        "app.benchmark.build_dispatcher", return_value=dispatcher
+    ), patch("app.benchmark.rq") as rq:
+        assert due_dispatcher(1.0) == dispatcher.tick
+
+    assert not rq.get_scheduler.called
+
+
+def test_commands_are_registered(app):
+    """Test that the sink and benchmark commands are available."""
+    assert "smtp-sink" in app.cli.commands
+    assert "benchmark" in app.cli.commands